@@ -1,28 +1,93 @@
-import mysql.connector
-from mysql.connector import Error
 from dotenv import load_dotenv
 import os
 import csv
 
-# Загружаем переменные окружения из .env файла
+# Загружаем переменные окружения из .env файла (до импорта db: он читает DB_BACKEND)
 load_dotenv()
 
+# Адаптер БД общий с сервисами (DB_BACKEND=mysql | sqlite) — пакет common/
+from common import db  # noqa: E402
+from common.db import Error  # noqa: E402
+
 def get_db_connection():
     try:
-        conn = mysql.connector.connect(
+        conn = db.connect(
             host=os.getenv("DB_HOST"),  # Адрес сервера MySQL из .env
             port=os.getenv("DB_PORT"),  # Порт из .env
             user=os.getenv("DB_USER"),  # Имя пользователя из .env
             password=os.getenv("DB_PASSWORD"),  # Пароль из .env
         )
         if conn.is_connected():
-            print("Подключение к MySQL успешно!")
+            print(f"Подключение к БД ({db.BACKEND}) успешно!")
             return conn
     except Error as e:
-        print(f"Ошибка подключения к MySQL: {e}")
+        print(f"Ошибка подключения к БД ({db.BACKEND}): {e}")
         return None
 
 
+# Колонки компактного аудита, которых нет в logs, созданной до их появления
+LOGS_NEW_COLUMNS = (
+    ("query_id", "BIGINT NULL"),
+    ("query_params", "TEXT NULL"),
+    ("row_count", "INT NULL"),
+    ("duration_ms", "FLOAT NULL"),
+)
+
+# Индексы компактного аудита: (имя, колонки)
+LOGS_INDEXES = (
+    ("idx_logs_query_id", "query_id"),
+    ("idx_logs_action_timestamp", "action, timestamp"),
+)
+
+# details записи с query_id — шаблон с {query} и {rows} (NULL — шаблон по умолчанию)
+LOGS_READABLE_VIEW = '''
+    CREATE VIEW logs_readable AS
+    SELECT l.log_id, l.session_id, l.user_id, l.username, l.action, l.timestamp, l.ip_address,
+           l.row_count, l.duration_ms,
+           CASE WHEN l.query_id IS NULL THEN l.details
+                ELSE REPLACE(
+                    REPLACE(COALESCE(l.details, CASE WHEN l.row_count IS NULL THEN '{query}'
+                                                    ELSE '{query} - returned {rows} row(s)' END),
+                            '{rows}', COALESCE(CAST(l.row_count AS CHAR), '')),
+                    '{query}', CONCAT(COALESCE(q.query_text, ''),
+                                      CASE WHEN l.query_params IS NULL THEN ''
+                                           ELSE CONCAT(' -- params=', l.query_params) END))
+           END AS details
+    FROM logs l
+    LEFT JOIN query_texts q ON q.query_id = l.query_id
+'''
+
+
+def index_names(cursor, table):
+    """Имена индексов таблицы в нижнем регистре (MySQL — SHOW INDEX, SQLite — PRAGMA index_list)."""
+    if db.BACKEND == "sqlite":
+        cursor.execute(f"PRAGMA index_list({table})")
+        return {row[1].lower() for row in cursor.fetchall()}
+    cursor.execute(f"SHOW INDEX FROM {table}")
+    return {row[2].lower() for row in cursor.fetchall()}
+
+
+def upgrade_logs(cursor):
+    """
+    Добавляет в существующую logs колонки и индексы компактного аудита.
+    Колонки и индексы проверяются по отдельности: повторный запуск после
+    прерванного обновления доделывает его, а не падает на уже созданном.
+    """
+    cursor.execute("SELECT * FROM logs LIMIT 0")
+    cursor.fetchall()
+    existing = {d[0].lower() for d in cursor.description}
+    missing = [(name, ddl) for name, ddl in LOGS_NEW_COLUMNS if name not in existing]
+    for name, ddl in missing:
+        cursor.execute(f"ALTER TABLE logs ADD COLUMN {name} {ddl}")
+    if missing:
+        print(f"В таблицу 'logs' добавлены колонки: {', '.join(name for name, _ in missing)}.")
+    indexes = index_names(cursor, "logs")
+    for name, columns in LOGS_INDEXES:
+        if name not in indexes:
+            cursor.execute(f"CREATE INDEX {name} ON logs ({columns})")
+            print(f"В таблицу 'logs' добавлен индекс {name}.")
+
+
 def import_csv_to_table(conn, csv_file_path):
     """Импорт данных из CSV в таблицу train_data с обработкой ошибок"""
     if not os.path.exists(csv_file_path):
@@ -61,7 +126,7 @@ def init_database():
         try:
             cursor = conn.cursor()
 
-            # Создание базы данных, если её ещё нет
+            # Создание базы данных, если её ещё нет (SQLite: пропускается, база — файл или память)
             cursor.execute("CREATE DATABASE IF NOT EXISTS TrainSafe;")
             print("База данных 'TrainSafe' успешно создана или уже существует.")
 
@@ -119,10 +184,32 @@ def init_database():
                                 details TEXT,
                                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                                 ip_address VARCHAR(45),
-                                FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+                                query_id BIGINT NULL,
+                                query_params TEXT NULL,
+                                row_count INT NULL,
+                                duration_ms FLOAT NULL,
+                                FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE,
+                                INDEX idx_logs_query_id (query_id),
+                                INDEX idx_logs_action_timestamp (action, timestamp)
                             );
                         ''')
             print("Таблица 'logs' успешно создана или уже существует.")
+            upgrade_logs(cursor)
+
+            # Тексты запросов аудита без повторов (см. request_service/audit_log.py)
+            cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS query_texts (
+                                query_id BIGINT PRIMARY KEY,
+                                query_text TEXT NOT NULL,
+                                first_seen DATETIME DEFAULT CURRENT_TIMESTAMP
+                            );
+                        ''')
+            print("Таблица 'query_texts' успешно создана или уже существует.")
+
+            # logs в прежнем читаемом виде: details с текстом запроса и числом строк
+            cursor.execute("DROP VIEW IF EXISTS logs_readable")
+            cursor.execute(LOGS_READABLE_VIEW)
+            print("Представление 'logs_readable' создано.")
 
             # Создание таблицы train_data
             cursor.execute('''
@@ -150,6 +237,18 @@ def init_database():
                         ''')
             print("Таблица 'train_data' успешно создана или уже существует.")
 
+            # Шина инвалидаций кэшей между репликами сервисов (CACHE_BUS=mysql, см. cache_bus.py)
+            cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                                event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                                tag VARCHAR(255) NOT NULL,
+                                origin VARCHAR(32) NOT NULL,
+                                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                INDEX idx_cache_invalidations_created_at (created_at)
+                            );
+                        ''')
+            print("Таблица 'cache_invalidations' успешно создана или уже существует.")
+
             # Импорт данных из CSV
             import_csv_to_table(conn, 'credit_train.csv')
 
@@ -158,7 +257,7 @@ def init_database():
         finally:
             cursor.close()
             conn.close()
-            print("Соединение с MySQL закрыто.")
+            print("Соединение с БД закрыто.")
 
 # Запуск функции
 if __name__ == "__main__":
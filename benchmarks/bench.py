@@ -0,0 +1,343 @@
+"""
+Микробенчмарки горячих путей TrainSafe.
+
+Работают полностью офлайн: без MySQL и без сети. Модули сервисов
+импортируются напрямую, а цепочки обработчиков собираются так, чтобы
+ни один шаг не обращался к БД или соседним сервисам.
+
+Что меряем:
+  - is_ip_allowed (разрешённые и запрещённые адреса);
+  - сборку и прогон цепочки обработчиков server.py;
+  - EditorHandler/ViewerHandler на корпусе коротких и длинных запросов;
+  - путь результата SELECT: dict(zip(...)) + jsonify на 1k/100k/1M строк.
+
+Запуск:
+    python benchmarks/bench.py                  # прогон и сравнение с baseline
+    python benchmarks/bench.py --save           # сохранить результаты как baseline
+    python benchmarks/bench.py --threshold 0.2  # порог регрессии (20%)
+    python benchmarks/bench.py --filter policy --sizes 1000,100000
+
+Код возврата 1 означает, что хотя бы один бенчмарк стал медленнее
+baseline больше, чем на порог.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+# Бенчмарки меряют сами горячие пути, а не запись логов
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "server"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "request_service"))
+
+import server  # noqa: E402
+import request_service  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = "1000,100000,1000000"
+DEFAULT_THRESHOLD = 0.15
+
+# Колонки train_data в порядке DB_init.py
+TRAIN_DATA_COLUMNS = [
+    "Loan_ID", "Customer_ID", "Loan_Status", "Current_Loan_Amount", "Term",
+    "Credit_Score", "Annual_Income", "Years_in_current_job", "Home_Ownership", "Purpose",
+    "Monthly_Debt", "Years_of_Credit_History", "Months_since_last_delinquent",
+    "Number_of_Open_Accounts", "Number_of_Credit_Problems",
+    "Current_Credit_Balance", "Maximum_Open_Credit", "Bankruptcies", "Tax_Liens",
+]
+
+
+# =============================================================================
+# КОРПУСЫ ДАННЫХ
+# =============================================================================
+
+IP_CORPUS = [
+    "127.0.0.1",        # первый диапазон
+    "10.1.2.3",         # подсеть 10.0.0.0/8
+    "192.168.1.10",     # локальная сеть, ближе к концу списка
+    "198.18.5.5",       # последний диапазон
+    "8.8.8.8",          # не разрешён — проходит весь список
+]
+
+_LONG_COLUMNS = ", ".join(TRAIN_DATA_COLUMNS)
+_LONG_WHERE = " AND ".join(
+    f"({col} IS NOT NULL OR {col} <> 'value_{i}')" for i, col in enumerate(TRAIN_DATA_COLUMNS)
+)
+
+QUERY_CORPUS = {
+    "short": [
+        "SELECT * FROM train_data LIMIT 10",
+        "SELECT Loan_ID, Credit_Score FROM train_data WHERE Credit_Score > 700",
+        "UPDATE train_data SET Term = 'Short Term' WHERE Loan_ID = 'abc'",
+        "DELETE FROM train_data WHERE Loan_ID = 'abc'",
+        "SELECT * FROM users",
+        "DROP TABLE train_data",
+    ],
+    "long": [
+        f"SELECT {_LONG_COLUMNS} FROM train_data WHERE {_LONG_WHERE} ORDER BY Loan_ID LIMIT 1000",
+        f"SELECT t.Loan_ID FROM train_data t JOIN train_data s ON t.Loan_ID = s.Loan_ID WHERE {_LONG_WHERE}",
+        f"UPDATE train_data SET Purpose = 'other' WHERE {_LONG_WHERE}",
+        # DELETE без WHERE — худший случай для negative lookahead (?!.*WHERE)
+        "DELETE FROM train_data " + " ".join(f"/* padding {i} */" for i in range(200)),
+    ],
+}
+
+
+def make_rows(count):
+    """
+    Синтетические строки в форме того, что возвращает mysql.connector для train_data:
+    кортежи с str, Decimal, float, int и None.
+    """
+    statuses = ["Approved", "Rejected", "Fully Paid"]
+    ownership = ["Rent", "Mortgage", "Own", "Other"]
+    rows = []
+    for i in range(count):
+        rows.append((
+            f"{i:08d}-0000-0000-0000-000000000000",
+            f"{i % 50000:08d}-cust",
+            statuses[i % 3],
+            Decimal(f"{10000 + i % 90000}.{i % 100:02d}"),
+            "Short Term" if i % 2 else "Long Term",
+            600 + i % 250 if i % 7 else None,
+            40000.0 + (i % 1000) * 17.5,
+            f"{i % 10} years",
+            ownership[i % 4],
+            "Debt Consolidation",
+            1200.25 + i % 300,
+            12.5 + i % 20,
+            None if i % 3 else i % 80,
+            i % 30,
+            i % 3,
+            Decimal(f"{i % 500000}.{i % 100:02d}"),
+            Decimal(f"{i % 900000}.{i % 100:02d}"),
+            i % 2,
+            0,
+        ))
+    return rows
+
+
+# =============================================================================
+# ИЗМЕРЕНИЯ
+# =============================================================================
+
+@contextlib.contextmanager
+def quiet():
+    """Глушит stdout, чтобы вывод сервисов не смешивался с отчётом."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def measure(func, repeat, min_time=0.2):
+    """
+    Возвращает список времён одного вызова func (в секундах) по repeat замерам.
+    Число вызовов в замере подбирается так, чтобы замер длился не меньше min_time.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        samples.append(timer.timeit(number) / number)
+    return samples
+
+
+def bench_ip(repeat):
+    results = {}
+    for ip in IP_CORPUS:
+        results[f"ip.is_ip_allowed[{ip}]"] = measure(lambda ip=ip: server.is_ip_allowed(ip), repeat)
+    return results
+
+
+def bench_chain(repeat):
+    """
+    Сборка цепочки /login и её прогон.
+    Последний шаг — базовый Handler, который просто возвращает data,
+    поэтому прогон не трогает БД и two_factor_service.
+    """
+    def build():
+        ip_handler = server.IPCheckHandler()
+        login_handler = server.LoginHandler()
+        gen_2fa_handler = server.Generate2FAHandler()
+        ip_handler.set_next(login_handler).set_next(gen_2fa_handler)
+        return ip_handler
+
+    def dispatch_allowed():
+        ip_handler = server.IPCheckHandler()
+        ip_handler.set_next(server.Handler())
+        return ip_handler.handle({"client_ip": "192.168.1.10", "username": "u", "password": "p"})
+
+    def dispatch_denied():
+        ip_handler = server.IPCheckHandler()
+        ip_handler.set_next(server.Handler())
+        return ip_handler.handle({"client_ip": "8.8.8.8", "username": "u", "password": "p"})
+
+    return {
+        "chain.build_login": measure(build, repeat),
+        "chain.dispatch_allowed": measure(dispatch_allowed, repeat),
+        "chain.dispatch_denied": measure(dispatch_denied, repeat),
+    }
+
+
+def bench_policy(repeat):
+    """Цепочка Admin → Editor → Viewer, как в execute_sql, на корпусе запросов."""
+    def build_chain():
+        admin_handler = request_service.AdminHandler()
+        editor_handler = request_service.EditorHandler()
+        viewer_handler = request_service.ViewerHandler()
+        admin_handler.set_next(editor_handler).set_next(viewer_handler)
+        return admin_handler
+
+    chain = build_chain()
+    results = {"policy.build_chain": measure(build_chain, repeat)}
+    for role in ("editor", "viewer"):
+        for size, queries in QUERY_CORPUS.items():
+            def run(role=role, queries=queries):
+                for query in queries:
+                    chain.handle(role, query)
+            results[f"policy.{role}[{size}]"] = measure(run, repeat)
+    return results
+
+
+def bench_rows(repeat, sizes):
+    """
+    Путь результата SELECT из execute_sql: dict(zip(...)) по строкам и jsonify.
+    Для больших объёмов один замер и так длится секунды, поэтому min_time=0.
+    """
+    results = {}
+    columns = TRAIN_DATA_COLUMNS
+    app = request_service.app
+    for size in sizes:
+        rows = make_rows(size)
+        min_time = 0.2 if size < 100_000 else 0
+
+        def to_dicts(rows=rows):
+            return [dict(zip(columns, row)) for row in rows]
+
+        result = to_dicts()
+
+        def to_json(result=result):
+            with app.app_context():
+                return request_service.jsonify({"result": result}).get_data()
+
+        results[f"rows.dict_zip[{size}]"] = measure(to_dicts, repeat, min_time)
+        results[f"rows.jsonify[{size}]"] = measure(to_json, repeat, min_time)
+        del rows, result
+    return results
+
+
+# =============================================================================
+# BASELINE И ОТЧЁТ
+# =============================================================================
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    """Сохраняет baseline; результаты других бенчмарков (при --filter) не теряются."""
+    merged = dict((load_baseline(path) or {}).get("results", {}))
+    merged.update(results)
+    payload = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": merged,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+
+
+def summarize(samples):
+    return {"median": statistics.median(samples), "min": min(samples), "runs": len(samples)}
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.2f} ns"
+
+
+def report(results, baseline, threshold):
+    """Печатает таблицу и возвращает список имён бенчмарков с регрессией."""
+    base_results = (baseline or {}).get("results", {})
+    regressions = []
+    print(f"{'benchmark':<40} {'median':>12} {'baseline':>12} {'delta':>8}")
+    for name, stats in results.items():
+        base = base_results.get(name)
+        if base:
+            delta = stats["median"] / base["median"] - 1
+            flag = ""
+            if delta > threshold:
+                flag = "  REGRESSION"
+                regressions.append(name)
+            print(f"{name:<40} {format_time(stats['median']):>12} "
+                  f"{format_time(base['median']):>12} {delta:+7.1%}{flag}")
+        else:
+            print(f"{name:<40} {format_time(stats['median']):>12} {'-':>12} {'-':>8}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TrainSafe micro-benchmarks (offline)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="path to baseline JSON")
+    parser.add_argument("--save", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown treated as regression (0.15 = 15%%)")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements per benchmark")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="row counts for rows.* benchmarks")
+    parser.add_argument("--filter", default="", help="run only benchmarks whose group contains this")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    groups = {
+        "ip": lambda: bench_ip(args.repeat),
+        "chain": lambda: bench_chain(args.repeat),
+        "policy": lambda: bench_policy(args.repeat),
+        "rows": lambda: bench_rows(min(args.repeat, 3), sizes),
+    }
+
+    results = {}
+    started = time.perf_counter()
+    with quiet():
+        for group, run in groups.items():
+            if args.filter and args.filter not in group:
+                continue
+            for name, samples in run().items():
+                results[name] = summarize(samples)
+
+    regressions = report(results, load_baseline(args.baseline), args.threshold)
+    print(f"\n{len(results)} benchmark(s) in {time.perf_counter() - started:.1f}s")
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
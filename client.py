@@ -1,16 +1,25 @@
+import csv
+import gzip
+import io
+import json
+import queue
+import threading
+import time
 import tkinter as tk
-from tkinter import messagebox, scrolledtext
+from tkinter import messagebox, scrolledtext, ttk
 import requests
 
 # Переменные сервисов, развернутые локально, в Docker-compose и Minikube
 AUTH_URL = "http://127.0.0.1:6000/login"
 VERIFY_2FA_URL = "http://127.0.0.1:6000/validate_2fa"
 EXECUTE_URL = "http://127.0.0.1:6000/execute"
+EXPORTS_URL = "http://127.0.0.1:6000/exports"
 
 # # Переменные сервисов, развернутые на удаленной виртуальной машине YC в Docker-compose
 # AUTH_URL = "http://158.160.37.33:6000/login"
 # VERIFY_2FA_URL = "http://158.160.37.33:6000/validate_2fa"
 # EXECUTE_URL = "http://158.160.37.33:6000/execute"
+# EXPORTS_URL = "http://158.160.37.33:6000/exports"
 
 # Глобальные переменные для хранения данных пользователя
 global_user_id = None
@@ -18,6 +27,286 @@ global_role = None
 entered_2fa_code = None
 global_session_id = None
 
+# Размер куска при чтении ответа: между кусками проверяется отмена и обновляется прогресс
+CHUNK_SIZE = 64 * 1024
+# Как часто главный поток Tk забирает события фоновых задач (мс)
+UI_POLL_MS = 50
+# Сколько строк выгрузки передаётся в таблицу за одно событие
+STREAM_BATCH_ROWS = 2000
+
+
+# =============================================================================
+# ФОНОВЫЕ ЗАДАЧИ
+# =============================================================================
+
+# Tk не потокобезопасен: фоновые потоки только кладут события в очередь,
+# а главный поток забирает их в poll_ui_queue() через root.after
+ui_queue = queue.Queue()
+
+
+class CancelledError(Exception):
+    """Задача отменена пользователем."""
+
+
+class BackgroundTask:
+    """
+    Сетевой вызов в фоновом потоке.
+
+    func(task) выполняется в фоне и может вызывать task.progress(text) и
+    task.check_cancelled(); колбэки on_success/on_error/on_progress вызываются
+    в главном потоке Tk. После cancel() все события задачи (включая on_finish)
+    отбрасываются: интерфейс освобождается сразу, а поток завершается сам.
+    """
+    def __init__(self, func, on_success, on_error=None, on_progress=None, on_finish=None):
+        self.func = func
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self._cancelled = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            result = self.func(self)
+            ui_queue.put((self, "success", result))
+        except CancelledError:
+            ui_queue.put((self, "cancelled", None))
+        except Exception as e:
+            ui_queue.put((self, "error", e))
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise CancelledError()
+
+    def progress(self, value):
+        ui_queue.put((self, "progress", value))
+
+    def post(self, callback, *args):
+        """Вызвать callback(*args) в главном потоке (например, передать порцию строк)."""
+        ui_queue.put((self, "call", (callback, args)))
+
+
+def run_in_background(func, on_success, on_error=None, on_progress=None, on_finish=None):
+    return BackgroundTask(func, on_success, on_error, on_progress, on_finish).start()
+
+
+def poll_ui_queue():
+    """Обрабатывает события фоновых задач в главном потоке Tk."""
+    while True:
+        try:
+            task, kind, value = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        if task.cancelled:
+            continue
+        if kind in ("success", "error") and task.on_finish:
+            task.on_finish()
+        if kind == "success":
+            task.on_success(value)
+        elif kind == "error":
+            if task.on_error:
+                task.on_error(value)
+            else:
+                messagebox.showerror("Error", str(value))
+        elif kind == "progress" and task.on_progress:
+            task.on_progress(value)
+        elif kind == "call":
+            callback, args = value
+            callback(*args)
+    root.after(UI_POLL_MS, poll_ui_queue)
+
+
+def read_body(response, task):
+    """Читает тело ответа кусками с прогрессом и проверкой отмены."""
+    total = int(response.headers.get("Content-Length") or 0)
+    received = 0
+    buffer = io.BytesIO()
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            task.check_cancelled()
+            buffer.write(chunk)
+            received += len(chunk)
+            task.progress((received, total))
+    finally:
+        # Закрытие ответа при отмене обрывает соединение и передачу
+        response.close()
+    return buffer.getvalue()
+
+
+def error_message(response):
+    try:
+        return response.json().get("message", response.text)
+    except ValueError:
+        return response.text
+
+
+# =============================================================================
+# ИСТОЧНИКИ РЕЗУЛЬТАТОВ ДЛЯ ТАБЛИЦЫ
+# =============================================================================
+
+class ResultSource:
+    """
+    Источник строк для VirtualGrid. Таблица запрашивает только видимое окно
+    через fetch(offset, limit), поэтому весь результат в виджет не попадает.
+    """
+    columns = []
+
+    def __len__(self):
+        """Сколько строк доступно сейчас."""
+        raise NotImplementedError
+
+    @property
+    def complete(self):
+        """Известен ли весь результат (для потокового источника — False, пока идёт загрузка)."""
+        return True
+
+    def fetch(self, offset, limit):
+        raise NotImplementedError
+
+
+class ListSource(ResultSource):
+    """Результат /execute: список словарей, уже полученный целиком."""
+
+    def __init__(self, rows):
+        self.columns = list(rows[0].keys()) if rows else []
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def fetch(self, offset, limit):
+        return [tuple(row.get(c) for c in self.columns) for row in self._rows[offset:offset + limit]]
+
+
+class StreamingSource(ResultSource):
+    """
+    Строки, которые догружаются порциями (например, из выгрузки /exports).
+    Порции добавляются в главном потоке через append(); таблица перерисовывается,
+    когда новые строки попадают в видимое окно.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._rows = []
+        self._complete = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def complete(self):
+        return self._complete
+
+    def append(self, rows):
+        self._rows.extend(rows)
+
+    def finish(self):
+        self._complete = True
+
+    def fetch(self, offset, limit):
+        return self._rows[offset:offset + limit]
+
+
+# =============================================================================
+# ВИРТУАЛИЗИРОВАННАЯ ТАБЛИЦА
+# =============================================================================
+
+class VirtualGrid:
+    """
+    ttk.Treeview, в котором материализованы только видимые строки.
+
+    Прокрутка не двигает Treeview, а меняет смещение offset в источнике и
+    перерисовывает окно из visible_rows() строк, так что размер результата
+    не влияет на число элементов в виджете.
+    """
+    def __init__(self, master, source, height=25):
+        self.source = source
+        self.offset = 0
+
+        frame = tk.Frame(master)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        self.tree = ttk.Treeview(frame, columns=source.columns, show="headings", height=height)
+        for column in source.columns:
+            self.tree.heading(column, text=column)
+            self.tree.column(column, width=120, stretch=True)
+        self.scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.on_scrollbar)
+        hscroll = ttk.Scrollbar(frame, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=hscroll.set)
+
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        hscroll.grid(row=1, column=0, sticky="ew")
+        frame.rowconfigure(0, weight=1)
+        frame.columnconfigure(0, weight=1)
+
+        self.status = tk.Label(master, anchor="w")
+        self.status.pack(fill=tk.X, padx=10)
+
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1, "units"))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        self.tree.bind("<Next>", lambda e: self.scroll(1, "pages"))
+        self.tree.bind("<Configure>", lambda e: self.refresh())
+
+    def visible_rows(self):
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        # Первая строка виджета занята заголовками колонок
+        return max(1, self.tree.winfo_height() // row_height - 1)
+
+    def scroll(self, amount, what):
+        step = self.visible_rows() if what == "pages" else 3
+        self.move_to(self.offset + int(amount) * step)
+        return "break"
+
+    def on_scrollbar(self, action, value, what=None):
+        if action == "moveto":
+            self.move_to(int(float(value) * len(self.source)))
+        else:
+            self.scroll(value, what)
+
+    def move_to(self, offset):
+        limit = self.visible_rows()
+        self.offset = max(0, min(offset, len(self.source) - limit))
+        self.refresh()
+
+    def refresh(self):
+        """Перерисовывает видимое окно и положение ползунка."""
+        self.tree.delete(*self.tree.get_children())
+        for row in self.source.fetch(self.offset, self.visible_rows()):
+            self.tree.insert("", tk.END, values=["" if v is None else v for v in row])
+        self.update_position()
+
+    def update_position(self):
+        limit = self.visible_rows()
+        total = len(self.source)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + limit) / total))
+        else:
+            self.scrollbar.set(0, 1)
+        shown_to = min(total, self.offset + limit)
+        suffix = "" if self.source.complete else " (loading...)"
+        self.status.config(text=f"Rows {self.offset + 1 if total else 0}-{shown_to} of {total}{suffix}")
+
+    def on_rows_added(self):
+        """Новые строки источника: строки перерисовываются, только если окно ещё не заполнено."""
+        if len(self.tree.get_children()) < self.visible_rows():
+            self.refresh()
+        else:
+            self.update_position()
+
 
 # =============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
@@ -27,65 +316,74 @@ def login():
     username = username_entry.get()
     password = password_entry.get()
 
-    # Отправка запроса на сервер (/login)
-    try:
-        response = requests.post(AUTH_URL, json={"username": username, "password": password})
-        response.raise_for_status()
-    except requests.RequestException as e:
-        messagebox.showerror("Network Error", f"Failed to connect: {e}")
-        return
-
-    if response.status_code == 200:
-        data = response.json()
-        user_id = data.get("user_id")
-        role = data.get("role")
-
-        if not user_id or not role:
-            messagebox.showerror("Error", "Invalid server response: Missing user_id or role")
-            return
-
-        # Сохраняем данные пользователя
-        global global_user_id, global_role
-        global_user_id = user_id
-        global_role = role
-
-        messagebox.showinfo("Success", f"Login successful! Role: {role}")
-        show_2fa_prompt(user_id)
-    elif response.status_code == 401:
-        messagebox.showerror("Error", "Invalid username or password!")
-    elif response.status_code == 403:
-        messagebox.showerror("Error", "Access denied: Invalid IP address!")
-    else:
-        messagebox.showerror("Error", f"Unexpected error occurred! (HTTP {response.status_code})")
+    def request_login(task):
+        # Отправка запроса на сервер (/login)
+        return requests.post(AUTH_URL, json={"username": username, "password": password})
+
+    def on_response(response):
+        if response.status_code == 200:
+            data = response.json()
+            user_id = data.get("user_id")
+            role = data.get("role")
+
+            if not user_id or not role:
+                messagebox.showerror("Error", "Invalid server response: Missing user_id or role")
+                return
+
+            # Сохраняем данные пользователя
+            global global_user_id, global_role
+            global_user_id = user_id
+            global_role = role
+
+            messagebox.showinfo("Success", f"Login successful! Role: {role}")
+            show_2fa_prompt(user_id)
+        elif response.status_code == 401:
+            messagebox.showerror("Error", "Invalid username or password!")
+        elif response.status_code == 403:
+            messagebox.showerror("Error", "Access denied: Invalid IP address!")
+        else:
+            messagebox.showerror("Error", f"Unexpected error occurred! (HTTP {response.status_code})")
+
+    login_button.config(state=tk.DISABLED)
+    run_in_background(
+        request_login, on_response,
+        on_error=lambda e: messagebox.showerror("Network Error", f"Failed to connect: {e}"),
+        on_finish=lambda: login_button.config(state=tk.NORMAL),
+    )
 
 def verify_2fa(user_id):
-    global entered_2fa_code, global_session_id
+    global entered_2fa_code
 
     code = twofa_entry.get()
     entered_2fa_code = code
 
-    # Отправка запроса на сервер (/validate_2fa)
-    try:
-        response = requests.post(VERIFY_2FA_URL, json={"user_id": user_id, "code": code})
-        response.raise_for_status()
-    except requests.RequestException as e:
-        messagebox.showerror("Network Error", f"Failed to connect: {e}")
-        return
-
-    if response.status_code == 200:
-        data = response.json()
-        global_session_id = data.get("session_id")  # Сохраняем session_id
-        if not global_session_id:
-            messagebox.showerror("Error", "Invalid server response: Missing session_id")
-            return
-        messagebox.showinfo("Success", "2FA verified successfully!")
-        twofa_window.destroy()
-        open_sql_window()  # Открываем окно для отправки SQL-запросов
-    else:
-        messagebox.showerror("Error", "Invalid or expired 2FA code!")
+    def request_verify(task):
+        # Отправка запроса на сервер (/validate_2fa)
+        return requests.post(VERIFY_2FA_URL, json={"user_id": user_id, "code": code})
+
+    def on_response(response):
+        global global_session_id
+        if response.status_code == 200:
+            data = response.json()
+            global_session_id = data.get("session_id")  # Сохраняем session_id
+            if not global_session_id:
+                messagebox.showerror("Error", "Invalid server response: Missing session_id")
+                return
+            messagebox.showinfo("Success", "2FA verified successfully!")
+            twofa_window.destroy()
+            open_sql_window()  # Открываем окно для отправки SQL-запросов
+        else:
+            messagebox.showerror("Error", "Invalid or expired 2FA code!")
+
+    verify_button.config(state=tk.DISABLED)
+    run_in_background(
+        request_verify, on_response,
+        on_error=lambda e: messagebox.showerror("Network Error", f"Failed to connect: {e}"),
+        on_finish=lambda: verify_button.winfo_exists() and verify_button.config(state=tk.NORMAL),
+    )
 
 def show_2fa_prompt(user_id):
-    global twofa_window, twofa_entry
+    global twofa_window, twofa_entry, verify_button
 
     twofa_window = tk.Toplevel(root)
     twofa_window.title("2FA Verification")
@@ -94,11 +392,83 @@ def show_2fa_prompt(user_id):
     twofa_entry = tk.Entry(twofa_window)
     twofa_entry.pack(padx=10, pady=10)
 
-    tk.Button(twofa_window, text="Verify", command=lambda: verify_2fa(user_id)).pack(pady=10)
+    verify_button = tk.Button(twofa_window, text="Verify", command=lambda: verify_2fa(user_id))
+    verify_button.pack(pady=10)
+
+def session_payload(query):
+    return {
+        "session_id": global_session_id,
+        "user_id": global_user_id,
+        "username": username_entry.get(),
+        "role": global_role,
+        "code": entered_2fa_code,
+        "query": query
+    }
+
+def session_headers():
+    """Заголовки сессии для GET /exports/..."""
+    return {"X-User-Id": str(global_user_id), "X-Session-Code": str(entered_2fa_code)}
+
+def fetch_execute(task, query):
+    """Фон: /execute с чтением ответа кусками. Возвращает разобранный JSON."""
+    resp = requests.post(EXECUTE_URL, json=session_payload(query), stream=True)
+    body = read_body(resp, task)
+    if resp.status_code >= 400:
+        try:
+            message = json.loads(body).get("message", body.decode(errors="replace"))
+        except ValueError:
+            message = body.decode(errors="replace")
+        raise RuntimeError(f"HTTP {resp.status_code}: {message}")
+    return json.loads(body)
+
+def stream_export(task, query, on_columns, on_rows):
+    """
+    Фон: выгрузка через /exports. Ждёт готовности файла, затем скачивает gzip-CSV
+    потоком и передаёт строки в главный поток порциями по STREAM_BATCH_ROWS.
+    Возвращает число строк.
+    """
+    resp = requests.post(EXPORTS_URL, json=session_payload(query))
+    if resp.status_code != 202:
+        raise RuntimeError(f"HTTP {resp.status_code}: {error_message(resp)}")
+    job_id = resp.json()["job_id"]
+
+    while True:
+        task.check_cancelled()
+        status = requests.get(f"{EXPORTS_URL}/{job_id}", headers=session_headers()).json()
+        if status.get("status") == "done":
+            break
+        if status.get("status") == "failed" or "message" in status:
+            raise RuntimeError(status.get("error") or status.get("message"))
+        task.progress(f"Export {status.get('status')}...")
+        time.sleep(0.5)
+
+    resp = requests.get(f"{EXPORTS_URL}/{job_id}/download", headers=session_headers(), stream=True)
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code}: {error_message(resp)}")
+    count = 0
+    try:
+        reader = csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=resp.raw), encoding="utf-8", newline=""))
+        task.post(on_columns, next(reader))
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= STREAM_BATCH_ROWS:
+                task.check_cancelled()
+                task.post(on_rows, batch)
+                count += len(batch)
+                task.progress(f"Loaded {count} rows...")
+                batch = []
+        if batch:
+            task.post(on_rows, batch)
+            count += len(batch)
+    finally:
+        resp.close()
+    return count
 
 def open_sql_window():
     """
     Окно для ввода SQL-запросов и их выполнения.
+    Сетевые вызовы идут в фоне: окно не блокируется, запрос можно отменить.
     """
     sql_window = tk.Toplevel(root)
     sql_window.title("SQL Console")
@@ -111,51 +481,115 @@ def open_sql_window():
     query_text = scrolledtext.ScrolledText(sql_window, width=60, height=5)
     query_text.pack(padx=10, pady=10)
 
-    def execute_query():
+    buttons = tk.Frame(sql_window)
+    buttons.pack(pady=5)
+
+    # Прогресс и отмена текущего запроса
+    progress_frame = tk.Frame(sql_window)
+    progress_frame.pack(fill=tk.X, padx=10, pady=5)
+    progress_bar = ttk.Progressbar(progress_frame, mode="indeterminate", length=300)
+    progress_bar.pack(side=tk.LEFT)
+    progress_label = tk.Label(progress_frame, anchor="w")
+    progress_label.pack(side=tk.LEFT, padx=10)
+    cancel_button = tk.Button(progress_frame, text="Cancel", state=tk.DISABLED)
+    cancel_button.pack(side=tk.RIGHT)
+
+    current = {"task": None}
+
+    def get_query():
         query = query_text.get("1.0", tk.END).strip()
         if not query:
             messagebox.showwarning("Warning", "SQL query is empty!")
-            return
+        return query
+
+    def start(task_func, on_success, on_error=None):
+        execute_button.config(state=tk.DISABLED)
+        export_button.config(state=tk.DISABLED)
+        cancel_button.config(state=tk.NORMAL)
+        progress_bar.start(10)
+        progress_label.config(text="Running...")
+        current["task"] = run_in_background(
+            task_func, on_success, on_error=on_error,
+            on_progress=show_progress, on_finish=finish,
+        )
+
+    def finish():
+        current["task"] = None
+        execute_button.config(state=tk.NORMAL)
+        export_button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+        progress_bar.stop()
+
+    def cancel():
+        if current["task"] is not None:
+            current["task"].cancel()
+            finish()
+            progress_label.config(text="Cancelled")
+
+    def show_progress(value):
+        if isinstance(value, tuple):
+            received, total = value
+            text = f"Received {received // 1024} KB"
+            progress_label.config(text=text + (f" of {total // 1024} KB" if total else ""))
+        else:
+            progress_label.config(text=value)
+
+    cancel_button.config(command=cancel)
 
-        payload = {
-            "session_id": global_session_id,
-            "user_id": global_user_id,
-            "username": username_entry.get(),
-            "role": global_role,
-            "code": entered_2fa_code,
-            "query": query
-        }
+    def execute_query():
+        query = get_query()
+        if not query:
+            return
 
-        try:
-            resp = requests.post(EXECUTE_URL, json=payload)
-            resp.raise_for_status()
-            data = resp.json()
+        def on_success(data):
+            progress_label.config(text="")
             if "result" in data:
-                show_select_result(data["result"])
+                show_select_result(ListSource(data["result"]))
             else:
                 messagebox.showinfo("Info", data.get("message", "Query executed successfully"))
-        except requests.HTTPError as e:
-            err = resp.json()
-            messagebox.showerror("Error", f"HTTP {resp.status_code}: {err.get('message', resp.text)}")
-        except requests.RequestException as e:
-            messagebox.showerror("Network Error", str(e))
 
-    def show_select_result(rows):
+        start(lambda task: fetch_execute(task, query), on_success,
+              on_error=lambda e: messagebox.showerror("Error", str(e)))
+
+    def export_query():
+        """Большой SELECT: выгрузка на сервере и потоковая загрузка строк в таблицу."""
+        query = get_query()
+        if not query:
+            return
+        view = {}
+
+        def on_columns(columns):
+            view["source"] = StreamingSource(columns)
+            view["grid"] = show_select_result(view["source"])
+
+        def on_rows(rows):
+            view["source"].append(rows)
+            view["grid"].on_rows_added()
+
+        def on_success(count):
+            progress_label.config(text=f"Loaded {count} rows")
+            if "source" in view:
+                view["source"].finish()
+                view["grid"].refresh()
+
+        start(lambda task: stream_export(task, query, on_columns, on_rows), on_success,
+              on_error=lambda e: messagebox.showerror("Error", str(e)))
+
+    def show_select_result(source):
         """
-        Отобразить результат запроса (список словарей) в новом окне.
+        Отобразить результат запроса в новом окне (виртуализированная таблица).
         """
         result_window = tk.Toplevel(sql_window)
         result_window.title("Query Result")
+        grid = VirtualGrid(result_window, source)
+        result_window.update_idletasks()
+        grid.refresh()
+        return grid
 
-        text_area = scrolledtext.ScrolledText(result_window, width=80, height=20)
-        text_area.pack(padx=10, pady=10)
-
-        for row in rows:
-            text_area.insert(tk.END, f"{row}\n")
-        text_area.config(state=tk.DISABLED)
-
-    execute_button = tk.Button(sql_window, text="Execute", command=execute_query)
-    execute_button.pack(pady=5)
+    execute_button = tk.Button(buttons, text="Execute", command=execute_query)
+    execute_button.pack(side=tk.LEFT, padx=5)
+    export_button = tk.Button(buttons, text="Export (large result)", command=export_query)
+    export_button.pack(side=tk.LEFT, padx=5)
 
     sql_window.focus()
 
@@ -181,5 +615,8 @@ password_entry.grid(row=1, column=1, padx=10, pady=10)
 login_button = tk.Button(root, text="Login", command=login)
 login_button.grid(row=2, columnspan=2, pady=20)
 
+# События фоновых задач обрабатываются в главном потоке
+root.after(UI_POLL_MS, poll_ui_queue)
+
 # Запуск основного окна
-root.mainloop()
\ No newline at end of file
+root.mainloop()
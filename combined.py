@@ -0,0 +1,124 @@
+"""
+Совмещённый режим TrainSafe: gateway (server.py), two_factor_service и request_service
+в одном процессе.
+
+Обработчики gateway вызывают функции сервисов напрямую (InProcessTransport),
+без HTTP-хопов и JSON-сериализации между сервисами. Приложения сервисов также
+смонтированы под префиксами /two_factor и /request, чтобы их внутренние API
+оставались доступны по HTTP (например, для отладки).
+
+Подходит для локального запуска, небольших однонодовых установок и профилирования
+всего пути /execute в одном процессе:
+    python combined.py
+
+С DB_BACKEND=sqlite MySQL не нужен: БД в памяти (DB_SQLITE_PATH не задан) создаётся
+при старте по схеме DB_init.py — все три сервиса работают с ней через адаптер db:
+    DB_BACKEND=sqlite python combined.py
+"""
+import os
+import sys
+
+from flask import request
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.serving import run_simple
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIRS = ("request_service", "two_factor_service", "server")
+
+
+def shadowed_modules(root=ROOT_DIR):
+    """
+    Модули, которые есть в нескольких каталогах сервисов (или называются как пакет common),
+    и каталоги, где они лежат. Все каталоги сервисов в одном sys.path: такой модуль
+    импортировался бы только из первого каталога, и сервис молча работал бы с чужим кодом.
+    Общий код — в пакете common/.
+    """
+    owners = {}
+    for service_dir in SERVICE_DIRS:
+        for name in sorted(os.listdir(os.path.join(root, service_dir))):
+            module, ext = os.path.splitext(name)
+            if ext == ".py" and not module.startswith("test_"):
+                owners.setdefault(module, []).append(service_dir)
+    return {module: dirs for module, dirs in owners.items() if len(dirs) > 1 or module == "common"}
+
+
+_shadowed = shadowed_modules()
+if _shadowed:
+    raise RuntimeError("Modules with the same name in several services cannot run in combined mode: "
+                       + ", ".join(f"{module} ({', '.join(dirs)})" for module, dirs in sorted(_shadowed.items())))
+
+for service_dir in SERVICE_DIRS:
+    sys.path.insert(0, os.path.join(ROOT_DIR, service_dir))
+
+from common import db  # noqa: E402
+from common.cache_bus import LocalBus  # noqa: E402
+import server  # noqa: E402
+import two_factor_service  # noqa: E402
+import request_service  # noqa: E402
+from transport import InProcessTransport  # noqa: E402
+
+
+_memory_database_ready = False
+
+
+def init_memory_database():
+    global _memory_database_ready
+    if _memory_database_ready:
+        return
+    if ROOT_DIR not in sys.path:
+        sys.path.append(ROOT_DIR)
+    import DB_init
+    DB_init.init_database()
+    _memory_database_ready = True
+
+
+def build_app():
+    """
+    Переключает gateway на прямые вызовы сервисов и возвращает WSGI-приложение.
+    Без CACHE_BUS в окружении кэши gateway и request_service получают общую LocalBus:
+    в одном процессе инвалидации не нужно передавать через БД.
+    БД SQLite в памяти при первом вызове создаётся со схемой и тестовыми пользователями DB_init.py.
+    """
+    if db.BACKEND == "sqlite" and db.SQLITE_PATH == ":memory:":
+        init_memory_database()
+    if not os.getenv("CACHE_BUS"):
+        bus = LocalBus()
+        server.use_cache_bus(bus)
+        request_service.use_cache_bus(bus)
+    server.use_transports(
+        two_factor=InProcessTransport({
+            "/generate_2fa": lambda payload: two_factor_service.generate_2fa_code(
+                payload.get("user_id")),
+            "/validate_2fa": lambda payload: two_factor_service.validate_2fa_code(
+                payload.get("user_id"), payload.get("code")),
+        }, name="two_factor_service"),
+        request_service=InProcessTransport({
+            # Вызов идёт внутри запроса gateway, поэтому в логи попадает IP клиента
+            "/execute_sql": lambda payload: request_service.run_sql(
+                payload, request.remote_addr),
+            "/execute_sql_batch": lambda payload: request_service.run_sql_batch(
+                payload, request.remote_addr),
+            "/exports": lambda payload: request_service.submit_export(
+                payload, request.remote_addr),
+            "GET /exports/<job_id>": lambda params, headers, job_id: request_service.export_status(
+                job_id, params.get("user_id")),
+            "GET /exports/<job_id>/download": lambda params, headers, job_id: request_service.export_download(
+                job_id, params.get("user_id"), headers.get("Range")),
+            "GET /dataset/batches": lambda params, headers: request_service.dataset_batches(
+                params, request.remote_addr),
+            "UPLOAD /ingest": lambda stream, params, headers: request_service.run_ingest(
+                stream, params, request.remote_addr, headers.get("Content-Encoding")),
+        }, name="request_service"),
+    )
+    return DispatcherMiddleware(server.app, {
+        "/two_factor": two_factor_service.app,
+        "/request": request_service.app,
+    })
+
+
+if __name__ == "__main__":
+    port = int(os.getenv("SERVER_PORT", 6000))
+    app = build_app()
+    for health in (server.HEALTH, two_factor_service.HEALTH, request_service.HEALTH):
+        health.start_warm_up()
+    run_simple("0.0.0.0", port, app, threaded=True)
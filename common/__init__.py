@@ -0,0 +1,8 @@
+"""
+Общие модули сервисов TrainSafe: адаптер БД и пул соединений, шина инвалидации кэшей,
+трассировка, дедлайны, кодеки, JSON-провайдер, логирование, health-проверки и профилировщик.
+
+Пакет один на все сервисы: в Docker-образ каждого сервиса он копируется из корня
+репозитория (контекст сборки — корень, см. Dockerfile сервиса), при локальном запуске
+скрипт сервиса добавляет корень репозитория в sys.path.
+"""
@@ -0,0 +1,384 @@
+"""
+Согласованные in-process кэши для нескольких реплик сервиса.
+
+CoherentCache — LRU-кэш с TTL, записи которого помечены тегами
+("table:sessions", "user:42", ...). Инвалидация тега рассылается через шину
+всем репликам; получив событие, каждая удаляет записи с этим тегом.
+Тег "*" очищает кэш целиком.
+
+Шины (общий интерфейс: subscribe, publish, start, lag, snapshot):
+- LocalBus — в пределах одного процесса (один экземпляр сервиса, совмещённый режим, тесты);
+- MySQLBus — таблица cache_invalidations: publish вставляет строку, фоновый поток
+  каждые poll_interval секунд читает новые события;
+- RedisBus — канал Redis pub/sub (нужен пакет redis).
+
+Задержка доставки ограничена: пока шина не подтверждала синхронизацию дольше
+max_staleness секунд (ошибки БД/Redis), кэши не отдают записи и очищаются —
+запросы идут мимо кэша, пока шина не восстановится.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # RedisBus недоступен, остальные шины работают
+    redis = None
+
+logger = logging.getLogger("cache_bus")
+
+ALL = "*"
+
+
+class LocalBus:
+    """Шина в пределах процесса: события доставляются подписчикам сразу."""
+
+    kind = "local"
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex[:12]
+        self._subscribers = []
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def start(self):
+        pass
+
+    def lag(self):
+        """Секунды с последней подтверждённой синхронизации с другими репликами."""
+        return 0.0
+
+    def _dispatch(self, tags):
+        for tag in tags:
+            for callback in self._subscribers:
+                try:
+                    callback(tag)
+                except Exception:
+                    logger.exception("Ошибка обработчика инвалидации %s", tag)
+
+    def publish(self, tags, conn=None):
+        tags = list(tags)
+        if tags:
+            self.published += len(tags)
+            self._dispatch(tags)
+
+    def snapshot(self):
+        return {"kind": self.kind, "node_id": self.node_id, "lag_seconds": round(self.lag(), 3),
+                "published": self.published, "received": self.received}
+
+
+class _PollingBus(LocalBus):
+    """Общая часть шин с фоновым потоком: запуск, отметка синхронизации, lag."""
+
+    def __init__(self):
+        super().__init__()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_sync = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"cache-bus-{self.kind}", daemon=True)
+                self._thread.start()
+
+    def lag(self):
+        if self._last_sync is None:
+            return float("inf")
+        return time.monotonic() - self._last_sync
+
+    def _synced(self):
+        self._last_sync = time.monotonic()
+
+    def _receive(self, tags):
+        self.received += len(tags)
+        self._dispatch(tags)
+
+    def _run(self):
+        raise NotImplementedError
+
+
+class MySQLBus(_PollingBus):
+    """
+    Шина на таблице cache_invalidations. connect — функция, возвращающая соединение
+    с БД TrainSafe; поток опроса держит своё соединение, publish без conn берёт
+    новое и закрывает его.
+    """
+
+    kind = "mysql"
+
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            tag VARCHAR(255) NOT NULL,
+            origin VARCHAR(32) NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_cache_invalidations_created_at (created_at)
+        )
+    """
+    # Строки с меньшими id могут зафиксироваться позже больших — перечитываем окно
+    LOOKBACK = 100
+
+    def __init__(self, connect, poll_interval=1.0, retention=3600):
+        super().__init__()
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._position = None
+        self._seen = OrderedDict()
+
+    def publish(self, tags, conn=None):
+        tags = list(tags)
+        if not tags:
+            return
+        # Свои кэши — сразу, остальные реплики — через таблицу
+        super().publish(tags)
+        own = conn is None
+        if own:
+            conn = self.connect()
+        if conn is None:
+            logger.warning("Инвалидация %s не отправлена: нет соединения с БД", tags)
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.executemany("INSERT INTO cache_invalidations (tag, origin) VALUES (%s, %s)",
+                               [(tag, self.node_id) for tag in tags])
+            conn.commit()
+        except Exception as e:
+            logger.warning("Инвалидация %s не отправлена: %s", tags, e)
+        finally:
+            cursor.close()
+            if own:
+                conn.close()
+
+    def _poll(self, conn):
+        cursor = conn.cursor()
+        try:
+            if self._position is None:
+                cursor.execute(self.CREATE_TABLE)
+                cursor.execute("SELECT COALESCE(MAX(event_id), 0) FROM cache_invalidations")
+                self._position = cursor.fetchone()[0]
+                tags = [ALL]    # что было закэшировано до подключения к шине — сбрасываем
+            else:
+                cursor.execute(
+                    "SELECT event_id, tag, origin FROM cache_invalidations WHERE event_id > %s ORDER BY event_id",
+                    (max(0, self._position - self.LOOKBACK),),
+                )
+                tags = []
+                for event_id, tag, origin in cursor.fetchall():
+                    if event_id in self._seen:
+                        continue
+                    self._seen[event_id] = True
+                    self._position = max(self._position, event_id)
+                    if origin != self.node_id:
+                        tags.append(tag)
+                while len(self._seen) > self.LOOKBACK * 10:
+                    self._seen.popitem(last=False)
+            conn.commit()   # следующий SELECT должен видеть новые строки (REPEATABLE READ)
+        finally:
+            cursor.close()
+        self._synced()
+        if tags:
+            self._receive(tags)
+
+    def _cleanup(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM cache_invalidations WHERE created_at < NOW() - INTERVAL %s SECOND",
+                           (self.retention,))
+            conn.commit()
+        finally:
+            cursor.close()
+
+    def _run(self):
+        conn, polls = None, 0
+        while True:
+            try:
+                if conn is None or not conn.is_connected():
+                    conn = self.connect()
+                if conn is not None:
+                    self._poll(conn)
+                    polls += 1
+                    if polls % 600 == 0:
+                        self._cleanup(conn)
+            except Exception as e:
+                logger.warning("Ошибка опроса cache_invalidations: %s", e)
+                conn = None
+            time.sleep(self.poll_interval)
+
+
+class RedisBus(_PollingBus):
+    """Шина на Redis pub/sub. После разрыва соединения события могли потеряться — кэши сбрасываются."""
+
+    kind = "redis"
+
+    def __init__(self, url, channel="trainsafe:cache-invalidations", heartbeat=1.0):
+        if redis is None:
+            raise RuntimeError("RedisBus requires the 'redis' package")
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.heartbeat = heartbeat
+
+    def publish(self, tags, conn=None):
+        tags = list(tags)
+        if not tags:
+            return
+        super().publish(tags)
+        try:
+            self.client.publish(self.channel, json.dumps({"origin": self.node_id, "tags": tags}))
+        except redis.RedisError as e:
+            logger.warning("Инвалидация %s не отправлена: %s", tags, e)
+
+    def _run(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self._receive([ALL])
+                while True:
+                    message = pubsub.get_message(timeout=self.heartbeat)
+                    self._synced()
+                    if message and message.get("type") == "message":
+                        event = json.loads(message["data"])
+                        if event.get("origin") != self.node_id:
+                            self._receive(event.get("tags") or [])
+            except redis.RedisError as e:
+                logger.warning("Потеряно соединение с Redis для инвалидаций: %s", e)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+            time.sleep(self.heartbeat)
+
+
+def make_bus(kind, connect=None, poll_interval=1.0, redis_url=None):
+    """Шина по имени из конфигурации: local | mysql | redis."""
+    kind = (kind or "local").lower()
+    if kind == "local":
+        return LocalBus()
+    if kind == "mysql":
+        return MySQLBus(connect, poll_interval=poll_interval)
+    if kind == "redis":
+        return RedisBus(redis_url)
+    raise ValueError(f"Unknown cache bus: {kind}")
+
+
+class CoherentCache:
+    """
+    LRU-кэш с TTL и тегами. ttl=0 выключает кэш (get всегда промах, set ничего не делает).
+    max_staleness — при большем отставании шины кэш не используется.
+    """
+
+    def __init__(self, name, bus, ttl=30.0, max_size=10000, max_staleness=5.0):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_staleness = max_staleness
+        self._entries = OrderedDict()       # key -> (value, expires_at, tags)
+        self._by_tag = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = self.bypassed = 0
+        self.bus = None
+        self.bind(bus)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def bind(self, bus):
+        """Переключает кэш на другую шину (совмещённый режим — одна LocalBus на процесс)."""
+        self.bus = bus
+        bus.subscribe(self._on_event)
+        self.clear()
+
+    def _usable(self):
+        if not self.enabled:
+            return False
+        self.bus.start()
+        if self.bus.lag() > self.max_staleness:
+            self.bypassed += 1
+            if self._entries:
+                self.clear()
+            return False
+        return True
+
+    def get(self, key, default=None):
+        if not self._usable():
+            return default
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tags=(), ttl=None):
+        if not self._usable():
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (value, time.monotonic() + ttl, tuple(tags))
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def _on_event(self, tag):
+        with self._lock:
+            if tag == ALL:
+                dropped = len(self._entries)
+                self._entries.clear()
+                self._by_tag.clear()
+            else:
+                keys = self._by_tag.pop(tag, set())
+                dropped = len(keys)
+                for key in keys:
+                    self._drop(key)
+            self.invalidations += dropped
+
+    def invalidate(self, *tags, conn=None):
+        """Удаляет записи с тегами здесь и рассылает инвалидацию остальным репликам."""
+        self.bus.publish(tags, conn=conn)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_tag.clear()
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated_entries": self.invalidations,
+            "bypassed": self.bypassed,
+        }
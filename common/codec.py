@@ -0,0 +1,95 @@
+"""
+Кодирование payload-ов внутренних API (/generate_2fa, /validate_2fa, /execute_sql).
+
+JSON остаётся форматом по умолчанию и единственным внешним форматом.
+Между сервисами можно договориться о MessagePack: отправитель ставит
+Content-Type / Accept: application/msgpack, получатель разбирает тело
+по Content-Type и отвечает в формате из Accept.
+
+Decimal, datetime, date и timedelta (типы из train_data и sessions)
+передаются в MessagePack без потерь через ext-типы.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask import Response, jsonify, request
+
+try:
+    import msgpack
+except ImportError:  # MessagePack необязателен: без него работаем только с JSON
+    msgpack = None
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# Коды ext-типов MessagePack
+EXT_DECIMAL = 1
+EXT_DATETIME = 2
+EXT_DATE = 3
+EXT_TIMEDELTA = 4
+
+
+def msgpack_available():
+    return msgpack is not None
+
+
+def _encode_ext(obj):
+    # datetime проверяем раньше date: datetime — подкласс date
+    if isinstance(obj, Decimal):
+        return msgpack.ExtType(EXT_DECIMAL, str(obj).encode())
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, date):
+        return msgpack.ExtType(EXT_DATE, obj.isoformat().encode())
+    if isinstance(obj, timedelta):
+        micros = (obj.days * 86400 + obj.seconds) * 1_000_000 + obj.microseconds
+        return msgpack.ExtType(EXT_TIMEDELTA, str(micros).encode())
+    raise TypeError(f"Object of type {type(obj).__name__} is not MessagePack serializable")
+
+
+def _decode_ext(code, data):
+    if code == EXT_DECIMAL:
+        return Decimal(data.decode())
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode())
+    if code == EXT_TIMEDELTA:
+        return timedelta(microseconds=int(data.decode()))
+    return msgpack.ExtType(code, data)
+
+
+def packb(obj):
+    return msgpack.packb(obj, default=_encode_ext, use_bin_type=True)
+
+
+def unpackb(data):
+    return msgpack.unpackb(data, ext_hook=_decode_ext, raw=False, strict_map_key=False)
+
+
+# =============================================================================
+# СТОРОНА СЕРВИСА (Flask)
+# =============================================================================
+
+def request_payload():
+    """
+    Тело текущего запроса как dict: MessagePack по Content-Type, иначе JSON.
+    """
+    if request.mimetype == MSGPACK_MIMETYPE and msgpack_available():
+        return unpackb(request.get_data())
+    return request.json
+
+
+def wants_msgpack():
+    """Клиент предпочитает MessagePack (Accept), и он доступен."""
+    if not msgpack_available():
+        return False
+    best = request.accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE])
+    return best == MSGPACK_MIMETYPE
+
+
+def make_response(body, status):
+    """Ответ в формате, который запросил клиент (по умолчанию JSON)."""
+    if wants_msgpack():
+        return Response(packb(body), status=status, mimetype=MSGPACK_MIMETYPE)
+    return jsonify(body), status
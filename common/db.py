@@ -0,0 +1,574 @@
+"""
+Адаптер БД: MySQL (mysql.connector) или встроенный SQLite.
+
+DB_BACKEND=mysql (по умолчанию) — соединения к DB_HOST, как раньше.
+DB_BACKEND=sqlite — встроенная БД в файле DB_SQLITE_PATH или в памяти
+(":memory:", по умолчанию) со схемой из DB_init.py. Нужна для локальных
+запусков, тестов и бенчмарков без MySQL.
+
+Соединение SQLite повторяет ту часть API mysql.connector, которой пользуются
+сервисы: cursor(dictionary=..., prepared=...), start_transaction(), commit(),
+rollback(), consume_results(), is_connected(), connection_id; курсор —
+execute/executemany, fetchone/fetchmany/fetchall, description, rowcount, with_rows.
+DATETIME возвращается как datetime, DECIMAL — как Decimal.
+
+Запросы переводятся с диалекта MySQL (translate):
+- плейсхолдеры %s → ?;
+- INSERT IGNORE → INSERT OR IGNORE; ON DUPLICATE KEY UPDATE c = VALUES(c) →
+  ON CONFLICT DO UPDATE SET c = excluded.c WHERE c IS NOT (excluded.c): строка,
+  которая не меняется, не перезаписывается, а rowcount такой же, как у MySQL
+  (1 — вставка, 2 — изменение, 0 — без изменений);
+- NOW() и NOW() - INTERVAL n SECOND|MINUTE|HOUR|DAY → datetime('now', 'localtime', ...);
+- DDL: AUTO_INCREMENT, ENUM (TEXT с CHECK), INDEX внутри CREATE TABLE (отдельный
+  CREATE INDEX), DEFAULT CURRENT_TIMESTAMP (местное время, как у MySQL),
+  CREATE TABLE ... LIKE, RENAME TABLE и DROP TABLE с несколькими таблицами;
+  CREATE DATABASE и USE пропускаются;
+- MD5, CONCAT, CONCAT_WS — функции Python. FOR UPDATE / LOCK IN SHARE MODE
+  отбрасываются: запись в SQLite и так идёт по одной транзакции за раз.
+
+БД в памяти общая для всех соединений процесса (shared cache) и живёт, пока
+жив процесс: подходит для совмещённого режима (combined.py), тестов и бенчмарков.
+Сервисы в отдельных процессах должны указывать общий файл.
+"""
+import hashlib
+import itertools
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+try:
+    import mysql.connector
+    from mysql.connector import errorcode, pooling
+except ImportError:  # без mysql-connector доступен только SQLite
+    mysql = None
+
+logger = logging.getLogger("db")
+
+BACKENDS = ("mysql", "sqlite")
+BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+# Файл БД SQLite или ":memory:"; сколько секунд ждать блокировку другой транзакции
+SQLITE_PATH = os.getenv("DB_SQLITE_PATH", ":memory:")
+SQLITE_TIMEOUT = float(os.getenv("DB_SQLITE_TIMEOUT", 5.0))
+
+if BACKEND not in BACKENDS:
+    raise ValueError(f"Unknown DB_BACKEND: {BACKEND} (expected {' or '.join(BACKENDS)})")
+if BACKEND == "mysql" and mysql is None:
+    raise ImportError("DB_BACKEND=mysql requires mysql-connector-python")
+
+# Ошибки БД обоих драйверов: except Error ловит любую из них
+if mysql is not None:
+    Error = (mysql.connector.Error, sqlite3.Error)
+    PoolError = pooling.PoolError
+else:
+    Error = (sqlite3.Error,)
+
+    class PoolError(Exception):
+        """Пул исчерпан (пул SQLite не ограничен, ошибка не возникает)."""
+
+
+def is_deadlock(e):
+    """Ошибка — взаимная блокировка транзакций (MySQL откатил транзакцию целиком)."""
+    if mysql is not None and isinstance(e, mysql.connector.Error):
+        return e.errno == errorcode.ER_LOCK_DEADLOCK
+    return False
+
+
+def is_timeout(e):
+    """Запрос прерван по пределу времени (limit_statement_time)."""
+    if mysql is not None and isinstance(e, mysql.connector.Error):
+        return e.errno == errorcode.ER_QUERY_TIMEOUT
+    return isinstance(e, sqlite3.OperationalError) and str(e) == "interrupted"
+
+
+# Начало SELECT (после комментариев) и, если есть, открытие его блока подсказок /*+
+_SELECT_HEAD_RE = re.compile(r"^(\s*(?:(?:/\*(?!\+).*?\*/|--[^\n]*\n|#[^\n]*\n)\s*)*SELECT\b)(\s*/\*\+)?",
+                             re.IGNORECASE | re.DOTALL)
+
+
+def time_limit_ms(seconds):
+    """
+    Предел в миллисекундах, округлённый вверх: до 100 мс в пределах секунды, дальше
+    до целых секунд. Текст запроса с подсказкой от вызова к вызову почти не меняется,
+    и кэш prepared statements (db_pool) не заполняется вариантами одного шаблона.
+    """
+    milliseconds = max(1, math.ceil(seconds * 1000))
+    step = 100 if milliseconds <= 1000 else 1000
+    return -(-milliseconds // step) * step
+
+
+def limit_statement_time(conn, query, seconds):
+    """
+    Запрос query с пределом времени seconds (None — без предела); по его
+    истечении запрос прерывается ошибкой, для которой is_timeout() истинно.
+    MySQL: подсказка /*+ MAX_EXECUTION_TIME(n) */ после SELECT (time_limit_ms) —
+    действует только на этот запрос, без SET и лишнего обращения к серверу, и на
+    соединении в пуле ничего не остаётся. Прочие запросы не ограничиваются
+    (max_execution_time MySQL действует только на SELECT).
+    SQLite: progress handler соединения до следующего вызова или возврата в пул; запрос не меняется.
+    """
+    if isinstance(conn, SQLiteConnection):
+        conn.limit_time(seconds)
+        return query
+    if seconds is None:
+        return query
+    match = _SELECT_HEAD_RE.match(query)
+    if match is None:
+        return query
+    hint = f"MAX_EXECUTION_TIME({time_limit_ms(seconds)})"
+    if match.group(2):
+        # У запроса свой блок подсказок — добавляем в него (второй блок MySQL не читает)
+        return f"{query[:match.end()]} {hint}{query[match.end():]}"
+    return f"{match.group(1)} /*+ {hint} */{query[match.end(1):]}"
+
+
+def connect(**config):
+    """Отдельное соединение (вне пула); для SQLite параметры MySQL игнорируются."""
+    if BACKEND == "sqlite":
+        raw, connection_id = _open_sqlite()
+        return SQLiteConnection(raw, connection_id)
+    return mysql.connector.connect(**config)
+
+
+def create_pool(name, config, size):
+    """Пул соединений: get_connection() выдаёт соединение, close() возвращает его в пул."""
+    if BACKEND == "sqlite":
+        return SQLitePool(size)
+    return MySQLPool(pool_name=name, pool_size=size, pool_reset_session=False, **config)
+
+
+def mark_session_changed(conn):
+    """
+    Помечает соединение, на котором выполнен запрос, меняющий сессию (USE, SET,
+    пользовательские переменные...): при возврате в пул его сессия не достанется
+    следующему пользователю — MySQLPool переоткрывает соединение, пул SQLite закрывает.
+    """
+    getattr(conn, "_cnx", conn)._trainsafe_session_changed = True
+
+
+if mysql is not None:
+    class MySQLPool(pooling.MySQLConnectionPool):
+        """
+        Пул mysql.connector, который не сбрасывает сессию при каждом возврате (prepared
+        statements соединения переживают возврат, см. db_pool), но сбрасывает её
+        (COM_RESET_CONNECTION: откат, блокировки, переменные), если соединение вернулось
+        с открытой транзакцией. Признак транзакции приходит в статусе каждого ответа
+        сервера, проверка не стоит обращения к нему. Соединение, помеченное
+        mark_session_changed, закрывается: get_connection пула откроет его заново
+        с исходными параметрами (база, autocommit). И сброс, и переподключение освобождают
+        prepared statements: счётчик _trainsafe_resets соединения сообщает об этом кэшу db_pool.
+        """
+
+        def add_connection(self, cnx=None):
+            if cnx is not None and getattr(cnx, "_trainsafe_session_changed", False):
+                logger.debug("Запрос изменил сессию соединения %s, соединение будет открыто заново",
+                             cnx.connection_id)
+                cnx._trainsafe_session_changed = False
+                cnx.disconnect()
+                cnx._trainsafe_resets = getattr(cnx, "_trainsafe_resets", 0) + 1
+            elif cnx is not None and cnx.in_transaction:
+                logger.warning("Соединение %s вернулось в пул %s с открытой транзакцией, сессия сбрасывается",
+                               cnx.connection_id, self.pool_name)
+                try:
+                    cnx.reset_session()
+                except mysql.connector.Error as e:
+                    logger.warning("Сброс сессии не удался (%s), соединение будет открыто заново", e)
+                    cnx.disconnect()
+                cnx._trainsafe_resets = getattr(cnx, "_trainsafe_resets", 0) + 1
+            super().add_connection(cnx)
+
+
+# =============================================================================
+# ПЕРЕВОД ЗАПРОСОВ MySQL → SQLite
+# =============================================================================
+
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_PLACEHOLDER_RE = re.compile(r"%s|%%")
+_SKIPPED_RE = re.compile(r"^\s*(?:CREATE\s+(?:DATABASE|SCHEMA)|USE)\b", re.IGNORECASE)
+_START_RE = re.compile(r"^\s*START\s+TRANSACTION\s*$", re.IGNORECASE)
+_DROP_RE = re.compile(r"^\s*DROP\s+TABLE\s+(IF\s+EXISTS\s+)?(.+)$", re.IGNORECASE | re.DOTALL)
+_RENAME_RE = re.compile(r"^\s*RENAME\s+TABLE\s+(.+)$", re.IGNORECASE | re.DOTALL)
+_LIKE_RE = re.compile(r"^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?(`?\w+`?)\s+LIKE\s+(`?\w+`?)\s*$",
+                      re.IGNORECASE)
+_CREATE_RE = re.compile(r"^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(`?\w+`?)\s*\(", re.IGNORECASE)
+_AUTO_INCREMENT_RE = re.compile(
+    r"(`?\w+`?)\s+(?:BIG|SMALL|MEDIUM|TINY)?INT(?:EGER)?(?:\(\d+\))?\s+(?:UNSIGNED\s+)?(?:NOT\s+NULL\s+)?"
+    r"AUTO_INCREMENT\s+PRIMARY\s+KEY", re.IGNORECASE)
+_ENUM_RE = re.compile(r"(`?\w+`?)\s+ENUM\s*\(([^)]*)\)", re.IGNORECASE)
+_INLINE_INDEX_RE = re.compile(r",\s*(UNIQUE\s+)?(?:INDEX|KEY)\s+(`?\w+`?)\s*\(([^)]*)\)", re.IGNORECASE)
+_TABLE_OPTIONS_RE = re.compile(r"\)\s*(?:ENGINE|DEFAULT\s+CHARSET|CHARSET|COLLATE|AUTO_INCREMENT)\s*=.*$",
+                               re.IGNORECASE | re.DOTALL)
+_CURRENT_TIMESTAMP_DEFAULT_RE = re.compile(r"DEFAULT\s+CURRENT_TIMESTAMP(?:\(\))?", re.IGNORECASE)
+_ON_UPDATE_RE = re.compile(r"\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP(?:\(\))?", re.IGNORECASE)
+_INTERVAL_RE = re.compile(r"\bNOW\(\)\s*([-+])\s*INTERVAL\s+(\?|\d+)\s+(SECOND|MINUTE|HOUR|DAY)\b", re.IGNORECASE)
+_NOW_RE = re.compile(r"\b(?:NOW|CURRENT_TIMESTAMP|LOCALTIME|LOCALTIMESTAMP)\(\)", re.IGNORECASE)
+_CURDATE_RE = re.compile(r"\bCURDATE\(\)", re.IGNORECASE)
+_INSERT_IGNORE_RE = re.compile(r"^\s*INSERT\s+IGNORE\b", re.IGNORECASE)
+_UPSERT_RE = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b(.*)$", re.IGNORECASE | re.DOTALL)
+_VALUES_FUNC_RE = re.compile(r"\bVALUES\s*\(\s*(`?\w+`?)\s*\)", re.IGNORECASE)
+_SQLITE_UPSERT_RE = re.compile(r"^\s*INSERT\s+INTO\s+(`?\w+`?).*\bON\s+CONFLICT\s+DO\s+UPDATE\b",
+                               re.IGNORECASE | re.DOTALL)
+_LOCKING_READ_RE = re.compile(r"\s+(?:FOR\s+UPDATE|FOR\s+SHARE|LOCK\s+IN\s+SHARE\s+MODE)\s*$", re.IGNORECASE)
+
+_NOW_SQL = "datetime('now', 'localtime')"
+
+
+def _protect_literals(sql, has_params):
+    """Заменяет строковые литералы метками, чтобы перевод их не задел."""
+    literals = []
+
+    def keep(match):
+        # С параметрами mysql.connector превращает %% в % и внутри литералов
+        literals.append(match.group(0).replace("%%", "%") if has_params else match.group(0))
+        return f"\x00{len(literals) - 1}\x00"
+
+    return _LITERAL_RE.sub(keep, sql), literals
+
+
+def _restore_literals(sql, literals):
+    return re.sub(r"\x00(\d+)\x00", lambda m: literals[int(m.group(1))], sql)
+
+
+def _create_table(sql):
+    """CREATE TABLE MySQL → CREATE TABLE SQLite и CREATE INDEX для индексов из тела таблицы."""
+    table = _CREATE_RE.match(sql).group(1)
+    indexes = []
+
+    def index(match):
+        unique, name, columns = match.groups()
+        indexes.append(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        return ""
+
+    sql = _INLINE_INDEX_RE.sub(index, sql)
+    sql = _TABLE_OPTIONS_RE.sub(")", sql)
+    sql = _AUTO_INCREMENT_RE.sub(r"\1 INTEGER PRIMARY KEY AUTOINCREMENT", sql)
+    sql = _ENUM_RE.sub(r"\1 TEXT CHECK (\1 IN (\2))", sql)
+    sql = _ON_UPDATE_RE.sub("", sql)
+    sql = _CURRENT_TIMESTAMP_DEFAULT_RE.sub(f"DEFAULT ({_NOW_SQL})", sql)
+    return [sql] + indexes
+
+
+def _split_top_level(sql):
+    """Части sql через запятые вне скобок (литералы уже заменены метками)."""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(sql):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(sql[start:i])
+            start = i + 1
+    parts.append(sql[start:])
+    return parts
+
+
+def _upsert_updates(updates):
+    """
+    "c = VALUES(c), ..." → "SET c = excluded.c, ... WHERE c IS NOT (excluded.c) OR ...":
+    как в MySQL, строка, значения которой не меняются, не перезаписывается.
+    """
+    updates = _VALUES_FUNC_RE.sub(r"excluded.\1", updates)
+    changed = []
+    for assignment in _split_top_level(updates):
+        column, _, value = assignment.partition("=")
+        changed.append(f"{column.strip()} IS NOT ({value.strip()})")
+    return f" {updates.strip()} WHERE {' OR '.join(changed)}"
+
+
+def _interval(match):
+    sign, amount, unit = match.groups()
+    return f"datetime('now', 'localtime', '{sign}' || {amount} || ' {unit.lower()}s')"
+
+
+@lru_cache(maxsize=1024)
+def translate(sql, has_params=True):
+    """
+    Запрос MySQL → кортеж запросов SQLite (DDL может дать несколько запросов или ни одного).
+    has_params — переданы ли параметры: только тогда %s и %% — плейсхолдер и экранирование.
+    """
+    sql = sql.strip().rstrip(";").strip()
+    protected, literals = _protect_literals(sql, has_params)
+    if has_params:
+        protected = _PLACEHOLDER_RE.sub(lambda m: "?" if m.group(0) == "%s" else "%", protected)
+
+    if _SKIPPED_RE.match(protected):
+        return ()
+    if _START_RE.match(protected):
+        statements = ["BEGIN"]
+    elif _DROP_RE.match(protected):
+        if_exists, tables = _DROP_RE.match(protected).groups()
+        statements = [f"DROP TABLE {if_exists or ''}{t.strip()}" for t in tables.split(",")]
+    elif _RENAME_RE.match(protected):
+        statements = []
+        for pair in _RENAME_RE.match(protected).group(1).split(","):
+            old, new = re.split(r"\s+TO\s+", pair.strip(), flags=re.IGNORECASE)
+            statements.append(f"ALTER TABLE {old} RENAME TO {new}")
+    elif _LIKE_RE.match(protected):
+        if_not_exists, table, source = _LIKE_RE.match(protected).groups()
+        statements = [f"CREATE TABLE {if_not_exists or ''}{table} AS SELECT * FROM {source} WHERE 0"]
+    elif _CREATE_RE.match(protected):
+        statements = _create_table(protected)
+    else:
+        statement = _INSERT_IGNORE_RE.sub("INSERT OR IGNORE", protected)
+        upsert = _UPSERT_RE.search(statement)
+        if upsert:
+            statement = statement[:upsert.start()] + "ON CONFLICT DO UPDATE SET" + _upsert_updates(upsert.group(1))
+        statement = _LOCKING_READ_RE.sub("", statement)
+        statements = [statement]
+
+    result = []
+    for statement in statements:
+        statement = _INTERVAL_RE.sub(_interval, statement)
+        statement = _NOW_RE.sub(_NOW_SQL, statement)
+        statement = _CURDATE_RE.sub("date('now', 'localtime')", statement)
+        result.append(_restore_literals(statement, literals))
+    return tuple(result)
+
+
+# =============================================================================
+# SQLite
+# =============================================================================
+
+def _md5(value):
+    return None if value is None else hashlib.md5(str(value).encode()).hexdigest()
+
+
+def _concat(*values):
+    return None if any(v is None for v in values) else "".join(str(v) for v in values)
+
+
+def _concat_ws(separator, *values):
+    if separator is None:
+        return None
+    return str(separator).join(str(v) for v in values if v is not None)
+
+
+_FUNCTIONS = (("MD5", 1, _md5), ("CONCAT", -1, _concat), ("CONCAT_WS", -1, _concat_ws))
+
+# Типы значений как у mysql.connector: параметры — в текст, колонки по объявленному типу — обратно
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda v: v.isoformat(" "))
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()))
+sqlite3.register_converter("DECIMAL", lambda b: Decimal(b.decode()))
+
+_connection_ids = itertools.count(1)
+_memory_anchor = None
+_wal_enabled = False
+_open_lock = threading.Lock()
+
+
+def _open_sqlite():
+    """Новое соединение SQLite и его connection_id."""
+    global _memory_anchor, _wal_enabled
+    memory = SQLITE_PATH == ":memory:"
+    target = f"file:trainsafe-{os.getpid()}?mode=memory&cache=shared" if memory else SQLITE_PATH
+    raw = sqlite3.connect(target, uri=memory, timeout=SQLITE_TIMEOUT, isolation_level=None,
+                          check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+    raw.execute("PRAGMA foreign_keys = ON")
+    for name, n_args, func in _FUNCTIONS:
+        raw.create_function(name, n_args, func, deterministic=True)
+    with _open_lock:
+        if memory and _memory_anchor is None:
+            # БД в памяти существует, пока открыто хотя бы одно соединение
+            _memory_anchor = sqlite3.connect(target, uri=True, check_same_thread=False)
+        if not memory and not _wal_enabled:
+            raw.execute("PRAGMA journal_mode = WAL")
+            _wal_enabled = True
+    return raw, next(_connection_ids)
+
+
+def _retry_locked(call):
+    """
+    Выполняет call(), повторяя его, пока таблица заблокирована другой транзакцией
+    (в shared cache SQLite сразу возвращает SQLITE_LOCKED, не дожидаясь timeout).
+    """
+    deadline = time.monotonic() + SQLITE_TIMEOUT
+    delay = 0.001
+    while True:
+        try:
+            return call()
+        except sqlite3.OperationalError as e:
+            if (getattr(e, "sqlite_errorcode", 0) & 0xFF) != sqlite3.SQLITE_LOCKED or time.monotonic() >= deadline:
+                raise
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+class SQLiteCursor:
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._cursor = conn._raw.cursor()
+        self.dictionary = dictionary
+        self._rowcount = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def with_rows(self):
+        return self._cursor.description is not None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount if self._rowcount is None else self._rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cursor.description or ())
+
+    def _upsert(self, statement, args, table):
+        """
+        INSERT ... ON CONFLICT DO UPDATE с rowcount как у MySQL. SQLite считает вставку
+        и изменение по одному; вставленные строки — те, что получили rowid больше прежнего.
+        """
+        raw = self._conn._raw
+        last = _retry_locked(lambda: raw.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]) or 0
+        _retry_locked(lambda: self._cursor.execute(statement, args))
+        changes = self._cursor.rowcount
+        inserted = raw.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid > ?", (last,)).fetchone()[0]
+        self._rowcount = inserted + 2 * (changes - inserted)
+
+    def execute(self, operation, params=None):
+        statements = translate(operation, params is not None)
+        args = tuple(params) if params is not None else ()
+        self._rowcount = None
+        upsert = _SQLITE_UPSERT_RE.match(statements[0]) if len(statements) == 1 else None
+        if upsert:
+            self._upsert(statements[0], args, upsert.group(1))
+        elif len(statements) == 1:
+            _retry_locked(lambda: self._cursor.execute(statements[0], args))
+        elif statements:
+            # Несколько запросов вместо одного (DROP/RENAME нескольких таблиц) — атомарно
+            self._cursor.execute("SAVEPOINT translated")
+            try:
+                for i, statement in enumerate(statements):
+                    _retry_locked(lambda: self._cursor.execute(statement, args if i == 0 else ()))
+            except sqlite3.Error:
+                self._cursor.execute("ROLLBACK TO translated")
+                self._cursor.execute("RELEASE translated")
+                raise
+            self._cursor.execute("RELEASE translated")
+
+    def executemany(self, operation, seq_params):
+        statements = translate(operation, True)
+        if len(statements) != 1:
+            raise sqlite3.ProgrammingError("executemany() supports a single statement")
+        rows = [tuple(p) for p in seq_params]
+        self._rowcount = None
+        _retry_locked(lambda: self._cursor.executemany(statements[0], rows))
+
+    def _convert(self, rows):
+        if not self.dictionary or rows is None:
+            return rows
+        names = self.column_names
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def fetchmany(self, size=1):
+        return self._convert(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._convert(self._cursor.fetchall())
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Соединение SQLite с API mysql.connector (см. модуль); autocommit, как у пула MySQL."""
+
+    def __init__(self, raw, connection_id, pool=None):
+        self._raw = raw
+        self._pool = pool
+        self.connection_id = connection_id
+        self.database = None
+        self.autocommit = True
+
+    def limit_time(self, seconds):
+        """Прерывает запросы после seconds секунд (progress handler SQLite); None — снять предел."""
+        if seconds is None:
+            self._raw.set_progress_handler(None, 0)
+            return
+        until = time.monotonic() + seconds
+        self._raw.set_progress_handler(lambda: time.monotonic() > until, 1000)
+
+    def cursor(self, dictionary=False, prepared=False, **kwargs):
+        # prepared игнорируется: SQLite и так кэширует разобранные запросы соединения
+        return SQLiteCursor(self, dictionary)
+
+    def is_connected(self):
+        return self._raw is not None
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def start_transaction(self):
+        # Как в InnoDB, блокировки берутся первым запросом, а не самим BEGIN
+        self._raw.execute("BEGIN")
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        raw.set_progress_handler(None, 0)
+        if raw.in_transaction:
+            raw.rollback()
+        if self._pool is not None and not getattr(self, "_trainsafe_session_changed", False):
+            self._pool._release(raw, self.connection_id)
+        else:
+            raw.close()
+
+
+class SQLitePool:
+    """Пул соединений SQLite: до size простаивающих соединений, сверх них — новые."""
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        with self._lock:
+            idle = self._idle.pop() if self._idle else None
+        raw, connection_id = idle or _open_sqlite()
+        return SQLiteConnection(raw, connection_id, pool=self)
+
+    def _release(self, raw, connection_id):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((raw, connection_id))
+                return
+        raw.close()
@@ -0,0 +1,143 @@
+"""
+Пул соединений с БД и кэш серверных prepared statements.
+
+Соединения берутся из пула адаптера БД (db.create_pool: mysql.connector.pooling
+или пул SQLite при DB_BACKEND=sqlite) и при close() возвращаются в пул.
+Сессия при возврате не сбрасывается (pool_reset_session=False): иначе MySQL
+освобождает все prepared statements соединения и кэш терял бы смысл. Поэтому
+соединения работают в autocommit, явные транзакции закрываются до возврата в пул,
+а соединение, на котором выполнен запрос, меняющий состояние сессии (USE, SET,
+LOCK TABLES, пользовательские переменные), request_service помечает
+(db.mark_session_changed), и пул открывает его заново. Если соединение вернулось
+с открытой транзакцией, пул сбрасывает его сессию (db.MySQLPool); в обоих случаях
+кэш prepared statements этого соединения создаётся заново.
+
+Prepared statements использует только request_service.
+"""
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from . import db
+from .db import Error
+
+logger = logging.getLogger("db_pool")
+
+
+class ConnectionPool:
+    """
+    Ленивый пул: соединения открываются при первом обращении, а не при импорте модуля.
+    Если все соединения заняты, выдаётся отдельное соединение вне пула.
+    """
+
+    def __init__(self, name, config, size):
+        self.name = name
+        self.config = dict(config, autocommit=True)
+        self.size = size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = db.create_pool(self.name, self.config, self.size)
+        return self._pool
+
+    def get_connection(self):
+        try:
+            conn = self._get_pool().get_connection()
+        except db.PoolError as e:
+            logger.warning("Пул %s исчерпан (%s), открываем соединение вне пула", self.name, e)
+            return db.connect(**self.config)
+        return conn
+
+    def warm_up(self):
+        """Открывает соединения пула заранее (MySQLConnectionPool создаёт их сразу, пул SQLite — по требованию)."""
+        self._get_pool()
+        return {"size": self.size}
+
+    def ping(self):
+        """SELECT 1 на соединении из пула; бросает Error, если БД недоступна."""
+        started = time.perf_counter()
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+        return {"latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+class PreparedStatementCache:
+    """
+    LRU серверных prepared statements одного физического соединения.
+
+    На каждый шаблон запроса держим отдельный prepared-курсор: повторное
+    выполнение того же шаблона не требует нового разбора на стороне MySQL.
+    Вытесненный курсор закрывается, что освобождает statement на сервере.
+    """
+
+    def __init__(self, conn, capacity):
+        self.conn = conn
+        self.capacity = capacity
+        self.connection_id = conn.connection_id
+        self.resets = getattr(conn, "_trainsafe_resets", 0)
+        self._cursors = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cursor_for(self, template):
+        cursor = self._cursors.get(template)
+        if cursor is not None:
+            self._cursors.move_to_end(template)
+            self.hits += 1
+            return cursor
+        self.misses += 1
+        cursor = self.conn.cursor(prepared=True)
+        self._cursors[template] = cursor
+        while len(self._cursors) > self.capacity:
+            _, evicted = self._cursors.popitem(last=False)
+            try:
+                evicted.close()
+            except Error as e:
+                logger.debug("Ошибка при закрытии prepared statement: %s", e)
+        return cursor
+
+    def discard(self, template):
+        """Убирает шаблон из кэша (например, после ошибки выполнения)."""
+        cursor = self._cursors.pop(template, None)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Error:
+                pass
+
+
+# Кэши привязаны к физическому соединению, которое живёт в пуле между запросами
+_statement_caches = weakref.WeakKeyDictionary()
+_statement_caches_lock = threading.Lock()
+
+
+def statement_cache(conn, capacity):
+    """
+    Кэш prepared statements для соединения из пула.
+    После переподключения (новый connection_id) или сброса сессии пулом кэш создаётся заново.
+    Соединение вне пула живёт один запрос — для него кэш не сохраняется.
+    """
+    raw_conn = getattr(conn, "_cnx", None)
+    if raw_conn is None:
+        return PreparedStatementCache(conn, capacity)
+    with _statement_caches_lock:
+        cache = _statement_caches.get(raw_conn)
+        if (cache is None or cache.connection_id != raw_conn.connection_id
+                or cache.resets != getattr(raw_conn, "_trainsafe_resets", 0)):
+            cache = PreparedStatementCache(raw_conn, capacity)
+            _statement_caches[raw_conn] = cache
+        return cache
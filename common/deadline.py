@@ -0,0 +1,130 @@
+"""
+Дедлайны запросов, сквозные для gateway и микросервисов.
+
+- gateway задаёт бюджет на каждый эндпоинт (scope), отсчёт идёт от входа запроса,
+  так что ожидание допуска и проверка сессии тоже расходуют бюджет;
+- клиент может сократить бюджет своим заголовком X-Request-Timeout-Ms;
+- исходящие вызовы передают остаток бюджета в миллисекундах тем же заголовком
+  (inject); сервис при входе восстанавливает по нему свой дедлайн (init_app).
+  Передаётся остаток, а не момент времени, поэтому расхождение часов не важно;
+- обработчики и обращения к БД проверяют дедлайн (check) и прекращают работу,
+  когда он истёк: ответ 504, долгий запрос никто уже не ждёт;
+- таймауты вызовов сервисов и предел времени запроса к БД берутся из остатка (cap).
+
+В совмещённом режиме (combined.py) дедлайн виден сервисам напрямую (contextvars).
+"""
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+HEADER = "X-Request-Timeout-Ms"
+
+# Абсолютный дедлайн текущего запроса по time.monotonic() или None — без ограничения
+_deadline = contextvars.ContextVar("trainsafe_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени запроса исчерпан."""
+
+    def __init__(self, message="Deadline exceeded"):
+        super().__init__(message)
+
+
+def remaining():
+    """Остаток бюджета в секундах (может быть отрицательным) или None, если дедлайна нет."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(where=None):
+    """Бросает DeadlineExceeded, если дедлайн истёк; where — что не успели (для сообщения)."""
+    if expired():
+        raise DeadlineExceeded(f"Deadline exceeded before {where}" if where else "Deadline exceeded")
+
+
+def cap(timeout):
+    """
+    Таймаут не больше остатка бюджета. Бросает DeadlineExceeded, если бюджет исчерпан:
+    начинать вызов или запрос уже бессмысленно.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left if timeout is None else min(timeout, left)
+
+
+@contextmanager
+def scope(seconds):
+    """
+    Дедлайн на время блока: через seconds секунд, но не позже уже действующего.
+    seconds=None или <= 0 — без собственного ограничения.
+    """
+    deadline = _deadline.get()
+    if seconds is not None and seconds > 0:
+        own = time.monotonic() + seconds
+        deadline = own if deadline is None else min(deadline, own)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def bounded(seconds):
+    """Декоратор: вызов функции в scope(seconds)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with scope(seconds):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inject(headers):
+    """Добавляет остаток бюджета в заголовки исходящего запроса."""
+    left = remaining()
+    if left is not None:
+        headers[HEADER] = str(max(0, int(left * 1000)))
+    return headers
+
+
+def parse(value):
+    """Значение заголовка -> секунды или None, если заголовка нет или он некорректен."""
+    try:
+        milliseconds = int(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, milliseconds) / 1000
+
+
+def init_app(app, error_response):
+    """
+    Подключает дедлайны к Flask-приложению: дедлайн из заголовка вызывающего на время
+    запроса и ответ 504 на DeadlineExceeded. error_response(body, status) — ответ в формате сервиса.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_deadline():
+        seconds = parse(request.headers.get(HEADER))
+        if seconds is not None:
+            g._deadline_token = _deadline.set(time.monotonic() + seconds)
+
+    @app.teardown_request
+    def _finish_deadline(exc):
+        token = g.pop("_deadline_token", None)
+        if token is not None:
+            _deadline.reset(token)
+
+    @app.errorhandler(DeadlineExceeded)
+    def _deadline_exceeded(e):
+        return error_response({"message": str(e)}, 504)
@@ -0,0 +1,136 @@
+"""
+Проверки живости и готовности сервиса (/healthz, /readyz) и прогрев при старте.
+
+/healthz — процесс жив и обслуживает HTTP; внешние зависимости не проверяются,
+           чтобы перебои БД не приводили к перезапуску пода.
+/readyz  — прогрев завершён и все критичные проверки (пул БД, доступность
+           соседних сервисов) проходят; иначе 503 — под не получает трафик.
+
+Шаги прогрева (открыть соединения пула, скомпилировать allowlist, открыть
+keep-alive к сервисам и т. п.) выполняются один раз в фоновом потоке: при запуске
+скриптом — сразу (start_on_run), под WSGI-сервером (gunicorn, flask run) — с первым
+запросом к сервису, в том числе пробой.
+Результаты проверок кэшируются на check_ttl секунд, чтобы частые пробы
+не нагружали БД.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("health")
+
+
+class Health:
+    def __init__(self, service, check_ttl=2.0):
+        self.service = service
+        self.check_ttl = check_ttl
+        self.started_at = time.time()
+        self.warmed_up = False
+        self.warm_up_results = {}
+        self._steps = []
+        self._checks = []
+        self._cached = None
+        self._cached_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def warm_up_step(self, name):
+        """Декоратор: шаг прогрева. Ошибка шага логируется, но не останавливает прогрев."""
+        def decorator(func):
+            self._steps.append((name, func))
+            return func
+        return decorator
+
+    def check(self, name, critical=True):
+        """
+        Декоратор: проверка готовности. Функция возвращает подробности (или None)
+        либо бросает исключение. Некритичная проверка видна в ответе, но не делает сервис неготовым.
+        """
+        def decorator(func):
+            self._checks.append((name, func, critical))
+            return func
+        return decorator
+
+    def warm_up(self):
+        for name, func in self._steps:
+            started = time.perf_counter()
+            try:
+                detail = func()
+                self.warm_up_results[name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+                if detail is not None:
+                    self.warm_up_results[name]["detail"] = detail
+            except Exception as e:
+                logger.warning("Шаг прогрева %s завершился ошибкой: %s", name, e)
+                self.warm_up_results[name] = {"ok": False, "error": str(e)}
+        self.warmed_up = True
+        logger.info("Прогрев %s завершён за %.2f с", self.service, time.time() - self.started_at)
+
+    def start_warm_up(self):
+        """Запускает прогрев в фоне (один раз на процесс)."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.warm_up, name="warm-up", daemon=True)
+                self._thread.start()
+
+    def start_on_run(self, app):
+        """
+        Прогрев при запуске скриптом (перед app.run). С debug Flask запускает reloader:
+        модуль выполняется и в процессе-наблюдателе, который запросов не обслуживает, —
+        прогрев и фоновые потоки нужны только в рабочем процессе (WERKZEUG_RUN_MAIN=true).
+        """
+        if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            self.start_warm_up()
+
+    def run_checks(self):
+        """(ready, {name: {ok, critical, detail|error}}) с кэшированием на check_ttl секунд."""
+        now = time.monotonic()
+        with self._lock:
+            if self._cached is not None and now - self._cached_at < self.check_ttl:
+                return self._cached
+        results, ready = {}, True
+        for name, func, critical in self._checks:
+            try:
+                detail = func()
+                results[name] = {"ok": True, "critical": critical}
+                if detail is not None:
+                    results[name]["detail"] = detail
+            except Exception as e:
+                results[name] = {"ok": False, "critical": critical, "error": str(e)}
+                ready = ready and not critical
+        with self._lock:
+            self._cached, self._cached_at = (ready, results), now
+        return ready, results
+
+    def liveness(self):
+        self.start_warm_up()
+        return {
+            "status": "ok",
+            "service": self.service,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "warmed_up": self.warmed_up,
+        }, 200
+
+    def readiness(self):
+        self.start_warm_up()
+        if not self.warmed_up:
+            return {"status": "warming_up", "service": self.service, "warm_up": self.warm_up_results}, 503
+        ready, checks = self.run_checks()
+        return {
+            "status": "ready" if ready else "not_ready",
+            "service": self.service,
+            "checks": checks,
+            "warm_up": self.warm_up_results,
+        }, 200 if ready else 503
+
+    def init_app(self, app, make_response):
+        """
+        Регистрирует /healthz и /readyz; make_response(body, status) -> ответ Flask.
+        Первый запрос к приложению запускает прогрев, если он ещё не запущен
+        (запуск не через __main__: gunicorn, flask run).
+        """
+        app.before_request(self.start_warm_up)
+        app.add_url_rule("/healthz", "healthz", lambda: make_response(*self.liveness()))
+        app.add_url_rule("/readyz", "readyz", lambda: make_response(*self.readiness()))
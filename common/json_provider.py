@@ -0,0 +1,135 @@
+"""
+Быстрый JSON-провайдер Flask (orjson) для запросов и ответов всех сервисов.
+
+Подключается через init_app(app) и заменяет стандартный провайдер: jsonify,
+request.json и codec.make_response начинают работать через orjson, который
+в разы быстрее на больших списках строк из train_data. Ответ собирается сразу
+в байтах, без промежуточной str.
+
+Типы:
+- datetime / date — ISO 8601 ("2024-05-01T12:30:00"), а не формат HTTP-даты Flask;
+- timedelta (колонки TIME) — строка "H:MM:SS";
+- Decimal (DECIMAL(15,2)) — по JSON_DECIMAL: string (по умолчанию, без потерь)
+  или float;
+- float (колонки FLOAT) — по JSON_FLOAT: native (как есть), float32 (кратчайшая
+  запись, точная для FLOAT одинарной точности: 0.3 вместо 0.30000001192092896)
+  или round:N (округление до N знаков). NaN и бесконечности — null.
+
+Ключи не сортируются: строки результата сохраняют порядок колонок SELECT.
+Без orjson используется стандартный json с теми же правилами для типов.
+"""
+import json
+import math
+import os
+import struct
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # без orjson — стандартный json, медленнее, но с тем же форматом
+    orjson = None
+
+JSON_DECIMAL = os.getenv("JSON_DECIMAL", "string").lower()
+JSON_FLOAT = os.getenv("JSON_FLOAT", "native").lower()
+
+
+def _float32(value):
+    """Кратчайшая десятичная запись, которая даёт то же число одинарной точности."""
+    if not math.isfinite(value):
+        return value
+    try:
+        target = struct.pack("<f", value)
+    except OverflowError:
+        return value
+    for digits in range(6, 10):
+        candidate = float(f"{value:.{digits}g}")
+        if struct.pack("<f", candidate) == target:
+            return candidate
+    return value
+
+
+def float_converter(policy):
+    """Функция преобразования float по политике (None для native)."""
+    if policy == "native":
+        return None
+    if policy == "float32":
+        return _float32
+    if policy.startswith("round:"):
+        ndigits = int(policy.split(":", 1)[1])
+        return lambda value: round(value, ndigits) if math.isfinite(value) else value
+    raise ValueError(f"Unknown JSON_FLOAT policy: {policy}")
+
+
+def _convert_floats(obj, convert):
+    if isinstance(obj, float):
+        return convert(obj)
+    if isinstance(obj, dict):
+        return {key: _convert_floats(value, convert) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_convert_floats(value, convert) for value in obj]
+    return obj
+
+
+class FastJSONProvider(JSONProvider):
+    """JSON-провайдер на orjson с политиками для Decimal и float (см. модуль)."""
+
+    mimetype = "application/json"
+
+    def __init__(self, app, decimal=JSON_DECIMAL, floats=JSON_FLOAT):
+        super().__init__(app)
+        if decimal not in ("string", "float"):
+            raise ValueError(f"Unknown JSON_DECIMAL policy: {decimal}")
+        self.decimal = decimal
+        self.floats = floats
+        self._convert_float = float_converter(floats)
+
+    def _default(self, obj):
+        # Вызывается только для типов, которые orjson / json не умеют сами
+        if isinstance(obj, Decimal):
+            if self.decimal == "float":
+                value = float(obj)
+                return self._convert_float(value) if self._convert_float else value
+            return str(obj)
+        if isinstance(obj, datetime):       # для стандартного json; orjson пишет их сам
+            return obj.isoformat()
+        if isinstance(obj, date):
+            return obj.isoformat()
+        if isinstance(obj, timedelta):
+            return str(obj)
+        if isinstance(obj, (bytes, bytearray)):
+            return obj.decode("utf-8", "replace")
+        if hasattr(obj, "__html__"):
+            return str(obj.__html__())
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def dumpb(self, obj):
+        """Сериализация сразу в байты UTF-8."""
+        if self._convert_float is not None:
+            obj = _convert_floats(obj, self._convert_float)
+        if orjson is not None:
+            return orjson.dumps(obj, default=self._default,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(obj, default=self._default, ensure_ascii=False,
+                          separators=(",", ":")).encode()
+
+    def dumps(self, obj, **kwargs):
+        return self.dumpb(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumpb(obj), mimetype=self.mimetype)
+
+
+def init_app(app, **options):
+    """Устанавливает FastJSONProvider как JSON-провайдер приложения."""
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app, **options)
+    return app.json
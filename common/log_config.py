@@ -0,0 +1,88 @@
+"""
+Общая настройка логирования сервисов TrainSafe.
+
+- уровень задаётся LOG_LEVEL (по умолчанию INFO), поэтому logger.debug(...)
+  в production сводится к одной проверке isEnabledFor;
+- LOG_FORMAT=json (по умолчанию) — одна JSON-строка на событие, LOG_FORMAT=text — читаемый вид;
+- LOG_DEBUG_SAMPLE_RATE (0..1) — доля DEBUG-событий, которые реально пишутся;
+- запись неблокирующая: поток запроса только кладёт запись в очередь (QueueHandler),
+  форматирует и пишет в stdout отдельный поток (QueueListener).
+
+Поля, переданные через extra=..., попадают в JSON как отдельные ключи.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+# Атрибуты LogRecord, которые не считаются пользовательскими полями
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на событие."""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": record.name.split(".")[0],
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Пропускает только долю rate DEBUG-событий; остальные уровни — всегда."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+def setup_logging(service):
+    """
+    Настраивает корневой логгер (один раз на процесс) и возвращает логгер сервиса.
+    В совмещённом режиме все три сервиса пишут через один общий QueueListener,
+    а поле service берётся из имени логгера.
+    """
+    global _listener
+    if _listener is None:
+        if os.getenv("LOG_FORMAT", "json").lower() == "text":
+            formatter = logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+        else:
+            formatter = JsonFormatter()
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(DebugSampler(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 1.0))))
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+    return logging.getLogger(service)
@@ -0,0 +1,268 @@
+"""
+Профилирование по запросу администратора (/debug/profile).
+
+Два режима:
+- GET /debug/profile?seconds=5&interval_ms=10 — сэмплирование всех потоков процесса
+  в течение seconds секунд (не больше max_seconds): раз в interval_ms снимаются стеки
+  (sys._current_frames), без трассировки вызовов, поэтому накладные расходы малы
+  и от нагрузки не зависят. Ответ — collapsed stacks ("поток;функция;функция N"),
+  их принимают flamegraph.pl и speedscope; format=json — те же стеки и топ функций
+  по собственному времени. Потоки, ждущие работы (idle=0), по умолчанию отбрасываются.
+  Одновременно идёт не больше одного сэмплирования (иначе 409).
+- заголовок X-Profile: 1 у обычного запроса — cProfile только потока этого запроса
+  от before_request до after_request (проверка IP, регулярные выражения политики,
+  сериализация ответа); в ответе X-Profile-Id, сам профиль —
+  GET /debug/profile/requests/<id>?sort=tottime|cumtime&limit=30. Тело потоковых ответов
+  отдаётся после after_request и в профиль не попадает. Одновременно профилируется
+  один запрос: остальные с X-Profile выполняются без профиля.
+
+Доступ — только с адресов allowed (по умолчанию localhost, например через kubectl
+port-forward) и с заголовком X-Profiler-Token, равным token; без token профилирование выключено.
+"""
+import cProfile
+import hmac
+import ipaddress
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+TOKEN_HEADER = "X-Profiler-Token"
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Листовые кадры потоков, которые ждут работы, а не выполняют её
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("socketserver.py", "serve_forever"),
+    ("queue.py", "get"),
+    ("handlers.py", "dequeue"),        # QueueListener логирования ждёт в SimpleQueue.get
+    ("thread.py", "_worker"),          # ThreadPoolExecutor ждёт задачу в SimpleQueue.get
+}
+
+# cProfile активен не больше чем в одном потоке процесса (в совмещённом режиме — на все сервисы)
+_request_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Сэмплирование уже идёт."""
+
+
+def frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def sample(seconds, interval, idle=False, exclude=()):
+    """
+    Стеки всех потоков раз в interval секунд в течение seconds секунд.
+    Возвращает (Counter {"поток;корень;...;лист": число сэмплов}, число снимков).
+    """
+    stacks = Counter()
+    snapshots = 0
+    exclude = set(exclude) | {threading.get_ident()}
+    end = time.monotonic() + seconds
+    while True:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in exclude:
+                continue
+            code = frame.f_code
+            if not idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(labels))] += 1
+        snapshots += 1
+        left = end - time.monotonic()
+        if left <= 0:
+            return stacks, snapshots
+        time.sleep(min(interval, left))
+
+
+def collapsed(stacks):
+    """Текст collapsed stacks: строка на стек, по убыванию числа сэмплов."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_functions(stacks, limit):
+    """Функции по собственному (лист стека) и полному времени в сэмплах."""
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if frames:
+            own[frames[-1]] += count
+        for label in set(frames):
+            total[label] += count
+    return [{"function": label, "self": count, "total": total[label]}
+            for label, count in own.most_common(limit)]
+
+
+def profile_rows(profile):
+    """Строки cProfile: функция, вызовы, собственное и полное время в мс."""
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in pstats.Stats(profile).stats.items():
+        label = f"{os.path.basename(filename)}:{line}({name})" if line else name
+        rows.append({"function": label, "calls": calls,
+                     "self_ms": round(tottime * 1000, 3), "total_ms": round(cumtime * 1000, 3)})
+    return rows
+
+
+class Profiler:
+    def __init__(self, service, token=None, allowed=("127.0.0.1", "::1"),
+                 max_seconds=30.0, default_interval=0.01, keep=20):
+        self.service = service
+        self.token = token or None
+        self.networks = tuple(ipaddress.ip_network(a.strip(), strict=False) for a in allowed if a.strip())
+        self.max_seconds = max_seconds
+        self.default_interval = default_interval
+        self._sampling = threading.Lock()
+        self._profiles = deque(maxlen=keep)
+        self._profiles_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @property
+    def enabled(self):
+        return self.token is not None
+
+    def authorized(self, remote_addr, token):
+        """Адрес из allowed и верный токен."""
+        if not self.enabled or not token:
+            return False
+        try:
+            address = ipaddress.ip_address(remote_addr)
+        except ValueError:
+            return False
+        if not any(address in network for network in self.networks):
+            return False
+        return hmac.compare_digest(token.encode(), self.token.encode())
+
+    def sample(self, seconds, interval, idle=False):
+        """Сэмплирование всех потоков (см. модуль); бросает ProfilerBusy."""
+        if not self._sampling.acquire(blocking=False):
+            raise ProfilerBusy("Profiling is already running")
+        try:
+            started = time.time()
+            stacks, snapshots = sample(min(seconds, self.max_seconds), interval, idle)
+            return {"service": self.service, "started_at": started, "seconds": round(time.time() - started, 3),
+                    "interval_ms": round(interval * 1000, 3), "snapshots": snapshots, "stacks": stacks}
+        finally:
+            self._sampling.release()
+
+    def request_profile(self, profile_id):
+        with self._profiles_lock:
+            for item in self._profiles:
+                if item["id"] == profile_id:
+                    return item
+        return None
+
+    def _store(self, item):
+        with self._profiles_lock:
+            self._profiles.append(item)
+
+    def init_app(self, app, make_response):
+        """
+        Подключает /debug/profile, /debug/profile/requests/<id> и профилирование по
+        заголовку X-Profile. make_response(body, status) -> ответ Flask в формате сервиса.
+        """
+        from flask import Response, g, request
+
+        def denied():
+            if not self.enabled:
+                return make_response({"message": "Not found"}, 404)
+            return make_response({"message": "Forbidden"}, 403)
+
+        @app.before_request
+        def _start_request_profile():
+            if request.headers.get(PROFILE_HEADER) not in ("1", "true"):
+                return
+            if not self.authorized(request.remote_addr, request.headers.get(TOKEN_HEADER)):
+                return
+            if not _request_profile_lock.acquire(blocking=False):
+                return
+            profile = cProfile.Profile()
+            g._request_profile = (profile, time.perf_counter())
+            profile.enable()
+
+        @app.after_request
+        def _finish_request_profile(response):
+            state = g.pop("_request_profile", None)
+            if state is None:
+                return response
+            profile, started = state
+            profile.disable()
+            _request_profile_lock.release()
+            profile_id = f"{next(self._ids)}-{uuid.uuid4().hex[:8]}"
+            self._store({
+                "id": profile_id,
+                "service": self.service,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "functions": profile_rows(profile),
+            })
+            response.headers[PROFILE_ID_HEADER] = profile_id
+            return response
+
+        @app.teardown_request
+        def _abort_request_profile(exc):
+            # after_request не вызывается, если обработчик бросил исключение
+            state = g.pop("_request_profile", None)
+            if state is not None:
+                state[0].disable()
+                _request_profile_lock.release()
+
+        def debug_profile():
+            if not self.authorized(request.remote_addr, request.headers.get(TOKEN_HEADER)):
+                return denied()
+            try:
+                seconds = float(request.args.get("seconds", 5))
+                interval = float(request.args.get("interval_ms", self.default_interval * 1000)) / 1000
+                limit = int(request.args.get("limit", 30))
+            except ValueError:
+                return make_response({"message": "seconds, interval_ms and limit must be numbers"}, 400)
+            if seconds <= 0 or not 0.001 <= interval <= 1:
+                return make_response({"message": "seconds must be positive, interval_ms 1..1000"}, 400)
+            fmt = request.args.get("format", "collapsed")
+            if fmt not in ("collapsed", "json"):
+                return make_response({"message": "format must be collapsed or json"}, 400)
+            try:
+                result = self.sample(seconds, interval, idle=request.args.get("idle") == "1")
+            except ProfilerBusy as e:
+                return make_response({"message": str(e)}, 409)
+            stacks = result.pop("stacks")
+            if fmt == "collapsed":
+                return Response(collapsed(stacks), mimetype="text/plain")
+            result["samples"] = sum(stacks.values())
+            result["top"] = top_functions(stacks, limit)
+            result["stacks"] = [{"stack": s, "count": c} for s, c in stacks.most_common()]
+            return make_response(result, 200)
+
+        def debug_request_profile(profile_id):
+            if not self.authorized(request.remote_addr, request.headers.get(TOKEN_HEADER)):
+                return denied()
+            item = self.request_profile(profile_id)
+            if item is None:
+                return make_response({"message": "Profile not found"}, 404)
+            sort = request.args.get("sort", "tottime")
+            if sort not in ("tottime", "cumtime"):
+                return make_response({"message": "sort must be tottime or cumtime"}, 400)
+            try:
+                limit = int(request.args.get("limit", 30))
+            except ValueError:
+                return make_response({"message": "limit must be an integer"}, 400)
+            key = "self_ms" if sort == "tottime" else "total_ms"
+            functions = sorted(item["functions"], key=lambda f: f[key], reverse=True)[:limit]
+            return make_response(dict(item, functions=functions), 200)
+
+        app.add_url_rule("/debug/profile", "debug_profile", debug_profile)
+        app.add_url_rule("/debug/profile/requests/<profile_id>", "debug_request_profile", debug_request_profile)
@@ -0,0 +1,101 @@
+"""CoherentCache: TTL, теги, отставание шины; доставка инвалидаций LocalBus и MySQLBus."""
+import pytest
+
+from common import db
+from common.cache_bus import ALL, CoherentCache, LocalBus, MySQLBus, make_bus
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("common.cache_bus.time.monotonic", lambda: now[0])
+    return now
+
+
+class LaggingBus(LocalBus):
+    def __init__(self, lag):
+        super().__init__()
+        self._lag = lag
+
+    def lag(self):
+        return self._lag
+
+
+def test_default_bus_is_local():
+    assert make_bus(None).kind == "local"
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = CoherentCache("c", LocalBus(), ttl=10)
+    cache.set("k", "v")
+    clock[0] += 9.9
+    assert cache.get("k") == "v"
+    clock[0] += 0.1
+    assert cache.get("k") is None
+
+
+def test_entry_ttl_is_bounded_by_cache_ttl_and_own_expiry(clock):
+    cache = CoherentCache("c", LocalBus(), ttl=30)
+    cache.set("session", "until +5s", ttl=5)
+    cache.set("long", "capped", ttl=3600)
+    cache.set("expired", "never", ttl=-1)
+    clock[0] += 5
+    assert cache.get("session") is None
+    assert cache.get("long") == "capped"
+    assert cache.get("expired") is None
+    clock[0] += 25
+    assert cache.get("long") is None
+
+
+def test_disabled_cache_stores_nothing():
+    cache = CoherentCache("c", LocalBus(), ttl=0)
+    cache.set("k", "v")
+    assert cache.get("k") is None and not cache.enabled
+
+
+def test_invalidation_drops_tagged_entries_in_every_cache():
+    bus = LocalBus()
+    first, second = CoherentCache("a", bus), CoherentCache("b", bus)
+    first.set("s1", 1, tags=("table:sessions", "user:1"))
+    first.set("s2", 2, tags=("table:sessions", "user:2"))
+    second.set("r", 3, tags=("table:train_data",))
+    first.invalidate("user:1")
+    assert first.get("s1") is None and first.get("s2") == 2
+    second.invalidate(ALL)
+    assert first.get("s2") is None and second.get("r") is None
+
+
+def test_stale_bus_bypasses_and_clears_cache():
+    bus = LaggingBus(0.0)
+    cache = CoherentCache("c", bus, max_staleness=5)
+    cache.set("k", "v")
+    bus._lag = 6
+    assert cache.get("k") is None
+    assert cache.snapshot()["size"] == 0 and cache.bypassed == 1
+    bus._lag = 0
+    cache.set("k", "v")
+    assert cache.get("k") == "v"
+
+
+def test_mysql_bus_delivers_to_other_nodes_only():
+    raw, connection_id = db._open_sqlite()
+    conn = db.SQLiteConnection(raw, connection_id)
+    conn.cursor().execute("DROP TABLE IF EXISTS cache_invalidations")
+    sender, receiver = MySQLBus(lambda: None), MySQLBus(lambda: None)
+    cache = CoherentCache("c", receiver)
+    own = []
+    sender.subscribe(own.append)
+    receiver._poll(conn)
+    sender._poll(conn)
+    cache.set("k", "v", tags=("table:sessions",))
+    cache.set("other", "v", tags=("table:users",))
+
+    sender.publish(["table:sessions"], conn=conn)
+    assert own == [ALL, "table:sessions"]
+    receiver._poll(conn)
+    sender._poll(conn)
+
+    assert cache.get("k") is None and cache.get("other") == "v"
+    assert receiver.received == 2 and own == [ALL, "table:sessions"]
+    assert receiver.lag() < 1
+    conn.close()
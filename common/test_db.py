@@ -0,0 +1,74 @@
+"""Предел времени запроса: подсказка MAX_EXECUTION_TIME (MySQL) и progress handler (SQLite)."""
+import pytest
+
+from common import db
+
+
+class MySQLStub:
+    """Соединение не SQLite: limit_statement_time только переписывает текст запроса."""
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (0.0001, 100),
+    (0.1, 100),
+    (0.1001, 200),
+    (1, 1000),
+    (1.2, 2000),
+    (29.3, 30000),
+])
+def test_time_limit_rounds_up(seconds, expected):
+    assert db.time_limit_ms(seconds) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT * FROM train_data",
+     "SELECT /*+ MAX_EXECUTION_TIME(2000) */ * FROM train_data"),
+    ("  select id FROM t",
+     "  select /*+ MAX_EXECUTION_TIME(2000) */ id FROM t"),
+    ("/* report */ -- daily\nSELECT 1",
+     "/* report */ -- daily\nSELECT /*+ MAX_EXECUTION_TIME(2000) */ 1"),
+    ("SELECT /*+ NO_INDEX_MERGE(t) */ * FROM t",
+     "SELECT /*+ MAX_EXECUTION_TIME(2000) NO_INDEX_MERGE(t) */ * FROM t"),
+])
+def test_select_gets_hint(query, expected):
+    assert db.limit_statement_time(MySQLStub(), query, 1.5) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "UPDATE train_data SET label = 1",
+    "INSERT INTO t SELECT * FROM s",
+    "WITH x AS (SELECT 1) SELECT * FROM x",
+    "SELECTED",
+])
+def test_other_statements_unchanged(query):
+    assert db.limit_statement_time(MySQLStub(), query, 1.5) == query
+
+
+def test_no_limit_keeps_query():
+    assert db.limit_statement_time(MySQLStub(), "SELECT 1", None) == "SELECT 1"
+
+
+def test_hint_text_is_stable_within_a_second():
+    queries = {db.limit_statement_time(MySQLStub(), "SELECT 1", s) for s in (28.01, 28.5, 28.99)}
+    assert len(queries) == 1
+
+
+@pytest.mark.skipif(db.BACKEND != "sqlite", reason="DB_BACKEND=sqlite")
+def test_sqlite_limit_interrupts_and_is_cleared_on_return():
+    pool = db.SQLitePool(1)
+    conn = pool.get_connection()
+    query = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+             "SELECT COUNT(*) FROM n")
+    assert db.limit_statement_time(conn, query, 0.05) == query
+    cursor = conn.cursor()
+    with pytest.raises(db.Error) as info:
+        cursor.execute(query)
+    assert db.is_timeout(info.value)
+    cursor.close()
+    conn.close()
+    conn = pool.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1")
+    assert cursor.fetchall() == [(1,)]
+    cursor.close()
+    conn.close()
@@ -0,0 +1,99 @@
+"""Кэш prepared statements и сброс сессии соединения, вернувшегося в пул с транзакцией или изменённой сессией."""
+import pytest
+
+from common import db
+from common.db_pool import statement_cache
+
+
+class RawConnection:
+    def __init__(self, connection_id=1, in_transaction=False):
+        self.connection_id = connection_id
+        self.in_transaction = in_transaction
+        self.resets = 0
+        self.connected = True
+
+    def cursor(self, prepared=False):
+        return Cursor()
+
+    def reset_session(self):
+        self.resets += 1
+        self.in_transaction = False
+
+    def disconnect(self):
+        self.connected = False
+
+
+class Cursor:
+    def close(self):
+        pass
+
+
+class Pooled:
+    def __init__(self, raw):
+        self._cnx = raw
+
+
+def test_cache_survives_return_to_pool():
+    raw = RawConnection()
+    cache = statement_cache(Pooled(raw), 4)
+    cursor = cache.cursor_for("SELECT %s")
+    assert statement_cache(Pooled(raw), 4) is cache
+    assert cache.cursor_for("SELECT %s") is cursor
+
+
+def test_cache_is_rebuilt_after_reconnect():
+    raw = RawConnection()
+    cache = statement_cache(Pooled(raw), 4)
+    raw.connection_id = 2
+    assert statement_cache(Pooled(raw), 4) is not cache
+
+
+@pytest.mark.skipif(db.mysql is None, reason="mysql-connector-python")
+def test_connection_returned_in_transaction_is_reset(monkeypatch):
+    queued = []
+    monkeypatch.setattr(db.pooling.MySQLConnectionPool, "add_connection",
+                        lambda self, cnx=None: queued.append(cnx))
+    pool = object.__new__(db.MySQLPool)
+    pool._pool_name = "test"
+    clean, dirty = RawConnection(1), RawConnection(2, in_transaction=True)
+    cache = statement_cache(Pooled(dirty), 4)
+
+    pool.add_connection(clean)
+    pool.add_connection(dirty)
+
+    assert queued == [clean, dirty]
+    assert clean.resets == 0 and dirty.resets == 1
+    assert statement_cache(Pooled(dirty), 4) is not cache
+
+
+@pytest.mark.skipif(db.mysql is None, reason="mysql-connector-python")
+def test_connection_with_changed_session_is_reopened(monkeypatch):
+    queued = []
+    monkeypatch.setattr(db.pooling.MySQLConnectionPool, "add_connection",
+                        lambda self, cnx=None: queued.append(cnx))
+    pool = object.__new__(db.MySQLPool)
+    pool._pool_name = "test"
+    raw = RawConnection()
+    cache = statement_cache(Pooled(raw), 4)
+
+    db.mark_session_changed(Pooled(raw))
+    pool.add_connection(raw)
+
+    assert queued == [raw] and not raw.connected
+    assert statement_cache(Pooled(raw), 4) is not cache
+    # Следующий возврат переоткрытого соединения — обычный
+    raw.connected = True
+    pool.add_connection(raw)
+    assert raw.connected
+
+
+def test_sqlite_connection_with_changed_session_is_not_pooled():
+    pool = db.SQLitePool(2)
+    conn = pool.get_connection()
+    db.mark_session_changed(conn)
+    conn.close()
+    assert pool._idle == []
+
+    conn = pool.get_connection()
+    conn.close()
+    assert len(pool._idle) == 1
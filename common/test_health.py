@@ -0,0 +1,42 @@
+"""Health: когда запускается прогрев — при запуске скриптом, под reloader-ом и под WSGI-сервером."""
+import threading
+
+import pytest
+from flask import Flask, jsonify
+
+from common.health import Health
+
+
+def health_app():
+    health = Health("test")
+    started = threading.Event()
+    health.warm_up_step("step")(started.set)
+    app = Flask("test")
+    health.init_app(app, lambda body, status: (jsonify(body), status))
+    app.add_url_rule("/ping", "ping", lambda: "pong")
+    return health, app, started
+
+
+@pytest.mark.parametrize("debug, run_main, expected", [
+    (False, None, True),        # app.run без debug
+    (True, None, False),        # процесс-наблюдатель reloader-а
+    (True, "true", True),       # рабочий процесс reloader-а
+])
+def test_start_on_run(monkeypatch, debug, run_main, expected):
+    if run_main is None:
+        monkeypatch.delenv("WERKZEUG_RUN_MAIN", raising=False)
+    else:
+        monkeypatch.setenv("WERKZEUG_RUN_MAIN", run_main)
+    health, app, started = health_app()
+    app.debug = debug
+    health.start_on_run(app)
+    assert started.wait(5) if expected else health._thread is None
+
+
+def test_first_request_starts_warm_up():
+    health, app, started = health_app()
+    assert health._thread is None
+    assert app.test_client().get("/ping").status_code == 200
+    assert started.wait(5)
+    health._thread.join(5)
+    assert app.test_client().get("/readyz").status_code == 200
@@ -0,0 +1,46 @@
+"""Трассировка на внешнем API: Server-Timing и флаг выборки только для доверенных адресов."""
+import pytest
+from flask import Flask
+
+from common import tracing
+
+CLIENT_TRACEPARENT = f"00-{'a' * 32}-{'b' * 16}-01"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_ENABLED", True)
+    monkeypatch.setattr(tracing, "TRACE_SERVER_TIMING", True)
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATIO", 0.0)
+    monkeypatch.setattr(tracing._exporter, "submit", lambda span: None)
+    app = Flask(__name__)
+    tracing.init_app(app, tracing.Tracer("test"), trusted=["10.1.0.0/16"])
+
+    @app.route("/relay")
+    def relay():
+        span = tracing.current_span()
+        # Как ответ request_service, переданный gateway вместе с заголовками
+        return {"sampled": span.sampled, "trace_id": span.trace_id}, 200, \
+            [("Server-Timing", "request_service.db;dur=1.00")]
+
+    return app.test_client()
+
+
+def test_untrusted_client_gets_no_server_timing(client):
+    resp = client.get("/relay", environ_base={"REMOTE_ADDR": "203.0.113.7"})
+    assert "Server-Timing" not in resp.headers
+
+
+def test_untrusted_client_cannot_force_sampling(client):
+    resp = client.get("/relay", headers={"traceparent": CLIENT_TRACEPARENT},
+                      environ_base={"REMOTE_ADDR": "203.0.113.7"})
+    assert resp.json == {"sampled": False, "trace_id": "a" * 32}
+
+
+def test_trusted_client_keeps_server_timing_and_sampling(client):
+    resp = client.get("/relay", headers={"traceparent": CLIENT_TRACEPARENT},
+                      environ_base={"REMOTE_ADDR": "10.1.2.3"})
+    assert resp.json["sampled"] is True
+    timing = resp.headers.getlist("Server-Timing")
+    assert timing[0] == "request_service.db;dur=1.00"
+    assert timing[1].startswith("test.GET__relay;dur=")
@@ -0,0 +1,347 @@
+"""
+Распределённая трассировка TrainSafe без внешних зависимостей.
+
+- контекст передаётся между сервисами заголовком W3C traceparent;
+- спаны: входящий запрос, обработчики цепочек, обращения к БД, HTTP-хопы;
+- экспорт батчами в фоновом потоке в формате OTLP/HTTP JSON в локальный коллектор
+  (TRACE_OTLP_ENDPOINT, по умолчанию http://127.0.0.1:4318/v1/traces); если коллектор
+  недоступен — в файл JSONL (TRACE_FILE, по умолчанию traces.jsonl);
+- выборка TRACE_SAMPLE_RATIO (0..1): решение принимает первый сервис в цепочке,
+  остальные следуют флагу sampled из traceparent;
+- независимо от выборки в ответ добавляется заголовок Server-Timing с собственным
+  временем каждого спана запроса — разбивка задержки видна без профилировщика.
+
+Внешнему API (gateway) init_app передаёт trusted — адреса администраторов. Остальным
+клиентам Server-Timing не отдаётся (в нём имена и время внутренних шагов), а флаг
+sampled из их traceparent не учитывается: иначе любой клиент мог бы включить экспорт
+всех своих запросов.
+
+TRACE_ENABLED=0 отключает трассировку полностью.
+"""
+import contextvars
+import functools
+import ipaddress
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") != "0"
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", 0.1))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "1") != "0"
+
+logger = logging.getLogger("tracing")
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_current_span = contextvars.ContextVar("trainsafe_current_span", default=None)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+
+class Span:
+    """Один спан. Время в наносекундах (time.time_ns), как в OTLP."""
+
+    __slots__ = ("service", "name", "trace_id", "span_id", "parent_id", "sampled", "kind",
+                 "attributes", "start_ns", "end_ns", "error", "children_ns", "parent", "finished")
+
+    def __init__(self, service, name, trace_id, parent_id, sampled, kind, parent=None):
+        self.service = service
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes = {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.children_ns = 0
+        self.parent = parent
+        # Завершённые спаны запроса (список общий для всего локального дерева)
+        self.finished = parent.finished if parent is not None else []
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ns(self):
+        return (self.end_ns or time.time_ns()) - self.start_ns
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.parent is not None:
+            self.parent.children_ns += self.duration_ns
+        self.finished.append(self)
+        if self.sampled:
+            _exporter.submit(self)
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+class Tracer:
+    """Создаёт спаны от имени сервиса (service.name в экспортируемых данных)."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def start_span(self, name, kind=SPAN_KIND_INTERNAL, traceparent=None, follow_sampling=True, **attributes):
+        """
+        traceparent — контекст вызывающего; с follow_sampling=False из него берётся только
+        trace_id и родитель, а решение о выборке принимается заново по TRACE_SAMPLE_RATIO.
+        """
+        parent = _current_span.get()
+        match = _TRACEPARENT_RE.match(traceparent or "")
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            sampled = flags == "01" if follow_sampling else random.random() < TRACE_SAMPLE_RATIO
+            span = Span(self.service, name, trace_id, parent_id, sampled, kind)
+        elif parent is not None:
+            span = Span(self.service, name, parent.trace_id, parent.span_id, parent.sampled, kind, parent)
+        else:
+            sampled = random.random() < TRACE_SAMPLE_RATIO
+            span = Span(self.service, name, f"{random.getrandbits(128):032x}", None, sampled, kind)
+        span.attributes.update(attributes)
+        return span
+
+    @contextmanager
+    def span(self, name, kind=SPAN_KIND_INTERNAL, **attributes):
+        """Контекстный менеджер: спан становится текущим на время блока."""
+        if not TRACE_ENABLED:
+            yield None
+            return
+        span = self.start_span(name, kind, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def traced(self, name=None):
+        """Декоратор: оборачивает вызов функции/метода в спан."""
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+def current_span():
+    return _current_span.get()
+
+
+def inject(headers):
+    """Добавляет traceparent текущего спана в заголовки исходящего запроса."""
+    span = _current_span.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent()
+    return headers
+
+
+def server_timing(root):
+    """
+    Значение заголовка Server-Timing: собственное время (без дочерних спанов)
+    каждого спана запроса в миллисекундах.
+    """
+    entries = []
+    for span in root.finished:
+        self_ms = max(0, span.duration_ns - span.children_ns) / 1e6
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{span.service}.{span.name}")
+        entries.append(f"{name};dur={self_ms:.2f}")
+    return ", ".join(entries)
+
+
+def _networks(addresses):
+    return tuple(ipaddress.ip_network(a.strip(), strict=False) for a in addresses if a.strip())
+
+
+def _address_in(remote_addr, networks):
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def init_app(app, tracer, trusted=None):
+    """
+    Подключает трассировку к Flask-приложению: серверный спан на каждый запрос
+    с продолжением traceparent вызывающего сервиса и заголовок Server-Timing в ответе.
+
+    trusted — адреса/подсети, которым доверяют (для внешнего API); None — доверять всем
+    (внутренние сервисы, их вызывает только gateway). Недоверенным клиентам Server-Timing
+    не отдаётся (в том числе переданный из ответа сервиса), а их флаг sampled не учитывается.
+    """
+    if not TRACE_ENABLED:
+        return
+    from flask import g, request
+
+    networks = _networks(trusted) if trusted is not None else None
+
+    @app.before_request
+    def _start_request_span():
+        g._trace_trusted = networks is None or _address_in(request.remote_addr, networks)
+        span = tracer.start_span(
+            f"{request.method} {request.path}", SPAN_KIND_SERVER,
+            traceparent=request.headers.get("traceparent"),
+            follow_sampling=g._trace_trusted,
+            **{"http.method": request.method, "http.route": request.path},
+        )
+        g._trace_span = span
+        g._trace_token = _current_span.set(span)
+
+    @app.after_request
+    def _finish_request_span(response):
+        span = g.pop("_trace_span", None)
+        if span is None:
+            return response
+        trusted = g.pop("_trace_trusted", True)
+        if not trusted:
+            response.headers.remove("Server-Timing")
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.error = f"HTTP {response.status_code}"
+        _current_span.reset(g.pop("_trace_token"))
+        span.end()
+        if TRACE_SERVER_TIMING and trusted:
+            response.headers.add("Server-Timing", server_timing(span))
+        return response
+
+    @app.teardown_request
+    def _abandon_request_span(exc):
+        # after_request не вызывается при необработанном исключении
+        span = g.pop("_trace_span", None)
+        if span is not None:
+            span.error = f"{type(exc).__name__}: {exc}" if exc else None
+            _current_span.reset(g.pop("_trace_token"))
+            span.end()
+
+
+# =============================================================================
+# ЭКСПОРТ
+# =============================================================================
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(spans):
+    by_service = {}
+    for span in spans:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        by_service.setdefault(span.service, []).append(otlp_span)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                "scopeSpans": [{"scope": {"name": "trainsafe"}, "spans": otlp_spans}],
+            }
+            for service, otlp_spans in by_service.items()
+        ]
+    }
+
+
+class BatchExporter:
+    """
+    Фоновый экспорт завершённых спанов батчами.
+    Если коллектор недоступен, батчи пишутся в файл, а коллектор
+    пробуется снова не чаще раза в retry_interval секунд.
+    """
+
+    def __init__(self, endpoint, file_path, batch_size=256, flush_interval=1.0,
+                 max_queue=10000, retry_interval=30.0):
+        self.endpoint = endpoint
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._collector_down_until = 0.0
+        self.dropped = 0
+
+    def submit(self, span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._export(_to_otlp(batch))
+
+    def _export(self, payload):
+        body = json.dumps(payload).encode()
+        if self.endpoint and time.monotonic() >= self._collector_down_until:
+            try:
+                req = urllib.request.Request(self.endpoint, data=body,
+                                             headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(req, timeout=2).close()
+                return
+            except OSError as e:
+                logger.info("Trace collector %s unavailable (%s), writing spans to %s",
+                            self.endpoint, e, self.file_path)
+                self._collector_down_until = time.monotonic() + self.retry_interval
+        try:
+            with open(self.file_path, "ab") as f:
+                f.write(body + b"\n")
+        except OSError as e:
+            logger.warning("Failed to write spans to %s: %s", self.file_path, e)
+
+
+_exporter = BatchExporter(TRACE_OTLP_ENDPOINT, TRACE_FILE)
@@ -0,0 +1,645 @@
+"""
+Материализованные агрегаты над train_data.
+
+Aggregate — объявленная сводная таблица: группировка по измерениям (колонки или
+выражения, например полосы Credit_Score) и на каждую группу число строк, сумма и
+число непустых значений по измеряемым колонкам. Из них без обращения к train_data
+вычисляются COUNT(*), COUNT(col), SUM(col) и AVG(col) для любого подмножества измерений.
+
+Актуальность:
+- инкрементально: DML по train_data, прошедший через execute_sql, захватывает
+  строки до и после изменения по первичному ключу Loan_ID (capture/finish),
+  а разница применяется к затронутым группам сводной таблицы (apply). Всё это —
+  в одной транзакции с самим DML: capture читает строки SELECT ... FOR UPDATE,
+  поэтому параллельные изменения тех же Loan_ID (в том числе с других реплик)
+  ждут commit и видят уже изменённые строки — разница не учитывается дважды;
+- изменение, во время которого шёл или начался полный пересчёт, инкрементально
+  не применяется: пересчёт мог как учесть его, так и нет, поэтому агрегат
+  помечается устаревшим (apply до commit и committed после него);
+- если изменение нельзя разобрать (нет WHERE, INSERT ... SELECT, ALTER и т. п.)
+  или затронуто слишком много строк, агрегат помечается устаревшим и
+  пересчитывается полностью в фоне;
+- полный пересчёт выполняется ещё и раз в refresh_interval секунд — он покрывает
+  изменения в обход сервиса и задаёт верхнюю границу устаревания.
+
+Запрос viewer-а вида SELECT <измерения>, COUNT(*) / SUM / AVG ... FROM train_data
+[WHERE <условия на измерения>] GROUP BY <измерения> [ORDER BY ...] [LIMIT ...]
+переписывается на сводную таблицу (rewrite); пока агрегат устарел, запросы идут в train_data.
+"""
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from common.db import Error, is_deadlock
+
+logger = logging.getLogger("request_service.aggregates")
+
+KEY_COLUMN = "Loan_ID"
+
+# Полосы кредитного рейтинга (FICO); выражение нужно писать в запросе так же, как здесь
+CREDIT_SCORE_BAND = (
+    "CASE WHEN Credit_Score IS NULL THEN 'unknown' "
+    "WHEN Credit_Score < 580 THEN 'poor' "
+    "WHEN Credit_Score < 670 THEN 'fair' "
+    "WHEN Credit_Score < 740 THEN 'good' "
+    "WHEN Credit_Score < 800 THEN 'very_good' "
+    "ELSE 'excellent' END"
+)
+
+
+def _normalize(expr):
+    """Выражение SQL для сравнения: без обратных кавычек, лишних пробелов и регистра."""
+    expr = expr.replace("`", "").strip()
+    expr = re.sub(r"\s+", " ", expr)
+    expr = re.sub(r"\s*([(),])\s*", r"\1", expr)
+    return expr.upper()
+
+
+def _split_top_level(text, separator=","):
+    """Разбивает по separator вне скобок и кавычек. separator="AND" — по слову AND."""
+    parts, depth, quote, start, i = [], 0, None, 0, 0
+    word = separator.isalpha()
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0:
+            if word:
+                if (text[i:i + len(separator)].upper() == separator
+                        and (i == 0 or not text[i - 1].isalnum())
+                        and (i + len(separator) == len(text) or not text[i + len(separator)].isalnum())):
+                    parts.append(text[start:i].strip())
+                    i += len(separator)
+                    start = i
+                    continue
+            elif ch == separator:
+                parts.append(text[start:i].strip())
+                start = i + 1
+        i += 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+class Aggregate:
+    """
+    name — имя сводной таблицы; dimensions — {колонка сводной таблицы: выражение над train_data};
+    measures — {колонка train_data: SQL-тип суммы}.
+    """
+
+    def __init__(self, name, dimensions, measures):
+        self.name = name
+        self.dimensions = dimensions
+        self.measures = measures
+        self.refreshed_at = None        # время последнего полного пересчёта (time.time())
+        self.dirty_at = None            # последнее изменение, не применённое инкрементально
+        self.refreshing = False
+        self.refresh_generation = 0     # число начатых полных пересчётов
+        self.incremental_updates = 0
+        self.full_refreshes = 0
+        self.rewrites = 0
+        # Нормализованные выражения измерений для сопоставления с запросом
+        self._dimension_by_expr = {}
+        for column, expr in dimensions.items():
+            self._dimension_by_expr[_normalize(column)] = column
+            self._dimension_by_expr[_normalize(expr)] = column
+
+    @property
+    def fresh(self):
+        return self.refreshed_at is not None and self.dirty_at is None
+
+    # ----- SQL -----------------------------------------------------------------
+
+    def _key_sql(self, values):
+        """Ключ группы (MD5 значений измерений) — первичный ключ сводной таблицы."""
+        return "MD5(CONCAT_WS(CHAR(31), {}))".format(
+            ", ".join(f"COALESCE({v}, CHAR(0))" for v in values))
+
+    def _create_sql(self, table):
+        columns = ["group_key CHAR(32) PRIMARY KEY"]
+        columns += [f"`{c}` VARCHAR(255) NULL" for c in self.dimensions]
+        columns.append("row_count BIGINT NOT NULL")
+        for column, sql_type in self.measures.items():
+            columns.append(f"`sum_{column}` {sql_type} NULL")
+            columns.append(f"`cnt_{column}` BIGINT NOT NULL")
+        return f"CREATE TABLE {table} ({', '.join(columns)})"
+
+    def _image_sql(self, where):
+        """Строки train_data с вычисленными измерениями и измеряемыми колонками."""
+        dims = ", ".join(self.dimensions.values())
+        measures = ", ".join(f"`{c}`" for c in self.measures)
+        return f"SELECT {KEY_COLUMN}, {dims}, {measures} FROM train_data WHERE {where}"
+
+    def full_refresh(self, conn):
+        """Полный пересчёт: строим новую таблицу и атомарно подменяем ею старую."""
+        new_table, old_table = f"{self.name}__new", f"{self.name}__old"
+        dims = list(self.dimensions.values())
+        measures = "".join(f", SUM(`{c}`), COUNT(`{c}`)" for c in self.measures)
+        started = time.time()
+        self.refreshing = True
+        self.refresh_generation += 1
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"DROP TABLE IF EXISTS {new_table}, {old_table}")
+            cursor.execute(self._create_sql(new_table))
+            cursor.execute(
+                f"INSERT INTO {new_table} SELECT {self._key_sql(dims)}, {', '.join(dims)}, COUNT(*){measures} "
+                f"FROM train_data GROUP BY {', '.join(str(i + 2) for i in range(len(dims)))}"
+            )
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.name} LIKE {new_table}")
+            cursor.execute(f"RENAME TABLE {self.name} TO {old_table}, {new_table} TO {self.name}")
+            cursor.execute(f"DROP TABLE {old_table}")
+        finally:
+            self.refreshing = False
+            cursor.close()
+        # Изменения, пришедшие во время пересчёта, могли в него не попасть — они оставляют dirty_at
+        if self.dirty_at is not None and self.dirty_at < started:
+            self.dirty_at = None
+        self.refreshed_at = started
+        self.full_refreshes += 1
+
+    def read_image(self, cursor, where, params):
+        cursor.execute(self._image_sql(where), params)
+        return cursor.fetchall()
+
+    def delta(self, before, after):
+        """
+        Разница по группам: {dims: [row_count, sum_1, cnt_1, ...]} между строками
+        до и после изменения (строки — результат read_image).
+        """
+        n_dims = len(self.dimensions)
+        deltas = defaultdict(lambda: [0] * (1 + 2 * len(self.measures)))
+        for rows, sign in ((before, -1), (after, 1)):
+            for row in rows:
+                dims = tuple(None if v is None else str(v) for v in row[1:1 + n_dims])
+                acc = deltas[dims]
+                acc[0] += sign
+                for i, value in enumerate(row[1 + n_dims:]):
+                    if value is not None:
+                        acc[1 + 2 * i] += sign * value
+                        acc[2 + 2 * i] += sign
+        return {dims: acc for dims, acc in deltas.items() if any(acc)}
+
+    def apply_delta(self, cursor, deltas):
+        dim_columns = ", ".join(f"`{c}`" for c in self.dimensions)
+        measure_columns = "".join(f", `sum_{c}`, `cnt_{c}`" for c in self.measures)
+        placeholders = ", ".join(["%s"] * (len(self.dimensions) + 1 + 2 * len(self.measures)))
+        updates = ["row_count = row_count + VALUES(row_count)"]
+        for c in self.measures:
+            updates.append(f"`sum_{c}` = COALESCE(`sum_{c}`, 0) + COALESCE(VALUES(`sum_{c}`), 0)")
+            updates.append(f"`cnt_{c}` = `cnt_{c}` + VALUES(`cnt_{c}`)")
+        sql = (
+            f"INSERT INTO {self.name} (group_key, {dim_columns}, row_count{measure_columns}) "
+            f"VALUES ({self._key_sql(['%s'] * len(self.dimensions))}, {placeholders}) "
+            f"ON DUPLICATE KEY UPDATE {', '.join(updates)}"
+        )
+        rows = [dims + dims + tuple(acc) for dims, acc in deltas.items()]
+        cursor.executemany(sql, rows)
+        cursor.execute(f"DELETE FROM {self.name} WHERE row_count <= 0")
+        self.incremental_updates += 1
+
+    # ----- переписывание запросов ----------------------------------------------
+
+    _QUERY_RE = re.compile(
+        r"^SELECT\s+(?P<select>.+?)\s+FROM\s+`?train_data`?"
+        r"(?:\s+WHERE\s+(?P<where>.+?))?"
+        r"\s+GROUP\s+BY\s+(?P<group>.+?)"
+        r"(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+        r"(?:\s+LIMIT\s+(?P<limit>\d+(?:\s*,\s*\d+)?))?\s*;?$",
+        re.IGNORECASE | re.DOTALL,
+    )
+    _ALIAS_RE = re.compile(r"^(?P<expr>.+?)(?:\s+AS\s+`?(?P<alias>\w+)`?)?$", re.IGNORECASE | re.DOTALL)
+    _FUNC_RE = re.compile(r"^(COUNT|SUM|AVG)\((\*|\w+)\)$")
+    _LITERAL = r"(?:%s|'(?:[^'\\]|\\.|'')*'|-?\d+(?:\.\d+)?)"
+    _PREDICATE_RES = (
+        re.compile(rf"^`?(\w+)`?\s*(?:=|<>|!=)\s*{_LITERAL}$", re.IGNORECASE),
+        re.compile(rf"^`?(\w+)`?\s+(?:NOT\s+)?IN\s*\(\s*{_LITERAL}(?:\s*,\s*{_LITERAL})*\s*\)$", re.IGNORECASE),
+        re.compile(r"^`?(\w+)`?\s+IS\s+(?:NOT\s+)?NULL$", re.IGNORECASE),
+    )
+
+    def _measure_sql(self, func, arg):
+        if func == "COUNT" and arg == "*":
+            return "CAST(SUM(row_count) AS SIGNED)"
+        column = next((c for c in self.measures if c.upper() == arg), None)
+        if column is None:
+            return None
+        if func == "COUNT":
+            return f"CAST(SUM(`cnt_{column}`) AS SIGNED)"
+        if func == "SUM":
+            return f"CASE WHEN SUM(`cnt_{column}`) = 0 THEN NULL ELSE SUM(`sum_{column}`) END"
+        # * 1.0: у SQLite сумма целой колонки делилась бы нацело, а AVG — нет
+        return f"SUM(`sum_{column}`) * 1.0 / NULLIF(SUM(`cnt_{column}`), 0)"
+
+    def rewrite(self, query):
+        """Текст запроса к сводной таблице или None, если запрос не подходит."""
+        match = self._QUERY_RE.match(query.strip())
+        if not match:
+            return None
+
+        select, labels, dims, dim_labels = [], {}, set(), {}
+        for item in _split_top_level(match.group("select")):
+            parts = self._ALIAS_RE.match(item)
+            expr, alias = parts.group("expr").strip(), parts.group("alias")
+            label = alias or expr.replace("`", "")
+            normalized = _normalize(expr)
+            if normalized in self._dimension_by_expr:
+                column = self._dimension_by_expr[normalized]
+                dims.add(column)
+                dim_labels[_normalize(label)] = column
+                sql = f"`{column}`"
+            else:
+                func = self._FUNC_RE.match(normalized)
+                sql = func and self._measure_sql(func.group(1), func.group(2))
+                if not sql:
+                    return None
+            select.append(f"{sql} AS `{label}`")
+            labels[normalized] = label
+            labels[_normalize(label)] = label
+
+        group = []
+        for item in _split_top_level(match.group("group")):
+            normalized = _normalize(item)
+            if normalized.isdigit() and 0 < int(normalized) <= len(select):
+                group.append(normalized)
+                continue
+            column = self._dimension_by_expr.get(normalized) or dim_labels.get(normalized)
+            if column is None:
+                return None
+            group.append(f"`{column}`")
+        if not dims or len(group) != len(dims):
+            return None
+
+        sql = f"SELECT {', '.join(select)} FROM {self.name}"
+        if match.group("where"):
+            for predicate in _split_top_level(match.group("where"), "AND"):
+                found = next((r.match(predicate) for r in self._PREDICATE_RES if r.match(predicate)), None)
+                if found is None:
+                    return None
+                # В условиях допустимы только исходные колонки-измерения (не выражения вроде полос)
+                column = self._dimension_by_expr.get(_normalize(found.group(1)))
+                if column is None or _normalize(self.dimensions[column]) != _normalize(found.group(1)):
+                    return None
+            sql += f" WHERE {match.group('where')}"
+        sql += f" GROUP BY {', '.join(group)}"
+
+        if match.group("order"):
+            order = []
+            for item in _split_top_level(match.group("order")):
+                direction = re.search(r"\s+(ASC|DESC)$", item, re.IGNORECASE)
+                expr = item[:direction.start()] if direction else item
+                normalized = _normalize(expr)
+                if normalized in labels:
+                    target = f"`{labels[normalized]}`"
+                elif normalized in self._dimension_by_expr:
+                    target = f"`{self._dimension_by_expr[normalized]}`"
+                elif normalized.isdigit():
+                    target = normalized
+                else:
+                    return None
+                order.append(target + (f" {direction.group(1).upper()}" if direction else ""))
+            sql += f" ORDER BY {', '.join(order)}"
+        if match.group("limit"):
+            sql += f" LIMIT {match.group('limit')}"
+        return sql
+
+    def freshness(self, refresh_interval):
+        """Насколько результат может отставать от train_data (для ответа клиенту)."""
+        refreshed = datetime.fromtimestamp(self.refreshed_at, timezone.utc) if self.refreshed_at else None
+        return {
+            "name": self.name,
+            "refreshed_at": refreshed.isoformat(timespec="seconds") if refreshed else None,
+            "seconds_since_full_refresh": round(time.time() - self.refreshed_at, 1) if self.refreshed_at else None,
+            "max_staleness_seconds": refresh_interval,
+        }
+
+    def snapshot(self, refresh_interval):
+        return dict(
+            self.freshness(refresh_interval),
+            fresh=self.fresh,
+            dimensions=list(self.dimensions),
+            measures=list(self.measures),
+            incremental_updates=self.incremental_updates,
+            full_refreshes=self.full_refreshes,
+            rewrites=self.rewrites,
+        )
+
+
+# =============================================================================
+# РАЗБОР DML ПО train_data
+# =============================================================================
+
+_UPDATE_RE = re.compile(
+    r"^\s*UPDATE\s+`?train_data`?\s+SET\s+(?P<set>.+?)(?:\s+WHERE\s+(?P<where>.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_DELETE_RE = re.compile(
+    r"^\s*DELETE\s+FROM\s+`?train_data`?(?:\s+WHERE\s+(?P<where>.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_INSERT_RE = re.compile(
+    r"^\s*INSERT\s+(?:IGNORE\s+)?INTO\s+`?train_data`?\s*\((?P<columns>[^)]*)\)\s*VALUES\s*(?P<values>.+?)\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_TOUCHES_TRAIN_DATA_RE = re.compile(r"\btrain_data\b", re.IGNORECASE)
+_LIMITED_RE = re.compile(r"\b(?:LIMIT|ORDER\s+BY)\b", re.IGNORECASE)
+_VALUE_TOKEN_RE = re.compile(r"\s*(%s|'(?:[^'\\]|\\.|'')*'|-?\d+(?:\.\d+)?|NULL)\s*(,|\))", re.IGNORECASE)
+
+
+def _parse_insert_keys(columns, values, params):
+    """Значения Loan_ID из INSERT ... VALUES (...), (...) или None, если разобрать нельзя."""
+    names = [c.strip().strip("`").upper() for c in columns.split(",")]
+    if KEY_COLUMN.upper() not in names:
+        return None
+    key_index = names.index(KEY_COLUMN.upper())
+    params = list(params or [])
+    keys, pos, param_index = [], 0, 0
+    while pos < len(values):
+        opening = re.compile(r"\s*,?\s*\(").match(values, pos)
+        if not opening:
+            return None
+        pos = opening.end()
+        row = []
+        while True:
+            token = _VALUE_TOKEN_RE.match(values, pos)
+            if not token:
+                return None
+            literal = token.group(1)
+            if literal == "%s":
+                if param_index >= len(params):
+                    return None
+                row.append(params[param_index])
+                param_index += 1
+            elif literal.startswith("'"):
+                row.append(literal[1:-1].replace("''", "'").replace("\\'", "'"))
+            else:
+                row.append(literal)
+            pos = token.end()
+            if token.group(2) == ")":
+                break
+        if len(row) != len(names):
+            return None
+        keys.append(row[key_index])
+        pos = len(values) if not values[pos:].strip() else pos
+    return keys
+
+
+class Change:
+    """
+    Изменение train_data одним запросом: строки затронутых ключей до и после.
+    generations — refresh_generation агрегатов на момент захвата.
+    """
+
+    def __init__(self, keys=None, before=None, full_refresh=False, generations=None):
+        self.keys = keys
+        self.before = before or {}
+        self.after = {}
+        self.full_refresh = full_refresh
+        self.generations = generations or {}
+
+
+class AggregateManager:
+    """
+    Реестр агрегатов: захват изменений DML, применение разницы,
+    фоновый полный пересчёт и переписывание запросов.
+    get_connection — соединение с primary; on_stale — уведомление других реплик
+    о том, что агрегаты устарели.
+    """
+
+    def __init__(self, aggregates, get_connection, refresh_interval=300, incremental_max_rows=10000,
+                 on_stale=None):
+        self.aggregates = aggregates
+        self.get_connection = get_connection
+        self.on_stale = on_stale
+        self.refresh_interval = refresh_interval
+        self.incremental_max_rows = incremental_max_rows
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ----- фоновый пересчёт ----------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or not self.aggregates:
+                return
+            self._thread = threading.Thread(target=self._run, name="aggregate-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh_all()
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+    def refresh_all(self, only_stale=False):
+        conn = self.get_connection()
+        if not conn:
+            logger.warning("Пересчёт агрегатов пропущен: нет соединения с БД")
+            return
+        try:
+            for aggregate in self.aggregates:
+                if only_stale and aggregate.fresh:
+                    continue
+                try:
+                    aggregate.full_refresh(conn)
+                    logger.info("Агрегат %s пересчитан полностью", aggregate.name)
+                except Error as e:
+                    logger.warning("Ошибка полного пересчёта агрегата %s: %s", aggregate.name, e)
+        finally:
+            conn.close()
+
+    def mark_stale(self, reason, notify=True):
+        if not self.aggregates:
+            return
+        now = time.time()
+        for aggregate in self.aggregates:
+            aggregate.dirty_at = now
+        logger.info("Агрегаты помечены устаревшими (%s), будет полный пересчёт", reason)
+        self.start()
+        self._wakeup.set()
+        if notify and self.on_stale is not None:
+            self.on_stale()
+
+    # ----- захват изменений ----------------------------------------------------
+
+    def tracks(self, query):
+        """Запрос может изменить train_data: его нужно выполнять в транзакции с capture/apply."""
+        return bool(self.aggregates) and bool(_TOUCHES_TRAIN_DATA_RE.search(query)) \
+            and not query.lstrip().upper().startswith(("SELECT", "WITH"))
+
+    def capture(self, conn, query, params):
+        """
+        Вызывается до выполнения запроса на primary внутри транзакции, в которой
+        выполнятся запрос, finish и apply. Для SELECT и запросов не к train_data
+        возвращает None, иначе Change со строками «до» (прочитанными с блокировкой
+        FOR UPDATE) или пометкой о полном пересчёте.
+        """
+        if not self.tracks(query):
+            return None
+        generations = {a.name: a.refresh_generation for a in self.aggregates}
+        if any(a.refreshing for a in self.aggregates):
+            # Идущий полный пересчёт мог прочитать train_data до изменения
+            return Change(full_refresh=True)
+        params = list(params) if params is not None else []
+
+        where, where_params, keys = None, [], None
+        update, delete, insert = _UPDATE_RE.match(query), _DELETE_RE.match(query), _INSERT_RE.match(query)
+        if update and update.group("where") and not _LIMITED_RE.search(update.group("where")):
+            set_clause = update.group("set")
+            if re.search(rf"\b{KEY_COLUMN}\b\s*=", set_clause, re.IGNORECASE):
+                return Change(full_refresh=True)
+            where, where_params = update.group("where"), params[set_clause.count("%s"):]
+        elif delete and delete.group("where") and not _LIMITED_RE.search(delete.group("where")):
+            where, where_params = delete.group("where"), params
+        elif insert:
+            keys = _parse_insert_keys(insert.group("columns"), insert.group("values"), params)
+        if where is None and not keys:
+            return Change(full_refresh=True)
+
+        change = Change(keys=keys, generations=generations)
+        cursor = conn.cursor()
+        try:
+            for aggregate in self.aggregates:
+                if keys is None:
+                    limit = f" LIMIT {self.incremental_max_rows + 1} FOR UPDATE"
+                    rows = aggregate.read_image(cursor, where + limit, where_params)
+                    if len(rows) > self.incremental_max_rows:
+                        return Change(full_refresh=True)
+                    change.keys = [row[0] for row in rows]
+                else:
+                    if len(keys) > self.incremental_max_rows:
+                        return Change(full_refresh=True)
+                    rows = self._read_keys(aggregate, cursor, keys, lock=True)
+                change.before[aggregate.name] = rows
+        except Error as e:
+            logger.warning("Не удалось захватить изменение для агрегатов: %s", e)
+            return Change(full_refresh=True)
+        finally:
+            cursor.close()
+        return change
+
+    def _read_keys(self, aggregate, cursor, keys, lock=False):
+        if not keys:
+            return []
+        placeholders = ", ".join(["%s"] * len(keys))
+        where = f"{KEY_COLUMN} IN ({placeholders})" + (" FOR UPDATE" if lock else "")
+        return aggregate.read_image(cursor, where, list(keys))
+
+    def finish(self, conn, change):
+        """Вызывается после успешного выполнения запроса: строки «после» по тем же ключам."""
+        if change is None or change.full_refresh:
+            return
+        cursor = conn.cursor()
+        try:
+            for aggregate in self.aggregates:
+                change.after[aggregate.name] = self._read_keys(aggregate, cursor, change.keys)
+        except Error as e:
+            logger.warning("Не удалось прочитать изменённые строки для агрегатов: %s", e)
+            change.full_refresh = True
+        finally:
+            cursor.close()
+
+    def _overlapped(self, changes):
+        """Полный пересчёт идёт или начался после захвата одного из изменений."""
+        for aggregate in self.aggregates:
+            if aggregate.refreshing:
+                return True
+            if any(c.generations.get(aggregate.name) != aggregate.refresh_generation for c in changes):
+                return True
+        return False
+
+    def apply(self, conn, changes):
+        """
+        Применяет разницу изменений к сводным таблицам в той же транзакции, до commit
+        основного запроса (commit делает вызывающий). Ошибка не влияет на ответ
+        клиенту — агрегат помечается устаревшим; только взаимную блокировку
+        (MySQL уже откатил транзакцию целиком) получает вызывающий.
+        """
+        changes = [c for c in changes if c is not None]
+        if not changes:
+            return
+        if any(c.full_refresh for c in changes):
+            self.mark_stale("change cannot be applied incrementally")
+            return
+        if self._overlapped(changes):
+            # Пересчёт заменит сводную таблицу и мог не учесть изменение (или учесть его)
+            self.mark_stale("change during full refresh")
+            return
+        cursor = conn.cursor()
+        try:
+            for aggregate in self.aggregates:
+                if aggregate.refreshed_at is None:
+                    continue  # сводная таблица ещё не построена
+                deltas = {}
+                for change in changes:
+                    for dims, acc in aggregate.delta(change.before.get(aggregate.name, []),
+                                                     change.after.get(aggregate.name, [])).items():
+                        total = deltas.setdefault(dims, [0] * len(acc))
+                        for i, value in enumerate(acc):
+                            total[i] += value
+                if deltas:
+                    aggregate.apply_delta(cursor, deltas)
+        except Error as e:
+            if is_deadlock(e):
+                raise
+            logger.warning("Ошибка инкрементального обновления агрегатов: %s", e)
+            self.mark_stale(str(e))
+        finally:
+            cursor.close()
+
+    def committed(self, changes):
+        """
+        Вызывается после commit транзакции с изменениями: пересчёт, начатый между
+        apply и commit, мог прочитать train_data без них, а разницу получила уже
+        заменённая таблица.
+        """
+        changes = [c for c in changes if c is not None and not c.full_refresh]
+        if changes and self._overlapped(changes):
+            self.mark_stale("change during full refresh")
+
+    # ----- чтение --------------------------------------------------------------
+
+    def rewrite(self, query):
+        """(текст запроса к сводной таблице, Aggregate) или None."""
+        if not self.aggregates:
+            return None
+        self.start()
+        for aggregate in self.aggregates:
+            if not aggregate.fresh:
+                continue
+            sql = aggregate.rewrite(query)
+            if sql is not None:
+                aggregate.rewrites += 1
+                return sql, aggregate
+        return None
+
+    def snapshot(self):
+        return [a.snapshot(self.refresh_interval) for a in self.aggregates]
+
+
+# Сводная таблица для дашбордов: статус, тип владения жильём, цель кредита и полоса рейтинга
+TRAIN_DATA_OVERVIEW = Aggregate(
+    "agg_train_data_overview",
+    dimensions={
+        "Loan_Status": "Loan_Status",
+        "Home_Ownership": "Home_Ownership",
+        "Purpose": "Purpose",
+        "Credit_Score_Band": CREDIT_SCORE_BAND,
+    },
+    measures={
+        "Current_Loan_Amount": "DECIMAL(22,2)",
+        "Annual_Income": "DOUBLE",
+        "Monthly_Debt": "DOUBLE",
+        "Credit_Score": "BIGINT",
+        "Current_Credit_Balance": "DECIMAL(24,2)",
+        "Years_of_Credit_History": "DOUBLE",
+    },
+)
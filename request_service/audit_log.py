@@ -0,0 +1,248 @@
+"""
+Компактное хранение аудита запросов в logs.
+
+Текст запроса хранится один раз в query_texts ровно в том виде, в котором
+выполнялся (с комментариями, регистром и литералами), запись logs ссылается на
+него по query_id — первые 8 байт SHA-1 текста (63 бита, положительный BIGINT).
+Отпечаток query_stats.fingerprint для аудита не годится: он теряет комментарии,
+а /*! ... */ MySQL выполняет. Повторы одного запроса и параметризованные запросы
+(%s с params) делят одну строку query_texts. Параметры запроса — компактный JSON
+в logs.query_params, число строк и время выполнения — типизированные колонки
+row_count и duration_ms.
+
+details у записи с query_id — шаблон с маркерами QUERY и ROWS, которые
+представление logs_readable (DB_init.py) заменяет текстом запроса с параметрами
+и числом строк; NULL — шаблон по умолчанию: "{query} - returned {rows} row(s)"
+при известном row_count, иначе "{query}". У записей без запроса details — как раньше.
+Так logs_readable показывает details в прежнем виде "{запрос} -- params=[...]"
+(параметры — JSON вместо repr списка Python).
+
+Какие тексты уже записаны, процесс помнит в QueryTexts (LRU), чтобы не повторять
+INSERT IGNORE в query_texts на каждую запись аудита.
+
+Записи, сделанные до перехода (полный текст в details), переводятся вручную:
+    python request_service/audit_log.py --compact --batch-size 1000
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+QUERY = "{query}"
+ROWS = "{rows}"
+RETURNED = f"{QUERY} - returned {ROWS} row(s)"
+
+LOG_COLUMNS = ("session_id", "user_id", "username", "action", "details", "ip_address",
+               "query_id", "query_params", "row_count", "duration_ms")
+INSERT_LOG = (f"INSERT INTO logs ({', '.join(LOG_COLUMNS)}) "
+              f"VALUES ({', '.join(['%s'] * len(LOG_COLUMNS))})")
+INSERT_QUERY_TEXT = "INSERT IGNORE INTO query_texts (query_id, query_text) VALUES (%s, %s)"
+
+# Записи прежнего формата, которые переводит compact(): самые частые, с текстом запроса
+LEGACY_ACTIONS = ("EXECUTE_SQL_OK_SELECT", "EXECUTE_SQL_OK_DML", "EXECUTE_SQL_ROLLED_BACK")
+_LEGACY_RETURNED_RE = re.compile(r" - returned (\d+) row\(s\)(.*)$", re.DOTALL)
+_LEGACY_TRANSACTION_RE = re.compile(r" \(transaction [\w-]+\)$")
+_LEGACY_PARAMS_RE = re.compile(r" -- params=(\[.*\])$", re.DOTALL)
+
+
+def query_id(text):
+    """Идентификатор текста запроса: 63 бита SHA-1."""
+    return int.from_bytes(hashlib.sha1(text.encode()).digest()[:8], "big") >> 1
+
+
+def encode_params(params):
+    """Параметры запроса компактным JSON; None — запрос без параметров."""
+    if params is None:
+        return None
+    return json.dumps(list(params), separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class QueryTexts:
+    """LRU идентификаторов текстов, уже записанных в query_texts этим процессом."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+
+    def missing(self, texts):
+        """Пары (query_id, текст), которых нет в кэше, без повторов."""
+        result = {}
+        with self._lock:
+            for qid, text in texts:
+                if qid in self._known:
+                    self._known.move_to_end(qid)
+                else:
+                    result[qid] = text
+        return list(result.items())
+
+    def remember(self, ids):
+        """Отмечает тексты записанными (после commit)."""
+        with self._lock:
+            for qid in ids:
+                self._known[qid] = True
+                self._known.move_to_end(qid)
+            while len(self._known) > self.max_size:
+                self._known.popitem(last=False)
+
+
+def log_row(session_id, user_id, username, action, details, ip_address,
+            query=None, params=None, rows=None, duration_ms=None):
+    """
+    Строка logs (в порядке LOG_COLUMNS) и текст запроса (query_id, query) или None.
+    С query details — шаблон с маркерами QUERY/ROWS либо None (см. модуль).
+    """
+    if query is None:
+        return (session_id, user_id, username, action, details, ip_address,
+                None, None, rows, duration_ms), None
+    qid = query_id(query)
+    if rows is not None and rows < 0:
+        rows = None  # rowcount DDL
+    if duration_ms is not None:
+        duration_ms = round(duration_ms, 3)
+    return (session_id, user_id, username, action, details, ip_address,
+            qid, encode_params(params), rows, duration_ms), (qid, query)
+
+
+def write_rows(cursor, texts, rows, cache):
+    """
+    Вставляет новые тексты запросов и строки logs (без commit).
+    Возвращает query_id вставленных текстов — их нужно передать cache.remember после commit.
+    """
+    new_texts = cache.missing(t for t in texts if t is not None)
+    if new_texts:
+        cursor.executemany(INSERT_QUERY_TEXT, new_texts)
+    if len(rows) == 1:
+        cursor.execute(INSERT_LOG, rows[0])
+    else:
+        cursor.executemany(INSERT_LOG, rows)
+    return [qid for qid, _ in new_texts]
+
+
+# =============================================================================
+# ПЕРЕВОД ЗАПИСЕЙ ПРЕЖНЕГО ФОРМАТА
+# =============================================================================
+
+def parse_legacy(action, details):
+    """
+    Запись LEGACY_ACTIONS прежнего формата -> (шаблон details, запрос, params, row_count)
+    или None, если details не разбирается.
+    """
+    if not details:
+        return None
+    template, rows = None, None
+    text = details
+    if action == "EXECUTE_SQL_OK_SELECT":
+        match = _LEGACY_RETURNED_RE.search(text)
+        if not match:
+            return None
+        rows = int(match.group(1))
+        template = RETURNED + match.group(2) if match.group(2) else None
+        text = text[:match.start()]
+    else:
+        match = _LEGACY_TRANSACTION_RE.search(text)
+        if match:
+            template = QUERY + match.group(0)
+            text = text[:match.start()]
+    params = None
+    match = _LEGACY_PARAMS_RE.search(text)
+    if match:
+        try:
+            params = ast.literal_eval(match.group(1))
+        except (ValueError, SyntaxError):
+            return None
+        text = text[:match.start()]
+    return template, text, params, rows
+
+
+def compact(conn, cache, batch_size=1000):
+    """
+    Переводит записи LEGACY_ACTIONS с полным текстом в details на query_texts,
+    порциями по batch_size с commit после каждой. Возвращает (переведено, пропущено).
+    """
+    converted = skipped = 0
+    last_id = 0
+    placeholders = ", ".join(["%s"] * len(LEGACY_ACTIONS))
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute(
+                f"SELECT log_id, action, details FROM logs WHERE log_id > %s AND query_id IS NULL "
+                f"AND action IN ({placeholders}) ORDER BY log_id LIMIT %s",
+                (last_id, *LEGACY_ACTIONS, batch_size),
+            )
+            batch = cursor.fetchall()
+            if not batch:
+                return converted, skipped
+            last_id = batch[-1][0]
+            texts, updates = [], []
+            for log_id, action, details in batch:
+                parsed = parse_legacy(action, details)
+                if parsed is None:
+                    skipped += 1
+                    continue
+                template, query, params, rows = parsed
+                qid = query_id(query)
+                texts.append((qid, query))
+                updates.append((template, qid, encode_params(params), rows, log_id))
+            new_texts = cache.missing(texts)
+            if new_texts:
+                cursor.executemany(INSERT_QUERY_TEXT, new_texts)
+            if updates:
+                cursor.executemany(
+                    "UPDATE logs SET details = %s, query_id = %s, query_params = %s, row_count = %s "
+                    "WHERE log_id = %s",
+                    updates,
+                )
+            conn.commit()
+            cache.remember(qid for qid, _ in new_texts)
+            converted += len(updates)
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv()
+    # Запуск скриптом из request_service/: пакет common/ — в корне репозитория
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from common import db
+    from common.db import Error
+
+    parser = argparse.ArgumentParser(description="Move full query texts of old audit records to query_texts")
+    parser.add_argument("--compact", action="store_true", help="convert old EXECUTE_SQL_OK_* records")
+    parser.add_argument("--batch-size", type=int, default=1000, help="records per transaction")
+    args = parser.parse_args(argv)
+    if not args.compact:
+        parser.print_help()
+        return 0
+
+    try:
+        conn = db.connect(
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            database="TrainSafe",
+        )
+    except Error as e:
+        print(f"Database connection error: {e}", file=sys.stderr)
+        return 1
+    try:
+        converted, skipped = compact(conn, QueryTexts(), args.batch_size)
+    except Error as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"Converted {converted} record(s), skipped {skipped} unparsable record(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Мини-батчи train_data для обучения моделей (/dataset/batches).
+
+Строки читаются ключевой пагинацией по первичному ключу (Loan_ID > последний
+ключ страницы ORDER BY Loan_ID LIMIT window) — каждая страница стоит одного
+поиска по индексу, без OFFSET, который тем медленнее, чем дальше от начала.
+
+Перемешивание детерминировано (seed, epoch):
+- диапазон ключей разбит на BUCKETS корзин по первым двум символам Loan_ID
+  (UUID — шестнадцатеричные символы, корзины примерно равны); порядок обхода
+  корзин — перестановка, зависящая от seed и epoch;
+- внутри корзины страница из window соседних ключей перемешивается своим
+  генератором (seed, epoch, корзина, ключ начала страницы).
+Loan_ID случайны, поэтому соседние ключи — это случайная выборка строк,
+и батчи перемешаны так же, как при полной перестановке таблицы.
+
+Позиция в эпохе (Position) — корзина, ключ начала страницы и число уже отданных
+строк страницы; она кодируется в курсор, с которого упавший обучающий процесс
+продолжает эпоху. Курсор действителен, пока не изменились seed, window и данные.
+
+Форматы:
+- npy — поток кадров: 4 байта длины (big-endian) + JSON-заголовок кадра
+  {"batch", "rows", "cursor", "columns": [{"name", "dtype", "nbytes", ...}]},
+  затем колонки подряд, каждая — полный файл .npy (numpy.load(io.BytesIO(blob))).
+  Числа — float32 (FLOAT, TINYINT) или float64 (DECIMAL, INT), NULL — NaN;
+  ENUM — коды int8 по списку "categories" (NULL — -1); VARCHAR — строки '<U'.
+- ndjson — строка JSON на батч: {"batch", "rows", "cursor", "columns": {имя: [значения]}}.
+Последний кадр — {"rows": 0, "cursor", "end_of_epoch"} (или "error", если чтение прервалось).
+"""
+import base64
+import hashlib
+import io
+import json
+import math
+import random
+import struct
+
+from ingest import TRAIN_DATA_SCHEMA
+
+try:
+    import numpy
+except ImportError:  # без NumPy доступен только формат ndjson
+    numpy = None
+
+FORMATS = ("npy", "ndjson")
+CONTENT_TYPES = {
+    "npy": "application/x-npy-frames",
+    "ndjson": "application/x-ndjson",
+}
+
+KEY_COLUMN = "Loan_ID"
+BUCKETS = 256
+_BOUNDARIES = [f"{i:02x}" for i in range(BUCKETS)]
+
+FRAME_HEADER = struct.Struct(">I")
+CURSOR_VERSION = 1
+
+_COLUMNS_BY_KEY = {column.name.lower(): column for column in TRAIN_DATA_SCHEMA}
+
+# dtype-ы числовых колонок в формате npy; целые с NULL — float с NaN
+NUMPY_DTYPES = {
+    "float": "float32",
+    "tinyint": "float32",
+    "int": "float64",
+    "decimal": "float64",
+}
+
+
+class DatasetError(Exception):
+    """Неверные параметры выборки или курсор."""
+
+
+def numpy_available():
+    return numpy is not None
+
+
+def resolve_columns(names):
+    """Колонки схемы train_data по списку имён (None — все); бросает DatasetError."""
+    if not names:
+        return list(TRAIN_DATA_SCHEMA)
+    columns, unknown = [], []
+    for name in names:
+        column = _COLUMNS_BY_KEY.get(name.strip().lower())
+        if column is None:
+            unknown.append(name)
+        elif column not in columns:
+            columns.append(column)
+    if unknown:
+        raise DatasetError(f"Unknown columns: {', '.join(unknown)}")
+    return columns
+
+
+def page_query(columns, lower=">", upper=True):
+    """
+    SELECT страницы корзины: Loan_ID первым, затем выбранные колонки.
+    lower: ">" — после ключа, ">=" — с начала корзины, None — с начала таблицы;
+    upper — есть ли верхняя граница корзины. Последний параметр — LIMIT.
+    """
+    names = [KEY_COLUMN] + [c.name for c in columns if c.name != KEY_COLUMN]
+    conditions = []
+    if lower:
+        conditions.append(f"{KEY_COLUMN} {lower} %s")
+    if upper:
+        conditions.append(f"{KEY_COLUMN} < %s")
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return (f"SELECT {', '.join(f'`{n}`' for n in names)} FROM train_data{where} "
+            f"ORDER BY {KEY_COLUMN} LIMIT %s")
+
+
+def bucket_bounds(bucket):
+    """(lo, hi) корзины: lo включительно, hi не включительно; None — без границы."""
+    lo = _BOUNDARIES[bucket] if bucket > 0 else None
+    hi = _BOUNDARIES[bucket + 1] if bucket + 1 < BUCKETS else None
+    return lo, hi
+
+
+def bucket_order(seed, epoch):
+    """Порядок обхода корзин в эпохе."""
+    order = list(range(BUCKETS))
+    random.Random(f"{seed}:{epoch}").shuffle(order)
+    return order
+
+
+def shuffle_page(rows, seed, epoch, bucket, after):
+    """Строки страницы в порядке эпохи; тот же результат при повторном чтении страницы."""
+    rows = list(rows)
+    random.Random(f"{seed}:{epoch}:{bucket}:{after or ''}").shuffle(rows)
+    return rows
+
+
+class Position:
+    """
+    Позиция в эпохе: pos — номер корзины в порядке обхода, after — ключ,
+    после которого начинается текущая страница (None — начало корзины),
+    skip — сколько строк перемешанной страницы уже отдано.
+    """
+
+    def __init__(self, epoch, pos=0, after=None, skip=0):
+        self.epoch = epoch
+        self.pos = pos
+        self.after = after
+        self.skip = skip
+
+    @property
+    def end_of_epoch(self):
+        return self.pos >= BUCKETS
+
+    def encode(self, fingerprint):
+        raw = json.dumps([CURSOR_VERSION, self.epoch, self.pos, self.after, self.skip, fingerprint],
+                         separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, cursor, fingerprint):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            version, epoch, pos, after, skip, saved = json.loads(base64.urlsafe_b64decode(padded))
+        except (ValueError, TypeError):
+            raise DatasetError("Invalid cursor")
+        if version != CURSOR_VERSION:
+            raise DatasetError("Unsupported cursor version")
+        if saved != fingerprint:
+            raise DatasetError("Cursor was issued for another seed or window")
+        if not (isinstance(epoch, int) and isinstance(pos, int) and isinstance(skip, int)
+                and 0 <= pos <= BUCKETS and skip >= 0 and (after is None or isinstance(after, str))):
+            raise DatasetError("Invalid cursor")
+        return cls(epoch, pos, after, skip)
+
+
+def fingerprint(seed, window):
+    """Отпечаток параметров, от которых зависит порядок строк, — для проверки курсора."""
+    return hashlib.sha1(f"{seed}:{window}:{BUCKETS}".encode()).hexdigest()[:12]
+
+
+def iter_batches(fetch_page, seed, window, batch_size, position, drop_last=False):
+    """
+    Батчи эпохи, начиная с position: (rows, позиция после батча).
+    fetch_page(lo, hi, after, limit) — строки корзины (первая колонка — Loan_ID)
+    после ключа after (или с lo), по возрастанию ключа, не больше limit.
+    """
+    epoch = position.epoch
+    order = bucket_order(seed, epoch)
+    pending = []
+    pos, after, skip = position.pos, position.after, position.skip
+    while pos < BUCKETS:
+        bucket = order[pos]
+        lo, hi = bucket_bounds(bucket)
+        page = fetch_page(lo, hi, after, window)
+        rows = shuffle_page(page, seed, epoch, bucket, after)
+        # Где начинается следующая страница: продолжение корзины или следующая корзина
+        if len(page) < window:
+            next_pos, next_after = pos + 1, None
+        else:
+            next_pos, next_after = pos, page[-1][0]
+        i = skip
+        while i < len(rows):
+            take = min(batch_size - len(pending), len(rows) - i)
+            pending.extend(rows[i:i + take])
+            i += take
+            if len(pending) == batch_size:
+                if i < len(rows):
+                    yield pending, Position(epoch, pos, after, i)
+                else:
+                    yield pending, Position(epoch, next_pos, next_after, 0)
+                pending = []
+        pos, after, skip = next_pos, next_after, 0
+    if pending and not drop_last:
+        yield pending, Position(epoch, BUCKETS)
+
+
+def column_values(column, values):
+    """Значения колонки для ndjson: числа — float, NULL — None."""
+    if column.kind in NUMPY_DTYPES:
+        return [None if v is None or (isinstance(v, float) and math.isnan(v)) else
+                (int(v) if column.kind in ("int", "tinyint") else float(v)) for v in values]
+    return list(values)
+
+
+def column_array(column, values):
+    """Значения колонки в массив NumPy (см. модуль) и описание для заголовка кадра."""
+    meta = {"name": column.name}
+    if column.kind in NUMPY_DTYPES:
+        array = numpy.array([math.nan if v is None else float(v) for v in values],
+                            dtype=NUMPY_DTYPES[column.kind])
+    elif column.kind == "enum":
+        codes = {value: i for i, value in enumerate(column.values)}
+        array = numpy.array([codes.get(v, -1) for v in values], dtype="int8")
+        meta["categories"] = list(column.values)
+    else:
+        array = numpy.array(["" if v is None else v for v in values], dtype=str)
+    return array, meta
+
+
+def _npy_bytes(array):
+    buf = io.BytesIO()
+    numpy.lib.format.write_array(buf, array, allow_pickle=False)
+    return buf.getvalue()
+
+
+def _frame(header, blobs=()):
+    head = json.dumps(header, separators=(",", ":")).encode()
+    return b"".join([FRAME_HEADER.pack(len(head)), head, *blobs])
+
+
+def encode_batch(fmt, columns, rows, index, cursor):
+    """
+    Кадр батча в формате fmt. rows — кортежи страницы (Loan_ID первым),
+    columns — выбранные колонки; cursor — курсор позиции после батча.
+    """
+    offsets = {name: i for i, name in enumerate(
+        [KEY_COLUMN] + [c.name for c in columns if c.name != KEY_COLUMN])}
+    header = {"batch": index, "rows": len(rows), "cursor": cursor}
+    if fmt == "ndjson":
+        header["columns"] = {
+            c.name: column_values(c, [row[offsets[c.name]] for row in rows]) for c in columns
+        }
+        return json.dumps(header, separators=(",", ":"), default=str).encode() + b"\n"
+    blobs, metas = [], []
+    for column in columns:
+        array, meta = column_array(column, [row[offsets[column.name]] for row in rows])
+        blob = _npy_bytes(array)
+        meta.update(dtype=array.dtype.str, nbytes=len(blob))
+        blobs.append(blob)
+        metas.append(meta)
+    header["columns"] = metas
+    return _frame(header, blobs)
+
+
+def encode_trailer(fmt, cursor, end_of_epoch, error=None):
+    """Последний кадр потока: курсор продолжения, признак конца эпохи или ошибка."""
+    trailer = {"rows": 0, "cursor": cursor, "end_of_epoch": end_of_epoch}
+    if error is not None:
+        trailer["error"] = error
+    if fmt == "ndjson":
+        return json.dumps(trailer, separators=(",", ":")).encode() + b"\n"
+    return _frame(trailer)
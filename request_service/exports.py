@@ -0,0 +1,313 @@
+"""
+Асинхронные выгрузки результатов SELECT в файл.
+
+ExportManager принимает задания и выполняет их в пуле фоновых потоков. Строки
+читаются с сервера порциями (fetchmany) и сразу пишутся в gzip-CSV или Parquet,
+поэтому выгрузка не держит результат в памяти. Готовые файлы отдаются с поддержкой
+HTTP Range (file_range) и удаляются через ttl секунд.
+
+Статус задания хранится рядом с файлом (<job_id>.json в directory). Если каталог общий
+для всех экземпляров request_service (том, смонтированный в каждый pod), статус и файл
+отдаёт любой экземпляр, а не только тот, что выполнял выгрузку.
+"""
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import parse_range_header
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet необязателен: без pyarrow доступен только CSV
+    pyarrow = None
+
+logger = logging.getLogger("request_service.exports")
+
+CONTENT_TYPES = {
+    "csv": "application/gzip",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXTENSIONS = {"csv": ".csv.gz", "parquet": ".parquet"}
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# job_id приходит из URL: только такие имена читаются из каталога выгрузок
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+class ExportLimitError(Exception):
+    """У пользователя уже запущено максимальное число выгрузок."""
+
+
+class ExportJob:
+    def __init__(self, user_id, username, session_id, role, query, params, fmt, ip_address=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.username = username
+        self.session_id = session_id
+        self.role = role
+        self.query = query
+        self.params = params
+        self.format = fmt
+        self.ip_address = ip_address
+        self.status = "queued"
+        self.rows = 0
+        self.size = 0
+        self.path = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_record(cls, record):
+        """Задание из записи record() (выгрузка другого экземпляра); запроса в записи нет."""
+        job = cls(record["user_id"], record["username"], record["session_id"], record["role"],
+                  None, None, record["format"])
+        job.id = record["job_id"]
+        for key in ("status", "rows", "error", "created_at", "started_at", "finished_at"):
+            setattr(job, key, record[key])
+        job.size = record["size_bytes"]
+        return job
+
+    def record(self):
+        """Состояние для файла <job_id>.json: статус и владелец, без текста запроса."""
+        return dict(self.snapshot(), user_id=self.user_id, username=self.username,
+                    session_id=self.session_id, role=self.role)
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "format": self.format,
+            "rows": self.rows,
+            "size_bytes": self.size,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ExportManager:
+    """
+    workers — число потоков выгрузки на процесс;
+    per_user_limit — сколько заданий пользователя могут одновременно ждать или выполняться
+    в этом процессе (задания других экземпляров не учитываются);
+    ttl — сколько секунд хранятся готовые файлы и статусы.
+    """
+
+    def __init__(self, directory, workers=2, per_user_limit=2, ttl=3600):
+        self.directory = directory
+        self.per_user_limit = per_user_limit
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job, run):
+        """
+        Ставит задание в очередь. run(job, path) пишет файл и возвращает число строк.
+        Бросает ExportLimitError, если лимит пользователя исчерпан.
+        """
+        job.path = os.path.join(self.directory, job.id + EXTENSIONS[job.format])
+        with self._lock:
+            self._sweep()
+            active = sum(1 for j in self._jobs.values()
+                         if j.user_id == job.user_id and j.status in ACTIVE_STATUSES)
+            if active >= self.per_user_limit:
+                raise ExportLimitError(f"Too many active exports (max {self.per_user_limit} per user)")
+            self._jobs[job.id] = job
+        os.makedirs(self.directory, exist_ok=True)
+        self._save(job)
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def get(self, job_id):
+        """Задание этого процесса или, если его нет, — из записи в каталоге выгрузок."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not _JOB_ID_RE.match(job_id or ""):
+            return job
+        try:
+            with open(self._record_path(job_id), encoding="utf-8") as f:
+                job = ExportJob.from_record(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+        if self._expired(job, time.time()):
+            return None
+        job.path = os.path.join(self.directory, job.id + EXTENSIONS[job.format])
+        return job
+
+    def _record_path(self, job_id):
+        return os.path.join(self.directory, job_id + ".json")
+
+    def _save(self, job):
+        """Записывает статус задания в <job_id>.json (атомарно, через os.replace)."""
+        path = self._record_path(job.id)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job.record(), f)
+        os.replace(path + ".tmp", path)
+
+    def _expired(self, job, now):
+        return job.finished_at is not None and now - job.finished_at > self.ttl
+
+    def _run(self, job, run):
+        job.status = "running"
+        job.started_at = time.time()
+        tmp_path = job.path + ".part"
+        try:
+            self._save(job)
+            job.rows = run(job, tmp_path)
+            os.replace(tmp_path, job.path)
+            job.size = os.path.getsize(job.path)
+            job.status = "done"
+        except Exception as e:
+            logger.warning("Выгрузка %s завершилась ошибкой: %s", job.id, e)
+            job.status = "failed"
+            job.error = str(e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            job.finished_at = time.time()
+            try:
+                self._save(job)
+            except OSError as e:
+                logger.warning("Статус выгрузки %s не сохранён: %s", job.id, e)
+
+    def _sweep(self):
+        """
+        Удаляет устаревшие задания, их записи и файлы (вызывается под self._lock),
+        в том числе оставленные другими экземплярами в общем каталоге.
+        """
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if self._expired(job, now):
+                del self._jobs[job_id]
+                if job.path and os.path.exists(job.path):
+                    os.remove(job.path)
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            job_id, ext = os.path.splitext(name)
+            if ext != ".json" or not _JOB_ID_RE.match(job_id) or job_id in self._jobs:
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    job = ExportJob.from_record(json.load(f))
+                if not self._expired(job, now):
+                    continue
+                for path in (os.path.join(self.directory, job_id + EXTENSIONS[job.format]),
+                             os.path.join(self.directory, name)):
+                    if os.path.exists(path):
+                        os.remove(path)
+            except (OSError, ValueError, KeyError) as e:
+                # Запись удалил другой экземпляр или она повреждена — пропускаем
+                logger.debug("Запись выгрузки %s пропущена: %s", name, e)
+
+
+# =============================================================================
+# ЗАПИСЬ ФАЙЛОВ
+# =============================================================================
+
+def write_csv_gz(cursor, path, batch_size):
+    """Строки курсора в gzip-CSV с заголовком. Возвращает число строк."""
+    columns = [desc[0] for desc in cursor.description]
+    count = 0
+    with gzip.open(path, "wt", newline="", encoding="utf-8", compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def write_parquet(cursor, path, batch_size):
+    """
+    Строки курсора в Parquet: каждая порция — отдельная row group.
+    Схема берётся из первой порции, следующие приводятся к ней.
+    """
+    columns = [desc[0] for desc in cursor.description]
+    count = 0
+    writer = None
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            data = {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+            if writer is None:
+                table = pyarrow.table(data)
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema, compression="zstd")
+            else:
+                table = pyarrow.table(data, schema=writer.schema)
+            writer.write_table(table)
+            count += len(rows)
+        if writer is None:
+            # Пустой результат — файл только со схемой из имён колонок
+            table = pyarrow.table({name: pyarrow.array([], pyarrow.null()) for name in columns})
+            writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+# =============================================================================
+# ОТДАЧА С ПОДДЕРЖКОЙ RANGE
+# =============================================================================
+
+def _read_chunks(path, start, length, chunk_size):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_range(path, range_header, content_type, filename, chunk_size=256 * 1024):
+    """
+    Ответ на скачивание файла: (chunks, status, headers).
+    Поддерживается один диапазон bytes=...; неудовлетворимый диапазон — (None, 416, headers).
+    """
+    size = os.path.getsize(path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Type": content_type,
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    ranges = parse_range_header(range_header) if range_header else None
+    if ranges is None or len(ranges.ranges) != 1:
+        headers["Content-Length"] = str(size)
+        return _read_chunks(path, 0, size, chunk_size), 200, headers
+
+    bounds = ranges.range_for_length(size)
+    if bounds is None:
+        headers["Content-Range"] = f"bytes */{size}"
+        return None, 416, headers
+    start, stop = bounds
+    headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    headers["Content-Length"] = str(stop - start)
+    return _read_chunks(path, start, stop - start, chunk_size), 206, headers
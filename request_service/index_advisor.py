@@ -0,0 +1,361 @@
+"""
+Офлайн-советник по индексам для train_data, sessions и logs.
+
+Источники нагрузки:
+  - GET /query_stats работающего request_service (время, p95, строки и образец
+    самого медленного выполнения по каждому отпечатку);
+  - исторические записи logs (EXECUTE_SQL_OK_SELECT / EXECUTE_SQL_OK_DML) за
+    последние --days дней: число выполнений по query_id (тексты — в query_texts,
+    время — duration_ms) и записи прежнего формата с полным текстом в details.
+
+Для образца каждого отпечатка выполняется EXPLAIN. Если по одной из таблиц идёт
+полный просмотр (type ALL/index или нет ключа), из условий запроса собирается
+кандидат: колонки равенства (самые селективные первыми), затем одна колонка
+диапазона или колонки ORDER BY. Кандидаты, уже покрытые существующим индексом
+(его префиксом), отбрасываются.
+
+Оценка выигрыша: строки, которые просматривает запрос сейчас (EXPLAIN rows),
+против ожидаемых с индексом (rows / число различных значений колонок равенства,
+для диапазона ещё ×0.3). Доля сэкономленных строк умножается на суммарное время
+отпечатка из /query_stats или на сумму duration_ms из logs; для записей logs
+прежнего формата (без времени) выигрыш выражается в строках (count × сэкономленные строки).
+
+Советник ничего не создаёт — он печатает CREATE INDEX для ручной проверки:
+    python request_service/index_advisor.py --stats-url http://127.0.0.1:6002 --days 7
+    python request_service/index_advisor.py --no-logs --json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+import mysql.connector
+import requests
+from dotenv import load_dotenv
+from mysql.connector import Error
+
+from audit_log import parse_legacy
+from query_stats import fingerprint
+
+# Колонки таблиц из DB_init.py, по которым имеет смысл строить индекс (без TEXT)
+TABLE_COLUMNS = {
+    "train_data": [
+        "Loan_ID", "Customer_ID", "Loan_Status", "Current_Loan_Amount", "Term",
+        "Credit_Score", "Annual_Income", "Years_in_current_job", "Home_Ownership", "Purpose",
+        "Monthly_Debt", "Years_of_Credit_History", "Months_since_last_delinquent",
+        "Number_of_Open_Accounts", "Number_of_Credit_Problems",
+        "Current_Credit_Balance", "Maximum_Open_Credit", "Bankruptcies", "Tax_Liens",
+    ],
+    "sessions": [
+        "session_id", "user_id", "username", "code", "expires_at",
+        "is_validated", "session_expires_at", "is_session_active",
+    ],
+    "logs": ["log_id", "session_id", "user_id", "username", "action", "timestamp", "ip_address",
+             "query_id", "row_count", "duration_ms"],
+}
+
+# Доля строк, которую оставляет условие-диапазон (та же грубая оценка, что у оптимизаторов)
+RANGE_SELECTIVITY = 0.3
+MAX_INDEX_COLUMNS = 3
+
+LOG_ACTIONS = ("EXECUTE_SQL_OK_SELECT", "EXECUTE_SQL_OK_DML")
+_EXPLAINABLE_RE = re.compile(r"^\s*(SELECT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+_DML_TABLE_RE = re.compile(r"^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?", re.IGNORECASE)
+_ORDER_BY_RE = re.compile(r"\bORDER\s+BY\s+(.+?)(?:\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+
+
+def get_db_connection():
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database="TrainSafe",
+    )
+
+
+# =============================================================================
+# НАГРУЗКА
+# =============================================================================
+
+def load_stats(url, limit, timeout=10):
+    """Отпечатки из /query_stats: {fp: {count, total_ms, p95_ms, query, params}}."""
+    response = requests.get(f"{url.rstrip('/')}/query_stats",
+                            params={"limit": limit, "order": "total_ms"}, timeout=timeout)
+    response.raise_for_status()
+    workload = {}
+    for item in response.json()["top"]:
+        sample = item.get("sample") or {}
+        if not sample.get("query"):
+            continue
+        workload[item["fingerprint"]] = {
+            "count": item["count"],
+            "total_ms": item["total_ms"],
+            "p95_ms": item["p95_ms"],
+            "query": sample["query"],
+            "params": sample.get("params"),
+        }
+    return workload
+
+
+def _add_log_entry(workload, query, params, count, total_ms):
+    fp = fingerprint(query)
+    entry = workload.setdefault(fp, {"count": 0, "total_ms": None, "p95_ms": None,
+                                     "query": query, "params": params})
+    entry["count"] += count
+    if total_ms is not None:
+        entry["total_ms"] = (entry["total_ms"] or 0) + total_ms
+
+
+def load_logs(conn, days, limit):
+    """
+    Отпечатки из logs за days дней: {fp: {count, total_ms, query, params}}.
+    Записи с query_id группируются в БД (время — сумма duration_ms), записи прежнего
+    формата (до --limit штук) разбираются из details.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT q.query_text, MAX(l.query_params), COUNT(*), SUM(l.duration_ms) "
+            "FROM logs l JOIN query_texts q ON q.query_id = l.query_id "
+            "WHERE l.action IN (%s, %s) AND l.timestamp >= NOW() - INTERVAL %s DAY "
+            "GROUP BY l.query_id, q.query_text",
+            (*LOG_ACTIONS, days),
+        )
+        workload = {}
+        for query, params, count, total_ms in cursor.fetchall():
+            _add_log_entry(workload, query, json.loads(params) if params else None,
+                           count, float(total_ms) if total_ms is not None else None)
+
+        cursor.execute(
+            "SELECT action, details FROM logs WHERE action IN (%s, %s) AND query_id IS NULL "
+            "AND timestamp >= NOW() - INTERVAL %s DAY ORDER BY log_id DESC LIMIT %s",
+            (*LOG_ACTIONS, days, limit),
+        )
+        for action, details in cursor:
+            parsed = parse_legacy(action, details)
+            if parsed is None or not parsed[1].strip():
+                continue
+            _, query, params, _ = parsed
+            _add_log_entry(workload, query.strip(), params, 1, None)
+        return workload
+    finally:
+        cursor.close()
+
+
+def merge_workloads(stats, logs):
+    """Время берётся из /query_stats, число выполнений — большее из двух источников."""
+    workload = dict(logs)
+    for fp, entry in stats.items():
+        if fp in workload:
+            entry = dict(entry, count=max(entry["count"], workload[fp]["count"]))
+        workload[fp] = entry
+    return workload
+
+
+# =============================================================================
+# АНАЛИЗ
+# =============================================================================
+
+def explain(conn, query, params):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"EXPLAIN {query}", tuple(params) if params else ())
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def existing_indexes(conn, table):
+    """Списки колонок существующих индексов таблицы (в порядке Seq_in_index)."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"SHOW INDEX FROM {table}")
+        indexes = {}
+        for row in cursor.fetchall():
+            indexes.setdefault(row["Key_name"], []).append((row["Seq_in_index"], row["Column_name"]))
+        return [[c.lower() for _, c in sorted(cols)] for cols in indexes.values()]
+    finally:
+        cursor.close()
+
+
+def predicate_columns(query, table):
+    """(колонки равенства, колонки диапазона, колонки ORDER BY) таблицы в тексте запроса."""
+    where = re.split(r"\bWHERE\b", query, maxsplit=1, flags=re.IGNORECASE)
+    where = re.split(r"\b(?:GROUP\s+BY|ORDER\s+BY|LIMIT)\b", where[1], flags=re.IGNORECASE)[0] \
+        if len(where) > 1 else ""
+    equality, ranges = [], []
+    for column in TABLE_COLUMNS[table]:
+        name = rf"(?:\w+\.)?`?{column}`?"
+        if re.search(rf"\b{name}\s*(?:=|<=>|\bIN\s*\(|\bIS\s+NULL\b)", where, re.IGNORECASE):
+            equality.append(column)
+        elif re.search(rf"\b{name}\s*(?:<|>|\bBETWEEN\b|\bLIKE\s+(?:%s|'[^%]))", where, re.IGNORECASE):
+            ranges.append(column)
+    order = []
+    match = _ORDER_BY_RE.search(query)
+    if match:
+        for item in match.group(1).split(","):
+            name = item.strip().split()[0].split(".")[-1].strip("`") if item.strip() else ""
+            column = next((c for c in TABLE_COLUMNS[table] if c.lower() == name.lower()), None)
+            if column:
+                order.append(column)
+    return equality, ranges, order
+
+
+def distinct_counts(conn, table, columns, cache):
+    """Число строк и различных значений набора колонок (кэшируется на запуск)."""
+    key = (table, tuple(columns))
+    if key not in cache:
+        cursor = conn.cursor()
+        try:
+            distinct = f", COUNT(DISTINCT {', '.join(columns)})" if columns else ""
+            cursor.execute(f"SELECT COUNT(*){distinct} FROM {table}")
+            row = cursor.fetchone()
+            cache[key] = (row[0], row[1] if columns else 1)
+        finally:
+            cursor.close()
+    return cache[key]
+
+
+def candidate_for(conn, table, query, ndv_cache):
+    """Кандидат (колонки, ожидаемая доля строк) или None."""
+    equality, ranges, order = predicate_columns(query, table)
+    if not equality and not ranges and not order:
+        return None
+    # Самые селективные колонки равенства — первыми
+    if len(equality) > 1:
+        equality.sort(key=lambda c: distinct_counts(conn, table, [c], ndv_cache)[1], reverse=True)
+    columns = equality[:MAX_INDEX_COLUMNS]
+    if ranges and len(columns) < MAX_INDEX_COLUMNS:
+        columns.append(ranges[0])
+    elif not ranges:
+        columns += [c for c in order if c not in columns][:MAX_INDEX_COLUMNS - len(columns)]
+    total, ndv = distinct_counts(conn, table, equality[:MAX_INDEX_COLUMNS], ndv_cache)
+    fraction = 1 / max(ndv, 1) if equality else 1.0
+    if ranges:
+        fraction *= RANGE_SELECTIVITY
+    return columns, fraction, total
+
+
+def covered(columns, indexes):
+    lowered = [c.lower() for c in columns]
+    return any(index[:len(lowered)] == lowered for index in indexes)
+
+
+def advise(conn, workload):
+    """Список рекомендаций, отсортированный по оценке выигрыша."""
+    index_cache, ndv_cache = {}, {}
+    writes = {table: 0 for table in TABLE_COLUMNS}
+    proposals = {}
+    skipped = []
+    for fp, entry in workload.items():
+        dml = _DML_TABLE_RE.match(entry["query"])
+        if dml and dml.group(1) in writes:
+            writes[dml.group(1)] += entry["count"]
+        if not _EXPLAINABLE_RE.match(entry["query"]):
+            continue
+        try:
+            plan = explain(conn, entry["query"], entry["params"])
+        except Error as e:
+            skipped.append({"fingerprint": fp, "reason": str(e)})
+            continue
+        for step in plan:
+            table = step.get("table")
+            if table not in TABLE_COLUMNS:
+                continue
+            if step.get("type") not in ("ALL", "index") and step.get("key"):
+                continue
+            if table not in index_cache:
+                index_cache[table] = existing_indexes(conn, table)
+            candidate = candidate_for(conn, table, entry["query"], ndv_cache)
+            if candidate is None:
+                continue
+            columns, fraction, total = candidate
+            if covered(columns, index_cache[table]):
+                continue
+            rows_before = step.get("rows") or total
+            rows_after = max(1.0, total * fraction)
+            saved = max(0.0, 1 - rows_after / rows_before) if rows_before else 0.0
+            proposal = proposals.setdefault((table, tuple(columns)), {
+                "table": table,
+                "columns": columns,
+                "ddl": f"CREATE INDEX idx_{table}_{'_'.join(c.lower() for c in columns)} "
+                       f"ON {table} ({', '.join(columns)});",
+                "estimated_saved_ms": 0.0,
+                "estimated_rows_avoided": 0,
+                "fingerprints": [],
+            })
+            if entry.get("total_ms") is not None:
+                proposal["estimated_saved_ms"] += entry["total_ms"] * saved
+            proposal["estimated_rows_avoided"] += int(entry["count"] * max(0.0, rows_before - rows_after))
+            proposal["fingerprints"].append({
+                "fingerprint": fp,
+                "count": entry["count"],
+                "total_ms": entry.get("total_ms"),
+                "p95_ms": entry.get("p95_ms"),
+                "rows_examined": rows_before,
+                "rows_expected": round(rows_after, 1),
+            })
+    result = sorted(proposals.values(),
+                    key=lambda p: (p["estimated_saved_ms"], p["estimated_rows_avoided"]), reverse=True)
+    for proposal in result:
+        proposal["estimated_saved_ms"] = round(proposal["estimated_saved_ms"], 1)
+        # Каждый индекс замедляет запись в таблицу — показываем, сколько её было
+        proposal["writes_to_table"] = writes[proposal["table"]]
+    return result, skipped
+
+
+def print_report(proposals, skipped, workload_size):
+    print(f"Analyzed {workload_size} fingerprint(s), {len(proposals)} index proposal(s)\n")
+    for i, p in enumerate(proposals, start=1):
+        print(f"{i}. {p['ddl']}")
+        print(f"   saved ~{p['estimated_saved_ms']} ms, ~{p['estimated_rows_avoided']} rows not scanned, "
+              f"{p['writes_to_table']} write(s) to {p['table']}")
+        for f in p["fingerprints"][:3]:
+            print(f"   - x{f['count']} rows {f['rows_examined']} -> {f['rows_expected']}: {f['fingerprint'][:100]}")
+    if skipped:
+        print(f"\nSkipped {len(skipped)} fingerprint(s) (EXPLAIN failed)")
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Propose indexes for TrainSafe tables from query statistics")
+    parser.add_argument("--stats-url", default=os.getenv("REQUEST_SERVICE_URL", "http://127.0.0.1:6002"),
+                        help="request_service base URL with /query_stats")
+    parser.add_argument("--no-stats", action="store_true", help="do not read /query_stats")
+    parser.add_argument("--no-logs", action="store_true", help="do not read historical logs")
+    parser.add_argument("--days", type=int, default=7, help="how many days of logs to read")
+    parser.add_argument("--log-limit", type=int, default=100000, help="max log rows to read")
+    parser.add_argument("--top", type=int, default=50, help="fingerprints to take from /query_stats")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a report")
+    args = parser.parse_args(argv)
+
+    try:
+        conn = get_db_connection()
+    except Error as e:
+        print(f"Database connection error: {e}", file=sys.stderr)
+        return 1
+    try:
+        stats = {}
+        if not args.no_stats:
+            try:
+                stats = load_stats(args.stats_url, args.top)
+            except requests.RequestException as e:
+                print(f"Could not read {args.stats_url}/query_stats: {e}", file=sys.stderr)
+        logs = {} if args.no_logs else load_logs(conn, args.days, args.log_limit)
+        workload = merge_workloads(stats, logs)
+        proposals, skipped = advise(conn, workload)
+    finally:
+        conn.close()
+
+    if args.json:
+        json.dump({"proposals": proposals, "skipped": skipped}, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_report(proposals, skipped, len(workload))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,364 @@
+"""
+Потоковая загрузка строк в train_data (CSV или NDJSON).
+
+Тело запроса читается построчно, без буферизации файла целиком. Каждая строка
+проверяется по схеме train_data из DB_init.py (обязательность, длина VARCHAR,
+значения ENUM, диапазоны DECIMAL/INT/TINYINT); строки с ошибками отклоняются
+и не мешают остальным. Корректные строки вставляются многострочными INSERT
+по batch_rows строк, фиксация — каждые commit_rows строк.
+
+on_duplicate: skip — строки с уже существующим Loan_ID пропускаются (INSERT IGNORE),
+update — заменяют существующие (ON DUPLICATE KEY UPDATE). В режиме update rowcount
+не различает новые строки и строки без изменений, поэтому вставленные считаются по
+числу Loan_ID порции в таблице до и после INSERT; остальные — обновлённые (updated)
+или совпавшие с существующими (unchanged).
+"""
+import codecs
+import csv
+import json
+import logging
+import math
+import time
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+logger = logging.getLogger("request_service.ingest")
+
+FORMATS = ("csv", "ndjson")
+ON_DUPLICATE = ("skip", "update")
+
+INT_RANGE = (-2 ** 31, 2 ** 31 - 1)
+TINYINT_RANGE = (-128, 127)
+FLOAT_MAX = 3.4028234663852886e38
+
+
+class IngestError(Exception):
+    """Загрузку нельзя начать: неизвестный формат, неверный заголовок CSV и т. п."""
+
+
+class Column:
+    """
+    Колонка train_data и правила проверки значения.
+    kind: varchar | enum | decimal | int | tinyint | float.
+    """
+
+    def __init__(self, name, kind, nullable=True, length=None, values=None, precision=None, scale=None):
+        self.name = name
+        self.kind = kind
+        self.nullable = nullable
+        self.length = length
+        self.values = values
+        self.precision = precision
+        self.scale = scale
+        if kind == "decimal":
+            self._quantum = Decimal(1).scaleb(-scale)
+            self._limit = Decimal(10) ** (precision - scale)
+
+    def convert(self, raw):
+        """Значение для INSERT; бросает ValueError с понятным сообщением."""
+        if raw is None or (isinstance(raw, str) and raw.strip() == ""):
+            if not self.nullable:
+                raise ValueError(f"{self.name} is required")
+            return None
+        if isinstance(raw, (dict, list, bool)):
+            raise ValueError(f"{self.name}: unsupported value {raw!r}")
+        if self.kind == "varchar":
+            value = str(raw).strip()
+            if len(value) > self.length:
+                raise ValueError(f"{self.name}: longer than {self.length} characters")
+            return value
+        if self.kind == "enum":
+            value = str(raw).strip()
+            if value not in self.values:
+                raise ValueError(f"{self.name}: {value!r} is not one of {', '.join(self.values)}")
+            return value
+        if self.kind == "decimal":
+            try:
+                value = Decimal(str(raw).strip()).quantize(self._quantum, rounding=ROUND_HALF_UP)
+            except InvalidOperation:
+                raise ValueError(f"{self.name}: {raw!r} is not a number")
+            if not value.is_finite() or abs(value) >= self._limit:
+                raise ValueError(f"{self.name}: {raw!r} is out of range for DECIMAL({self.precision},{self.scale})")
+            return value
+        if self.kind in ("int", "tinyint"):
+            try:
+                number = Decimal(str(raw).strip())
+            except InvalidOperation:
+                raise ValueError(f"{self.name}: {raw!r} is not an integer")
+            if not number.is_finite() or number != number.to_integral_value():
+                raise ValueError(f"{self.name}: {raw!r} is not an integer")
+            low, high = INT_RANGE if self.kind == "int" else TINYINT_RANGE
+            if not low <= number <= high:
+                raise ValueError(f"{self.name}: {raw!r} is out of range for {self.kind.upper()}")
+            return int(number)
+        if self.kind == "float":
+            try:
+                value = float(str(raw).strip())
+            except ValueError:
+                raise ValueError(f"{self.name}: {raw!r} is not a number")
+            if not math.isfinite(value) or abs(value) > FLOAT_MAX:
+                raise ValueError(f"{self.name}: {raw!r} is out of range for FLOAT")
+            return value
+        raise ValueError(f"{self.name}: unknown column kind {self.kind}")
+
+
+# Схема train_data (DB_init.py); Loan_ID — первичный ключ
+TRAIN_DATA_SCHEMA = [
+    Column("Loan_ID", "varchar", nullable=False, length=36),
+    Column("Customer_ID", "varchar", length=36),
+    Column("Loan_Status", "enum", nullable=False, values=("Approved", "Rejected", "Fully Paid")),
+    Column("Current_Loan_Amount", "decimal", precision=10, scale=2),
+    Column("Term", "varchar", length=10),
+    Column("Credit_Score", "int"),
+    Column("Annual_Income", "float"),
+    Column("Years_in_current_job", "varchar", length=50),
+    Column("Home_Ownership", "enum", values=("Rent", "Mortgage", "Own", "Other")),
+    Column("Purpose", "varchar", length=255),
+    Column("Monthly_Debt", "float"),
+    Column("Years_of_Credit_History", "float"),
+    Column("Months_since_last_delinquent", "int"),
+    Column("Number_of_Open_Accounts", "tinyint"),
+    Column("Number_of_Credit_Problems", "tinyint"),
+    Column("Current_Credit_Balance", "decimal", precision=15, scale=2),
+    Column("Maximum_Open_Credit", "decimal", precision=15, scale=2),
+    Column("Bankruptcies", "tinyint"),
+    Column("Tax_Liens", "tinyint"),
+]
+_COLUMNS_BY_KEY = {column.name.lower(): column for column in TRAIN_DATA_SCHEMA}
+
+
+def _column_key(name):
+    """"Loan ID", "loan_id", "Loan_ID" — одна и та же колонка (заголовки исходного CSV с пробелами)."""
+    return str(name).strip().replace(" ", "_").lower()
+
+
+def resolve_columns(names):
+    """Колонки схемы по заголовку; бросает IngestError на неизвестные и отсутствие Loan_ID."""
+    columns, unknown = [], []
+    for name in names:
+        column = _COLUMNS_BY_KEY.get(_column_key(name))
+        if column is None:
+            unknown.append(str(name))
+        columns.append(column)
+    if unknown:
+        raise IngestError(f"Unknown columns: {', '.join(unknown)}")
+    if not any(c.name == "Loan_ID" for c in columns):
+        raise IngestError("Loan_ID column is required")
+    return columns
+
+
+def validate(record):
+    """{колонка схемы: сырое значение} -> кортеж значений в порядке TRAIN_DATA_SCHEMA."""
+    return tuple(column.convert(record.get(column.name)) for column in TRAIN_DATA_SCHEMA)
+
+
+def _text_lines(stream, chunk_size=64 * 1024):
+    """Строки UTF-8 из байтового потока с сохранением "\n" (BOM в начале отбрасывается)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        lines = (tail + decoder.decode(chunk or b"", final=not chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+        if not chunk:
+            if tail:
+                yield tail
+            return
+
+
+def read_csv(stream):
+    """(номер строки, {колонка: значение} | ValueError) из CSV с заголовком."""
+    reader = csv.reader(_text_lines(stream))
+    try:
+        header = next(reader)
+    except StopIteration:
+        return
+    columns = resolve_columns(header)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(columns):
+            yield reader.line_num, ValueError(f"expected {len(columns)} fields, got {len(row)}")
+            continue
+        yield reader.line_num, {column.name: value for column, value in zip(columns, row)}
+
+
+def read_ndjson(stream):
+    """(номер строки, {колонка: значение} | ValueError) из NDJSON — по объекту на строку."""
+    for line_no, line in enumerate(_text_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"invalid JSON: {e}")
+            continue
+        if not isinstance(obj, dict):
+            yield line_no, ValueError("each line must be a JSON object")
+            continue
+        record, unknown = {}, []
+        for key, value in obj.items():
+            column = _COLUMNS_BY_KEY.get(_column_key(key))
+            if column is None:
+                unknown.append(str(key))
+            else:
+                record[column.name] = value
+        if unknown:
+            yield line_no, ValueError(f"Unknown columns: {', '.join(unknown)}")
+            continue
+        yield line_no, record
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+def insert_sql(rows, on_duplicate):
+    names = ", ".join(c.name for c in TRAIN_DATA_SCHEMA)
+    row_placeholder = "(" + ", ".join(["%s"] * len(TRAIN_DATA_SCHEMA)) + ")"
+    values = ", ".join([row_placeholder] * rows)
+    if on_duplicate == "update":
+        updates = ", ".join(f"{c.name} = VALUES({c.name})" for c in TRAIN_DATA_SCHEMA if c.name != "Loan_ID")
+        return f"INSERT INTO train_data ({names}) VALUES {values} ON DUPLICATE KEY UPDATE {updates}"
+    return f"INSERT IGNORE INTO train_data ({names}) VALUES {values}"
+
+
+def count_sql(rows):
+    return f"SELECT COUNT(*) FROM train_data WHERE Loan_ID IN ({', '.join(['%s'] * rows)})"
+
+
+def policy_statements(on_duplicate):
+    """
+    Запросы, эквивалентные загрузке, для проверки ролевой цепочкой: INSERT в train_data,
+    для update — ещё и UPDATE train_data (текст ON DUPLICATE KEY UPDATE цепочка не разбирает).
+    """
+    names = ", ".join(c.name for c in TRAIN_DATA_SCHEMA)
+    placeholders = ", ".join(["%s"] * len(TRAIN_DATA_SCHEMA))
+    statements = [f"INSERT INTO train_data ({names}) VALUES ({placeholders})"]
+    if on_duplicate == "update":
+        assignments = ", ".join(f"{c.name} = %s" for c in TRAIN_DATA_SCHEMA if c.name != "Loan_ID")
+        statements.append(f"UPDATE train_data SET {assignments} WHERE Loan_ID = %s")
+    return statements
+
+
+class IngestResult:
+    def __init__(self, max_errors=20):
+        self.max_errors = max_errors
+        self.accepted = 0
+        self.rejected = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.committed = 0
+        self.batches = 0
+        self.commits = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "message": message})
+
+    def summary(self):
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "committed": self.committed,
+            "batches": self.batches,
+            "commits": self.commits,
+            "errors": self.errors,
+            "errors_truncated": self.rejected > len(self.errors),
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+
+def ingest(stream, fmt, conn, batch_rows=500, commit_rows=5000, on_duplicate="skip", max_errors=20):
+    """
+    Читает stream в формате fmt и вставляет строки в train_data на соединении conn.
+    Возвращает IngestResult. Ошибка БД откатывает незафиксированную часть и пробрасывается
+    дальше; уже зафиксированные строки видны в result.committed (атрибут исключения ingest_result).
+    """
+    if fmt not in READERS:
+        raise IngestError(f"Unsupported format: {fmt} (expected {' or '.join(FORMATS)})")
+    if on_duplicate not in ON_DUPLICATE:
+        raise IngestError(f"on_duplicate must be {' or '.join(ON_DUPLICATE)}")
+    batch_rows = max(1, batch_rows)
+    commit_rows = max(batch_rows, commit_rows)
+
+    result = IngestResult(max_errors)
+    records = READERS[fmt](stream)
+    full_batch_sql = insert_sql(batch_rows, on_duplicate)
+    batch, pending = [], 0
+    cursor = conn.cursor()
+
+    def flush():
+        nonlocal batch, pending
+        if not batch:
+            return
+        sql = full_batch_sql if len(batch) == batch_rows else insert_sql(len(batch), on_duplicate)
+        if on_duplicate == "update":
+            keys = [row[0] for row in batch]
+            existing = count_existing(keys)
+        cursor.execute(sql, [value for row in batch for value in row])
+        result.batches += 1
+        affected = max(cursor.rowcount, 0)
+        if on_duplicate == "update":
+            # rowcount: 1 — новая строка, 2 — обновлённая, 0 — не изменилась
+            inserted = count_existing(keys) - existing
+            updated = min(len(batch) - inserted, max(0, affected - inserted) // 2)
+            result.inserted += inserted
+            result.updated += updated
+            result.unchanged += len(batch) - inserted - updated
+        else:
+            result.inserted += affected
+            result.duplicates += len(batch) - affected
+        pending += len(batch)
+        batch = []
+
+    def count_existing(keys):
+        cursor.execute(count_sql(len(keys)), keys)
+        return cursor.fetchall()[0][0]
+
+    def commit():
+        nonlocal pending
+        conn.commit()
+        result.commits += 1
+        result.committed += pending
+        pending = 0
+
+    try:
+        conn.start_transaction()
+        for line, record in records:
+            if isinstance(record, ValueError):
+                result.reject(line, str(record))
+                continue
+            try:
+                row = validate(record)
+            except ValueError as e:
+                result.reject(line, str(e))
+                continue
+            result.accepted += 1
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                flush()
+                if pending >= commit_rows:
+                    commit()
+                    conn.start_transaction()
+        flush()
+        commit()
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        e.ingest_result = result
+        raise
+    finally:
+        cursor.close()
+    return result
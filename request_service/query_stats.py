@@ -0,0 +1,151 @@
+"""
+Статистика выполненных запросов по отпечаткам (fingerprint).
+
+Отпечаток — текст запроса без литералов: строки, числа и плейсхолдеры %s
+заменяются на ?, списки IN (?, ?, ...) сворачиваются в IN (?+), комментарии
+вне строк убираются (кроме /*! ... */ — их MySQL выполняет), пробелы
+нормализуются, регистр приводится к нижнему. Запросы, отличающиеся только
+значениями, попадают в одну группу.
+
+На отпечаток хранится число выполнений и ошибок, суммарное и максимальное
+время, возвращённые строки, последние samples длительностей (для p95) и
+образец самого медленного выполнения — его использует index_advisor.py для EXPLAIN.
+"""
+import math
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+# Строки и исполняемые комментарии /*! */ сопоставляются раньше обычных комментариев и остаются
+_COMMENT_RE = re.compile(f"({_STRING_RE.pattern}|/\\*!.*?\\*/)|/\\*.*?\\*/|--[^\\n]*|#[^\\n]*", re.DOTALL)
+_NUMBER_RE = re.compile(r"(?<![\w.`!])[-+]?\d+(?:\.\d+)?(?:e[-+]?\d+)?(?![\w.`])", re.IGNORECASE)
+_PLACEHOLDER_RE = re.compile(r"%s")
+_IN_LIST_RE = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_RE = re.compile(r"\bvalues\s*\(.*\)", re.IGNORECASE | re.DOTALL)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def strip_comments(query):
+    """Запрос без комментариев вне строковых литералов; /*! ... */ сохраняются."""
+    return _COMMENT_RE.sub(lambda m: m.group(1) or " ", query)
+
+
+def fingerprint(query):
+    """Нормализованный текст запроса без значений."""
+    text = strip_comments(query)
+    text = _STRING_RE.sub("?", text)
+    text = _PLACEHOLDER_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("in (?+)", text)
+    # Многострочный INSERT ... VALUES (...), (...) — один отпечаток при любом числе строк
+    text = _VALUES_RE.sub("values (?+)", text)
+    text = _SPACE_RE.sub(" ", text).strip().rstrip(";").strip()
+    return text.lower()
+
+
+def percentile(values, p):
+    """p-й перцентиль (0..100) методом ближайшего ранга; None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class FingerprintStats:
+    __slots__ = ("fingerprint", "count", "errors", "total_ms", "max_ms", "rows",
+                 "samples", "first_seen", "last_seen", "slowest_query", "slowest_params")
+
+    def __init__(self, fp, samples):
+        self.fingerprint = fp
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=samples)
+        self.first_seen = self.last_seen = time.time()
+        self.slowest_query = None
+        self.slowest_params = None
+
+    def snapshot(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "p95_ms": percentile(self.samples, 95),
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "avg_rows": round(self.rows / self.count, 1) if self.count else None,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "sample": {"query": self.slowest_query, "params": self.slowest_params},
+        }
+
+
+class QueryStats:
+    """
+    Потокобезопасный реестр статистики. Хранит не больше max_fingerprints
+    отпечатков: при переполнении вытесняется тот, что дольше всех не выполнялся.
+    """
+
+    ORDERS = ("total_ms", "p95_ms", "avg_ms", "max_ms", "count", "rows")
+
+    def __init__(self, max_fingerprints=1000, samples=256):
+        self.max_fingerprints = max_fingerprints
+        self.samples = samples
+        self._stats = OrderedDict()
+        self._fingerprints = {}     # кэш query -> fingerprint для повторяющихся шаблонов
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _fingerprint(self, query):
+        fp = self._fingerprints.get(query)
+        if fp is None:
+            fp = fingerprint(query)
+            if len(self._fingerprints) >= self.max_fingerprints * 4:
+                self._fingerprints.clear()
+            self._fingerprints[query] = fp
+        return fp
+
+    def record(self, query, elapsed_ms, rows=0, params=None, error=False):
+        fp = self._fingerprint(query)
+        with self._lock:
+            stats = self._stats.get(fp)
+            if stats is None:
+                stats = self._stats[fp] = FingerprintStats(fp, self.samples)
+                if len(self._stats) > self.max_fingerprints:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(fp)
+            stats.count += 1
+            stats.errors += bool(error)
+            stats.total_ms += elapsed_ms
+            stats.rows += rows or 0
+            stats.samples.append(round(elapsed_ms, 3))
+            stats.last_seen = time.time()
+            if elapsed_ms >= stats.max_ms:
+                stats.max_ms = elapsed_ms
+                stats.slowest_query = query
+                stats.slowest_params = list(params) if params is not None else None
+
+    def top(self, limit=10, order="total_ms"):
+        """Самые «дорогие» отпечатки по order (по умолчанию — суммарное время)."""
+        if order not in self.ORDERS:
+            raise ValueError(f"order must be one of {', '.join(self.ORDERS)}")
+        with self._lock:
+            snapshots = [s.snapshot() for s in self._stats.values()]
+        snapshots.sort(key=lambda s: s[order] or 0, reverse=True)
+        return snapshots[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.started_at = time.time()
+
+    def __len__(self):
+        return len(self._stats)
@@ -0,0 +1,176 @@
+"""
+Реплики чтения request_service.
+
+ReplicaSet держит пул соединений на каждую реплику и фоновую проверку здоровья:
+раз в check_interval секунд на реплике выполняется SHOW REPLICA STATUS и читается
+отставание (Seconds_Behind_Source). Для чтения выбирается здоровая реплика с
+наименьшим отставанием, не превышающим max_lag. Если подходящих реплик нет,
+вызывающий код идёт на primary. Первая проверка тоже идёт в фоновом потоке —
+до её завершения чтение идёт на primary, запрос не ждёт недоступную реплику.
+
+Реплики задаются DB_REPLICA_HOSTS="host1:3306,host2:3306"; пользователь, пароль
+и база те же, что у primary.
+"""
+import logging
+import random
+import threading
+import time
+
+from common import db
+from common.db import Error
+
+from common.db_pool import ConnectionPool
+
+logger = logging.getLogger("request_service.replicas")
+
+
+def parse_hosts(value):
+    """"h1:3306,h2" -> [("h1", "3306"), ("h2", None)]"""
+    hosts = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        hosts.append((host, port or None))
+    return hosts
+
+
+class Replica:
+    def __init__(self, name, config, pool_size):
+        self.name = name
+        self.config = config
+        self.pool = ConnectionPool(name, config, pool_size)
+        self.healthy = False
+        self.lag = None
+        self.last_error = None
+        self.checked_at = 0.0
+
+    def snapshot(self):
+        return {
+            "host": f"{self.config['host']}:{self.config.get('port') or 3306}",
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "last_error": self.last_error,
+            "checked_ago_seconds": round(time.monotonic() - self.checked_at, 1) if self.checked_at else None,
+        }
+
+
+class ReplicaSet:
+    """
+    Набор реплик с проверкой здоровья и выбором по отставанию.
+
+    standalone_ok=True считает здоровым сервер без настроенной репликации
+    (пустой SHOW REPLICA STATUS) с нулевым отставанием — так маршрутизацию можно
+    проверить на двух независимых локальных MySQL.
+    """
+
+    def __init__(self, base_config, hosts, pool_size, max_lag=5.0, check_interval=5.0,
+                 standalone_ok=False):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.standalone_ok = standalone_ok
+        self.replicas = [
+            Replica(f"replica_{i}", dict(base_config, host=host, port=port or base_config.get("port")),
+                    pool_size)
+            for i, (host, port) in enumerate(hosts)
+        ]
+        self._thread = None
+        self._lock = threading.Lock()
+        self._checked = threading.Event()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    # ----- проверка здоровья -------------------------------------------------
+
+    def _replication_lag(self, replica):
+        conn = db.connect(**replica.config, connection_timeout=2)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Error:
+                # MySQL < 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        if status is None:
+            if self.standalone_ok:
+                return 0
+            raise RuntimeError("replication is not configured")
+        lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        if lag is None:
+            # NULL — поток репликации остановлен
+            raise RuntimeError("replication is stopped")
+        return int(lag)
+
+    def check(self):
+        """
+        Одна проверка всех реплик (вызывается фоновым потоком). Любая ошибка проверки
+        (не только ошибка БД: неожиданный ответ SHOW REPLICA STATUS и т.п.) исключает
+        реплику из чтения до следующей успешной проверки.
+        """
+        for replica in self.replicas:
+            try:
+                replica.lag = self._replication_lag(replica)
+                replica.last_error = None
+                if not replica.healthy:
+                    logger.info("Реплика %s доступна, отставание %s с", replica.name, replica.lag)
+                replica.healthy = True
+            except Exception as e:
+                if not isinstance(e, Error + (RuntimeError,)):
+                    logger.exception("Ошибка проверки реплики %s", replica.name)
+                elif replica.healthy:
+                    logger.warning("Реплика %s исключена из чтения: %s", replica.name, e)
+                replica.healthy = False
+                replica.lag = None
+                replica.last_error = str(e)
+            replica.checked_at = time.monotonic()
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                # Поток не должен завершиться: иначе реплики навсегда сохранят последний healthy
+                logger.exception("Ошибка проверки реплик")
+                for replica in self.replicas:
+                    replica.healthy = False
+            finally:
+                self._checked.set()
+            time.sleep(self.check_interval)
+
+    def start(self):
+        """Запускает фоновую проверку (первая — сразу); не ждёт её завершения."""
+        with self._lock:
+            if self._thread is not None or not self.replicas:
+                return
+            self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+            self._thread.start()
+
+    def wait_checked(self, timeout=None):
+        """Ждёт первой проверки не дольше timeout секунд; True — проверка завершена."""
+        return self._checked.wait(timeout)
+
+    # ----- выбор реплики -----------------------------------------------------
+
+    def choose(self):
+        """
+        Здоровая реплика с минимальным отставанием (среди равных — случайная) или None.
+        None и до завершения первой проверки: реплики ещё не проверены.
+        """
+        if self._thread is None:
+            self.start()
+        if not self._checked.is_set():
+            return None
+        candidates = [r for r in self.replicas if r.healthy and r.lag is not None and r.lag <= self.max_lag]
+        if not candidates:
+            return None
+        best_lag = min(r.lag for r in candidates)
+        return random.choice([r for r in candidates if r.lag == best_lag])
+
+    def snapshot(self):
+        return {r.name: r.snapshot() for r in self.replicas}
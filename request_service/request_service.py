@@ -1,12 +1,53 @@
-from flask import Flask, request, jsonify
-import mysql.connector
-from mysql.connector import Error
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
+import collections
+import functools
+import gzip
+import logging
 import os
 import re
+import sys
+import threading
+import time
+
+# Общие модули сервисов — пакет common/ в корне репозитория (в образе — /app/common)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+from common import codec, deadline, json_provider, tracing  # noqa: E402
+from common.cache_bus import CoherentCache, make_bus  # noqa: E402
+from common.db import Error, is_deadlock, is_timeout, limit_statement_time, mark_session_changed  # noqa: E402
+from common.db_pool import ConnectionPool, statement_cache  # noqa: E402
+from common.health import Health  # noqa: E402
+from common.log_config import setup_logging  # noqa: E402
+from common.profiler import Profiler  # noqa: E402
+from aggregates import TRAIN_DATA_OVERVIEW, AggregateManager  # noqa: E402
+from audit_log import QUERY, RETURNED, QueryTexts, log_row, write_rows  # noqa: E402
+from dataset import (BUCKETS, CONTENT_TYPES as DATASET_CONTENT_TYPES, FORMATS as DATASET_FORMATS,  # noqa: E402
+                     DatasetError, Position, bucket_bounds, encode_batch, encode_trailer, fingerprint,
+                     iter_batches, numpy_available, page_query, resolve_columns)
+from exports import (CONTENT_TYPES, EXTENSIONS, ExportJob, ExportLimitError, ExportManager,  # noqa: E402
+                     file_range, parquet_available, write_csv_gz, write_parquet)
+from ingest import FORMATS as INGEST_FORMATS, ON_DUPLICATE, IngestError, ingest, policy_statements  # noqa: E402
+from query_stats import QueryStats  # noqa: E402
+from replicas import ReplicaSet, parse_hosts  # noqa: E402
+from transactions import TransactionError, TransactionManager, changes_session, control_statement  # noqa: E402
 
 load_dotenv()
 
+logger = setup_logging("request_service")
+tracer = tracing.Tracer("request_service")
+
+# Максимальное число запросов в одном /execute_sql_batch
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 100))
+
+# Размер пула соединений, LRU prepared statements на соединение
+# и LRU решений ролевой политики по (role, шаблон запроса)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+PREPARED_CACHE_SIZE = int(os.getenv("PREPARED_CACHE_SIZE", 64))
+POLICY_CACHE_SIZE = int(os.getenv("POLICY_CACHE_SIZE", 1024))
+
 DB_CONFIG = {
     "host": os.getenv("DB_HOST"),
     "port": os.getenv("DB_PORT"),
@@ -15,54 +56,355 @@ DB_CONFIG = {
     "database": "TrainSafe"
 }
 
+DB_POOL = ConnectionPool("request_service", DB_CONFIG, DB_POOL_SIZE)
+
+# Реплики для read-only SELECT: DB_REPLICA_HOSTS="host1:3306,host2:3306" (пусто — всё на primary).
+# Реплика с отставанием больше DB_REPLICA_MAX_LAG секунд в чтение не берётся.
+REPLICAS = ReplicaSet(
+    DB_CONFIG,
+    parse_hosts(os.getenv("DB_REPLICA_HOSTS")),
+    pool_size=int(os.getenv("DB_REPLICA_POOL_SIZE", DB_POOL_SIZE)),
+    max_lag=float(os.getenv("DB_REPLICA_MAX_LAG", 5)),
+    check_interval=float(os.getenv("DB_REPLICA_CHECK_INTERVAL", 5)),
+    standalone_ok=os.getenv("DB_REPLICA_STANDALONE_OK", "0") == "1",
+)
+# Сколько секунд прогрев ждёт первой проверки реплик (чтение до неё идёт на primary)
+REPLICA_WARM_UP_WAIT = float(os.getenv("DB_REPLICA_WARM_UP_WAIT", 10))
+
+# Асинхронные выгрузки: каталог файлов, потоки, лимит активных заданий на пользователя,
+# время хранения готовых файлов (сек) и размер порции fetchmany
+EXPORTS = ExportManager(
+    os.getenv("EXPORT_DIR", "exports"),
+    workers=int(os.getenv("EXPORT_WORKERS", 2)),
+    per_user_limit=int(os.getenv("EXPORT_PER_USER_LIMIT", 2)),
+    ttl=int(os.getenv("EXPORT_TTL", 3600)),
+)
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", 10000))
+
+# Материализованные агрегаты над train_data (AGG_ENABLED=0 — выключить): полный пересчёт
+# раз в AGG_REFRESH_INTERVAL секунд, изменения больше AGG_INCREMENTAL_MAX_ROWS строк
+# применяются не инкрементально, а тоже полным пересчётом
+AGGREGATES = AggregateManager(
+    [TRAIN_DATA_OVERVIEW] if os.getenv("AGG_ENABLED", "1") == "1" else [],
+    lambda: get_db_connection(),
+    refresh_interval=int(os.getenv("AGG_REFRESH_INTERVAL", 300)),
+    incremental_max_rows=int(os.getenv("AGG_INCREMENTAL_MAX_ROWS", 10000)),
+    on_stale=lambda: CACHE_BUS.publish([AGGREGATES_STALE_TAG]),
+)
+
+# Шина инвалидаций кэшей между репликами (см. cache_bus.py и server.py):
+# CACHE_BUS=local (по умолчанию) | mysql (таблица cache_invalidations) | redis (REDIS_URL)
+CACHE_BUS = make_bus(
+    os.getenv("CACHE_BUS", "local"),
+    connect=lambda: get_db_connection(),
+    poll_interval=float(os.getenv("CACHE_BUS_POLL_INTERVAL", 1.0)),
+    redis_url=os.getenv("REDIS_URL"),
+)
+AGGREGATES_STALE_TAG = "aggregates:stale"
+
+# Кэш результатов SELECT роли viewer (RESULT_CACHE_TTL секунд, 0 — выключен).
+# Записи помечены таблицами запроса и сбрасываются на всех репликах при их изменении.
+RESULT_CACHE = CoherentCache(
+    "results", CACHE_BUS,
+    ttl=float(os.getenv("RESULT_CACHE_TTL", 0)),
+    max_size=int(os.getenv("RESULT_CACHE_SIZE", 1000)),
+    max_staleness=float(os.getenv("CACHE_MAX_STALENESS", 5.0)),
+)
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", 1000))
+
+# Потоковая загрузка строк в train_data (/ingest): строк в одном INSERT и строк между commit
+INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", 500))
+INGEST_COMMIT_ROWS = int(os.getenv("INGEST_COMMIT_ROWS", 5000))
+
+# Мини-батчи train_data (/dataset/batches): строк в странице ключевой пагинации (она же окно
+# перемешивания; от него зависит порядок строк и курсоры) и предельный размер батча
+DATASET_WINDOW_ROWS = int(os.getenv("DATASET_WINDOW_ROWS", 4096))
+DATASET_MAX_BATCH_SIZE = int(os.getenv("DATASET_MAX_BATCH_SIZE", 65536))
+
+# Транзакции из нескольких /execute (BEGIN ... COMMIT/ROLLBACK), закреплённые за сессией:
+# не больше TXN_MAX_OPEN одновременно (каждая держит соединение пула), откат после
+# TXN_IDLE_TIMEOUT секунд без запросов или TXN_MAX_DURATION секунд с начала
+TRANSACTIONS = TransactionManager(
+    max_open=int(os.getenv("TXN_MAX_OPEN", max(1, DB_POOL_SIZE // 2))),
+    idle_timeout=float(os.getenv("TXN_IDLE_TIMEOUT", 30)),
+    max_duration=float(os.getenv("TXN_MAX_DURATION", 300)),
+    on_reaped=lambda txn, reason: log_action(
+        session_id=txn.session_id, user_id=txn.user_id, username=txn.username,
+        action="EXECUTE_SQL_TXN_TIMEOUT",
+        details=f"Transaction={txn.id} rolled back after {txn.statements} statement(s): {reason}",
+        ip_address=txn.ip_address,
+    ),
+)
+# Сколько секунд запрос ждёт, пока предыдущий запрос той же транзакции освободит соединение
+TXN_BUSY_TIMEOUT = float(os.getenv("TXN_BUSY_TIMEOUT", 5))
+
+# Статистика запросов по отпечаткам: сколько отпечатков хранить и сколько
+# последних длительностей на отпечаток использовать для p95
+QUERY_STATS = QueryStats(
+    max_fingerprints=int(os.getenv("QUERY_STATS_MAX_FINGERPRINTS", 1000)),
+    samples=int(os.getenv("QUERY_STATS_SAMPLES", 256)),
+)
+
+# Аудит запросов (см. audit_log.py): сколько query_id уже записанных текстов помнить,
+# чтобы не вставлять их в query_texts повторно
+AUDIT_QUERY_TEXTS = QueryTexts(max_size=int(os.getenv("AUDIT_QUERY_CACHE_SIZE", 10000)))
+
+# Счётчики маршрутизации: "primary.read", "replica_0.read", "primary.write", "replica.fallback"
+ROUTE_COUNTERS = collections.Counter()
+_route_counters_lock = threading.Lock()
+
 app = Flask(__name__)
+json_provider.init_app(app)
+tracing.init_app(app, tracer)
+deadline.init_app(app, codec.make_response)
+
+HEALTH = Health("request_service")
+HEALTH.init_app(app, codec.make_response)
+
+# Профилирование (/debug/profile и заголовок X-Profile, см. profiler.py): токен администратора
+# PROFILER_TOKEN (пусто — выключено), адреса, с которых оно доступно, и предел сэмплирования в секундах
+PROFILER = Profiler(
+    "request_service",
+    token=os.getenv("PROFILER_TOKEN"),
+    allowed=os.getenv("PROFILER_ALLOWED_IPS", "127.0.0.1,::1").split(","),
+    max_seconds=float(os.getenv("PROFILER_MAX_SECONDS", 30)),
+)
+PROFILER.init_app(app, codec.make_response)
+
+
+# =============================================================================
+# ГОТОВНОСТЬ И ПРОГРЕВ (/healthz, /readyz)
+# =============================================================================
+
+@HEALTH.warm_up_step("db_pool")
+def _warm_db_pool():
+    return DB_POOL.warm_up()
+
+
+@HEALTH.warm_up_step("replicas")
+def _warm_replicas():
+    # Первая проверка здоровья идёт в фоновом потоке; прогрев ждёт её (запросы — нет),
+    # затем прогреваются пулы здоровых реплик
+    REPLICAS.start()
+    REPLICAS.wait_checked(REPLICA_WARM_UP_WAIT)
+    warmed = []
+    for replica in REPLICAS.replicas:
+        if replica.healthy:
+            replica.pool.warm_up()
+            warmed.append(replica.name)
+    return {"configured": len(REPLICAS.replicas), "warmed": warmed}
+
+
+@HEALTH.warm_up_step("background")
+def _warm_background():
+    CACHE_BUS.start()
+    AGGREGATES.start()
+
+
+@HEALTH.check("db")
+def _check_db():
+    return DB_POOL.ping()
+
+
+@HEALTH.check("replicas", critical=False)
+def _check_replicas():
+    # Без реплик чтение идёт на primary — сервис остаётся готовым
+    healthy = sum(r.healthy for r in REPLICAS.replicas)
+    if REPLICAS and not healthy:
+        raise RuntimeError("no healthy replicas, reads go to primary")
+    return {"healthy": healthy, "configured": len(REPLICAS.replicas)}
 
 
 # =============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # =============================================================================
 
+@tracer.traced("db.connect")
 def get_db_connection():
-    """Подключение к базе данных."""
+    """Соединение из пула (close() возвращает его в пул)."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = DB_POOL.get_connection()
         if conn.is_connected():
             return conn
     except Error as e:
-        print(f"Ошибка подключения к базе данных: {e}")
+        logger.error("Ошибка подключения к базе данных: %s", e)
     return None
 
 
-def log_action(session_id, user_id, username, action, details, ip_address):
+def get_read_connection():
+    """
+    Соединение для read-only запроса: подходящая реплика, если есть, иначе primary.
+    Возвращает (conn | None, route).
+    """
+    replica = REPLICAS.choose() if REPLICAS else None
+    if replica is not None:
+        try:
+            conn = replica.pool.get_connection()
+            if conn.is_connected():
+                return conn, replica.name
+        except Error as e:
+            # До следующей проверки здоровья реплика не используется
+            logger.warning("Реплика %s недоступна, читаем с primary: %s", replica.name, e)
+            replica.healthy = False
+        count_route("replica.fallback")
+    return get_db_connection(), "primary"
+
+
+def _on_cache_event(tag):
+    # Агрегат помечен устаревшим на другой реплике — здесь тоже не переписываем запросы
+    if tag == AGGREGATES_STALE_TAG:
+        AGGREGATES.mark_stale("stale on another replica", notify=False)
+
+
+CACHE_BUS.subscribe(_on_cache_event)
+
+
+def use_cache_bus(bus):
+    """Подменяет шину инвалидаций (совмещённый режим — общая LocalBus с gateway)."""
+    global CACHE_BUS
+    CACHE_BUS = bus
+    bus.subscribe(_on_cache_event)
+    RESULT_CACHE.bind(bus)
+
+
+_TABLE_REFERENCE_RE = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+_MODIFIED_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT\s+(?:IGNORE\s+)?(?:INTO\s+)?|REPLACE\s+(?:INTO\s+)?|UPDATE\s+(?:IGNORE\s+)?|"
+    r"DELETE\s+FROM\s+|TRUNCATE\s+(?:TABLE\s+)?|ALTER\s+TABLE\s+|DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?)`?(\w+)`?",
+    re.IGNORECASE,
+)
+
+
+def cache_tags(query):
+    """Теги записи кэша результатов — таблицы, из которых читает запрос."""
+    return tuple(f"table:{t.lower()}" for t in set(_TABLE_REFERENCE_RE.findall(query)))
+
+
+def invalidation_tags(query):
+    """
+    Что инвалидировать после изменяющего запроса: таблицу из INSERT/UPDATE/DELETE/DDL
+    или всё ("*"), если таблицу определить нельзя (многотабличный DML, CREATE ... и т. п.).
+    """
+    match = _MODIFIED_TABLE_RE.match(query)
+    if match is None or re.search(r"\bJOIN\b", query, re.IGNORECASE):
+        return ["*"]
+    return [f"table:{match.group(1).lower()}"]
+
+
+def count_route(key):
+    with _route_counters_lock:
+        ROUTE_COUNTERS[key] += 1
+
+
+def valid_params(params):
+    """params — None или список скалярных значений для плейсхолдеров %s."""
+    if params is None:
+        return True
+    return isinstance(params, (list, tuple)) and all(
+        not isinstance(p, (list, tuple, dict)) for p in params
+    )
+
+
+def execute_query(conn, cursor, query, params):
+    """
+    Выполняет запрос и возвращает (rows | None, columns | None, rowcount, время в мс).
+
+    Без params запрос уходит текстом на переданном курсоре. С params используется
+    серверный prepared statement из LRU-кэша соединения: повторные вызовы того же
+    шаблона не разбираются MySQL заново. Время и число строк попадают в QUERY_STATS.
+    Время запроса ограничено остатком дедлайна вызывающего: после дедлайна запрос
+    не начинается, а прерванный по пределу SELECT — DeadlineExceeded.
+    Если запрос меняет сессию (USE, SET...), соединение помечается: пул не отдаст
+    эту сессию следующему пользователю.
+    """
+    if changes_session(query):
+        mark_session_changed(conn)
+    statement = limit_statement_time(conn, query, deadline.cap(None))
+    started = time.perf_counter()
+    try:
+        if params is None:
+            cur = cursor
+            cur.execute(statement)
+        else:
+            cache = statement_cache(conn, PREPARED_CACHE_SIZE)
+            cur = cache.cursor_for(statement)
+            try:
+                cur.execute(statement, tuple(params))
+            except Error:
+                cache.discard(statement)
+                raise
+        if not cur.with_rows:
+            rows, columns = None, None
+        else:
+            rows = cur.fetchall()
+            columns = [desc[0] for desc in cur.description]
+    except Error as e:
+        QUERY_STATS.record(query, (time.perf_counter() - started) * 1000, params=params, error=True)
+        if is_timeout(e):
+            raise deadline.DeadlineExceeded("Deadline exceeded during query execution") from e
+        raise
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    QUERY_STATS.record(query, elapsed_ms,
+                       rows=len(rows) if rows is not None else max(cur.rowcount, 0), params=params)
+    return rows, columns, cur.rowcount, elapsed_ms
+
+
+@tracer.traced()
+def log_action(session_id, user_id, username, action, details, ip_address,
+               query=None, params=None, rows=None, duration_ms=None):
     """
     Записывает действие в таблицу logs (обновлённая структура).
 
     Предполагаем, что таблица logs имеет поля:
       log_id (PK, auto-increment),
-      session_id, user_id, username, action, details, ip_address, timestamp.
+      session_id, user_id, username, action, details, ip_address, timestamp,
+      query_id, query_params, row_count, duration_ms (см. audit_log.py).
 
     :param session_id: ID сессии (обязательный, FOREIGN KEY на sessions.session_id)
     :param user_id: ID пользователя
     :param username: имя пользователя (дублируется для удобства в logs)
     :param action: короткое описание действия (например, "EXECUTE_SQL_OK_SELECT")
-    :param details: более детальное описание, например сам SQL-запрос или ошибка
+    :param details: более детальное описание, например ошибка; для действия с запросом —
+                    шаблон с маркерами QUERY/ROWS или None (шаблон по умолчанию)
     :param ip_address: IP-адрес клиента
+    :param query: текст SQL-запроса (хранится один раз в query_texts)
+    :param params: параметры запроса
+    :param rows: число возвращённых или изменённых строк
+    :param duration_ms: время выполнения запроса
     """
+    row, text = log_row(session_id, user_id, username, action, details, ip_address,
+                        query, params, rows, duration_ms)
+    write_audit([row], [text])
+
+
+@tracer.traced()
+def log_actions(entries):
+    """
+    Записывает несколько действий в logs одной многострочной вставкой.
+
+    :param entries: список кортежей (session_id, user_id, username, action, details, ip_address)
+                    и, для действий с запросом, query, params, rows, duration_ms (как у log_action)
+    """
+    if not entries:
+        return
+    rows, texts = zip(*(log_row(*entry) for entry in entries))
+    write_audit(list(rows), texts)
+
+
+def write_audit(rows, texts):
+    """Вставляет строки logs и новые тексты запросов в одной транзакции."""
     conn_log = get_db_connection()
     if not conn_log:
-        print("[WARNING] Не удалось подключиться к БД для логирования.")
+        logger.warning("Не удалось подключиться к БД для логирования")
         return
 
+    cursor_log = conn_log.cursor()
     try:
-        cursor_log = conn_log.cursor()
-        insert_query = """
-            INSERT INTO logs (session_id, user_id, username, action, details, ip_address)
-            VALUES (%s, %s, %s, %s, %s, %s);
-        """
-        cursor_log.execute(insert_query, (session_id, user_id, username, action, details, ip_address))
+        inserted = write_rows(cursor_log, texts, rows, AUDIT_QUERY_TEXTS)
         conn_log.commit()
+        AUDIT_QUERY_TEXTS.remember(inserted)
     except Error as e:
-        print(f"[WARNING] Ошибка при вставке лога: {e}")
+        logger.warning("Ошибка при вставке логов: %s", e)
     finally:
         cursor_log.close()
         conn_log.close()
@@ -175,35 +517,74 @@ class ViewerHandler(Handler):
             return super().handle(role, query)
 
 
-@app.route('/execute_sql', methods=['POST'])
-def execute_sql():
+@functools.lru_cache(maxsize=POLICY_CACHE_SIZE)
+def check_policy(role, query):
+    """
+    Прогоняет запрос через цепочку Admin → Editor → Viewer.
+    Возвращает (is_allowed: bool, error_msg: str|None).
+
+    Решение зависит только от роли и текста (шаблона) запроса, поэтому кэшируется:
+    параметризованный шаблон проверяется один раз, а не на каждый набор параметров.
+    """
+    admin_handler = AdminHandler()
+    editor_handler = EditorHandler()
+    viewer_handler = ViewerHandler()
+    admin_handler.set_next(editor_handler).set_next(viewer_handler)
+    return admin_handler.handle(role, query)
+
+
+# Блокирующее чтение и SELECT ... INTO должны идти на primary
+_PRIMARY_ONLY_SELECT_RE = re.compile(r"\bFOR\s+UPDATE\b|\bFOR\s+SHARE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bINTO\b")
+
+
+@functools.lru_cache(maxsize=POLICY_CACHE_SIZE)
+def is_read_only(query):
+    """
+    Read-only — запрос, который цепочка пропускает для роли viewer (SELECT из train_data),
+    без блокирующего чтения. Такие запросы можно отправлять на реплику.
     """
-    Ожидаем JSON:
+    is_allowed, _ = check_policy("viewer", query)
+    return is_allowed and not _PRIMARY_ONLY_SELECT_RE.search(query.upper())
+
+
+@tracer.traced()
+def run_sql(data, ip_address):
+    """
+    Ожидаем payload:
     {
       "session_id": 42,             # новый обязательный параметр для логирования
       "user_id": 123,
       "username": "editor_user",
       "role": "admin|editor|viewer",
-      "query": "SELECT ..."
+      "query": "SELECT ... WHERE Loan_ID = %s",
+      "params": ["..."]             # необязательно: значения для плейсхолдеров %s
     }
     1) Прогоняем через цепочку Handler (Admin → Editor → Viewer).
-    2) При успехе — выполняем запрос в БД.
+    2) При успехе — выполняем запрос в БД: read-only SELECT на реплике (если настроены),
+       остальное — на primary. GROUP BY-запрос viewer-а, совпадающий с агрегатом,
+       читается из сводной таблицы, а в ответе есть "aggregate" с границей устаревания.
+       DML по train_data обновляет агрегаты (см. aggregates.py).
     3) Логируем результат.
+    Возвращает (body: dict, status_code). Вызывается маршрутом /execute_sql
+    и напрямую gateway-ем в совмещённом режиме (combined.py).
     """
-    data = request.json or {}
-
-    print(f"[DEBUG] Received payload in request_service: {data}")  # Отладка
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("execute_sql: user_id=%s session_id=%s role=%s query=%.200s",
+                     data.get("user_id"), data.get("session_id"), data.get("role"), data.get("query"))
 
     session_id = data.get("session_id")
     user_id = data.get("user_id")
     username = data.get("username") or "unknown"
     role = data.get("role")
     query = data.get("query")
-    ip_address = request.remote_addr
+    params = data.get("params")
 
     if not session_id or not user_id or not role or not query:
-        print(f"[DEBUG] Missing fields in request_service: {data}")  # Отладка
-        return jsonify({"message": "role, query, session_id, and user_id are required"}), 400
+        logger.debug("execute_sql: missing fields, got keys %s", sorted(data))
+        return {"message": "role, query, session_id, and user_id are required"}, 400
+    if not valid_params(params):
+        return {"message": "params must be a list of scalar values"}, 400
+    deadline.check("query execution")
 
     # Проверка обязательных полей
     if not role or not query or not session_id or not user_id:
@@ -215,15 +596,11 @@ def execute_sql():
             details="Missing role or query or session_id or user_id",
             ip_address=ip_address
         )
-        return jsonify({"message": "role, query, session_id, and user_id are required"}), 400
+        return {"message": "role, query, session_id, and user_id are required"}, 400
 
     # Цепочка: Admin → Editor → Viewer
-    admin_handler = AdminHandler()
-    editor_handler = EditorHandler()
-    viewer_handler = ViewerHandler()
-    admin_handler.set_next(editor_handler).set_next(viewer_handler)
-
-    is_allowed, error_msg = admin_handler.handle(role, query)
+    with tracer.span("policy_check", role=role):
+        is_allowed, error_msg = check_policy(role, query)
     if not is_allowed:
         # Логируем запрет
         log_action(
@@ -231,13 +608,50 @@ def execute_sql():
             user_id=user_id,
             username=username,
             action="EXECUTE_SQL_DENIED",
-            details=f"Role={role}, Query={query}, Error={error_msg}",
-            ip_address=ip_address
+            details=f"Role={role}, Query={QUERY}, Error={error_msg}",
+            ip_address=ip_address,
+            query=query,
+            params=params
         )
-        return jsonify({"message": error_msg}), 403
+        return {"message": error_msg}, 403
+
+    # BEGIN / COMMIT / ROLLBACK и запросы сессии с открытой транзакцией —
+    # на закреплённом за ней соединении
+    try:
+        txn = TRANSACTIONS.get(user_id, session_id, data.get("transaction_id"))
+    except TransactionError as e:
+        return {"message": str(e)}, e.status
+    control = control_statement(query)
+    if txn is not None or control is not None:
+        return run_sql_in_transaction(txn, control, session_id, user_id, username, query, params, ip_address)
 
     # Если разрешено, выполняем запрос
-    conn = get_db_connection()
+    read_only = is_read_only(query)
+    cache_key = None
+    if role == "viewer" and read_only and RESULT_CACHE.enabled:
+        cache_key = (query, tuple(params) if params is not None else None)
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            log_action(
+                session_id=session_id,
+                user_id=user_id,
+                username=username,
+                action="EXECUTE_SQL_OK_SELECT",
+                details=f"{RETURNED} (cached)",
+                ip_address=ip_address,
+                query=query,
+                params=params,
+                rows=len(cached["result"])
+            )
+            return cached, 200
+
+    sql, aggregate = query, None
+    if role == "viewer" and read_only:
+        rewritten = AGGREGATES.rewrite(query)
+        if rewritten is not None:
+            sql, aggregate = rewritten
+            count_route(f"aggregate.{aggregate.name}")
+    conn, route = get_read_connection() if read_only else (get_db_connection(), "primary")
     if not conn:
         # Логируем ошибку подключения
         log_action(
@@ -248,17 +662,25 @@ def execute_sql():
             details="Failed to connect to DB",
             ip_address=ip_address
         )
-        return jsonify({"message": "Failed to connect to DB"}), 500
+        return {"message": "Failed to connect to DB"}, 500
+    count_route(f"{route}.{'read' if read_only else 'write'}")
 
     try:
         cursor = conn.cursor()
-        cursor.execute(query)
+        change = None
+        if not read_only and AGGREGATES.tracks(query):
+            # Строки «до», сам запрос и разница в агрегатах — одной транзакцией (см. aggregates.py)
+            conn.start_transaction()
+            change = AGGREGATES.capture(conn, query, params)
+        with tracer.span("db.query", prepared=params is not None, route=route) as span:
+            # Для SELECT rows — список строк, для DML/DDL — None
+            rows, columns, rowcount, elapsed_ms = execute_query(conn, cursor, sql, params)
+            if span is not None:
+                span.set_attribute("db.rows", len(rows) if rows is not None else rowcount)
 
-        # Если это SELECT, cursor.with_rows = True
-        if cursor.with_rows:
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
+        if rows is not None:
             result = [dict(zip(columns, row)) for row in rows]
+            source = f" (aggregate {aggregate.name})" if aggregate is not None else ""
 
             # Логируем успешный SELECT
             log_action(
@@ -266,13 +688,26 @@ def execute_sql():
                 user_id=user_id,
                 username=username,
                 action="EXECUTE_SQL_OK_SELECT",
-                details=f"{query} - returned {len(rows)} row(s)",
-                ip_address=ip_address
+                details=f"{RETURNED}{source}" if source else None,
+                ip_address=ip_address,
+                query=query,
+                params=params,
+                rows=len(rows),
+                duration_ms=elapsed_ms
             )
-            return jsonify({"result": result}), 200
+            body = {"result": result}
+            if aggregate is not None:
+                body["aggregate"] = aggregate.freshness(AGGREGATES.refresh_interval)
+            if cache_key is not None and len(rows) <= RESULT_CACHE_MAX_ROWS:
+                RESULT_CACHE.set(cache_key, body, tags=cache_tags(query))
+            return body, 200
         else:
             # INSERT, UPDATE, DELETE, CREATE TABLE и т. п.
+            AGGREGATES.finish(conn, change)
+            AGGREGATES.apply(conn, [change])
             conn.commit()
+            AGGREGATES.committed([change])
+            CACHE_BUS.publish(invalidation_tags(query), conn=conn)
 
             # Логируем успешное изменение (DML/DDL)
             log_action(
@@ -280,26 +715,818 @@ def execute_sql():
                 user_id=user_id,
                 username=username,
                 action="EXECUTE_SQL_OK_DML",
-                details=query,
-                ip_address=ip_address
+                details=QUERY,
+                ip_address=ip_address,
+                query=query,
+                params=params,
+                rows=rowcount,
+                duration_ms=elapsed_ms
             )
-            return jsonify({"message": "Query executed successfully"}), 200
+            return {"message": "Query executed successfully"}, 200
 
     except Error as e:
+        if conn.in_transaction:
+            conn.rollback()
         # Логируем ошибку при выполнении SQL
         log_action(
             session_id=session_id,
             user_id=user_id,
             username=username,
             action="EXECUTE_SQL_ERROR",
-            details=f"{query} - DB error: {e}",
-            ip_address=ip_address
+            details=f"{QUERY} - DB error: {e}",
+            ip_address=ip_address,
+            query=query,
+            params=params
         )
-        return jsonify({"message": f"Database error: {e}"}), 500
+        return {"message": f"Database error: {e}"}, 500
+    except deadline.DeadlineExceeded as e:
+        if conn.in_transaction:
+            conn.rollback()
+        log_action(
+            session_id=session_id,
+            user_id=user_id,
+            username=username,
+            action="EXECUTE_SQL_DEADLINE",
+            details=f"{QUERY} - {e}",
+            ip_address=ip_address,
+            query=query,
+            params=params
+        )
+        return {"message": str(e)}, 504
     finally:
         cursor.close()
         conn.close()
 
 
+@tracer.traced()
+def run_sql_in_transaction(txn, control, session_id, user_id, username, query, params, ip_address):
+    """
+    Запрос сессии в режиме транзакции (см. transactions.py); запрос уже прошёл цепочку Handler.
+    control — "begin" | "commit" | "rollback" для управляющих команд, None для обычного запроса.
+    Изменения train_data попадают в агрегаты, а инвалидации кэшей рассылаются только после COMMIT.
+    """
+    def audit(action, details, **statement):
+        log_action(session_id=session_id, user_id=user_id, username=username,
+                   action=action, details=details, ip_address=ip_address, **statement)
+
+    if control == "begin":
+        if txn is not None:
+            return {"message": "Transaction already open for this session", "transaction_id": txn.id}, 409
+        try:
+            txn = TRANSACTIONS.begin(user_id, session_id, username, get_db_connection, ip_address)
+        except TransactionError as e:
+            audit("EXECUTE_SQL_TXN_REJECTED", str(e))
+            return {"message": str(e)}, e.status
+        except Error as e:
+            audit("EXECUTE_SQL_ERROR", f"BEGIN - DB error: {e}")
+            return {"message": f"Database error: {e}"}, 500
+        count_route("primary.transaction")
+        audit("EXECUTE_SQL_TXN_BEGIN", f"Transaction={txn.id}")
+        return {
+            "message": "Transaction started",
+            "transaction_id": txn.id,
+            "idle_timeout_seconds": TRANSACTIONS.idle_timeout,
+        }, 200
+
+    if txn is None:
+        return {"message": "No open transaction for this session"}, 409
+    if not txn.lock.acquire(timeout=deadline.cap(TXN_BUSY_TIMEOUT)):
+        return {"message": "Transaction is busy with another request"}, 409
+    try:
+        # Пока ждали блокировку, транзакцию мог откатить reaper
+        if TRANSACTIONS.get(user_id, session_id) is not txn:
+            return {"message": "Transaction not found (rolled back after timeout)"}, 409
+        txn.touch()
+        conn = txn.conn
+
+        if control == "rollback":
+            try:
+                conn.rollback()
+            finally:
+                TRANSACTIONS.release(txn, committed=False)
+            audit("EXECUTE_SQL_TXN_ROLLBACK", f"Transaction={txn.id}, statements={txn.statements}")
+            return {"message": "Transaction rolled back", "transaction_id": txn.id}, 200
+
+        if control == "commit":
+            try:
+                AGGREGATES.apply(conn, txn.changes)
+                conn.commit()
+            except Error as e:
+                conn.rollback()
+                TRANSACTIONS.release(txn, committed=False)
+                audit("EXECUTE_SQL_ERROR", f"COMMIT Transaction={txn.id} - DB error: {e}")
+                return {"message": f"Database error: {e}", "transaction_id": txn.id}, 500
+            AGGREGATES.committed(txn.changes)
+            if txn.modified:
+                CACHE_BUS.publish(dict.fromkeys(txn.modified), conn=conn)
+            TRANSACTIONS.release(txn, committed=True)
+            audit("EXECUTE_SQL_TXN_COMMIT", f"Transaction={txn.id}, statements={txn.statements}")
+            return {"message": "Transaction committed", "transaction_id": txn.id,
+                    "statements": txn.statements}, 200
+
+        cursor = conn.cursor()
+        try:
+            change = AGGREGATES.capture(conn, query, params) if not is_read_only(query) else None
+            with tracer.span("db.query", prepared=params is not None, route="transaction"):
+                rows, columns, rowcount, elapsed_ms = execute_query(conn, cursor, query, params)
+            txn.statements += 1
+            if rows is not None:
+                audit("EXECUTE_SQL_OK_SELECT", f"{RETURNED} (transaction {txn.id})",
+                      query=query, params=params, rows=len(rows), duration_ms=elapsed_ms)
+                return {"result": [dict(zip(columns, row)) for row in rows], "transaction_id": txn.id}, 200
+            AGGREGATES.finish(conn, change)
+            txn.changes.append(change)
+            txn.modified.extend(invalidation_tags(query))
+            audit("EXECUTE_SQL_OK_DML", f"{QUERY} (transaction {txn.id})",
+                  query=query, params=params, rows=rowcount, duration_ms=elapsed_ms)
+            return {"message": "Query executed in transaction", "rowcount": rowcount,
+                    "transaction_id": txn.id}, 200
+        except Error as e:
+            audit("EXECUTE_SQL_ERROR", f"{QUERY} (transaction {txn.id}) - DB error: {e}",
+                  query=query, params=params)
+            body = {"message": f"Database error: {e}", "transaction_id": txn.id}
+            if is_deadlock(e):
+                # MySQL уже откатил всю транзакцию
+                TRANSACTIONS.release(txn, committed=False)
+                body["transaction"] = "rolled_back"
+            return body, 500
+        except deadline.DeadlineExceeded as e:
+            # Запрос не выполнился или прерванный SELECT ничего не изменил — транзакция остаётся открытой
+            audit("EXECUTE_SQL_DEADLINE", f"{QUERY} (transaction {txn.id}) - {e}", query=query, params=params)
+            return {"message": str(e), "transaction_id": txn.id}, 504
+        finally:
+            cursor.close()
+    finally:
+        txn.lock.release()
+
+
+# BEGIN/COMMIT/ROLLBACK в пакете: транзакцию пакета задаёт поле "transaction"
+BATCH_CONTROL_ERROR = 'Transaction control is not allowed in a batch, use "transaction": true'
+
+
+@tracer.traced()
+def run_sql_batch(data, ip_address):
+    """
+    Пакетное выполнение запросов за один вызов.
+    Ожидаем payload:
+    {
+      "session_id": 42,
+      "user_id": 123,
+      "username": "editor_user",
+      "role": "admin|editor|viewer",
+      "queries": ["SELECT ...", {"query": "UPDATE ... WHERE Loan_ID = %s", "params": ["..."]}],
+      "transaction": false          # true — все запросы в одной транзакции
+    }
+    1) Каждый запрос проверяется цепочкой Handler (Admin → Editor → Viewer);
+       BEGIN/COMMIT/ROLLBACK в пакете запрещены — транзакцию пакета задаёт "transaction".
+    2) Разрешённые запросы выполняются по порядку на одном соединении.
+       Пакет только из read-only SELECT без транзакции идёт на реплику, остальные — на primary.
+       Без транзакции каждый DML фиксируется сразу, ошибка одного запроса
+       не мешает остальным. В транзакции запрет любого запроса отклоняет
+       весь пакет, а первая ошибка откатывает его и пропускает оставшиеся.
+    3) Все записи аудита пишутся одной вставкой (log_actions).
+    Возвращает (body: dict, status_code); body["results"] — результат по каждому запросу.
+    """
+    session_id = data.get("session_id")
+    user_id = data.get("user_id")
+    username = data.get("username") or "unknown"
+    role = data.get("role")
+    queries = data.get("queries")
+    in_transaction = bool(data.get("transaction"))
+
+    if not session_id or not user_id or not role or not queries:
+        return {"message": "role, queries, session_id, and user_id are required"}, 400
+    if not isinstance(queries, list):
+        return {"message": "queries must be a list"}, 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return {"message": f"Too many queries in batch (max {BATCH_MAX_QUERIES})"}, 400
+    if TRANSACTIONS.get(user_id, session_id) is not None:
+        return {"message": "Finish the open transaction before sending a batch"}, 409
+    deadline.check("batch execution")
+
+    # Элемент пакета — строка запроса или {"query": ..., "params": [...]}
+    statements = []
+    for item in queries:
+        query, params = (item.get("query"), item.get("params")) if isinstance(item, dict) else (item, None)
+        if not isinstance(query, str) or not query.strip() or not valid_params(params):
+            return {"message": "each query must be a non-empty string or {query, params}"}, 400
+        statements.append((query, params))
+
+    audit = []
+
+    def audit_entry(action, details, query=None, params=None, rows=None, duration_ms=None):
+        audit.append((session_id, user_id, username, action, details, ip_address,
+                      query, params, rows, duration_ms))
+
+    with tracer.span("policy_check", role=role, queries=len(statements)):
+        decisions = [check_policy(role, query) for query, _ in statements]
+    # Иначе транзакция, открытая запросом пакета, осталась бы на соединении пула
+    decisions = [(False, BATCH_CONTROL_ERROR) if is_allowed and control_statement(query) else (is_allowed, error_msg)
+                 for (query, _), (is_allowed, error_msg) in zip(statements, decisions)]
+
+    results = []
+    for index, ((query, params), (is_allowed, error_msg)) in enumerate(zip(statements, decisions)):
+        if not is_allowed:
+            results.append({"index": index, "status": "denied", "message": error_msg})
+            audit_entry("EXECUTE_SQL_DENIED", f"Role={role}, Query={QUERY}, Error={error_msg}", query, params)
+
+    if in_transaction and results:
+        log_actions(audit)
+        return {"status": "denied", "results": results}, 403
+
+    read_only = not in_transaction and all(
+        is_read_only(query) for (query, _), (is_allowed, _) in zip(statements, decisions) if is_allowed
+    )
+    conn, route = get_read_connection() if read_only else (get_db_connection(), "primary")
+    if not conn:
+        audit_entry("EXECUTE_SQL_DB_CONN_FAIL", "Failed to connect to DB")
+        log_actions(audit)
+        return {"message": "Failed to connect to DB"}, 500
+    count_route(f"{route}.{'read' if read_only else 'write'}")
+
+    denied = {r["index"]: r for r in results}
+    results = []
+    changes = []        # изменения train_data в транзакции — в агрегаты после commit
+    modified = []       # теги инвалидации кэшей для зафиксированных изменений
+    failed = False
+    timed_out = False   # дедлайн истёк: остальные запросы пакета не выполняются
+    try:
+        cursor = conn.cursor()
+        if in_transaction:
+            conn.start_transaction()
+        for index, (query, params) in enumerate(statements):
+            if index in denied:
+                results.append(denied[index])
+                continue
+            if failed or timed_out:
+                results.append({"index": index, "status": "skipped"})
+                continue
+            try:
+                sql, aggregate = query, None
+                if role == "viewer" and not in_transaction and is_read_only(query):
+                    sql, aggregate = AGGREGATES.rewrite(query) or (query, None)
+                change = None
+                if not is_read_only(query) and AGGREGATES.tracks(query):
+                    if not in_transaction:
+                        conn.start_transaction()
+                    change = AGGREGATES.capture(conn, query, params)
+                with tracer.span("db.query", index=index, prepared=params is not None, route=route):
+                    rows, columns, rowcount, elapsed_ms = execute_query(conn, cursor, sql, params)
+                if rows is not None:
+                    item = {"index": index, "status": "ok",
+                            "result": [dict(zip(columns, row)) for row in rows]}
+                    source = ""
+                    if aggregate is not None:
+                        item["aggregate"] = aggregate.freshness(AGGREGATES.refresh_interval)
+                        source = f" (aggregate {aggregate.name})"
+                    results.append(item)
+                    audit_entry("EXECUTE_SQL_OK_SELECT", f"{RETURNED}{source}" if source else None,
+                                query, params, len(rows), elapsed_ms)
+                else:
+                    AGGREGATES.finish(conn, change)
+                    if not in_transaction:
+                        AGGREGATES.apply(conn, [change])
+                        conn.commit()
+                        AGGREGATES.committed([change])
+                    else:
+                        changes.append(change)
+                    modified.extend(invalidation_tags(query))
+                    results.append({"index": index, "status": "ok", "rowcount": rowcount})
+                    audit_entry("EXECUTE_SQL_OK_DML", QUERY, query, params, rowcount, elapsed_ms)
+            except Error as e:
+                results.append({"index": index, "status": "error", "message": f"Database error: {e}"})
+                audit_entry("EXECUTE_SQL_ERROR", f"{QUERY} - DB error: {e}", query, params)
+                if in_transaction:
+                    conn.rollback()
+                    failed = True
+                elif conn.in_transaction:
+                    conn.rollback()     # транзакция изменения с агрегатами
+            except deadline.DeadlineExceeded as e:
+                results.append({"index": index, "status": "error", "message": str(e)})
+                audit_entry("EXECUTE_SQL_DEADLINE", f"{QUERY} - {e}", query, params)
+                if in_transaction:
+                    conn.rollback()
+                    failed = True
+                else:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    timed_out = True
+
+        if in_transaction and not failed:
+            AGGREGATES.apply(conn, changes)
+            conn.commit()
+            AGGREGATES.committed(changes)
+        if modified and not failed:
+            CACHE_BUS.publish(dict.fromkeys(modified), conn=conn)
+    except Error as e:
+        if in_transaction:
+            conn.rollback()
+        audit_entry("EXECUTE_SQL_ERROR", f"Batch transaction error: {e}")
+        log_actions(audit)
+        return {"message": f"Database error: {e}"}, 500
+    finally:
+        cursor.close()
+        conn.close()
+
+    if failed:
+        # Изменения откатились — отмечаем это и в ответе, и в аудите
+        for r in results:
+            if r["status"] == "ok" and "rowcount" in r:
+                r["status"] = "rolled_back"
+        audit = [entry[:3] + ("EXECUTE_SQL_ROLLED_BACK",) + entry[4:]
+                 if entry[3] == "EXECUTE_SQL_OK_DML" else entry for entry in audit]
+    log_actions(audit)
+
+    if failed:
+        status = "rolled_back"
+    elif all(r["status"] == "ok" for r in results):
+        status = "ok"
+    else:
+        status = "partial"
+    return {"status": status, "results": results}, 200
+
+
+# =============================================================================
+# АСИНХРОННЫЕ ВЫГРУЗКИ
+# =============================================================================
+
+@tracer.traced()
+def submit_export(data, ip_address):
+    """
+    Ставит SELECT в очередь выгрузки в файл.
+    Ожидаем payload как у run_sql плюс "format": "csv" (gzip, по умолчанию) | "parquet".
+    Запрос проходит ту же цепочку Handler и пишется в аудит.
+    Возвращает ({"job_id", "status"}, 202).
+    """
+    session_id = data.get("session_id")
+    user_id = data.get("user_id")
+    username = data.get("username") or "unknown"
+    role = data.get("role")
+    query = data.get("query")
+    params = data.get("params")
+    fmt = data.get("format") or "csv"
+
+    if not session_id or not user_id or not role or not query:
+        return {"message": "role, query, session_id, and user_id are required"}, 400
+    if not valid_params(params):
+        return {"message": "params must be a list of scalar values"}, 400
+    if fmt not in CONTENT_TYPES:
+        return {"message": f"Unsupported format: {fmt}"}, 400
+    if fmt == "parquet" and not parquet_available():
+        return {"message": "Parquet export requires pyarrow"}, 400
+    if not query.strip().upper().startswith("SELECT"):
+        return {"message": "Only SELECT queries can be exported"}, 400
+
+    with tracer.span("policy_check", role=role):
+        is_allowed, error_msg = check_policy(role, query)
+    if not is_allowed:
+        log_action(
+            session_id=session_id,
+            user_id=user_id,
+            username=username,
+            action="EXPORT_DENIED",
+            details=f"Role={role}, Query={QUERY}, Error={error_msg}",
+            ip_address=ip_address,
+            query=query,
+            params=params
+        )
+        return {"message": error_msg}, 403
+
+    job = ExportJob(str(user_id), username, session_id, role, query, params, fmt, ip_address)
+    try:
+        EXPORTS.submit(job, run_export)
+    except ExportLimitError as e:
+        return {"message": str(e)}, 429
+
+    log_action(
+        session_id=session_id,
+        user_id=user_id,
+        username=username,
+        action="EXPORT_SUBMITTED",
+        details=f"Job={job.id}, Format={fmt}, Query={QUERY}",
+        ip_address=ip_address,
+        query=query,
+        params=params
+    )
+    return {"job_id": job.id, "status": job.status}, 202
+
+
+def run_export(job, path):
+    """
+    Выполняется в потоке ExportManager: читает результат порциями (небуферизованный
+    курсор) и пишет файл. Read-only запросы идут на реплику, если она есть.
+    """
+    read_only = is_read_only(job.query)
+    conn, route = get_read_connection() if read_only else (get_db_connection(), "primary")
+    if not conn:
+        raise RuntimeError("Failed to connect to DB")
+    count_route(f"{route}.export")
+
+    audit = dict(session_id=job.session_id, user_id=job.user_id, username=job.username,
+                 ip_address=job.ip_address)
+    if changes_session(job.query):
+        mark_session_changed(conn)
+    cursor = conn.cursor()
+    try:
+        with tracer.span("export.write", format=job.format, route=route):
+            cursor.execute(job.query, tuple(job.params) if job.params is not None else ())
+            writer = write_parquet if job.format == "parquet" else write_csv_gz
+            rows = writer(cursor, path, EXPORT_FETCH_SIZE)
+    except Exception as e:
+        # Недочитанный результат нельзя оставлять на соединении, которое вернётся в пул
+        try:
+            conn.consume_results()
+        except Error:
+            pass
+        log_action(action="EXPORT_ERROR", details=f"Job={job.id} - {e}", **audit)
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    log_action(action="EXPORT_OK", details=f"Job={job.id} - exported {rows} row(s)", **audit)
+    return rows
+
+
+def _user_export(job_id, user_id):
+    """Задание выгрузки, если оно принадлежит user_id, иначе None."""
+    job = EXPORTS.get(job_id)
+    if job is None or user_id is None or job.user_id != str(user_id):
+        return None
+    return job
+
+
+def export_status(job_id, user_id):
+    """Статус задания: queued | running | done | failed, число строк и размер файла."""
+    job = _user_export(job_id, user_id)
+    if job is None:
+        return {"message": "Export not found"}, 404
+    return job.snapshot(), 200
+
+
+def export_download(job_id, user_id, range_header=None):
+    """
+    Готовый файл выгрузки: (chunks, status, headers) с поддержкой Range
+    или (body: dict, status_code) при ошибке.
+    """
+    job = _user_export(job_id, user_id)
+    if job is None:
+        return {"message": "Export not found"}, 404
+    if job.status != "done":
+        return {"message": "Export is not ready", "status": job.status}, 409
+    chunks, status, headers = file_range(job.path, range_header, CONTENT_TYPES[job.format],
+                                         f"export-{job.id}{EXTENSIONS[job.format]}")
+    return chunks if chunks is not None else iter(()), status, headers
+
+
+# =============================================================================
+# ЗАГРУЗКА СТРОК В train_data
+# =============================================================================
+
+@tracer.traced()
+def run_ingest(stream, params, ip_address, content_encoding=None):
+    """
+    Потоковая загрузка CSV/NDJSON в train_data (см. ingest.py).
+    params (строка запроса): session_id, user_id, username, role,
+      format — csv | ndjson, on_duplicate — skip (по умолчанию) | update,
+      commit_rows — строк между commit (по умолчанию INGEST_COMMIT_ROWS).
+    Ролевая политика проверяется один раз — на INSERT в train_data, аудит — одна запись на загрузку.
+    Возвращает (body: dict, status_code); body — сводка принятых и отклонённых строк.
+    """
+    session_id = params.get("session_id")
+    user_id = params.get("user_id")
+    username = params.get("username") or "unknown"
+    role = params.get("role")
+    fmt = (params.get("format") or "csv").lower()
+    on_duplicate = params.get("on_duplicate") or "skip"
+
+    if not session_id or not user_id or not role:
+        return {"message": "role, session_id, and user_id are required"}, 400
+    if fmt not in INGEST_FORMATS:
+        return {"message": f"Unsupported format: {fmt}"}, 400
+    if on_duplicate not in ON_DUPLICATE:
+        return {"message": f"on_duplicate must be one of: {', '.join(ON_DUPLICATE)}"}, 400
+    try:
+        commit_rows = int(params.get("commit_rows") or INGEST_COMMIT_ROWS)
+    except ValueError:
+        return {"message": "commit_rows must be an integer"}, 400
+    if content_encoding == "gzip":
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    elif content_encoding not in (None, "", "identity"):
+        return {"message": f"Unsupported Content-Encoding: {content_encoding}"}, 415
+
+    def audit(action, details):
+        log_action(session_id=session_id, user_id=user_id, username=username,
+                   action=action, details=details, ip_address=ip_address)
+
+    # Цепочка (EditorHandler и др.) проверяет загрузку один раз, а не каждую строку
+    with tracer.span("policy_check", role=role):
+        is_allowed, error_msg = True, None
+        for statement in policy_statements(on_duplicate):
+            is_allowed, error_msg = check_policy(role, statement)
+            if not is_allowed:
+                break
+    if not is_allowed:
+        audit("INGEST_DENIED", f"Role={role}, Format={fmt}, Error={error_msg}")
+        return {"message": error_msg}, 403
+
+    conn = get_db_connection()
+    if not conn:
+        audit("INGEST_DB_CONN_FAIL", "Failed to connect to DB")
+        return {"message": "Failed to connect to DB"}, 500
+    count_route("primary.ingest")
+
+    try:
+        with tracer.span("db.ingest", format=fmt) as span:
+            result = ingest(stream, fmt, conn, batch_rows=INGEST_BATCH_ROWS, commit_rows=commit_rows,
+                            on_duplicate=on_duplicate)
+            if span is not None:
+                span.set_attribute("db.rows", result.accepted)
+    except IngestError as e:
+        audit("INGEST_ERROR", f"Format={fmt} - {e}")
+        return {"message": str(e)}, 400
+    except Error + (EOFError, OSError) as e:
+        # Зафиксированные до ошибки порции остаются в таблице — сообщаем, сколько их
+        summary = e.ingest_result.summary() if hasattr(e, "ingest_result") else {}
+        if summary.get("committed"):
+            _after_ingest()
+        audit("INGEST_ERROR", f"Format={fmt} - committed {summary.get('committed', 0)} row(s) - error: {e}")
+        return dict(summary, status="failed", message=f"Ingest failed: {e}"), 500
+    finally:
+        conn.close()
+
+    if result.committed:
+        _after_ingest()
+    summary = result.summary()
+    audit("INGEST_OK",
+          f"Format={fmt}, on_duplicate={on_duplicate} - accepted {result.accepted}, "
+          f"rejected {result.rejected}, inserted {result.inserted}, duplicates {result.duplicates}, "
+          f"updated {result.updated} in {result.batches} batch(es)")
+    summary["status"] = "ok" if not result.rejected else "partial"
+    return summary, 200
+
+
+def _after_ingest():
+    """После загрузки: агрегаты — полным пересчётом, кэши train_data — инвалидация на всех репликах."""
+    AGGREGATES.mark_stale("bulk ingest")
+    CACHE_BUS.publish(["table:train_data"])
+
+
+# =============================================================================
+# МИНИ-БАТЧИ ДЛЯ ОБУЧЕНИЯ
+# =============================================================================
+
+def _int_param(params, name, default, minimum=0):
+    value = params.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise DatasetError(f"{name} must be an integer")
+    if value < minimum:
+        raise DatasetError(f"{name} must be at least {minimum}")
+    return value
+
+
+@tracer.traced()
+def dataset_batches(params, ip_address):
+    """
+    Поток мини-батчей train_data (см. dataset.py).
+    params (строка запроса): session_id, user_id, username, role,
+      columns — через запятую (по умолчанию все), batch_size (256), seed (0), epoch (0),
+      cursor — продолжение эпохи с позиции из предыдущего ответа (epoch берётся из него),
+      format — npy (по умолчанию) | ndjson, drop_last — 1, чтобы не отдавать неполный
+      последний батч, max_batches — сколько батчей отдать за этот запрос.
+    Ролевая политика проверяется один раз — на SELECT выбранных колонок из train_data.
+    Возвращает (chunks, 200, headers) или (body: dict, status_code) при ошибке.
+    """
+    session_id = params.get("session_id")
+    user_id = params.get("user_id")
+    username = params.get("username") or "unknown"
+    role = params.get("role")
+    fmt = (params.get("format") or "npy").lower()
+
+    if not session_id or not user_id or not role:
+        return {"message": "role, session_id, and user_id are required"}, 400
+    if fmt not in DATASET_FORMATS:
+        return {"message": f"Unsupported format: {fmt}"}, 400
+    if fmt == "npy" and not numpy_available():
+        return {"message": "npy format requires numpy"}, 400
+    try:
+        names = [n for n in (params.get("columns") or "").split(",") if n.strip()]
+        columns = resolve_columns(names)
+        batch_size = _int_param(params, "batch_size", 256, minimum=1)
+        if batch_size > DATASET_MAX_BATCH_SIZE:
+            raise DatasetError(f"batch_size must be at most {DATASET_MAX_BATCH_SIZE}")
+        seed = _int_param(params, "seed", 0)
+        max_batches = _int_param(params, "max_batches", 0)
+        drop_last = str(params.get("drop_last") or "").lower() in ("1", "true", "yes")
+        key = fingerprint(seed, DATASET_WINDOW_ROWS)
+        if params.get("cursor"):
+            position = Position.decode(params["cursor"], key)
+        else:
+            position = Position(_int_param(params, "epoch", 0))
+    except DatasetError as e:
+        return {"message": str(e)}, 400
+
+    def audit(action, details):
+        log_action(session_id=session_id, user_id=user_id, username=username,
+                   action=action, details=details, ip_address=ip_address)
+
+    query = page_query(columns)
+    with tracer.span("policy_check", role=role):
+        is_allowed, error_msg = check_policy(role, query)
+    if not is_allowed:
+        audit("DATASET_DENIED", f"Role={role}, Query={query}, Error={error_msg}")
+        return {"message": error_msg}, 403
+
+    description = (f"Columns={','.join(c.name for c in columns)}, seed={seed}, epoch={position.epoch}, "
+                   f"batch_size={batch_size}" + (", resumed" if params.get("cursor") else ""))
+
+    def fetch_page(conn, cursor, lo, hi, after, limit):
+        if after is not None:
+            sql, args = page_query(columns, ">", hi is not None), [after]
+        elif lo is not None:
+            sql, args = page_query(columns, ">=", hi is not None), [lo]
+        else:
+            sql, args = page_query(columns, None, hi is not None), []
+        if hi is not None:
+            args.append(hi)
+        rows, _, _, _ = execute_query(conn, cursor, sql, args + [limit])
+        return rows
+
+    def stream():
+        # Соединение берётся при первом чтении потока: если клиент ушёл раньше,
+        # не остаётся соединения, которое некому вернуть в пул
+        conn, route = get_read_connection()
+        if not conn:
+            audit("DATASET_DB_CONN_FAIL", "Failed to connect to DB")
+            yield encode_trailer(fmt, position.encode(key), False, "Failed to connect to DB")
+            return
+        count_route(f"{route}.dataset")
+        cursor = conn.cursor()
+        fetch = functools.partial(fetch_page, conn, cursor)
+        batches = rows = 0
+        last, error, finished = position, None, False
+        try:
+            for batch, last in iter_batches(fetch, seed, DATASET_WINDOW_ROWS, batch_size,
+                                            position, drop_last):
+                yield encode_batch(fmt, columns, batch, batches, last.encode(key))
+                batches += 1
+                rows += len(batch)
+                if max_batches and batches >= max_batches:
+                    break
+            else:
+                last = Position(position.epoch, BUCKETS)
+            finished = True
+        except Error as e:
+            error = e
+            yield encode_trailer(fmt, last.encode(key), False, f"Database error: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+            if error is not None:
+                audit("DATASET_ERROR", f"{description} - streamed {batches} batch(es), {rows} row(s) - "
+                                       f"DB error: {error}")
+            else:
+                audit("DATASET_OK", f"{description} - streamed {batches} batch(es), {rows} row(s)"
+                                    + ("" if finished else " - stopped by client"))
+        if finished:
+            yield encode_trailer(fmt, last.encode(key), last.end_of_epoch)
+
+    return stream(), 200, {"Content-Type": DATASET_CONTENT_TYPES[fmt]}
+
+
+@app.route('/execute_sql', methods=['POST'])
+def execute_sql():
+    """
+    Принимает JSON или MessagePack (см. run_sql) и выполняет запрос.
+    Ответ — в формате из заголовка Accept (по умолчанию JSON).
+    """
+    data = codec.request_payload() or {}
+    body, status = run_sql(data, request.remote_addr)
+    return codec.make_response(body, status)
+
+
+@app.route('/execute_sql_batch', methods=['POST'])
+def execute_sql_batch():
+    """
+    Принимает JSON или MessagePack (см. run_sql_batch) и выполняет пакет запросов.
+    """
+    data = codec.request_payload() or {}
+    body, status = run_sql_batch(data, request.remote_addr)
+    return codec.make_response(body, status)
+
+
+@app.route('/exports', methods=['POST'])
+def create_export():
+    """Принимает JSON или MessagePack (см. submit_export) и ставит выгрузку в очередь."""
+    data = codec.request_payload() or {}
+    body, status = submit_export(data, request.remote_addr)
+    return codec.make_response(body, status)
+
+
+@app.route('/exports/<job_id>', methods=['GET'])
+def get_export(job_id):
+    """Статус выгрузки. Владелец передаётся параметром ?user_id= (его проверяет gateway)."""
+    body, status = export_status(job_id, request.args.get("user_id"))
+    return codec.make_response(body, status)
+
+
+@app.route('/exports/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    """Файл выгрузки; поддерживается заголовок Range для докачки."""
+    result = export_download(job_id, request.args.get("user_id"), request.headers.get("Range"))
+    if len(result) == 2:
+        return codec.make_response(*result)
+    chunks, status, headers = result
+    return Response(chunks, status=status, headers=headers, direct_passthrough=True)
+
+
+@app.route('/ingest', methods=['POST'])
+def ingest_rows():
+    """
+    Потоковая загрузка строк в train_data: тело — CSV или NDJSON (можно gzip,
+    Content-Encoding: gzip), параметры — в строке запроса (см. run_ingest).
+    """
+    body, status = run_ingest(request.stream, request.args, request.remote_addr,
+                              request.headers.get("Content-Encoding"))
+    return codec.make_response(body, status)
+
+
+@app.route('/dataset/batches', methods=['GET'])
+def get_dataset_batches():
+    """
+    Поток мини-батчей train_data для обучения (см. dataset_batches);
+    параметры и сессия — в строке запроса (их передаёт gateway).
+    """
+    result = dataset_batches(request.args, request.remote_addr)
+    if len(result) == 2:
+        return codec.make_response(*result)
+    chunks, status, headers = result
+    return Response(chunks, status=status, headers=headers)
+
+
+@app.route('/aggregates', methods=['GET'])
+def aggregates_status():
+    """Состояние материализованных агрегатов: время пересчёта, счётчики обновлений и переписываний."""
+    return codec.make_response({"aggregates": AGGREGATES.snapshot()}, 200)
+
+
+@app.route('/query_stats', methods=['GET'])
+def query_stats():
+    """
+    Самые дорогие отпечатки запросов: ?limit=10&order=total_ms|p95_ms|avg_ms|max_ms|count|rows.
+    DELETE сбрасывает статистику.
+    """
+    try:
+        limit = int(request.args.get("limit", 10))
+        top = QUERY_STATS.top(limit, request.args.get("order", "total_ms"))
+    except ValueError as e:
+        return codec.make_response({"message": str(e)}, 400)
+    return codec.make_response({
+        "since": QUERY_STATS.started_at,
+        "fingerprints": len(QUERY_STATS),
+        "top": top,
+    }, 200)
+
+
+@app.route('/query_stats', methods=['DELETE'])
+def reset_query_stats():
+    QUERY_STATS.reset()
+    return codec.make_response({"message": "Query stats reset"}, 200)
+
+
+@app.route('/transactions', methods=['GET'])
+def transactions_status():
+    """Открытые транзакции сессий и счётчики BEGIN/COMMIT/ROLLBACK/откатов по таймауту."""
+    return codec.make_response(TRANSACTIONS.snapshot(), 200)
+
+
+@app.route('/caches', methods=['GET'])
+def caches():
+    """Состояние кэша результатов и шины инвалидаций."""
+    return codec.make_response({
+        "bus": CACHE_BUS.snapshot(),
+        "caches": [RESULT_CACHE.snapshot()],
+    }, 200)
+
+
+@app.route('/db_routes', methods=['GET'])
+def db_routes():
+    """Счётчики маршрутизации запросов (primary / реплики) и состояние реплик."""
+    with _route_counters_lock:
+        routes = dict(ROUTE_COUNTERS)
+    return codec.make_response({
+        "routes": routes,
+        "replicas": REPLICAS.snapshot(),
+        "max_lag_seconds": REPLICAS.max_lag,
+    }, 200)
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=6002, debug=True)
\ No newline at end of file
+    # FLASK_DEBUG=0 — без debug и reloader-а
+    app.debug = os.getenv("FLASK_DEBUG", "1") not in ("0", "false", "no")
+    HEALTH.start_on_run(app)
+    app.run(host="0.0.0.0", port=6002, debug=app.debug)
\ No newline at end of file
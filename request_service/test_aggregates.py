@@ -0,0 +1,177 @@
+"""Переписанные на сводную таблицу запросы дают тот же результат, что и запросы к train_data."""
+import pytest
+
+from common import db
+from aggregates import CREDIT_SCORE_BAND, AggregateManager, TRAIN_DATA_OVERVIEW
+
+ROWS = [
+    ("a1", "Approved", "Rent", "car", 700, 1000.50, 50000.0),
+    ("a2", "Approved", "Rent", "car", 701, 2000.25, 61000.5),
+    ("a3", "Approved", "Own", "home", 655, 1500.00, None),
+    ("r1", "Rejected", "Rent", "car", None, 300.10, 20000.0),
+    ("r2", "Rejected", "Mortgage", "debt", 590, None, 30500.0),
+    ("f1", "Fully Paid", "Own", "home", 810, 800.00, 90000.0),
+]
+
+QUERIES = [
+    "SELECT Loan_Status, COUNT(*) FROM train_data GROUP BY Loan_Status",
+    "SELECT Loan_Status, COUNT(Credit_Score) FROM train_data GROUP BY Loan_Status",
+    "SELECT Loan_Status, SUM(Credit_Score) FROM train_data GROUP BY Loan_Status",
+    "SELECT Loan_Status, AVG(Credit_Score) FROM train_data GROUP BY Loan_Status",
+    "SELECT Loan_Status, AVG(Current_Loan_Amount) AS amount FROM train_data GROUP BY Loan_Status",
+    "SELECT Home_Ownership, SUM(Annual_Income), AVG(Annual_Income) FROM train_data "
+    "WHERE Loan_Status = 'Approved' GROUP BY Home_Ownership",
+    f"SELECT {CREDIT_SCORE_BAND} AS band, COUNT(*), AVG(Credit_Score) FROM train_data GROUP BY band",
+    "SELECT Purpose, Loan_Status, AVG(Credit_Score) FROM train_data GROUP BY Purpose, Loan_Status",
+]
+
+
+@pytest.fixture
+def conn():
+    raw, connection_id = db._open_sqlite()
+    conn = db.SQLiteConnection(raw, connection_id)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS train_data, {TRAIN_DATA_OVERVIEW.name}")
+    cursor.execute(
+        "CREATE TABLE train_data (Loan_ID VARCHAR(36) PRIMARY KEY, Loan_Status VARCHAR(20), "
+        "Home_Ownership VARCHAR(20), Purpose VARCHAR(255), Credit_Score INT NULL, "
+        "Current_Loan_Amount DECIMAL(10,2), Annual_Income FLOAT, Monthly_Debt FLOAT, "
+        "Current_Credit_Balance DECIMAL(10,2), Years_of_Credit_History FLOAT)"
+    )
+    cursor.executemany(
+        "INSERT INTO train_data (Loan_ID, Loan_Status, Home_Ownership, Purpose, Credit_Score, "
+        "Current_Loan_Amount, Annual_Income) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        ROWS,
+    )
+    cursor.close()
+    TRAIN_DATA_OVERVIEW.full_refresh(conn)
+    yield conn
+    TRAIN_DATA_OVERVIEW.refreshed_at = TRAIN_DATA_OVERVIEW.dirty_at = None
+    conn.close()
+
+
+def run(conn, query):
+    cursor = conn.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def assert_same_result(conn, query):
+    rewritten = TRAIN_DATA_OVERVIEW.rewrite(query)
+    assert rewritten is not None, query
+    expected, actual = sorted(run(conn, query), key=repr), sorted(run(conn, rewritten), key=repr)
+    assert len(actual) == len(expected)
+    for got, want in zip(actual, expected):
+        assert [type(v) for v in got if v is not None] == [type(v) for v in want if v is not None]
+        assert got == pytest.approx(want), query
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_rewrite_matches_direct_query(conn, query):
+    assert_same_result(conn, query)
+
+
+def test_avg_of_integer_column_is_not_truncated(conn):
+    rewritten = TRAIN_DATA_OVERVIEW.rewrite(QUERIES[3])
+    assert dict(run(conn, rewritten))["Approved"] == pytest.approx((700 + 701 + 655) / 3)
+
+
+def apply_change(manager, conn, query, params):
+    """Как execute_sql: строки «до», запрос, строки «после» и разница — одной транзакцией."""
+    conn.start_transaction()
+    change = manager.capture(conn, query, params)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    cursor.close()
+    manager.finish(conn, change)
+    manager.apply(conn, [change])
+    conn.commit()
+    manager.committed([change])
+    return change
+
+
+@pytest.mark.parametrize("query, params", [
+    ("INSERT INTO train_data (Loan_ID, Loan_Status, Home_Ownership, Purpose, Credit_Score, "
+     "Current_Loan_Amount) VALUES (%s, 'Approved', 'Rent', 'car', %s, 10.5), ('n2', 'Other', 'Own', 'x', 500, 1)",
+     ["n1", 733]),
+    ("UPDATE train_data SET Credit_Score = %s, Loan_Status = 'Rejected' WHERE Loan_ID = %s", [802, "a1"]),
+    ("UPDATE train_data SET Annual_Income = NULL WHERE Home_Ownership = 'Rent'", None),
+    ("DELETE FROM train_data WHERE Loan_Status = %s", ["Approved"]),
+])
+def test_incremental_update_matches_direct_query(conn, query, params):
+    manager = AggregateManager([TRAIN_DATA_OVERVIEW], get_connection=lambda: None)
+    change = apply_change(manager, conn, query, params)
+    assert change is not None and not change.full_refresh
+    assert TRAIN_DATA_OVERVIEW.fresh
+    for query in QUERIES:
+        assert_same_result(conn, query)
+
+
+def test_repeated_changes_of_same_rows_are_counted_once(conn):
+    manager = AggregateManager([TRAIN_DATA_OVERVIEW], get_connection=lambda: None)
+    for score in (500, 820, 640):
+        apply_change(manager, conn, "UPDATE train_data SET Credit_Score = %s WHERE Loan_ID IN ('a1', 'a2')", [score])
+    apply_change(manager, conn, "DELETE FROM train_data WHERE Loan_ID = %s", ["a1"])
+    assert TRAIN_DATA_OVERVIEW.fresh
+    for query in QUERIES:
+        assert_same_result(conn, query)
+
+
+def test_capture_locks_rows_before_change(conn):
+    executed = []
+
+    class RecordingConnection:
+        def cursor(self):
+            cursor = conn.cursor()
+            execute = cursor.execute
+
+            def record(sql, params=None):
+                executed.append(sql)
+                return execute(sql, params)
+            cursor.execute = record
+            return cursor
+
+    manager = AggregateManager([TRAIN_DATA_OVERVIEW], get_connection=lambda: None)
+    manager.capture(RecordingConnection(), "UPDATE train_data SET Credit_Score = 1 WHERE Loan_Status = %s", ["Rejected"])
+    manager.capture(RecordingConnection(), "INSERT INTO train_data (Loan_ID, Loan_Status) VALUES ('n1', 'Approved')", None)
+    assert len(executed) == 2 and all(sql.endswith("FOR UPDATE") for sql in executed)
+
+
+def test_change_overlapping_full_refresh_marks_aggregate_stale(conn):
+    manager = AggregateManager([TRAIN_DATA_OVERVIEW], get_connection=lambda: None)
+    manager.start = lambda: None    # без фонового пересчёта
+    query, params = "UPDATE train_data SET Credit_Score = %s WHERE Loan_ID = %s", [802, "a1"]
+    conn.start_transaction()
+    change = manager.capture(conn, query, params)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    cursor.close()
+    manager.finish(conn, change)
+    conn.commit()
+    # Пересчёт начался после захвата: он уже учёл изменение, разница посчиталась бы дважды
+    TRAIN_DATA_OVERVIEW.full_refresh(conn)
+    manager.apply(conn, [change])
+    assert not TRAIN_DATA_OVERVIEW.fresh
+    for query in QUERIES:
+        assert_same_result(conn, query)
+
+
+def test_refresh_between_apply_and_commit_marks_aggregate_stale(conn):
+    manager = AggregateManager([TRAIN_DATA_OVERVIEW], get_connection=lambda: None)
+    manager.start = lambda: None
+    change = manager.capture(conn, "DELETE FROM train_data WHERE Loan_ID = %s", ["r1"])
+    TRAIN_DATA_OVERVIEW.refresh_generation += 1     # пересчёт, начатый до commit
+    manager.committed([change])
+    assert not TRAIN_DATA_OVERVIEW.fresh
+
+
+def test_capture_during_full_refresh_requests_full_refresh(conn):
+    manager = AggregateManager([TRAIN_DATA_OVERVIEW], get_connection=lambda: None)
+    TRAIN_DATA_OVERVIEW.refreshing = True
+    try:
+        change = manager.capture(conn, "DELETE FROM train_data WHERE Loan_ID = %s", ["r1"])
+    finally:
+        TRAIN_DATA_OVERVIEW.refreshing = False
+    assert change.full_refresh
@@ -0,0 +1,126 @@
+"""Аудит запросов: один отпечаток на запросы, отличающиеся значениями, и перевод старых записей."""
+import json
+
+import pytest
+
+from common import db
+from audit_log import QueryTexts, compact, log_row, query_id, write_rows
+from query_stats import fingerprint
+
+
+@pytest.fixture
+def conn():
+    raw, connection_id = db._open_sqlite()
+    conn = db.SQLiteConnection(raw, connection_id)
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS logs")
+    cursor.execute("DROP TABLE IF EXISTS query_texts")
+    cursor.execute(
+        "CREATE TABLE logs (log_id INTEGER PRIMARY KEY AUTOINCREMENT, session_id INT, user_id INT, "
+        "username TEXT, action TEXT, details TEXT, ip_address TEXT, query_id BIGINT, "
+        "query_params TEXT, row_count INT, duration_ms FLOAT)"
+    )
+    cursor.execute("CREATE TABLE query_texts (query_id BIGINT PRIMARY KEY, query_text TEXT)")
+    cursor.close()
+    yield conn
+    conn.close()
+
+
+def fetch(conn, query):
+    cursor = conn.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def test_repeated_and_parameterized_queries_share_query_id():
+    first, text = log_row(1, 2, "u", "EXECUTE_SQL_OK_SELECT", None, "127.0.0.1",
+                          query="SELECT * FROM train_data WHERE Loan_ID = %s", params=["a"], rows=1)
+    second, _ = log_row(1, 2, "u", "EXECUTE_SQL_OK_SELECT", None, "127.0.0.1",
+                        query="SELECT * FROM train_data WHERE Loan_ID = %s", params=["b"], rows=0)
+    assert first[6] == second[6] == text[0] == query_id("SELECT * FROM train_data WHERE Loan_ID = %s")
+    assert (first[7], second[7]) == ('["a"]', '["b"]')
+
+
+def test_different_text_gets_different_query_id():
+    assert query_id("SELECT a FROM t WHERE b = 1") != query_id("SELECT a FROM t WHERE b = 2")
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM train_data WHERE Purpose = 'a#b' OR Loan_ID IN (SELECT Loan_ID FROM train_data -- x\n)",
+    "SELECT Loan_ID /*!50000 , (SELECT password FROM users LIMIT 1) */ FROM train_data",
+    "select  *\nFROM train_data /* note */ WHERE Term = 'Short -- Term'",
+])
+def test_audit_keeps_query_text_as_executed(conn, query):
+    row, text = log_row(1, 2, "u", "EXECUTE_SQL_OK_SELECT", None, "127.0.0.1", query=query, rows=2)
+    cursor = conn.cursor()
+    write_rows(cursor, [text], [row], QueryTexts())
+    cursor.close()
+    assert fetch(conn, "SELECT q.query_text, l.row_count FROM logs l "
+                       "JOIN query_texts q ON q.query_id = l.query_id") == [(query, 2)]
+
+
+def test_fingerprint_strips_comments_only_outside_strings():
+    assert fingerprint("SELECT * FROM train_data WHERE Purpose = 'a#b' OR Loan_ID IN (SELECT x FROM t) # c") == \
+        "select * from train_data where purpose = ? or loan_id in (select x from t)"
+    assert fingerprint("SELECT a /* 9 */ FROM t WHERE b = '--x' AND c IN (1, 'x''y', %s) -- tail") == \
+        "select a from t where b = ? and c in (?+)"
+
+
+def test_fingerprint_keeps_executable_comments():
+    assert fingerprint("SELECT Loan_ID /*!50000 , (SELECT password FROM users LIMIT 1) */ FROM train_data") == \
+        "select loan_id /*!50000 , (select password from users limit ?) */ from train_data"
+
+
+def test_log_row_stores_query_and_params():
+    query = "DELETE FROM train_data WHERE Term = %s"
+    row, text = log_row(1, 2, "u", "EXECUTE_SQL_OK_DML", "{query}", "127.0.0.1",
+                        query=query, params=["Short Term"], rows=-1, duration_ms=1.23456)
+    assert text == (query_id(query), query)
+    assert row[6:] == (query_id(query), '["Short Term"]', None, 1.235)
+
+
+def test_log_row_without_params():
+    row, _ = log_row(1, 2, "u", "EXECUTE_SQL_OK_SELECT", None, "127.0.0.1",
+                     query="SELECT COUNT(*) FROM train_data", rows=1)
+    assert row[7] is None
+
+
+def test_write_rows_stores_each_text_once(conn):
+    cache = QueryTexts()
+    entries = [log_row(1, 2, "u", "EXECUTE_SQL_OK_SELECT", None, "127.0.0.1",
+                       query="SELECT * FROM train_data WHERE Credit_Score = %s", params=[score], rows=0)
+               for score in (700, 710, 720)]
+    cursor = conn.cursor()
+    new = write_rows(cursor, [t for _, t in entries], [r for r, _ in entries], cache)
+    cursor.close()
+    cache.remember(new)
+    assert len(new) == 1
+    assert fetch(conn, "SELECT COUNT(*) FROM query_texts") == [(1,)]
+    assert [json.loads(p) for (p,) in fetch(conn, "SELECT query_params FROM logs ORDER BY log_id")] == \
+        [[700], [710], [720]]
+    assert cache.missing([entries[0][1]]) == []
+
+
+def test_compact_converts_legacy_rows_to_query_texts(conn):
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO logs (session_id, user_id, username, action, details, ip_address) "
+        "VALUES (1, 2, 'u', %s, %s, '127.0.0.1')",
+        [("EXECUTE_SQL_OK_SELECT", "SELECT * FROM train_data WHERE Term = %s -- params=['Long Term'] - returned 3 row(s)"),
+         ("EXECUTE_SQL_OK_SELECT",
+          "SELECT * FROM train_data WHERE Term = %s -- params=['Short Term'] - returned 0 row(s)"),
+         ("EXECUTE_SQL_OK_DML", "UPDATE train_data SET Term = 'x' WHERE Credit_Score = 1 (transaction ab-12)"),
+         ("EXECUTE_SQL_OK_SELECT", "no row count here")],
+    )
+    cursor.close()
+    assert compact(conn, QueryTexts(), batch_size=2) == (3, 1)
+    rows = fetch(conn, "SELECT details, query_id, query_params, row_count FROM logs ORDER BY log_id")
+    select_id = query_id("SELECT * FROM train_data WHERE Term = %s")
+    assert rows[0] == (None, select_id, '["Long Term"]', 3)
+    assert rows[1] == (None, select_id, '["Short Term"]', 0)
+    assert rows[2][:3] == ("{query} (transaction ab-12)",
+                           query_id("UPDATE train_data SET Term = 'x' WHERE Credit_Score = 1"), None)
+    assert rows[3][1] is None
+    assert fetch(conn, "SELECT COUNT(*) FROM query_texts") == [(2,)]
@@ -0,0 +1,130 @@
+"""Мини-батчи train_data: детерминированное перемешивание, курсор на границе батча и продолжение эпохи."""
+import random
+import uuid
+
+import pytest
+
+from common import db
+from dataset import (
+    BUCKETS, DatasetError, Position, bucket_bounds, fingerprint, iter_batches, page_query, resolve_columns,
+)
+
+SEED, WINDOW = 7, 4
+
+
+def loan_ids(count, seed=0):
+    """UUID-ключи в нескольких корзинах (включая первую и последнюю) — по нескольку страниц на корзину."""
+    rng = random.Random(seed)
+    return sorted(rng.choice(["00", "3f", "a0", "ff"]) + str(uuid.UUID(int=rng.getrandbits(128), version=4))[2:]
+                  for _ in range(count))
+
+
+def memory_pages(keys):
+    """fetch_page по отсортированному списку ключей — как SELECT page_query."""
+    def fetch_page(lo, hi, after, limit):
+        rows = [(k,) for k in keys
+                if (after is None or k > after) and (after is not None or lo is None or k >= lo)
+                and (hi is None or k < hi)]
+        return rows[:limit]
+    return fetch_page
+
+
+def epoch(fetch_page, position=None, seed=SEED, window=WINDOW, batch_size=3, drop_last=False):
+    return list(iter_batches(fetch_page, seed, window, batch_size, position or Position(0), drop_last))
+
+
+def keys_of(batches):
+    return [row[0] for rows, _ in batches for row in rows]
+
+
+def test_bucket_bounds_cover_key_space_once():
+    for key in loan_ids(200) + ["", "0", "ff", "zz"]:
+        owners = [b for b in range(BUCKETS)
+                  if (bucket_bounds(b)[0] is None or key >= bucket_bounds(b)[0])
+                  and (bucket_bounds(b)[1] is None or key < bucket_bounds(b)[1])]
+        assert len(owners) == 1, key
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 4, 7])
+def test_epoch_yields_every_row_once(batch_size):
+    keys = loan_ids(100)
+    fetch_page = memory_pages(keys)
+    batches = epoch(fetch_page, batch_size=batch_size)
+    assert sorted(keys_of(batches)) == keys
+    assert all(len(rows) == batch_size for rows, _ in batches[:-1])
+    # После последнего батча эпоха пуста (оставшиеся корзины могут быть ещё не пройдены)
+    assert epoch(fetch_page, batches[-1][1], batch_size=batch_size) == []
+
+
+def test_shuffle_is_deterministic_and_depends_on_seed_and_epoch():
+    fetch_page = memory_pages(loan_ids(100))
+    order = keys_of(epoch(fetch_page))
+    assert keys_of(epoch(fetch_page)) == order
+    assert keys_of(epoch(fetch_page, seed=SEED + 1)) != order
+    assert keys_of(epoch(fetch_page, Position(1))) != order
+    assert order != sorted(order)
+
+
+def test_drop_last_skips_incomplete_batch():
+    keys = loan_ids(10)
+    batches = epoch(memory_pages(keys), batch_size=4, drop_last=True)
+    assert [len(rows) for rows, _ in batches] == [4, 4]
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 4, 5])
+def test_resume_from_each_cursor_reproduces_rest_of_epoch(batch_size):
+    fetch_page = memory_pages(loan_ids(60))
+    batches = epoch(fetch_page, batch_size=batch_size)
+    stamp = fingerprint(SEED, WINDOW)
+    # Курсоры посреди страницы и на продолжении корзины
+    assert any(position.skip for _, position in batches)
+    assert any(position.after for _, position in batches)
+    for index, (_, position) in enumerate(batches):
+        resumed = epoch(fetch_page, Position.decode(position.encode(stamp), stamp), batch_size=batch_size)
+        assert [rows for rows, _ in resumed] == [rows for rows, _ in batches[index + 1:]]
+
+
+def test_cursor_for_another_seed_or_window_is_rejected():
+    cursor = Position(0, 5, "ab", 2).encode(fingerprint(SEED, WINDOW))
+    for other in (fingerprint(SEED + 1, WINDOW), fingerprint(SEED, WINDOW * 2)):
+        with pytest.raises(DatasetError, match="another seed or window"):
+            Position.decode(cursor, other)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", Position(0, BUCKETS + 1).encode("x"),
+                                    Position(0, 0, 5).encode("x"), Position(0, 0, None, -1).encode("x")])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(DatasetError):
+        Position.decode(cursor, "x")
+
+
+def test_page_query_reads_buckets_from_sqlite():
+    raw, connection_id = db._open_sqlite()
+    conn = db.SQLiteConnection(raw, connection_id)
+    keys = loan_ids(30)
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS train_data")
+    cursor.execute("CREATE TABLE train_data (Loan_ID VARCHAR(50) PRIMARY KEY, Credit_Score INT)")
+    for key in keys:
+        cursor.execute("INSERT INTO train_data (Loan_ID, Credit_Score) VALUES (%s, %s)", (key, 700))
+    columns = resolve_columns(["Credit_Score"])
+
+    def fetch_page(lo, hi, after, limit):
+        if after is not None:
+            sql, args = page_query(columns, ">", hi is not None), [after]
+        elif lo is not None:
+            sql, args = page_query(columns, ">=", hi is not None), [lo]
+        else:
+            sql, args = page_query(columns, None, hi is not None), []
+        if hi is not None:
+            args.append(hi)
+        cursor.execute(sql, tuple(args + [limit]))
+        return cursor.fetchall()
+
+    try:
+        batches = epoch(fetch_page)
+        assert sorted(keys_of(batches)) == keys
+        assert keys_of(batches) == keys_of(epoch(memory_pages(keys)))
+    finally:
+        cursor.close()
+        conn.close()
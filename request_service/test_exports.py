@@ -0,0 +1,93 @@
+"""ExportManager: статус в <job_id>.json, чтение заданий другого экземпляра, лимит и очистка."""
+import json
+import os
+import threading
+
+import pytest
+
+from exports import ExportJob, ExportLimitError, ExportManager
+
+
+def job(user_id="1", fmt="csv"):
+    return ExportJob(user_id, "u", 42, "viewer", "SELECT 1", None, fmt)
+
+
+def write(rows=3):
+    def run(job, path):
+        with open(path, "wb") as f:
+            f.write(b"x" * rows)
+        return rows
+    return run
+
+
+def wait(manager, job_id):
+    """Ждёт конца задания и записи его итогового статуса на диск (finished_at ставится до записи)."""
+    finished = manager.get(job_id)
+    while finished.finished_at is None or saved(manager, job_id)["finished_at"] is None:
+        threading.Event().wait(0.005)
+    return finished
+
+
+def saved(manager, job_id):
+    with open(os.path.join(manager.directory, f"{job_id}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_other_instance_sees_status_and_file(tmp_path):
+    first, second = ExportManager(str(tmp_path)), ExportManager(str(tmp_path))
+    submitted = first.submit(job(), write(3))
+    wait(first, submitted.id)
+    shared = second.get(submitted.id)
+    assert shared.snapshot() == first.get(submitted.id).snapshot()
+    assert (shared.status, shared.rows, shared.size, shared.user_id) == ("done", 3, 3, "1")
+    assert shared.path == submitted.path and os.path.exists(shared.path)
+    assert "query" not in json.loads((tmp_path / f"{submitted.id}.json").read_text())
+
+
+def test_failed_job_is_recorded(tmp_path):
+    def fail(job, path):
+        raise RuntimeError("boom")
+
+    manager = ExportManager(str(tmp_path))
+    submitted = manager.submit(job(), fail)
+    wait(manager, submitted.id)
+    shared = ExportManager(str(tmp_path)).get(submitted.id)
+    assert (shared.status, shared.error) == ("failed", "boom")
+    assert not os.path.exists(submitted.path + ".part")
+
+
+@pytest.mark.parametrize("job_id", ["missing" * 4, "../" + "a" * 32, "A" * 32, "", None])
+def test_unknown_or_invalid_job_id(tmp_path, job_id):
+    assert ExportManager(str(tmp_path)).get(job_id) is None
+
+
+def test_per_user_limit(tmp_path):
+    gate = threading.Event()
+
+    def blocked(job, path):
+        gate.wait(5)
+        return 0
+
+    manager = ExportManager(str(tmp_path), per_user_limit=1)
+    first = manager.submit(job(), blocked)
+    with pytest.raises(ExportLimitError):
+        manager.submit(job(), blocked)
+    manager.submit(job(user_id="2"), blocked)
+    gate.set()
+    wait(manager, first.id)
+    manager.submit(job(), write())
+
+
+def test_sweep_removes_expired_jobs_of_other_instances(tmp_path):
+    first = ExportManager(str(tmp_path), ttl=60)
+    old = first.submit(job(), write())
+    wait(first, old.id)
+    record = json.loads((tmp_path / f"{old.id}.json").read_text())
+    record["finished_at"] -= 120
+    (tmp_path / f"{old.id}.json").write_text(json.dumps(record))
+
+    second = ExportManager(str(tmp_path), ttl=60)
+    assert second.get(old.id) is None
+    kept = second.submit(job(user_id="2"), write())
+    wait(second, kept.id)
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{kept.id}.json", f"{kept.id}.csv.gz"])
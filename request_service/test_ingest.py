@@ -0,0 +1,103 @@
+"""Загрузка в train_data: проверка строк и счётчики inserted / duplicates / updated / unchanged."""
+import io
+import json
+
+import pytest
+
+from common import db
+from ingest import TRAIN_DATA_SCHEMA, IngestError, ingest
+
+TYPES = {"enum": "VARCHAR(20)", "int": "INT", "tinyint": "TINYINT", "float": "FLOAT"}
+
+
+@pytest.fixture
+def conn():
+    raw, connection_id = db._open_sqlite()
+    conn = db.SQLiteConnection(raw, connection_id)
+    columns = ", ".join(
+        f"{c.name} " + (f"VARCHAR({c.length})" if c.kind == "varchar" else
+                        f"DECIMAL({c.precision},{c.scale})" if c.kind == "decimal" else TYPES[c.kind])
+        + (" PRIMARY KEY" if c.name == "Loan_ID" else "")
+        for c in TRAIN_DATA_SCHEMA
+    )
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS train_data")
+    cursor.execute(f"CREATE TABLE train_data ({columns})")
+    cursor.close()
+    yield conn
+    conn.close()
+
+
+def ndjson(*rows):
+    return io.BytesIO("".join(json.dumps(row) + "\n" for row in rows).encode())
+
+
+def row(loan_id, score=700, status="Approved"):
+    return {"Loan_ID": loan_id, "Loan_Status": status, "Credit_Score": score, "Current_Loan_Amount": "100.50"}
+
+
+def scores(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT Loan_ID, Credit_Score FROM train_data ORDER BY Loan_ID")
+    rows = cursor.fetchall()
+    cursor.close()
+    return dict(rows)
+
+
+def counts(result):
+    summary = result.summary()
+    return {key: summary[key] for key in ("accepted", "rejected", "inserted", "duplicates", "updated", "unchanged")}
+
+
+def test_csv_rows_are_validated(conn):
+    stream = io.BytesIO(b"Loan ID,Loan Status,Credit Score\na,Approved,700\nb,Unknown,1\nc,Rejected,x\n")
+    result = ingest(stream, "csv", conn)
+    assert (result.accepted, result.rejected, result.inserted) == (1, 2, 1)
+    assert [e["line"] for e in result.errors] == [3, 4]
+
+
+def test_unknown_format_is_rejected(conn):
+    with pytest.raises(IngestError):
+        ingest(io.BytesIO(b""), "xml", conn)
+
+
+def test_skip_counts_duplicates(conn):
+    ingest(ndjson(row("a"), row("b")), "ndjson", conn)
+    result = ingest(ndjson(row("a", 1), row("c"), row("c", 2)), "ndjson", conn, batch_rows=2)
+    assert counts(result) == {"accepted": 3, "rejected": 0, "inserted": 1, "duplicates": 2,
+                              "updated": 0, "unchanged": 0}
+    assert scores(conn) == {"a": 700, "b": 700, "c": 700}
+
+
+def test_update_separates_updated_and_unchanged(conn):
+    ingest(ndjson(row("a"), row("b"), row("c")), "ndjson", conn)
+    result = ingest(ndjson(row("a"), row("b", 650), row("c"), row("d"), row("e"), row("e", 600)),
+                    "ndjson", conn, batch_rows=4, on_duplicate="update")
+    assert counts(result) == {"accepted": 6, "rejected": 0, "inserted": 2, "duplicates": 0,
+                              "updated": 2, "unchanged": 2}
+    assert result.committed == 6
+    assert scores(conn) == {"a": 700, "b": 650, "c": 700, "d": 700, "e": 600}
+
+
+def test_reloading_same_file_changes_nothing(conn):
+    rows = [row(f"id{i}", 600 + i) for i in range(5)]
+    ingest(ndjson(*rows), "ndjson", conn, on_duplicate="update")
+    result = ingest(ndjson(*rows), "ndjson", conn, batch_rows=2, on_duplicate="update")
+    assert (result.inserted, result.updated, result.unchanged) == (0, 0, 5)
+
+
+def test_upsert_rowcount_matches_mysql(conn):
+    cursor = conn.cursor()
+    sql = ("INSERT INTO train_data (Loan_ID, Loan_Status, Credit_Score) VALUES (%s, %s, %s), (%s, %s, %s) "
+           "ON DUPLICATE KEY UPDATE Loan_Status = VALUES(Loan_Status), Credit_Score = VALUES(Credit_Score)")
+    cursor.execute(sql, ["a", "Approved", 1, "b", "Approved", 2])
+    assert cursor.rowcount == 2
+    cursor.execute(sql, ["a", "Approved", 1, "b", "Rejected", 2])
+    assert cursor.rowcount == 2
+    cursor.execute(sql, ["a", "Approved", 1, "b", "Rejected", 2])
+    assert cursor.rowcount == 0
+    cursor.execute(sql, ["c", "Approved", None, "c", "Approved", 3])
+    assert cursor.rowcount == 3
+    cursor.execute("DELETE FROM train_data")
+    assert cursor.rowcount == 3
+    cursor.close()
@@ -0,0 +1,92 @@
+"""ReplicaSet: первая проверка в фоне, primary до её завершения и выбор по отставанию."""
+import threading
+
+import pytest
+
+from replicas import ReplicaSet, parse_hosts
+
+CONFIG = {"host": "primary", "port": 3306, "user": "u", "password": "p", "database": "d"}
+
+
+@pytest.fixture
+def lags(monkeypatch):
+    """Отставание реплик по имени; проверка ждёт события gate."""
+    state = {"gate": threading.Event(), "lags": {}}
+
+    def replication_lag(self, replica):
+        state["gate"].wait(5)
+        lag = state["lags"].get(replica.name)
+        if isinstance(lag, Exception):
+            raise lag
+        return lag
+
+    monkeypatch.setattr(ReplicaSet, "_replication_lag", replication_lag)
+    return state
+
+
+def replica_set(count=2, max_lag=5.0):
+    return ReplicaSet(CONFIG, [(f"r{i}", None) for i in range(count)], pool_size=1,
+                      max_lag=max_lag, check_interval=3600)
+
+
+def test_parse_hosts():
+    assert parse_hosts(" h1:3307, h2 ,,") == [("h1", "3307"), ("h2", None)]
+    assert parse_hosts(None) == []
+
+
+def test_choose_does_not_wait_for_first_check(lags):
+    replicas = replica_set()
+    lags["lags"] = {"replica_0": 0, "replica_1": 0}
+    assert replicas.choose() is None
+    assert not replicas.wait_checked(0.01)
+    lags["gate"].set()
+    assert replicas.wait_checked(5)
+    assert replicas.choose() is not None
+
+
+def test_choose_prefers_smallest_lag_within_limit(lags):
+    lags["gate"].set()
+    lags["lags"] = {"replica_0": 3, "replica_1": 1, "replica_2": 9}
+    replicas = replica_set(count=3)
+    replicas.check()
+    replicas._checked.set()
+    assert replicas.choose().name == "replica_1"
+    lags["lags"]["replica_1"] = RuntimeError("replication is stopped")
+    replicas.check()
+    assert replicas.choose().name == "replica_0"
+    snapshot = replicas.snapshot()["replica_1"]
+    assert (snapshot["healthy"], snapshot["last_error"]) == (False, "replication is stopped")
+    lags["lags"]["replica_0"] = 6
+    replicas.check()
+    assert replicas.choose() is None
+
+
+@pytest.mark.parametrize("error", [ValueError("invalid literal for int()"), TypeError("NoneType")])
+def test_unexpected_check_error_marks_replica_unhealthy(lags, error):
+    lags["gate"].set()
+    lags["lags"] = {"replica_0": 0}
+    replicas = replica_set(count=1)
+    replicas.check()
+    assert replicas.replicas[0].healthy
+    lags["lags"]["replica_0"] = error
+    replicas.check()
+    snapshot = replicas.snapshot()["replica_0"]
+    assert (snapshot["healthy"], snapshot["lag_seconds"], snapshot["last_error"]) == (False, None, str(error))
+
+
+def test_health_loop_survives_check_failure(monkeypatch):
+    replicas = ReplicaSet(CONFIG, [("r0", None)], pool_size=1, check_interval=0.01)
+    replicas.replicas[0].healthy = True
+    calls = []
+    recovered = threading.Event()
+
+    def check(self):
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise KeyError("unexpected")
+        recovered.set()
+
+    monkeypatch.setattr(ReplicaSet, "check", check)
+    replicas.start()
+    assert recovered.wait(5)
+    assert not replicas.replicas[0].healthy
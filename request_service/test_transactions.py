@@ -0,0 +1,212 @@
+"""Команды транзакций, запросы, меняющие состояние сессии, и закрепление транзакций за сессией."""
+import threading
+
+import pytest
+
+from transactions import TransactionError, TransactionManager, changes_session, control_statement
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("transactions.time.monotonic", lambda: now[0])
+    return now
+
+
+class Connection:
+    def __init__(self):
+        self.calls = []
+
+    def start_transaction(self):
+        self.calls.append("begin")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+    def close(self):
+        self.calls.append("close")
+
+
+def manager(**kwargs):
+    kwargs.setdefault("reap_interval", 3600)
+    return TransactionManager(**kwargs)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("BEGIN", "begin"),
+    ("begin work;", "begin"),
+    ("  START   TRANSACTION ; ", "begin"),
+    ("/* txn */ START TRANSACTION", "begin"),
+    ("COMMIT", "commit"),
+    ("COMMIT WORK; -- done", "commit"),
+    ("commit and no chain no release", "commit"),
+    ("ROLLBACK", "rollback"),
+    ("rollback work # undo", "rollback"),
+    ("START TRANSACTION READ ONLY", None),
+    ("START TRANSACTION WITH CONSISTENT SNAPSHOT", None),
+    ("COMMIT AND CHAIN", None),
+    ("ROLLBACK RELEASE", None),
+    ("ROLLBACK TO SAVEPOINT a", None),
+    ("COMMIT; DELETE FROM train_data", None),
+    ("BEGIN NOT ATOMIC", None),
+    ("SELECT 1", None),
+])
+def test_control_statement(query, expected):
+    assert control_statement(query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "START TRANSACTION READ WRITE",
+    "COMMIT AND CHAIN",
+    "ROLLBACK TO SAVEPOINT a",
+    "COMMIT; DELETE FROM train_data",
+    "START SLAVE",
+])
+def test_unsupported_transaction_control_changes_session(query):
+    assert changes_session(query)
+
+
+def test_begin_pins_connection_to_session():
+    txns, conn = manager(), Connection()
+    txn = txns.begin(1, 42, "u", lambda: conn)
+    assert conn.calls == ["begin"]
+    assert txns.get("1", "42") is txn and txn.conn is conn
+    assert txns.get(1, 42, txn.id) is txn
+    assert txns.get(1, 43) is None
+    with pytest.raises(TransactionError) as info:
+        txns.begin(1, 42, "u", Connection)
+    assert info.value.status == 409
+
+
+def test_unknown_transaction_id_is_rejected():
+    txns = manager()
+    txns.begin(1, 42, "u", Connection)
+    with pytest.raises(TransactionError):
+        txns.get(1, 42, "other")
+    with pytest.raises(TransactionError):
+        txns.get(1, 99, "gone")
+
+
+@pytest.mark.parametrize("committed", [True, False])
+def test_release_returns_connection(committed):
+    txns, conn = manager(), Connection()
+    txn = txns.begin(1, 42, "u", lambda: conn)
+    txns.release(txn, committed)
+    txns.release(txn, committed)
+    assert conn.calls == ["begin", "close"]
+    assert txns.get(1, 42) is None
+    snapshot = txns.snapshot()
+    assert (snapshot["committed"], snapshot["rolled_back"], snapshot["open"]) == \
+        ((1, 0, 0) if committed else (0, 1, 0))
+
+
+def test_max_open_rejects_and_frees_slot_after_release():
+    txns = manager(max_open=1)
+    txn = txns.begin(1, 1, "u", Connection)
+    with pytest.raises(TransactionError) as info:
+        txns.begin(2, 2, "u", Connection)
+    assert info.value.status == 503 and txns.rejected == 1
+    txns.release(txn, True)
+    txns.begin(2, 2, "u", Connection)
+
+
+def test_failed_connect_frees_reserved_slot():
+    txns = manager(max_open=1)
+    with pytest.raises(TransactionError) as info:
+        txns.begin(1, 1, "u", lambda: None)
+    assert info.value.status == 500
+    txns.begin(1, 1, "u", Connection)
+
+
+def test_concurrent_begins_respect_max_open():
+    txns, started, errors = manager(max_open=2), threading.Barrier(8), []
+
+    def begin(i):
+        started.wait()
+        try:
+            txns.begin(i, i, "u", Connection)
+        except TransactionError as e:
+            errors.append(e.status)
+
+    threads = [threading.Thread(target=begin, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert txns.snapshot()["open"] == 2 and errors == [503] * 6
+
+
+def test_reaper_rolls_back_idle_and_overlong_transactions(clock):
+    reaped = []
+    txns = manager(idle_timeout=30, max_duration=300, on_reaped=lambda txn, reason: reaped.append(reason))
+    idle_conn, busy_conn = Connection(), Connection()
+    idle = txns.begin(1, 1, "u", lambda: idle_conn)
+    long_running = txns.begin(2, 2, "u", lambda: busy_conn)
+    clock[0] += 29
+    long_running.touch()
+    assert txns.reap() == 0
+
+    clock[0] += 2
+    long_running.touch()
+    assert txns.reap() == 1
+    assert idle_conn.calls == ["begin", "rollback", "close"] and reaped == ["idle timeout"]
+    with pytest.raises(TransactionError):
+        txns.get(1, 1, idle.id)
+
+    clock[0] += 270
+    long_running.touch()
+    assert txns.reap() == 1 and reaped[-1] == "max duration exceeded"
+    assert txns.snapshot()["reaped"] == 2
+
+
+def test_reaper_skips_transaction_in_use(clock):
+    txns, conn = manager(idle_timeout=1), Connection()
+    txn = txns.begin(1, 1, "u", lambda: conn)
+    clock[0] += 5
+    with txn.lock:
+        assert txns.reap() == 0
+    assert txns.get(1, 1) is txn
+    assert txns.reap() == 1 and "rollback" in conn.calls
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM train_data WHERE loan_id = %s",
+    "UPDATE train_data SET credit_score = 1 WHERE loan_id = 'x'",
+    "INSERT INTO train_data SET loan_id = 'a'",
+    "SELECT '@x := 1', \"GET_LOCK(\" FROM train_data",
+    "SELECT @@version",
+    "BEGIN",
+    "COMMIT",
+    "ROLLBACK",
+])
+def test_session_safe_statements(query):
+    assert not changes_session(query)
+
+
+@pytest.mark.parametrize("query", [
+    "USE mysql",
+    "SET SESSION sql_mode = ''",
+    "set autocommit = 0",
+    "SET @x = 1",
+    "SET NAMES latin1",
+    "SET TRANSACTION ISOLATION LEVEL SERIALIZABLE",
+    "LOCK TABLES train_data WRITE",
+    "UNLOCK TABLES",
+    "/* c */ LOCK TABLES train_data READ",
+    "-- c\nUSE mysql",
+    "PREPARE s FROM 'SELECT 1'",
+    "HANDLER train_data OPEN",
+    "FLUSH TABLES WITH READ LOCK",
+    "XA START 'x'",
+    "SAVEPOINT a",
+    "RELEASE SAVEPOINT a",
+    "SELECT @x := credit_score FROM train_data",
+    "SELECT credit_score INTO @x FROM train_data LIMIT 1",
+    "SELECT GET_LOCK('k', 10)",
+    "CREATE TEMPORARY TABLE t (a INT)",
+    "/*!40101 SET @x = 1 */",
+    "SELECT /*!50000 @x := 1 */ 1",
+    "START TRANSACTION READ ONLY",
+])
+def test_session_changing_statements_detected(query):
+    assert changes_session(query)
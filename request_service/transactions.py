@@ -0,0 +1,284 @@
+"""
+Транзакции из нескольких /execute, закреплённые за сессией.
+
+BEGIN (или START TRANSACTION) берёт соединение из пула и закрепляет его за парой
+(user_id, session_id); следующие /execute этой сессии выполняются на нём без
+фиксации, COMMIT / ROLLBACK завершают транзакцию и возвращают соединение в пул.
+
+TransactionManager ограничивает число одновременно открытых транзакций
+(каждая держит соединение пула) и в фоновом потоке откатывает транзакции,
+простаивающие дольше idle_timeout или открытые дольше max_duration.
+
+Соединения пула переходят от пользователя к пользователю без сброса сессии (db_pool).
+Запрос, меняющий состояние сессии (USE, SET, LOCK TABLES, пользовательские переменные,
+команды транзакций, кроме поддерживаемых), распознаёт changes_session(): request_service
+помечает его соединение, и пул не отдаёт эту сессию следующему пользователю
+(db.mark_session_changed).
+
+Транзакции живут в памяти процесса: при нескольких экземплярах request_service
+запросы одной сессии должны попадать в один экземпляр. Запрос с transaction_id,
+которого здесь нет, отклоняется, а не выполняется вне транзакции.
+"""
+import logging
+import re
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("request_service.transactions")
+
+# Команды транзакций, которые поддерживает закрепление, по словам (после WORK у COMMIT/ROLLBACK —
+# только значения по умолчанию: AND NO CHAIN, NO RELEASE)
+_CONTROL_WORDS = {("BEGIN",): "begin", ("START", "TRANSACTION"): "begin",
+                  ("COMMIT",): "commit", ("ROLLBACK",): "rollback"}
+_DEFAULT_COMPLETION = {(), ("AND", "NO", "CHAIN"), ("NO", "RELEASE"), ("AND", "NO", "CHAIN", "NO", "RELEASE")}
+_COMMENT_RE = re.compile(r"/\*(?!!).*?\*/|--[^\n]*|#[^\n]*", re.DOTALL)
+
+# Пробелы и комментарии в начале запроса; /*! ... */ MySQL выполняет, это не комментарий
+_LEADING_NOISE_RE = re.compile(r"(?:\s+|/\*(?!!).*?\*/|--[^\n]*(?:\n|$)|#[^\n]*(?:\n|$))*", re.DOTALL)
+_WORD_RE = re.compile(r"[A-Za-z_]+")
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+
+# Команды, состояние которых остаётся в сессии соединения после запроса
+SESSION_COMMANDS = frozenset({"USE", "SET", "LOCK", "UNLOCK", "PREPARE", "EXECUTE", "DEALLOCATE",
+                              "HANDLER", "FLUSH", "XA", "SAVEPOINT", "RELEASE"})
+_TRANSACTION_COMMANDS = frozenset({"BEGIN", "START", "COMMIT", "ROLLBACK"})
+# То же внутри запроса: пользовательские переменные, именованные блокировки,
+# временные таблицы, исполняемые комментарии
+_SESSION_STATE_RE = re.compile(
+    r"@\w+\s*:=|\bINTO\s+@|\b(?:GET_LOCK|RELEASE_LOCK|RELEASE_ALL_LOCKS)\s*\(|\bTEMPORARY\s+TABLES?\b|/\*!",
+    re.IGNORECASE,
+)
+
+
+def control_statement(query):
+    """
+    "begin" | "commit" | "rollback" для команд транзакции, которые поддерживает закрепление:
+    BEGIN [WORK], START TRANSACTION, COMMIT [WORK], ROLLBACK [WORK] — в любом регистре,
+    с комментариями и ; в конце. Иначе None: остальные команды транзакций (START TRANSACTION
+    READ ONLY, ROLLBACK TO SAVEPOINT, COMMIT AND CHAIN...) выполняются как обычные запросы,
+    меняющие сессию (changes_session).
+    """
+    words = tuple(_COMMENT_RE.sub(" ", query).strip().rstrip(";").upper().split())
+    if words[:2] == ("START", "TRANSACTION"):
+        return "begin" if len(words) == 2 else None
+    control = _CONTROL_WORDS.get(words[:1])
+    rest = words[1:]
+    if rest[:1] == ("WORK",):
+        rest = rest[1:]
+    if control == "begin":
+        return control if not rest else None
+    return control if rest in _DEFAULT_COMPLETION else None
+
+
+def first_word(query):
+    """Первое слово запроса в верхнем регистре без комментариев в начале ("" — слова нет)."""
+    match = _WORD_RE.match(query, _LEADING_NOISE_RE.match(query).end())
+    return match.group(0).upper() if match else ""
+
+
+def changes_session(query):
+    """
+    True, если запрос оставляет состояние в сессии соединения (USE, SET, LOCK TABLES,
+    пользовательские переменные, временные таблицы...). BEGIN/COMMIT/ROLLBACK, которые
+    распознаёт control_statement, сессию не меняют: транзакцию закрывает закрепление.
+    """
+    word = first_word(query)
+    if word in SESSION_COMMANDS:
+        return True
+    if word in _TRANSACTION_COMMANDS and control_statement(query) is None:
+        return True
+    return bool(_SESSION_STATE_RE.search(_LITERAL_RE.sub("''", query)))
+
+
+class TransactionError(Exception):
+    """Транзакцию нельзя открыть или использовать; status — HTTP-код ответа."""
+
+    def __init__(self, message, status=409):
+        super().__init__(message)
+        self.status = status
+
+
+class PinnedTransaction:
+    def __init__(self, user_id, session_id, username, conn, ip_address=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.session_id = session_id
+        self.username = username
+        self.ip_address = ip_address
+        self.conn = conn
+        self.started_at = time.monotonic()
+        self.last_used = self.started_at
+        self.statements = 0
+        self.changes = []           # изменения train_data — в агрегаты после COMMIT
+        self.modified = []          # теги инвалидации кэшей — рассылаются после COMMIT
+        self.lock = threading.Lock()    # один запрос сессии на соединении в каждый момент
+
+    @property
+    def key(self):
+        return str(self.user_id), str(self.session_id)
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "transaction_id": self.id,
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "statements": self.statements,
+            "age_seconds": round(now - self.started_at, 1),
+            "idle_seconds": round(now - self.last_used, 1),
+        }
+
+
+class TransactionManager:
+    """
+    max_open — сколько транзакций (закреплённых соединений) может быть открыто одновременно;
+    idle_timeout — через сколько секунд без запросов транзакция откатывается;
+    max_duration — предельная длительность транзакции;
+    on_reaped(txn, reason) — вызывается после отката транзакции reaper-ом (для аудита).
+    """
+
+    def __init__(self, max_open=4, idle_timeout=30.0, max_duration=300.0, reap_interval=1.0,
+                 on_reaped=None):
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.max_duration = max_duration
+        self.reap_interval = reap_interval
+        self.on_reaped = on_reaped
+        self._open = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.begun = self.committed = self.rolled_back = self.reaped = self.rejected = 0
+
+    def begin(self, user_id, session_id, username, connect, ip_address=None):
+        """
+        Открывает транзакцию сессии на соединении connect().
+        Бросает TransactionError, если у сессии уже есть транзакция или достигнут max_open.
+        """
+        key = (str(user_id), str(session_id))
+        with self._lock:
+            if key in self._open:
+                raise TransactionError("Transaction already open for this session")
+            if len(self._open) >= self.max_open:
+                self.rejected += 1
+                raise TransactionError(f"Too many open transactions (max {self.max_open})", 503)
+            # Место резервируем до подключения, чтобы параллельные BEGIN не превысили max_open
+            self._open[key] = None
+        try:
+            conn = connect()
+            if conn is None:
+                raise TransactionError("Failed to connect to DB", 500)
+            conn.start_transaction()
+        except Exception:
+            with self._lock:
+                self._open.pop(key, None)
+            raise
+        txn = PinnedTransaction(user_id, session_id, username, conn, ip_address)
+        with self._lock:
+            self._open[key] = txn
+            self.begun += 1
+        self._start_reaper()
+        return txn
+
+    def get(self, user_id, session_id, transaction_id=None):
+        """
+        Открытая транзакция сессии или None. Если клиент передал transaction_id,
+        а такой транзакции нет (откачена reaper-ом, другой экземпляр) — TransactionError.
+        """
+        with self._lock:
+            txn = self._open.get((str(user_id), str(session_id)))
+        if txn is not None and transaction_id and txn.id != transaction_id:
+            txn = None
+        if txn is None and transaction_id:
+            raise TransactionError("Transaction not found (rolled back after timeout or on another instance)")
+        return txn
+
+    def release(self, txn, committed):
+        """Снимает закрепление и возвращает соединение в пул (после COMMIT/ROLLBACK)."""
+        with self._lock:
+            if self._open.get(txn.key) is not txn:
+                return
+            del self._open[txn.key]
+            if committed:
+                self.committed += 1
+            else:
+                self.rolled_back += 1
+        try:
+            txn.conn.close()
+        except Exception as e:
+            logger.debug("Ошибка при возврате соединения транзакции в пул: %s", e)
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._reap_loop, name="txn-reaper", daemon=True)
+                self._thread.start()
+
+    def _expired(self, txn, now):
+        if now - txn.started_at > self.max_duration:
+            return "max duration exceeded"
+        if now - txn.last_used > self.idle_timeout:
+            return "idle timeout"
+        return None
+
+    def reap(self):
+        """Откатывает просроченные транзакции; возвращает их число."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [(txn, self._expired(txn, now)) for txn in self._open.values() if txn is not None]
+        reaped = 0
+        for txn, reason in candidates:
+            # Занятую запросом транзакцию не трогаем — проверим в следующий проход
+            if reason is None or not txn.lock.acquire(blocking=False):
+                continue
+            try:
+                with self._lock:
+                    if self._open.get(txn.key) is not txn:
+                        continue
+                    del self._open[txn.key]
+                    self.reaped += 1
+                try:
+                    txn.conn.rollback()
+                except Exception as e:
+                    logger.warning("Ошибка отката транзакции %s: %s", txn.id, e)
+                try:
+                    txn.conn.close()
+                except Exception:
+                    pass
+            finally:
+                txn.lock.release()
+            reaped += 1
+            logger.warning("Транзакция %s сессии %s откачена: %s", txn.id, txn.session_id, reason)
+            if self.on_reaped is not None:
+                try:
+                    self.on_reaped(txn, reason)
+                except Exception:
+                    logger.exception("Ошибка обработчика отката транзакции %s", txn.id)
+        return reaped
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Ошибка reaper-а транзакций")
+
+    def snapshot(self):
+        with self._lock:
+            open_txns = [txn.snapshot() for txn in self._open.values() if txn is not None]
+        return {
+            "open": len(open_txns),
+            "max_open": self.max_open,
+            "idle_timeout_seconds": self.idle_timeout,
+            "max_duration_seconds": self.max_duration,
+            "begun": self.begun,
+            "committed": self.committed,
+            "rolled_back": self.rolled_back,
+            "reaped": self.reaped,
+            "rejected": self.rejected,
+            "transactions": open_txns,
+        }
@@ -0,0 +1,219 @@
+"""
+Контроль допуска запросов в gateway (admission control) и сброс нагрузки.
+
+Каждая точка входа (/login, /execute, ...) — отдельная полоса (Lane) со своим
+пределом одновременных запросов, короткой очередью ожидания и приоритетом.
+Поверх полос действует общий предел capacity на весь gateway; последние
+reserved мест общего предела доступны только полосам с приоритетом 0
+(/login, /validate_2fa), чтобы медленные /execute не вытесняли вход в систему.
+
+Освободившееся место получает ожидающий запрос с наименьшим приоритетом,
+при равенстве — пришедший раньше. Если очередь полосы заполнена или место
+не освободилось за max_wait секунд, запрос сразу отклоняется (Overloaded) —
+gateway отвечает 503 с Retry-After, не занимая поток и память до таймаута.
+
+Потоковый ответ (/dataset/batches, скачивание выгрузки) держит место, пока
+сервер не закроет его тело, а не только пока выполняется функция маршрута.
+"""
+import bisect
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Приоритеты полос: меньше — важнее
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+
+class Overloaded(Exception):
+    """Запрос отклонён контролем допуска; retry_after — через сколько секунд повторить."""
+
+    def __init__(self, lane, reason, retry_after):
+        super().__init__(f"{lane} is overloaded ({reason})")
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Lane:
+    """
+    Полоса одной точки входа.
+    limit — одновременно выполняемых запросов, queue_size — ожидающих,
+    max_wait — сколько секунд запрос может ждать места в очереди.
+    """
+
+    def __init__(self, name, limit, queue_size=16, max_wait=0.5, priority=PRIORITY_NORMAL,
+                 samples=1024):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+        self.priority = priority
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.wait_max = 0.0
+        self._waits = deque(maxlen=samples)
+        self._service_time = None       # EWMA времени обработки, сек
+
+    @property
+    def shed(self):
+        return self.shed_queue_full + self.shed_timeout
+
+    def _record_wait(self, seconds):
+        self._waits.append(seconds)
+        self.wait_max = max(self.wait_max, seconds)
+
+    def _record_service_time(self, seconds):
+        if self._service_time is None:
+            self._service_time = seconds
+        else:
+            self._service_time += 0.2 * (seconds - self._service_time)
+
+    def retry_after(self):
+        """Оценка (целые секунды, не меньше 1), когда очередь полосы успеет разойтись."""
+        if self._service_time is None:
+            return 1
+        backlog = (self.in_flight + self.waiting) / self.limit
+        return max(1, math.ceil(self._service_time * backlog))
+
+    def snapshot(self):
+        waits = sorted(self._waits)
+
+        def percentile(q):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, math.ceil(q * len(waits)) - 1)] * 1000, 1)
+
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "max_wait_seconds": self.max_wait,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "wait_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": round(self.wait_max * 1000, 1)},
+            "service_time_ms": None if self._service_time is None else round(self._service_time * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """
+    Общий предел capacity и набор полос. enabled=False — запросы пропускаются
+    без ограничений (метрики in_flight при этом всё равно считаются).
+    """
+
+    def __init__(self, lanes, capacity=64, reserved=8, enabled=True):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.capacity = max(1, capacity)
+        self.reserved = min(max(0, reserved), self.capacity - 1)
+        self.enabled = enabled
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._waiters = []              # отсортированы по (priority, seq)
+        self._seq = itertools.count()
+
+    def _has_room(self, lane):
+        if lane.in_flight >= lane.limit:
+            return False
+        limit = self.capacity if lane.priority == PRIORITY_HIGH else self.capacity - self.reserved
+        return self.in_flight < limit
+
+    def _first_eligible(self):
+        """Ключ ожидающего, которому положено следующее место (или None)."""
+        for key in self._waiters:
+            if self._has_room(self.lanes[key[2]]):
+                return key
+        return None
+
+    def _take(self, lane):
+        lane.in_flight += 1
+        lane.admitted += 1
+        self.in_flight += 1
+
+    def acquire(self, name):
+        """Занимает место в полосе name; бросает Overloaded, если места не будет."""
+        lane = self.lanes[name]
+        with self._cond:
+            if not self.enabled or (self._has_room(lane) and self._first_eligible() is None):
+                self._take(lane)
+                return
+            if lane.waiting >= lane.queue_size:
+                lane.shed_queue_full += 1
+                raise Overloaded(name, "queue full", lane.retry_after())
+
+            key = (lane.priority, next(self._seq), name)
+            bisect.insort(self._waiters, key)
+            lane.waiting += 1
+            lane.queued += 1
+            started = time.monotonic()
+            deadline = started + lane.max_wait
+            try:
+                while self._first_eligible() != key:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        lane.shed_timeout += 1
+                        raise Overloaded(name, "queue timeout", lane.retry_after())
+                    self._cond.wait(remaining)
+                self._take(lane)
+            finally:
+                self._waiters.remove(key)
+                lane.waiting -= 1
+                lane._record_wait(time.monotonic() - started)
+                # Место могло достаться следующему в очереди (в том числе после нашего таймаута)
+                self._cond.notify_all()
+
+    def release(self, name, service_time=None):
+        lane = self.lanes[name]
+        with self._cond:
+            lane.in_flight -= 1
+            self.in_flight -= 1
+            if service_time is not None:
+                lane._record_service_time(service_time)
+            if self._waiters:
+                self._cond.notify_all()
+
+    def hold(self, name):
+        """
+        Занимает место в полосе name и возвращает функцию, которая его освобождает.
+        Повторный вызов функции ничего не делает — место освобождается один раз, даже
+        если потоковый ответ закрывают и по окончании, и при обрыве соединения.
+        """
+        self.acquire(name)
+        started = time.monotonic()
+        released = threading.Lock()
+
+        def release():
+            if released.acquire(blocking=False):
+                self.release(name, time.monotonic() - started)
+        return release
+
+    @contextmanager
+    def admit(self, name):
+        release = self.hold(name)
+        try:
+            yield
+        finally:
+            release()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "capacity": self.capacity,
+                "reserved_for_priority": self.reserved,
+                "in_flight": self.in_flight,
+                "queue_depth": len(self._waiters),
+                "lanes": {name: lane.snapshot() for name, lane in self.lanes.items()},
+            }
@@ -0,0 +1,116 @@
+"""
+Устойчивость вызовов к микросервисам: повторы с джиттером и circuit breaker.
+
+Используется HttpTransport (transport.py). Таймауты подключения/чтения задаются
+в самом транспорте отдельно для каждого сервиса.
+"""
+import random
+import threading
+import time
+
+
+class RetryPolicy:
+    """
+    Ограниченное число попыток с экспоненциальной задержкой и полным джиттером.
+    max_attempts — общее число попыток, включая первую.
+    """
+    def __init__(self, max_attempts=3, backoff_base=0.05, backoff_max=0.5):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt):
+        """Пауза перед повтором номер attempt (начиная с 1)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для одного сервиса.
+
+    closed    — запросы идут, считаем подряд идущие сбои;
+    open      — после failure_threshold сбоев запросы сразу отклоняются;
+    half_open — через reset_timeout секунд пропускаем один пробный запрос:
+                успех закрывает breaker, сбой снова открывает. Пробный запрос,
+                завершившийся без результата (например, по дедлайну вызывающего),
+                должен вернуть право на пробу (release_probe), иначе breaker
+                так и останется half_open без проб.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_owner = None
+        self.trips = 0
+        self.rejected = 0
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+                self._probe_owner = threading.get_ident()
+            return True
+
+    def release_probe(self):
+        """
+        Пробный запрос этого потока завершился, не дав ни успеха, ни сбоя:
+        следующий запрос снова может стать пробным. Вне half_open ничего не делает.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probe_owner == threading.get_ident():
+                self._probe_in_flight = False
+                self._probe_owner = None
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+            self._probe_owner = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.trips += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self._probe_owner = None
+
+    def retry_after(self):
+        """Сколько секунд осталось до пробного запроса (0, если breaker не открыт)."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def snapshot(self):
+        retry_after = self.retry_after()
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_after_seconds": round(retry_after, 1),
+            }
@@ -1,14 +1,32 @@
-from flask import Flask, request, jsonify
-import mysql.connector
-from mysql.connector import Error
+from flask import Flask, request, jsonify, make_response
 from dotenv import load_dotenv
 import os
+import sys
+import functools
 import ipaddress
-import requests
 from datetime import datetime, timedelta
 
+# Общие модули сервисов — пакет common/ в корне репозитория (в образе — /app/common)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+from common import codec, deadline, json_provider, tracing  # noqa: E402
+from common.cache_bus import CoherentCache, make_bus  # noqa: E402
+from common.db import Error  # noqa: E402
+from common.db_pool import ConnectionPool  # noqa: E402
+from common.health import Health  # noqa: E402
+from common.log_config import setup_logging  # noqa: E402
+from common.profiler import Profiler  # noqa: E402
+from admission import PRIORITY_HIGH, AdmissionController, Lane, Overloaded  # noqa: E402
+from resilience import CircuitBreaker, RetryPolicy  # noqa: E402
+from transport import CircuitOpenError, HttpTransport, TransportError  # noqa: E402
+
 load_dotenv()
 
+logger = setup_logging("server")
+tracer = tracing.Tracer("server")
+
 # ------------------------------------
 # Конфигурация БД (TrainSafe)
 # ------------------------------------
@@ -20,6 +38,10 @@ DB_CONFIG = {
     "database": "TrainSafe"
 }
 
+# Пул соединений gateway (сессии, логин); открывается при прогреве
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+DB_POOL = ConnectionPool("server", DB_CONFIG, DB_POOL_SIZE)
+
 # Разрешённые IP-адреса/подсети
 ALLOWED_IP_RANGES = [
     "127.0.0.1",
@@ -47,22 +69,132 @@ REQUEST_SERVICE_URL = "http://127.0.0.1:6002"
 # TWO_FACTOR_SERVICE_URL = "http://two-factor-service-service:6001"
 # REQUEST_SERVICE_URL = "http://request-service-service:6002"
 
+# Формат payload-ов между сервисами: json (по умолчанию) или msgpack.
+# Внешний API gateway всегда отвечает JSON.
+INTERNAL_CONTENT_TYPE = {
+    "json": codec.JSON_MIMETYPE,
+    "msgpack": codec.MSGPACK_MIMETYPE,
+}[os.getenv("INTERNAL_CONTENT_TYPE", "json").lower()]
+
+# Таймауты (сек), повторы и circuit breaker для вызовов микросервисов
+TWO_FACTOR_CONNECT_TIMEOUT = float(os.getenv("TWO_FACTOR_CONNECT_TIMEOUT", 1.0))
+TWO_FACTOR_READ_TIMEOUT = float(os.getenv("TWO_FACTOR_READ_TIMEOUT", 5.0))
+REQUEST_SERVICE_CONNECT_TIMEOUT = float(os.getenv("REQUEST_SERVICE_CONNECT_TIMEOUT", 1.0))
+REQUEST_SERVICE_READ_TIMEOUT = float(os.getenv("REQUEST_SERVICE_READ_TIMEOUT", 60.0))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 3))
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", 5))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", 30.0))
+# Таймаут чтения ответа на /ingest: сервис отвечает только после обработки всего файла
+INGEST_READ_TIMEOUT = float(os.getenv("INGEST_READ_TIMEOUT", 600.0))
+
+# Дедлайны запросов (сек) по эндпоинтам, 0 — без дедлайна. Отсчёт от входа в gateway (включая
+# ожидание допуска); остаток передаётся сервисам заголовком X-Request-Timeout-Ms и ограничивает
+# таймауты вызовов и время запросов к БД. Клиент может сократить бюджет тем же заголовком.
+# Потоковые /ingest, /dataset/batches и скачивание выгрузок своего дедлайна не имеют.
+DEADLINE_AUTH = float(os.getenv("DEADLINE_AUTH", 5.0))
+DEADLINE_EXECUTE = float(os.getenv("DEADLINE_EXECUTE", 30.0))
+DEADLINE_BATCH = float(os.getenv("DEADLINE_BATCH", 60.0))
+DEADLINE_EXPORTS = float(os.getenv("DEADLINE_EXPORTS", 10.0))
+
+# Транспорт к микросервисам: по умолчанию HTTP, в совмещённом режиме
+# (combined.py) подменяется на прямой вызов функций через use_transports()
+TWO_FACTOR_TRANSPORT = HttpTransport(
+    TWO_FACTOR_SERVICE_URL, INTERNAL_CONTENT_TYPE, name="two_factor_service",
+    connect_timeout=TWO_FACTOR_CONNECT_TIMEOUT, read_timeout=TWO_FACTOR_READ_TIMEOUT,
+    retry=RetryPolicy(UPSTREAM_MAX_ATTEMPTS),
+    breaker=CircuitBreaker("two_factor_service", UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET),
+)
+REQUEST_SERVICE_TRANSPORT = HttpTransport(
+    REQUEST_SERVICE_URL, INTERNAL_CONTENT_TYPE, name="request_service",
+    connect_timeout=REQUEST_SERVICE_CONNECT_TIMEOUT, read_timeout=REQUEST_SERVICE_READ_TIMEOUT,
+    retry=RetryPolicy(UPSTREAM_MAX_ATTEMPTS),
+    breaker=CircuitBreaker("request_service", UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET),
+)
+
+# Шина инвалидаций кэшей между репликами gateway и request_service:
+# CACHE_BUS=local (только этот процесс, по умолчанию) | mysql (таблица cache_invalidations,
+# её создаёт DB_init.py; опрос раз в CACHE_BUS_POLL_INTERVAL) | redis (REDIS_URL).
+# Кэш не используется, если шина не синхронизировалась дольше CACHE_MAX_STALENESS секунд.
+CACHE_BUS = make_bus(
+    os.getenv("CACHE_BUS", "local"),
+    connect=lambda: get_db_connection(),
+    poll_interval=float(os.getenv("CACHE_BUS_POLL_INTERVAL", 1.0)),
+    redis_url=os.getenv("REDIS_URL"),
+)
+CACHE_MAX_STALENESS = float(os.getenv("CACHE_MAX_STALENESS", 5.0))
+
+# Кэш проверок активных 2FA-сессий для /execute (SESSION_CACHE_TTL=0 — выключить); запись
+# живёт не дольше session_expires_at сессии. Сбрасывается при изменении таблиц sessions/users
+# через request_service на любой реплике — если шина общая с request_service. С LocalBus
+# отдельного процесса gateway этих инвалидаций не видит и отдавал бы отозванную сессию
+# до конца TTL, поэтому по умолчанию кэш включён только с общей шиной (mysql, redis,
+# LocalBus совмещённого режима — use_cache_bus).
+SHARED_BUS_SESSION_CACHE_TTL = 30.0
+SESSION_CACHE = CoherentCache(
+    "sessions", CACHE_BUS,
+    ttl=float(os.getenv("SESSION_CACHE_TTL", 0 if CACHE_BUS.kind == "local" else SHARED_BUS_SESSION_CACHE_TTL)),
+    max_size=int(os.getenv("SESSION_CACHE_SIZE", 10000)),
+    max_staleness=CACHE_MAX_STALENESS,
+)
+
+# Контроль допуска: общий предел одновременных запросов gateway, последние
+# ADMISSION_RESERVED мест — только для /login и /validate_2fa. Сверх предела
+# и короткой очереди — сразу 503 с Retry-After (ADMISSION_ENABLED=0 — выключить).
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 16))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 0.5))
+ADMISSION = AdmissionController(
+    [
+        Lane("login", int(os.getenv("ADMISSION_AUTH_LIMIT", 16)), ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT,
+             priority=PRIORITY_HIGH),
+        Lane("validate_2fa", int(os.getenv("ADMISSION_AUTH_LIMIT", 16)), ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT,
+             priority=PRIORITY_HIGH),
+        Lane("execute", int(os.getenv("ADMISSION_EXECUTE_LIMIT", 32)), ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT),
+        Lane("execute_batch", int(os.getenv("ADMISSION_BATCH_LIMIT", 8)), ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT),
+        Lane("exports", int(os.getenv("ADMISSION_EXPORTS_LIMIT", 8)), ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT),
+        Lane("ingest", int(os.getenv("ADMISSION_INGEST_LIMIT", 2)), ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT),
+        Lane("dataset", int(os.getenv("ADMISSION_DATASET_LIMIT", 8)), ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT),
+    ],
+    capacity=int(os.getenv("ADMISSION_CAPACITY", 48)),
+    reserved=int(os.getenv("ADMISSION_RESERVED", 8)),
+    enabled=os.getenv("ADMISSION_ENABLED", "1") != "0",
+)
+
 app = Flask(__name__)
+json_provider.init_app(app)
+# Server-Timing и флаг выборки из traceparent клиента — только для адресов администраторов
+tracing.init_app(app, tracer, trusted=os.getenv("TRACE_TRUSTED_IPS", "127.0.0.1,::1").split(","))
+deadline.init_app(app, lambda body, status: (jsonify(body), status))
+
+HEALTH = Health("server")
+HEALTH.init_app(app, lambda body, status: (jsonify(body), status))
+
+# Профилирование (/debug/profile и заголовок X-Profile, см. profiler.py): токен администратора
+# PROFILER_TOKEN (пусто — выключено), адреса, с которых оно доступно, и предел сэмплирования в секундах
+PROFILER = Profiler(
+    "server",
+    token=os.getenv("PROFILER_TOKEN"),
+    allowed=os.getenv("PROFILER_ALLOWED_IPS", "127.0.0.1,::1").split(","),
+    max_seconds=float(os.getenv("PROFILER_MAX_SECONDS", 30)),
+)
+PROFILER.init_app(app, lambda body, status: (jsonify(body), status))
 
 # =============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # =============================================================================
 
+@tracer.traced("db.connect")
 def get_db_connection():
     """
-    Возвращает соединение к базе данных TrainSafe.
+    Возвращает соединение к базе данных TrainSafe из пула (close() возвращает его в пул).
+    После дедлайна запроса соединение не берётся (DeadlineExceeded).
     """
+    deadline.check("DB connection")
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = DB_POOL.get_connection()
         if conn.is_connected():
             return conn
     except Error as e:
-        print(f"Ошибка подключения к базе данных: {e}")
+        logger.error("Ошибка подключения к базе данных: %s", e)
     return None
 
 def is_ip_allowed(ip):
@@ -75,15 +207,80 @@ def is_ip_allowed(ip):
     # """
     # return True
 
-    print(f"Received IP for checking: {ip}")
-    for allowed_range in ALLOWED_IP_RANGES:
-        print(f"Testing against range: {allowed_range}")
-        if ipaddress.ip_address(ip) in ipaddress.ip_network(allowed_range):
-            print(f"IP {ip} is allowed")
+    address = ipaddress.ip_address(ip)
+    for allowed_range, network in allowed_networks():
+        if address in network:
+            logger.debug("IP %s is allowed by %s", ip, allowed_range)
             return True
-    print(f"IP {ip} is not allowed")
+    logger.info("IP %s is not allowed", ip)
     return False
 
+@functools.lru_cache(maxsize=1)
+def allowed_networks():
+    """ALLOWED_IP_RANGES, разобранные один раз (при прогреве), а не на каждый запрос."""
+    return tuple((r, ipaddress.ip_network(r)) for r in ALLOWED_IP_RANGES)
+
+
+def use_transports(two_factor, request_service):
+    """
+    Подменяет транспорт к two_factor_service и request_service.
+    """
+    global TWO_FACTOR_TRANSPORT, REQUEST_SERVICE_TRANSPORT
+    TWO_FACTOR_TRANSPORT = two_factor
+    REQUEST_SERVICE_TRANSPORT = request_service
+
+
+def use_cache_bus(bus):
+    """
+    Подменяет шину инвалидаций кэшей (совмещённый режим — общая LocalBus с request_service).
+    Шина общая с request_service, поэтому кэш сессий включается, если SESSION_CACHE_TTL не задан.
+    """
+    global CACHE_BUS
+    CACHE_BUS = bus
+    SESSION_CACHE.bind(bus)
+    if os.getenv("SESSION_CACHE_TTL") is None:
+        SESSION_CACHE.ttl = SHARED_BUS_SESSION_CACHE_TTL
+
+
+
+# =============================================================================
+# ГОТОВНОСТЬ И ПРОГРЕВ (/healthz, /readyz)
+# =============================================================================
+
+@HEALTH.warm_up_step("db_pool")
+def _warm_db_pool():
+    return DB_POOL.warm_up()
+
+
+@HEALTH.warm_up_step("ip_allowlist")
+def _warm_ip_allowlist():
+    return {"networks": len(allowed_networks())}
+
+
+@HEALTH.warm_up_step("upstreams")
+def _warm_upstreams():
+    # Открывает keep-alive соединения к сервисам; недоступность видна в /readyz
+    return {"two_factor_service": TWO_FACTOR_TRANSPORT.ping(), "request_service": REQUEST_SERVICE_TRANSPORT.ping()}
+
+
+@HEALTH.warm_up_step("cache_bus")
+def _warm_cache_bus():
+    CACHE_BUS.start()
+
+
+@HEALTH.check("db")
+def _check_db():
+    return DB_POOL.ping()
+
+
+@HEALTH.check("two_factor_service")
+def _check_two_factor_service():
+    return TWO_FACTOR_TRANSPORT.ping()
+
+
+@HEALTH.check("request_service")
+def _check_request_service():
+    return REQUEST_SERVICE_TRANSPORT.ping()
 
 
 # =============================================================================
@@ -102,8 +299,11 @@ class Handler:
         """
         Если обработчик не может/не хочет обрабатывать,
         передаёт дальше; иначе возвращает (body, code) или dict.
+        После дедлайна запроса цепочка дальше не идёт (504).
         """
         if self._next_handler:
+            if deadline.expired():
+                return {"error": "Deadline exceeded"}, 504
             return self._next_handler.handle(data)
         return data
 
@@ -116,6 +316,7 @@ class IPCheckHandler(Handler):
     """
     Проверка IP-адреса.
     """
+    @tracer.traced()
     def handle(self, data):
         ip_addr = data.get("client_ip")
         if not is_ip_allowed(ip_addr):
@@ -126,6 +327,7 @@ class LoginHandler(Handler):
     """
     Проверка логина/пароля.
     """
+    @tracer.traced()
     def handle(self, data):
         username = data.get("username")
         password = data.get("password")
@@ -135,11 +337,12 @@ class LoginHandler(Handler):
             return {"error": "Failed to connect DB"}, 500
         try:
             cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, role FROM users WHERE username=%s AND password=%s",
-                (username, password)
-            )
-            result = cursor.fetchone()
+            with tracer.span("db.users_lookup"):
+                cursor.execute(
+                    "SELECT id, role FROM users WHERE username=%s AND password=%s",
+                    (username, password)
+                )
+                result = cursor.fetchone()
             if not result:
                 return {"error": "Invalid username/password"}, 401
             user_id, role = result
@@ -157,16 +360,16 @@ class Generate2FAHandler(Handler):
     """
     Генерация 2FA-кода через сервис two_factor_service.
     """
+    @tracer.traced()
     def handle(self, data):
         user_id = data["user_id"]
         try:
-            resp = requests.post(
-                f"{TWO_FACTOR_SERVICE_URL}/generate_2fa",
-                json={"user_id": user_id}
-            )
+            resp = TWO_FACTOR_TRANSPORT.post("/generate_2fa", {"user_id": user_id})
             if resp.status_code != 200:
                 return {"error": "Failed to generate 2FA"}, 500
-        except requests.RequestException as e:
+        except CircuitOpenError as e:
+            return {"error": str(e)}, 503
+        except TransportError as e:
             return {"error": f"2FA service error: {e}"}, 500
 
         return super().handle(data)
@@ -181,6 +384,7 @@ class Validate2FAHandler(Handler):
     Делегирует проверку 2FA (код и user_id) на two_factor_service (/validate_2fa).
     Ожидается, что data содержит поля 'user_id' и 'code'.
     """
+    @tracer.traced()
     def handle(self, data):
         user_id = data.get("user_id")
         input_code = data.get("code")
@@ -190,45 +394,44 @@ class Validate2FAHandler(Handler):
 
         # Отправляем запрос к two_factor_service
         try:
-            print(f"[DEBUG] Отправляем запрос в two_factor_service: user_id={user_id}, code={input_code}")
-            resp = requests.post(
-                f"{TWO_FACTOR_SERVICE_URL}/validate_2fa",
-                json={"user_id": user_id, "code": input_code}
-            )
+            logger.debug("Отправляем запрос в two_factor_service: user_id=%s", user_id)
+            resp = TWO_FACTOR_TRANSPORT.post("/validate_2fa", {"user_id": user_id, "code": input_code})
             resp.raise_for_status()  # Проверяем HTTP статус
-        except requests.RequestException as e:
-            print(f"[ERROR] Ошибка при вызове two_factor_service: {e}")
+        except CircuitOpenError as e:
+            logger.error("two_factor_service недоступен: %s", e)
+            return {"error": str(e)}, 503
+        except TransportError as e:
+            logger.error("Ошибка при вызове two_factor_service: %s", e)
             return {"error": f"Failed to call two_factor_service: {e}"}, 500
 
         if resp.status_code == 200:
             # 2FA прошла успешно
             try:
                 resp_data = resp.json()
-                print(f"[DEBUG] Ответ от two_factor_service: {resp_data}")
 
                 # Проверяем наличие session_id
                 if "session_id" not in resp_data:
-                    print("[ERROR] Отсутствует session_id в ответе от two_factor_service")
+                    logger.error("Отсутствует session_id в ответе от two_factor_service")
                     return {"error": "Missing session_id in response"}, 500
 
                 # Добавляем данные в `data`
                 data["session_id"] = resp_data.get("session_id")
                 data["role"] = resp_data.get("role", data.get("role"))  # возможно обновить
-                print(f"[DEBUG] Данные после добавления session_id: {data}")
+                logger.debug("2FA подтверждена: user_id=%s, session_id=%s", user_id, data["session_id"])
                 return super().handle(data)
 
             except ValueError as e:
-                print(f"[ERROR] Ошибка обработки JSON-ответа от two_factor_service: {e}")
+                logger.error("Ошибка обработки ответа от two_factor_service: %s", e)
                 return {"error": "Invalid JSON response from two_factor_service"}, 500
 
         else:
             # Обработка ошибки от two_factor_service
             try:
                 err_data = resp.json()
-                print(f"[ERROR] Ошибка от two_factor_service: {err_data}")
+                logger.error("Ошибка от two_factor_service: %s", err_data.get("message"))
             except ValueError:
                 err_data = {"message": "Unknown error from two_factor_service"}
-                print(f"[ERROR] Некорректный ответ от two_factor_service")
+                logger.error("Некорректный ответ от two_factor_service")
             return {"error": err_data.get("message", "Invalid 2FA")}, resp.status_code
 
 
@@ -243,16 +446,32 @@ class Check2FASessionHandler(Handler):
 
     Ожидаем, что клиент передаёт: user_id, code (который вернулся ему после
     валидации). is_session_active = TRUE, session_expires_at > now().
+    Для /execute_batch вместо query передаётся список queries.
+    require_query=False — проверяется только сессия (статус и скачивание выгрузок).
+    Активная сессия кэшируется в SESSION_CACHE до истечения TTL или session_expires_at.
     """
+    def __init__(self, require_query=True):
+        super().__init__()
+        self.require_query = require_query
+
+    @tracer.traced()
     def handle(self, data):
         user_id = data.get("user_id")
         code = data.get("code")
-        role = data.get("role")
-        query = data.get("query")
 
-        # Для выполнения запроса нужны user_id, code (как "токен"), role, query
-        if not user_id or not code or not role or not query:
-            return {"error": "user_id, code, role, and query are required"}, 400
+        if self.require_query:
+            role = data.get("role")
+            query = data.get("query") or data.get("queries")
+            # Для выполнения запроса нужны user_id, code (как "токен"), role, query
+            if not user_id or not code or not role or not query:
+                return {"error": "user_id, code, role, and query are required"}, 400
+        elif not user_id or not code:
+            return {"error": "user_id and code are required"}, 400
+
+        cache_key = (str(user_id), str(code))
+        cached = SESSION_CACHE.get(cache_key)
+        if cached is not None and datetime.now() <= cached:
+            return super().handle(data)
 
         conn = get_db_connection()
         if not conn:
@@ -260,14 +479,15 @@ class Check2FASessionHandler(Handler):
 
         try:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT session_id, is_session_active, session_expires_at
-                FROM sessions
-                WHERE user_id = %s AND code = %s
-                ORDER BY expires_at DESC
-                LIMIT 1
-            ''', (user_id, code))
-            row = cursor.fetchone()
+            with tracer.span("db.session_lookup"):
+                cursor.execute('''
+                    SELECT session_id, is_session_active, session_expires_at
+                    FROM sessions
+                    WHERE user_id = %s AND code = %s
+                    ORDER BY expires_at DESC
+                    LIMIT 1
+                ''', (user_id, code))
+                row = cursor.fetchone()
             if not row:
                 return {"error": "Invalid session token"}, 401
 
@@ -278,6 +498,9 @@ class Check2FASessionHandler(Handler):
                 return {"error": "Session is not active"}, 401
             if datetime.now() > session_expires:
                 return {"error": "Session expired"}, 401
+            SESSION_CACHE.set(cache_key, session_expires,
+                              tags=("table:sessions", "table:users", f"user:{user_id}"),
+                              ttl=(session_expires - datetime.now()).total_seconds())
 
             # Можно при желании data["session_id"] = session_id
             # чтобы дальше логировать в logs.
@@ -294,22 +517,142 @@ class Check2FASessionHandler(Handler):
 class RequestServiceHandler(Handler):
     """
     Делегирует запрос к микросервису request_service.py (/execute_sql),
-    передавая JSON: {role, query, user_id}.
+    передавая JSON: {role, query, params, user_id, session_id, username, transaction_id}.
+    transaction_id — транзакция сессии, открытая через BEGIN (см. request_service/transactions.py).
+    """
+    @tracer.traced()
+    def handle(self, data):
+        payload = {
+            "role": data.get("role"),
+            "query": data.get("query"),
+            "params": data.get("params"),
+            "user_id": data.get("user_id"),
+            "session_id": data.get("session_id"),
+            "username": data.get("username", "unknown"),
+            "transaction_id": data.get("transaction_id"),
+        }
+
+        # viewer может выполнять только SELECT, поэтому его запрос безопасно повторить
+        idempotent = data.get("role") == "viewer"
+        try:
+            resp = REQUEST_SERVICE_TRANSPORT.post("/execute_sql", payload, idempotent=idempotent)
+            return resp.relay()
+        except CircuitOpenError as e:
+            return {"error": str(e)}, 503
+        except TransportError as e:
+            return {"error": f"request_service error: {e}"}, 500
+
+
+class RequestServiceBatchHandler(Handler):
+    """
+    Делегирует пакет запросов к микросервису request_service.py (/execute_sql_batch),
+    передавая JSON: {role, queries, transaction, user_id, session_id, username}.
+    """
+    @tracer.traced()
+    def handle(self, data):
+        payload = {
+            "role": data.get("role"),
+            "queries": data.get("queries"),
+            "transaction": bool(data.get("transaction")),
+            "user_id": data.get("user_id"),
+            "session_id": data.get("session_id"),
+            "username": data.get("username", "unknown")
+        }
+
+        idempotent = data.get("role") == "viewer"
+        try:
+            resp = REQUEST_SERVICE_TRANSPORT.post("/execute_sql_batch", payload, idempotent=idempotent)
+            return resp.relay()
+        except CircuitOpenError as e:
+            return {"error": str(e)}, 503
+        except TransportError as e:
+            return {"error": f"request_service error: {e}"}, 500
+
+
+class ExportSubmitHandler(Handler):
+    """
+    Ставит выгрузку SELECT в очередь request_service (/exports),
+    передавая JSON: {role, query, params, format, user_id, session_id, username}.
     """
+    @tracer.traced()
     def handle(self, data):
         payload = {
             "role": data.get("role"),
             "query": data.get("query"),
+            "params": data.get("params"),
+            "format": data.get("format", "csv"),
             "user_id": data.get("user_id"),
             "session_id": data.get("session_id"),
             "username": data.get("username", "unknown")
-            # Если нужно, можно передать session_id, если его сохранили
         }
+        try:
+            resp = REQUEST_SERVICE_TRANSPORT.post("/exports", payload)
+            return resp.relay()
+        except CircuitOpenError as e:
+            return {"error": str(e)}, 503
+        except TransportError as e:
+            return {"error": f"request_service error: {e}"}, 500
+
+
+class ExportFetchHandler(Handler):
+    """
+    Статус выгрузки или её файл из request_service (GET /exports/<job_id>[/download]).
+    Файл передаётся клиенту потоком, заголовок Range пробрасывается как есть.
+    """
+    def __init__(self, download=False):
+        super().__init__()
+        self.download = download
 
+    @tracer.traced()
+    def handle(self, data):
+        path = f"/exports/{data['job_id']}" + ("/download" if self.download else "")
+        headers = {"Range": data["range"]} if data.get("range") else None
+        try:
+            resp = REQUEST_SERVICE_TRANSPORT.get(path, params={"user_id": data.get("user_id")},
+                                                 headers=headers, stream=self.download)
+            return resp.relay()
+        except CircuitOpenError as e:
+            return {"error": str(e)}, 503
+        except TransportError as e:
+            return {"error": f"request_service error: {e}"}, 500
+
+
+class IngestHandler(Handler):
+    """
+    Потоковая загрузка строк в train_data через request_service (POST /ingest).
+    Тело запроса клиента передаётся сервису потоком, без буферизации в gateway.
+    """
+    @tracer.traced()
+    def handle(self, data):
+        params = {key: data.get(key) for key in
+                  ("user_id", "session_id", "username", "role", "format", "on_duplicate", "commit_rows")
+                  if data.get(key) is not None}
+        headers = {key: data[key] for key in ("Content-Type", "Content-Encoding") if data.get(key)}
+        try:
+            resp = REQUEST_SERVICE_TRANSPORT.upload("/ingest", data["stream"], params=params,
+                                                    headers=headers, read_timeout=INGEST_READ_TIMEOUT)
+            return resp.relay()
+        except CircuitOpenError as e:
+            return {"error": str(e)}, 503
+        except TransportError as e:
+            return {"error": f"request_service error: {e}"}, 500
+
+
+class DatasetHandler(Handler):
+    """
+    Поток мини-батчей train_data из request_service (GET /dataset/batches).
+    Батчи передаются клиенту потоком, без буферизации в gateway.
+    """
+    @tracer.traced()
+    def handle(self, data):
+        params = {key: data.get(key) for key in DATASET_PARAMS + ("user_id", "session_id", "username", "role")
+                  if data.get(key) is not None}
         try:
-            resp = requests.post(f"{REQUEST_SERVICE_URL}/execute_sql", json=payload)
-            return resp.content, resp.status_code, resp.headers.items()
-        except requests.RequestException as e:
+            resp = REQUEST_SERVICE_TRANSPORT.get("/dataset/batches", params=params, stream=True)
+            return resp.relay()
+        except CircuitOpenError as e:
+            return {"error": str(e)}, 503
+        except TransportError as e:
             return {"error": f"request_service error: {e}"}, 500
 
 
@@ -317,7 +660,57 @@ class RequestServiceHandler(Handler):
 # FLASK-МАРШРУТЫ
 # =============================================================================
 
+def chain_response(result):
+    """
+    Преобразует результат цепочки обработчиков в ответ Flask:
+    (body, code) — JSON, (content, code, headers) — ответ сервиса как есть.
+    """
+    if isinstance(result, tuple):
+        if len(result) == 2:
+            body, code = result
+            return jsonify(body), code
+        elif len(result) == 3:
+            content, code, headers = result
+            return content, code, headers
+
+    if isinstance(result, dict) and "error" in result:
+        return jsonify({"message": result["error"]}), 400
+
+    return jsonify({"message": "Unexpected error"}), 500
+
+def admitted(lane):
+    """
+    Декоратор маршрута: обработка только после допуска в полосу lane (ADMISSION).
+    При перегрузке — 503 с Retry-After без выполнения цепочки.
+    Место потокового ответа освобождается, когда сервер закроет его тело
+    (передано полностью или клиент отключился), остальных — по возврате из маршрута.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                release = ADMISSION.hold(lane)
+            except Overloaded as e:
+                logger.warning("Запрос %s отклонён: %s", request.path, e.reason)
+                return (jsonify({"message": "Server is overloaded, please retry later"}), 503,
+                        {"Retry-After": str(e.retry_after)})
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                release()
+                raise
+            if response.is_streamed:
+                response.call_on_close(release)
+            else:
+                release()
+            return response
+        return wrapper
+    return decorator
+
+
 @app.route('/login', methods=['POST'])
+@deadline.bounded(DEADLINE_AUTH)
+@admitted("login")
 def login():
     """
     Цепочка для /login:
@@ -358,13 +751,16 @@ def login():
             "role": role
         }), 200
 
+    except deadline.DeadlineExceeded as e:
+        return jsonify({"message": str(e)}), 504
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Ошибка при обработке /login")
         return jsonify({"message": f"Internal Server Error: {str(e)}"}), 500
 
 
 @app.route('/validate_2fa', methods=['POST'])
+@deadline.bounded(DEADLINE_AUTH)
+@admitted("validate_2fa")
 def validate_2fa():
     """
     Делегирует проверку кода 2FA в two_factor_service.
@@ -389,6 +785,8 @@ def validate_2fa():
 
 
 @app.route('/execute', methods=['POST'])
+@deadline.bounded(DEADLINE_EXECUTE)
+@admitted("execute")
 def execute_query():
     """
     Пример цепочки для /execute:
@@ -421,21 +819,202 @@ def execute_query():
     # ip_handler.set_next(validate_2fa_handler).set_next(request_service)
 
     result = ip_handler.handle(data)
+    return chain_response(result)
 
-    if isinstance(result, tuple):
-        if len(result) == 2:
-            body, code = result
-            return jsonify(body), code
-        elif len(result) == 3:
-            content, code, headers = result
-            return content, code, headers
 
-    if isinstance(result, dict) and "error" in result:
-        return jsonify({"message": result["error"]}), 400
+@app.route('/execute_batch', methods=['POST'])
+@deadline.bounded(DEADLINE_BATCH)
+@admitted("execute_batch")
+def execute_batch():
+    """
+    Несколько запросов за один вызов (один проход IP-проверки и проверки сессии,
+    одно соединение к БД и одна вставка аудита в request_service).
+    Ожидаем JSON: {username, user_id, code, role, session_id, queries: [...], transaction: bool}
+    1) IPCheckHandler
+    2) Check2FASessionHandler
+    3) RequestServiceBatchHandler
+    """
+    data = request.json or {}
+    data["client_ip"] = request.remote_addr
+
+    if "username" not in data:
+        return jsonify({"message": "Username is required"}), 400
+    if not isinstance(data.get("queries"), list):
+        return jsonify({"message": "queries must be a list"}), 400
+
+    ip_handler = IPCheckHandler()
+    ip_handler.set_next(Check2FASessionHandler()).set_next(RequestServiceBatchHandler())
+
+    result = ip_handler.handle(data)
+    return chain_response(result)
+
+
+@app.route('/exports', methods=['POST'])
+@deadline.bounded(DEADLINE_EXPORTS)
+@admitted("exports")
+def create_export():
+    """
+    Асинхронная выгрузка результата SELECT в файл (gzip-CSV или Parquet).
+    Ожидаем JSON как у /execute плюс "format": "csv" | "parquet"; в ответе — job_id (202).
+    1) IPCheckHandler
+    2) Check2FASessionHandler
+    3) ExportSubmitHandler
+    """
+    data = request.json or {}
+    data["client_ip"] = request.remote_addr
+
+    if "username" not in data:
+        return jsonify({"message": "Username is required"}), 400
+
+    ip_handler = IPCheckHandler()
+    ip_handler.set_next(Check2FASessionHandler()).set_next(ExportSubmitHandler())
+
+    result = ip_handler.handle(data)
+    return chain_response(result)
+
+
+@app.route('/ingest', methods=['POST'])
+@admitted("ingest")
+def ingest():
+    """
+    Потоковая загрузка CSV или NDJSON в train_data (для editor и admin).
+    Сессия и роль — заголовками X-User-Id, X-Session-Code, X-Session-Id, X-Role, X-Username;
+    ?format=csv|ndjson (по умолчанию — по Content-Type), ?on_duplicate=skip|update, ?commit_rows=N.
+    1) IPCheckHandler
+    2) Check2FASessionHandler
+    3) IngestHandler
+    """
+    fmt = request.args.get("format")
+    if not fmt:
+        fmt = "ndjson" if request.mimetype in ("application/x-ndjson", "application/jsonl") else "csv"
+    data = {
+        "client_ip": request.remote_addr,
+        "user_id": request.headers.get("X-User-Id"),
+        "code": request.headers.get("X-Session-Code"),
+        "session_id": request.headers.get("X-Session-Id"),
+        "role": request.headers.get("X-Role"),
+        "username": request.headers.get("X-Username"),
+        "format": fmt,
+        "on_duplicate": request.args.get("on_duplicate"),
+        "commit_rows": request.args.get("commit_rows"),
+        "Content-Type": request.headers.get("Content-Type"),
+        "Content-Encoding": request.headers.get("Content-Encoding"),
+        "stream": request.stream,
+    }
+    if not data["role"] or not data["session_id"]:
+        return jsonify({"message": "X-Role and X-Session-Id headers are required"}), 400
+
+    ip_handler = IPCheckHandler()
+    ip_handler.set_next(Check2FASessionHandler(require_query=False)).set_next(IngestHandler())
+
+    result = ip_handler.handle(data)
+    return chain_response(result)
+
+
+# Параметры /dataset/batches, которые передаются request_service как есть
+DATASET_PARAMS = ("columns", "batch_size", "seed", "epoch", "cursor", "format", "drop_last", "max_batches")
+
+
+@app.route('/dataset/batches', methods=['GET'])
+@admitted("dataset")
+def dataset_batches():
+    """
+    Поток мини-батчей train_data для обучения: ?columns=a,b&batch_size=256&seed=0&epoch=0,
+    ?cursor= — продолжить эпоху, ?format=npy|ndjson, ?max_batches=N, ?drop_last=1.
+    Сессия и роль — заголовками X-User-Id, X-Session-Code, X-Session-Id, X-Role, X-Username.
+    1) IPCheckHandler
+    2) Check2FASessionHandler
+    3) DatasetHandler
+    """
+    data = {key: request.args.get(key) for key in DATASET_PARAMS}
+    data.update({
+        "client_ip": request.remote_addr,
+        "user_id": request.headers.get("X-User-Id"),
+        "code": request.headers.get("X-Session-Code"),
+        "session_id": request.headers.get("X-Session-Id"),
+        "role": request.headers.get("X-Role"),
+        "username": request.headers.get("X-Username"),
+    })
+    if not data["role"] or not data["session_id"]:
+        return jsonify({"message": "X-Role and X-Session-Id headers are required"}), 400
+
+    ip_handler = IPCheckHandler()
+    ip_handler.set_next(Check2FASessionHandler(require_query=False)).set_next(DatasetHandler())
+
+    result = ip_handler.handle(data)
+    return chain_response(result)
+
+
+def export_fetch(job_id, download):
+    """
+    Общая цепочка для статуса и скачивания выгрузки. Сессия передаётся
+    заголовками X-User-Id и X-Session-Code (code, полученный после /validate_2fa).
+    """
+    data = {
+        "client_ip": request.remote_addr,
+        "user_id": request.headers.get("X-User-Id"),
+        "code": request.headers.get("X-Session-Code"),
+        "job_id": job_id,
+        "range": request.headers.get("Range"),
+    }
+
+    ip_handler = IPCheckHandler()
+    ip_handler.set_next(Check2FASessionHandler(require_query=False)).set_next(
+        ExportFetchHandler(download=download))
+
+    result = ip_handler.handle(data)
+    return chain_response(result)
+
+
+@app.route('/exports/<job_id>', methods=['GET'])
+@deadline.bounded(DEADLINE_EXPORTS)
+@admitted("exports")
+def get_export(job_id):
+    """Статус выгрузки: queued | running | done | failed, число строк и размер файла."""
+    return export_fetch(job_id, download=False)
+
+
+@app.route('/exports/<job_id>/download', methods=['GET'])
+@admitted("exports")
+def download_export(job_id):
+    """Файл выгрузки; поддерживается Range для докачки."""
+    return export_fetch(job_id, download=True)
+
+
+@app.route('/upstreams', methods=['GET'])
+def upstreams():
+    """
+    Состояние вызовов микросервисов: таймауты, состояние circuit breaker и число срабатываний.
+    """
+    if not is_ip_allowed(request.remote_addr):
+        return jsonify({"message": "Invalid IP address"}), 403
+    return jsonify({
+        "two_factor_service": TWO_FACTOR_TRANSPORT.stats(),
+        "request_service": REQUEST_SERVICE_TRANSPORT.stats(),
+    }), 200
+
+
+@app.route('/admission', methods=['GET'])
+def admission():
+    """Контроль допуска: занятые места, глубина очередей, время ожидания и число отказов по полосам."""
+    if not is_ip_allowed(request.remote_addr):
+        return jsonify({"message": "Invalid IP address"}), 403
+    return jsonify(ADMISSION.snapshot()), 200
 
-    return jsonify({"message": "Unexpected error"}), 500
 
+@app.route('/caches', methods=['GET'])
+def caches():
+    """Состояние кэшей gateway и шины инвалидаций."""
+    if not is_ip_allowed(request.remote_addr):
+        return jsonify({"message": "Invalid IP address"}), 403
+    return jsonify({
+        "bus": CACHE_BUS.snapshot(),
+        "caches": [SESSION_CACHE.snapshot()],
+    }), 200
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=6000, debug=True)
\ No newline at end of file
+    # FLASK_DEBUG=0 — без debug и reloader-а
+    app.debug = os.getenv("FLASK_DEBUG", "1") not in ("0", "false", "no")
+    HEALTH.start_on_run(app)
+    app.run(host="0.0.0.0", port=6000, debug=app.debug)
\ No newline at end of file
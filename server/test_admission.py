@@ -0,0 +1,129 @@
+"""Контроль допуска: пределы полос, резерв для приоритетных, сброс нагрузки и места потоковых ответов."""
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import server
+from admission import PRIORITY_HIGH, AdmissionController, Lane, Overloaded
+
+
+def controller(capacity=4, reserved=1, limit=2, queue_size=2, max_wait=0.2):
+    return AdmissionController([
+        Lane("login", limit=capacity, queue_size=queue_size, max_wait=max_wait, priority=PRIORITY_HIGH),
+        Lane("execute", limit=limit, queue_size=queue_size, max_wait=max_wait),
+        Lane("dataset", limit=limit, queue_size=queue_size, max_wait=max_wait),
+    ], capacity=capacity, reserved=reserved)
+
+
+def test_lane_limit_sheds_when_queue_is_full():
+    admission = controller(queue_size=0)
+    admission.acquire("execute")
+    admission.acquire("execute")
+    with pytest.raises(Overloaded) as info:
+        admission.acquire("execute")
+    assert info.value.reason == "queue full" and info.value.retry_after >= 1
+    assert admission.lanes["execute"].shed_queue_full == 1
+    admission.acquire("dataset")
+
+
+def test_queued_request_times_out():
+    admission = controller(limit=1, max_wait=0.05)
+    admission.acquire("execute")
+    with pytest.raises(Overloaded) as info:
+        admission.acquire("execute")
+    assert info.value.reason == "queue timeout"
+    snapshot = admission.snapshot()["lanes"]["execute"]
+    assert (snapshot["in_flight"], snapshot["queue_depth"], snapshot["shed_timeout"]) == (1, 0, 1)
+
+
+def test_reserved_capacity_is_left_for_priority_lane():
+    admission = controller(capacity=3, reserved=1, queue_size=0)
+    admission.acquire("execute")
+    admission.acquire("dataset")
+    with pytest.raises(Overloaded):
+        admission.acquire("dataset")
+    admission.acquire("login")
+    assert admission.in_flight == 3
+
+
+def test_released_slot_goes_to_waiting_request():
+    admission = controller(limit=1, max_wait=5)
+    admission.acquire("execute")
+    admitted = threading.Event()
+
+    def wait():
+        admission.acquire("execute")
+        admitted.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    while admission.lanes["execute"].waiting == 0:
+        time.sleep(0.001)
+    assert not admitted.is_set()
+    admission.release("execute", 0.01)
+    thread.join()
+    assert admitted.is_set() and admission.lanes["execute"].in_flight == 1
+
+
+def test_hold_releases_once():
+    admission = controller()
+    release = admission.hold("execute")
+    release()
+    release()
+    assert admission.in_flight == 0 and admission.lanes["execute"].in_flight == 0
+
+
+@pytest.fixture
+def app(monkeypatch):
+    admission = controller(limit=1, queue_size=0)
+    monkeypatch.setattr(server, "ADMISSION", admission)
+    app = Flask(__name__)
+
+    @app.route("/stream")
+    @server.admitted("dataset")
+    def stream():
+        def chunks():
+            yield b"a"
+            yield b"b"
+        return chunks(), 200, [("Content-Type", "application/octet-stream")]
+
+    @app.route("/plain")
+    @server.admitted("execute")
+    def plain():
+        return {"ok": True}, 200
+
+    @app.route("/fail")
+    @server.admitted("execute")
+    def fail():
+        raise RuntimeError("boom")
+
+    app.admission = admission
+    return app
+
+
+def test_streamed_response_holds_slot_until_closed(app):
+    client = app.test_client()
+    response = client.get("/stream", buffered=False)
+    assert app.admission.lanes["dataset"].in_flight == 1
+    assert client.get("/stream").status_code == 503
+    assert b"".join(response.response) == b"ab"
+    response.close()
+    assert app.admission.lanes["dataset"].in_flight == 0
+    assert client.get("/stream").data == b"ab"
+
+
+def test_stream_closed_early_releases_slot(app):
+    response = app.test_client().get("/stream", buffered=False)
+    next(iter(response.response))
+    response.close()
+    assert app.admission.in_flight == 0
+
+
+def test_plain_response_releases_slot_on_return(app):
+    client = app.test_client()
+    assert client.get("/plain", buffered=False).json == {"ok": True}
+    assert app.admission.lanes["execute"].in_flight == 0
+    assert client.get("/fail").status_code == 500
+    assert app.admission.lanes["execute"].in_flight == 0
@@ -0,0 +1,97 @@
+"""Состояния CircuitBreaker: closed → open → half_open и возврат пробы."""
+import threading
+
+import pytest
+
+from resilience import CircuitBreaker, RetryPolicy
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("resilience.time.monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow_request()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_and_rejects(clock):
+    breaker = CircuitBreaker("svc", failure_threshold=3, reset_timeout=10)
+    open_breaker(breaker)
+    assert breaker.snapshot()["state"] == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()["rejected"] == 1
+    assert breaker.trips == 1
+
+
+def test_success_resets_consecutive_failures(clock):
+    breaker = CircuitBreaker("svc", failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.snapshot()["state"] == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_single_probe(clock):
+    breaker = CircuitBreaker("svc", failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock[0] += 10
+    assert breaker.allow_request()
+    assert breaker.snapshot()["state"] == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+
+def test_probe_success_closes_and_failure_reopens(clock):
+    breaker = CircuitBreaker("svc", failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock[0] += 10
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.snapshot()["state"] == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+    clock[0] += 10
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.snapshot()["state"] == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_released_probe_can_be_taken_again(clock):
+    breaker = CircuitBreaker("svc", failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock[0] += 10
+    assert breaker.allow_request()
+    breaker.release_probe()
+    assert breaker.snapshot()["state"] == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_release_probe_from_other_thread_keeps_probe(clock):
+    breaker = CircuitBreaker("svc", failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock[0] += 10
+    assert breaker.allow_request()
+    other = threading.Thread(target=breaker.release_probe)
+    other.start()
+    other.join()
+    assert not breaker.allow_request()
+
+
+def test_release_probe_outside_half_open_is_noop(clock):
+    breaker = CircuitBreaker("svc", failure_threshold=1, reset_timeout=10)
+    breaker.release_probe()
+    open_breaker(breaker)
+    breaker.release_probe()
+    assert breaker.snapshot()["state"] == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_retry_delay_is_bounded():
+    policy = RetryPolicy(max_attempts=5, backoff_base=0.1, backoff_max=0.3)
+    for attempt in range(1, 6):
+        assert 0 <= policy.delay(attempt) <= min(0.3, 0.1 * 2 ** (attempt - 1))
@@ -0,0 +1,136 @@
+"""HttpTransport: дедлайны вызывающего и проба half_open breaker."""
+import socket
+import threading
+
+import pytest
+
+from common import deadline
+from resilience import CircuitBreaker, RetryPolicy
+from transport import HttpTransport, TransportError
+
+
+@pytest.fixture
+def silent_server():
+    """Сокет, который принимает соединения и никогда не отвечает."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    accepted = []
+    stop = threading.Event()
+
+    def accept():
+        listener.settimeout(0.05)
+        while not stop.is_set():
+            try:
+                accepted.append(listener.accept()[0])
+            except OSError:
+                continue
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{listener.getsockname()[1]}"
+    stop.set()
+    thread.join()
+    for conn in accepted:
+        conn.close()
+    listener.close()
+
+
+def half_open_transport(url):
+    breaker = CircuitBreaker("svc", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    return HttpTransport(url, name="svc", read_timeout=5, retry=RetryPolicy(max_attempts=1),
+                         breaker=breaker)
+
+
+@pytest.mark.parametrize("call", [
+    lambda t: t.post("/x", {}),
+    lambda t: t.get("/x"),
+    lambda t: t.upload("/x", __import__("io").BytesIO(b"data")),
+])
+def test_deadline_during_probe_releases_it(silent_server, call):
+    transport = half_open_transport(silent_server)
+    with deadline.scope(0.2):
+        with pytest.raises(deadline.DeadlineExceeded):
+            call(transport)
+    assert transport.breaker.snapshot()["state"] == CircuitBreaker.HALF_OPEN
+    assert transport.breaker.allow_request()
+
+
+def test_expired_deadline_does_not_take_probe(silent_server):
+    transport = half_open_transport(silent_server)
+    with deadline.scope(0.001):
+        threading.Event().wait(0.01)
+        with pytest.raises(deadline.DeadlineExceeded):
+            transport.post("/x", {})
+    assert transport.breaker.snapshot()["rejected"] == 0
+    assert transport.breaker.allow_request()
+
+
+def test_unreachable_service_reopens_breaker():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    transport = half_open_transport(f"http://127.0.0.1:{port}")
+    with pytest.raises(TransportError):
+        transport.post("/x", {})
+    assert transport.breaker.snapshot()["state"] == CircuitBreaker.OPEN
+
+
+@pytest.fixture
+def status_server():
+    """HTTP-сервер, который отвечает на каждый запрос статусом из statuses (по очереди)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    statuses = []
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(length)
+            calls.append(self.path)
+            status = statuses.pop(0) if statuses else 200
+            body = b'{"message": "x"}'
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", statuses, calls
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_application_error_is_not_retried_or_counted(status_server):
+    url, statuses, calls = status_server
+    transport = HttpTransport(url, name="svc", retry=RetryPolicy(max_attempts=3, backoff_base=0),
+                              breaker=CircuitBreaker("svc", failure_threshold=2))
+    for _ in range(3):
+        statuses.append(500)
+        assert transport.post("/execute_sql", {}, idempotent=True).status_code == 500
+        statuses.append(500)
+        assert transport.get("/x").status_code == 500
+    assert len(calls) == 6
+    assert transport.breaker.snapshot()["state"] == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize("status", [502, 503])
+def test_unavailable_status_is_retried_and_counted(status_server, status):
+    url, statuses, calls = status_server
+    transport = HttpTransport(url, name="svc", retry=RetryPolicy(max_attempts=2, backoff_base=0),
+                              breaker=CircuitBreaker("svc", failure_threshold=1))
+    statuses.extend([status, status])
+    assert transport.post("/x", {}, idempotent=True).status_code == status
+    assert len(calls) == 2
+    assert transport.breaker.snapshot()["state"] == CircuitBreaker.OPEN
@@ -0,0 +1,398 @@
+"""
+Транспорт для вызовов микросервисов из обработчиков server.py.
+
+HttpTransport      — распределённый вариант: сервисы в отдельных процессах, вызов по HTTP.
+InProcessTransport — совмещённый режим (combined.py): функции сервисов вызываются
+                     напрямую в том же процессе, без сериализации и сети.
+
+HTTP-вызовы ограничены таймаутами подключения/чтения, повторяются с джиттером
+(только если это безопасно) и проходят через circuit breaker (resilience.py).
+Таймауты и повторы укладываются в остаток дедлайна запроса (deadline.py), а сам
+остаток передаётся сервису заголовком; истёкший дедлайн — DeadlineExceeded, а не сбой
+сервиса: breaker он не открывает, а пробу half_open возвращает (release_probe).
+
+Оба транспорта возвращают ServiceResponse с интерфейсом, знакомым по requests
+(status_code, json(), raise_for_status()), поэтому обработчики не зависят от режима.
+Помимо POST поддерживается GET (в том числе потоковый — для скачивания выгрузок)
+и потоковая загрузка тела (upload — для /ingest).
+"""
+import json
+import logging
+import time
+
+import requests
+from urllib3.exceptions import NewConnectionError
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+
+from common import codec, deadline, tracing
+from resilience import CircuitBreaker, RetryPolicy
+
+logger = logging.getLogger("server.transport")
+tracer = tracing.Tracer("server")
+
+# Заголовки потокового ответа сервиса, которые передаются клиенту
+STREAM_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges",
+                  "Content-Disposition")
+STREAM_CHUNK_SIZE = 256 * 1024
+# Ответы, которые означают сбой самого сервиса (или прокси перед ним): их повторяют и
+# учитывают в breaker. 500 сервисы отдают и на ошибки в запросе пользователя (SQL с опечаткой) —
+# это ответ работающего сервиса. 504 — запрос брошен по дедлайну вызывающего, повтор бессмыслен.
+UPSTREAM_FAILURE_STATUSES = (502, 503)
+
+
+class TransportError(Exception):
+    """Сервис недоступен или ответил ошибкой (аналог requests.RequestException)."""
+
+
+class CircuitOpenError(TransportError):
+    """Breaker сервиса открыт: запрос отклонён без обращения к сервису."""
+
+
+class ServiceResponse:
+    """
+    Ответ микросервиса.
+
+    В HTTP-режиме хранит сырые байты (content) и заголовки — JSON можно отдать
+    клиенту как есть, не разбирая. В совмещённом режиме хранит готовый dict (body).
+    Потоковый ответ (stream) — итератор кусков тела, который читается при отдаче клиенту.
+    """
+    def __init__(self, status_code, body=None, content=None, headers=None, stream=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.stream = stream
+        self._body = body
+
+    @property
+    def is_msgpack(self):
+        content_type = self.headers.get("Content-Type", "")
+        return content_type.split(";")[0].strip() == codec.MSGPACK_MIMETYPE
+
+    def json(self):
+        """
+        Тело ответа как dict (из JSON или MessagePack).
+        Бросает ValueError, если тело не разбирается.
+        """
+        if self._body is None:
+            if self.is_msgpack:
+                try:
+                    self._body = codec.unpackb(self.content)
+                except Exception as e:
+                    raise ValueError(f"Invalid MessagePack body: {e}") from e
+            else:
+                self._body = json.loads(self.content)
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise TransportError(f"{self.status_code} Error returned by service")
+
+    def relay(self):
+        """
+        Ответ в форме, которую возвращают обработчики цепочки:
+        (content, code, headers) для JSON по HTTP или потокового ответа, (body, code) —
+        для MessagePack (наружу всегда уходит JSON) и совмещённого режима.
+        """
+        if self.stream is not None:
+            headers = [(k, self.headers[k]) for k in STREAM_HEADERS if k in self.headers]
+            return self.stream, self.status_code, headers
+        if self.content is not None and not self.is_msgpack:
+            return self.content, self.status_code, self.headers.items()
+        return self.json(), self.status_code
+
+
+def _request_not_sent(exc):
+    """Запрос гарантированно не дошёл до сервиса (таймаут или отказ в подключении)."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(exc, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def _iter_and_close(resp):
+    """Куски тела потокового ответа requests; соединение освобождается по окончании."""
+    try:
+        yield from resp.iter_content(STREAM_CHUNK_SIZE)
+    finally:
+        resp.close()
+
+
+def _timeouts(connect_timeout, read_timeout):
+    """(connect, read) не больше остатка дедлайна; DeadlineExceeded, если он истёк."""
+    return deadline.cap(connect_timeout), deadline.cap(read_timeout)
+
+
+def _can_retry(delay):
+    """Повтор после паузы delay ещё укладывается в дедлайн."""
+    left = deadline.remaining()
+    return left is None or left > delay
+
+
+class HttpTransport:
+    """
+    Вызов микросервиса по HTTP (requests).
+
+    content_type: codec.JSON_MIMETYPE (по умолчанию) или codec.MSGPACK_MIMETYPE —
+    формат тела запроса и предпочитаемый формат ответа.
+    connect_timeout/read_timeout — таймауты в секундах.
+    retry — RetryPolicy. Повтор после таймаута подключения или отказа в подключении
+    безопасен всегда (запрос не дошёл до сервиса); после таймаута чтения, обрыва или
+    ответа из UPSTREAM_FAILURE_STATUSES — только для вызовов с idempotent=True.
+    breaker — CircuitBreaker; сбоями считаются только ошибки соединения, таймауты и
+    UPSTREAM_FAILURE_STATUSES. При открытом breaker бросается CircuitOpenError.
+    Таймауты сокращаются до остатка дедлайна запроса; если он истёк до или во время
+    вызова — бросается deadline.DeadlineExceeded.
+    """
+
+    def __init__(self, base_url, content_type=codec.JSON_MIMETYPE, name=None,
+                 connect_timeout=1.0, read_timeout=10.0, retry=None, breaker=None):
+        self.base_url = base_url
+        if content_type == codec.MSGPACK_MIMETYPE and not codec.msgpack_available():
+            logger.warning("msgpack is not installed, falling back to JSON")
+            content_type = codec.JSON_MIMETYPE
+        self.content_type = content_type
+        self.name = name or base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(self.name)
+        # Keep-alive соединения к сервису переиспользуются между запросами
+        self.session = requests.Session()
+
+    def post(self, path, payload, idempotent=False):
+        with tracer.span(f"http.{self.name}{path}", tracing.SPAN_KIND_CLIENT,
+                         **{"http.url": f"{self.base_url}{path}"}) as span:
+            resp = self._post(path, payload, idempotent)
+            if span is not None:
+                span.set_attribute("http.status_code", resp.status_code)
+            return resp
+
+    def _post(self, path, payload, idempotent):
+        url = f"{self.base_url}{path}"
+        headers = deadline.inject(tracing.inject({}))
+        if self.content_type == codec.MSGPACK_MIMETYPE:
+            headers.update({"Content-Type": codec.MSGPACK_MIMETYPE, "Accept": codec.MSGPACK_MIMETYPE})
+            kwargs = {"data": codec.packb(payload), "headers": headers}
+        else:
+            kwargs = {"json": payload, "headers": headers}
+
+        # Дедлайн проверяется до breaker: истёкший запрос не должен занимать пробу half_open
+        timeout = _timeouts(self.connect_timeout, self.read_timeout)
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        try:
+            return self._post_attempts(url, kwargs, idempotent, timeout)
+        finally:
+            self.breaker.release_probe()
+
+    def _post_attempts(self, url, kwargs, idempotent, timeout):
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1:
+                timeout = _timeouts(self.connect_timeout, self.read_timeout)
+            try:
+                resp = self.session.post(url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                if deadline.expired():
+                    raise deadline.DeadlineExceeded(f"Deadline exceeded waiting for {self.name}") from e
+                retriable = idempotent or _request_not_sent(e)
+                delay = self.retry.delay(attempt)
+                if retriable and attempt < self.retry.max_attempts and _can_retry(delay):
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+                raise TransportError(str(e)) from e
+
+            if resp.status_code in UPSTREAM_FAILURE_STATUSES:
+                delay = self.retry.delay(attempt)
+                if idempotent and attempt < self.retry.max_attempts and _can_retry(delay):
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return ServiceResponse(resp.status_code, content=resp.content, headers=resp.headers)
+
+    def get(self, path, params=None, headers=None, stream=False):
+        """
+        GET к сервису. Повторяется как идемпотентный вызов.
+        stream=True — тело успешного ответа не читается сразу, а отдаётся итератором
+        ServiceResponse.stream (скачивание файлов без буферизации в gateway).
+        """
+        with tracer.span(f"http.{self.name}{path}", tracing.SPAN_KIND_CLIENT,
+                         **{"http.url": f"{self.base_url}{path}", "http.method": "GET"}) as span:
+            resp = self._get(path, params, headers, stream)
+            if span is not None:
+                span.set_attribute("http.status_code", resp.status_code)
+            return resp
+
+    def _get(self, path, params, headers, stream):
+        url = f"{self.base_url}{path}"
+        headers = deadline.inject(tracing.inject(dict(headers or {})))
+        headers.setdefault("Accept", self.content_type)
+
+        timeout = _timeouts(self.connect_timeout, self.read_timeout)
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        try:
+            return self._get_attempts(url, params, headers, stream, timeout)
+        finally:
+            self.breaker.release_probe()
+
+    def _get_attempts(self, url, params, headers, stream, timeout):
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1:
+                timeout = _timeouts(self.connect_timeout, self.read_timeout)
+            try:
+                resp = self.session.get(url, params=params, headers=headers, timeout=timeout,
+                                        stream=stream)
+            except requests.RequestException as e:
+                if deadline.expired():
+                    raise deadline.DeadlineExceeded(f"Deadline exceeded waiting for {self.name}") from e
+                delay = self.retry.delay(attempt)
+                if attempt < self.retry.max_attempts and _can_retry(delay):
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+                raise TransportError(str(e)) from e
+
+            if resp.status_code in UPSTREAM_FAILURE_STATUSES:
+                resp.close()
+                delay = self.retry.delay(attempt)
+                if attempt < self.retry.max_attempts and _can_retry(delay):
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if stream and resp.status_code < 300:
+                return ServiceResponse(resp.status_code, headers=resp.headers, stream=_iter_and_close(resp))
+            return ServiceResponse(resp.status_code, content=resp.content, headers=resp.headers)
+
+    def upload(self, path, stream, params=None, headers=None, read_timeout=None):
+        """
+        POST с потоковым телом (stream — файловый объект, читается порциями, передаётся chunked).
+        Не повторяется: тело уже прочитано. read_timeout — таймаут чтения вместо
+        обычного (обработка больших загрузок идёт дольше обычного запроса).
+        """
+        url = f"{self.base_url}{path}"
+        timeout = _timeouts(self.connect_timeout, read_timeout or self.read_timeout)
+        headers = deadline.inject(tracing.inject(dict(headers or {})))
+        headers.setdefault("Accept", self.content_type)
+        body = iter(lambda: stream.read(STREAM_CHUNK_SIZE), b"")
+
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        try:
+            with tracer.span(f"http.{self.name}{path}", tracing.SPAN_KIND_CLIENT,
+                             **{"http.url": url, "http.method": "POST"}) as span:
+                try:
+                    resp = self.session.post(url, data=body, params=params, headers=headers, timeout=timeout)
+                except requests.RequestException as e:
+                    if deadline.expired():
+                        raise deadline.DeadlineExceeded(f"Deadline exceeded waiting for {self.name}") from e
+                    self.breaker.record_failure()
+                    raise TransportError(str(e)) from e
+                if resp.status_code in UPSTREAM_FAILURE_STATUSES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if span is not None:
+                    span.set_attribute("http.status_code", resp.status_code)
+                return ServiceResponse(resp.status_code, content=resp.content, headers=resp.headers)
+        finally:
+            self.breaker.release_probe()
+
+    def ping(self, path="/healthz"):
+        """
+        Доступность сервиса для /readyz gateway: один GET без повторов и без учёта
+        в breaker (пробы не должны его открывать). Заодно прогревает keep-alive соединение.
+        Бросает TransportError, если сервис не ответил или ответил 5xx.
+        """
+        started = time.perf_counter()
+        try:
+            resp = self.session.get(f"{self.base_url}{path}", timeout=(self.connect_timeout, self.connect_timeout))
+        except requests.RequestException as e:
+            raise TransportError(f"{self.name} is unreachable: {e}") from e
+        if resp.status_code >= 500:
+            raise TransportError(f"{self.name}{path} returned {resp.status_code}")
+        return {"latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "breaker": self.breaker.snapshot()["state"]}
+
+    def stats(self):
+        return {
+            "mode": "http",
+            "url": self.base_url,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "max_attempts": self.retry.max_attempts,
+            "breaker": self.breaker.snapshot(),
+        }
+
+
+class InProcessTransport:
+    """
+    Прямой вызов функций сервиса в том же процессе. Дедлайн запроса gateway сервис
+    видит напрямую (contextvars), заголовок не нужен.
+
+    routes: {rule: callable}, rule — путь в синтаксисе werkzeug ("/exports/<job_id>"),
+    для GET с префиксом "GET " ("GET /exports/<job_id>").
+    POST: callable(payload, **path_args) -> (body: dict, status_code)
+    GET:  callable(params, headers, **path_args) -> (body: dict, status_code)
+          или (chunks, status_code, headers) для потокового ответа.
+    UPLOAD (потоковое тело, ключ "UPLOAD /ingest"):
+          callable(stream, params, headers, **path_args) -> (body: dict, status_code).
+    """
+
+    def __init__(self, routes, name="in-process"):
+        self.routes = routes
+        self.name = name
+        rules = []
+        for key in routes:
+            method, _, rule = key.rpartition(" ")
+            rules.append(Rule(rule, endpoint=key, methods=[method or "POST"]))
+        self._urls = Map(rules).bind("in-process")
+
+    def _match(self, method, path):
+        try:
+            key, path_args = self._urls.match(path, method=method)
+        except HTTPException:
+            raise TransportError(f"No in-process route for {method} {path}")
+        return self.routes[key], path_args
+
+    def post(self, path, payload, idempotent=False):
+        func, path_args = self._match("POST", path)
+        deadline.check(f"calling {self.name}")
+        # Копия payload — сервис не должен менять данные цепочки gateway
+        with tracer.span(f"call.{self.name}{path}"):
+            body, status_code = func(dict(payload), **path_args)
+        return ServiceResponse(status_code, body=body)
+
+    def get(self, path, params=None, headers=None, stream=False):
+        func, path_args = self._match("GET", path)
+        deadline.check(f"calling {self.name}")
+        with tracer.span(f"call.{self.name}{path}"):
+            result = func(dict(params or {}), dict(headers or {}), **path_args)
+        if len(result) == 3:
+            chunks, status_code, response_headers = result
+            return ServiceResponse(status_code, headers=dict(response_headers), stream=chunks)
+        body, status_code = result
+        return ServiceResponse(status_code, body=body)
+
+    def upload(self, path, stream, params=None, headers=None, read_timeout=None):
+        func, path_args = self._match("UPLOAD", path)
+        deadline.check(f"calling {self.name}")
+        with tracer.span(f"call.{self.name}{path}"):
+            body, status_code = func(stream, dict(params or {}), dict(headers or {}), **path_args)
+        return ServiceResponse(status_code, body=body)
+
+    def ping(self, path="/healthz"):
+        """Сервис в том же процессе доступен всегда."""
+        return {"mode": "in-process"}
+
+    def stats(self):
+        return {"mode": "in-process", "routes": sorted(self.routes)}
@@ -0,0 +1,20 @@
+"""Совмещённый режим: модули сервисов не перекрывают друг друга в общем sys.path."""
+import combined
+
+
+def test_service_modules_are_not_shadowed():
+    assert combined.shadowed_modules() == {}
+
+
+def test_duplicate_module_is_reported(tmp_path):
+    for service_dir in combined.SERVICE_DIRS:
+        (tmp_path / service_dir).mkdir()
+        (tmp_path / service_dir / f"{service_dir}.py").write_text("")
+        (tmp_path / service_dir / "test_db.py").write_text("")
+    (tmp_path / "server" / "db.py").write_text("")
+    (tmp_path / "request_service" / "db.py").write_text("")
+    (tmp_path / "two_factor_service" / "common.py").write_text("")
+    assert combined.shadowed_modules(str(tmp_path)) == {
+        "db": ["request_service", "server"],
+        "common": ["two_factor_service"],
+    }
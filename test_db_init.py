@@ -0,0 +1,45 @@
+"""DB_init.upgrade_logs: повторный запуск после прерванного обновления logs."""
+import pytest
+
+import DB_init
+from common import db
+
+
+@pytest.fixture
+def cursor(monkeypatch):
+    monkeypatch.setattr(db, "BACKEND", "sqlite")
+    raw, connection_id = db._open_sqlite()
+    conn = db.SQLiteConnection(raw, connection_id)
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS logs")
+    cursor.execute("CREATE TABLE logs (log_id INTEGER PRIMARY KEY, action VARCHAR(50), timestamp DATETIME)")
+    yield cursor
+    cursor.close()
+    conn.close()
+
+
+def columns(cursor):
+    cursor.execute("SELECT * FROM logs LIMIT 0")
+    cursor.fetchall()
+    return {d[0] for d in cursor.description}
+
+
+def test_upgrade_finishes_interrupted_upgrade(cursor):
+    # Прерванное обновление: одна колонка и её индекс уже есть
+    cursor.execute("ALTER TABLE logs ADD COLUMN query_id BIGINT NULL")
+    cursor.execute("CREATE INDEX idx_logs_query_id ON logs (query_id)")
+
+    DB_init.upgrade_logs(cursor)
+    DB_init.upgrade_logs(cursor)
+
+    assert {name for name, _ in DB_init.LOGS_NEW_COLUMNS} <= columns(cursor)
+    assert {name for name, _ in DB_init.LOGS_INDEXES} <= DB_init.index_names(cursor, "logs")
+
+
+def test_upgrade_adds_index_missing_after_columns(cursor):
+    for name, ddl in DB_init.LOGS_NEW_COLUMNS:
+        cursor.execute(f"ALTER TABLE logs ADD COLUMN {name} {ddl}")
+
+    DB_init.upgrade_logs(cursor)
+
+    assert {name for name, _ in DB_init.LOGS_INDEXES} <= DB_init.index_names(cursor, "logs")
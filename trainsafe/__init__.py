@@ -0,0 +1,12 @@
+"""
+Python SDK TrainSafe: вход с 2FA, запросы и выгрузки без GUI.
+
+    from trainsafe import TrainSafeClient
+
+    with TrainSafeClient(username="viewer_user", password="...", code_provider=lambda: input("2FA: ")) as ts:
+        frame = ts.to_pandas("SELECT * FROM train_data")
+"""
+from .client import SessionExpiredError, TrainSafeClient, TrainSafeError
+from .schema import TRAIN_DATA_COLUMNS
+
+__all__ = ["TrainSafeClient", "TrainSafeError", "SessionExpiredError", "TRAIN_DATA_COLUMNS"]
@@ -0,0 +1,136 @@
+"""
+Командная строка TrainSafe поверх TrainSafeClient.
+
+    python -m trainsafe login -u viewer_user
+    python -m trainsafe query -u viewer_user "SELECT * FROM train_data WHERE Loan_Status = %s" -p "Fully Paid"
+    python -m trainsafe extract -u viewer_user "SELECT * FROM train_data" -o train.csv.gz
+    python -m trainsafe logout -u viewer_user
+
+Сессия после login сохраняется (TRAINSAFE_SESSION_FILE) и переиспользуется
+следующими командами. Пароль и код 2FA берутся из --password/--code,
+TRAINSAFE_PASSWORD/TRAINSAFE_2FA_CODE или спрашиваются интерактивно.
+"""
+import argparse
+import csv
+import getpass
+import json
+import os
+import sys
+
+from .client import DEFAULT_SESSION_FILE, DEFAULT_URL, TrainSafeClient, TrainSafeError
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="trainsafe", description="TrainSafe command line client")
+    parser.add_argument("--url", default=DEFAULT_URL, help="адрес gateway (TRAINSAFE_URL)")
+    parser.add_argument("--session-file", default=DEFAULT_SESSION_FILE)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-u", "--username", default=os.getenv("TRAINSAFE_USER"), required=not os.getenv("TRAINSAFE_USER"))
+    common.add_argument("--password", default=os.getenv("TRAINSAFE_PASSWORD"))
+    common.add_argument("--code", default=os.getenv("TRAINSAFE_2FA_CODE"), help="код 2FA")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("login", parents=[common], help="войти и сохранить сессию")
+    commands.add_parser("logout", parents=[common], help="забыть сохранённую сессию")
+
+    query = commands.add_parser("query", parents=[common], help="выполнить запрос через /execute")
+    query.add_argument("sql")
+    query.add_argument("-p", "--param", action="append", dest="params",
+                       help="значение для плейсхолдера %%s (можно повторять)")
+    query.add_argument("-f", "--format", choices=("table", "csv", "json"), default="table")
+
+    batch = commands.add_parser("batch", parents=[common], help="выполнить файл запросов через /execute_batch")
+    batch.add_argument("file", help="файл с запросами, по одному на строку")
+    batch.add_argument("--transaction", action="store_true")
+
+    extract = commands.add_parser("extract", parents=[common], help="выгрузить результат в файл через /exports")
+    extract.add_argument("sql")
+    extract.add_argument("-p", "--param", action="append", dest="params")
+    extract.add_argument("-o", "--output", required=True)
+    extract.add_argument("--format", choices=("csv", "parquet"), default="csv")
+
+    ingest = commands.add_parser("ingest", parents=[common], help="загрузить строки в train_data через /ingest")
+    ingest.add_argument("file", help="CSV или NDJSON (можно .gz)")
+    ingest.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    ingest.add_argument("--on-duplicate", choices=("skip", "update"), default="skip")
+    ingest.add_argument("--commit-rows", type=int)
+    return parser
+
+
+def make_client(args):
+    def ask_code():
+        return args.code or input("2FA code: ").strip()
+
+    return TrainSafeClient(
+        args.url, args.username,
+        password=args.password,
+        code_provider=ask_code,
+        session_file=args.session_file,
+    )
+
+
+def ensure_password(client):
+    if not client.password:
+        client.password = getpass.getpass(f"Password for {client.username}: ")
+
+
+def print_rows(rows, fmt):
+    if fmt == "json":
+        json.dump(rows, sys.stdout, ensure_ascii=False, indent=2, default=str)
+        sys.stdout.write("\n")
+        return
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    if fmt == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(columns)
+        writer.writerows([row.get(c) for c in columns] for row in rows)
+        return
+    widths = [max(len(c), *(len(str(row.get(c))) for row in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    client = make_client(args)
+    try:
+        if args.command == "login":
+            ensure_password(client)
+            client.login()
+            print(f"Logged in as {client.username} (role: {client.role}, session: {client.session_id})")
+        elif args.command == "logout":
+            client.logout()
+        else:
+            if not client.authenticated:
+                ensure_password(client)
+            if args.command == "query":
+                result = client.execute(args.sql, args.params)
+                if isinstance(result, list):
+                    print_rows(result, args.format)
+                else:
+                    print(result)
+            elif args.command == "batch":
+                with open(args.file, encoding="utf-8") as f:
+                    queries = [line.strip() for line in f if line.strip()]
+                result = client.execute_batch(queries, args.transaction)
+                json.dump(result, sys.stdout, ensure_ascii=False, indent=2, default=str)
+                sys.stdout.write("\n")
+            elif args.command == "extract":
+                job_id = client.submit_export(args.sql, args.params, args.format)
+                status = client.wait_export(job_id)
+                size = client.download_export(job_id, args.output)
+                print(f"{status['rows']} rows, {size} bytes -> {args.output}", file=sys.stderr)
+            elif args.command == "ingest":
+                result = client.ingest(args.file, args.format, args.on_duplicate, args.commit_rows)
+                json.dump(result, sys.stdout, ensure_ascii=False, indent=2, default=str)
+                sys.stdout.write("\n")
+    except TrainSafeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        client.close()
+    return 0
@@ -0,0 +1,521 @@
+"""
+Клиент TrainSafe без GUI: /login → /validate_2fa → /execute, /execute_batch, /exports, /ingest и /dataset/batches.
+
+- один requests.Session на клиента: keep-alive соединения к gateway переиспользуются;
+- подтверждённая сессия (user_id, role, code, session_id) сохраняется в файл и
+  переиспользуется следующими запусками, пока gateway её принимает;
+- iter_rows() читает большие результаты потоком через выгрузку /exports,
+  не держа их в памяти; to_pandas()/to_numpy() собирают типизированные колонки.
+"""
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .schema import NUMPY_DTYPES, PANDAS_DTYPES, column_kind, convert_value
+
+try:
+    import pandas
+except ImportError:  # pandas необязателен: нужен только для to_pandas()
+    pandas = None
+
+try:
+    import numpy
+except ImportError:  # NumPy необязателен: нужен только для to_numpy() и iter_dataset()
+    numpy = None
+
+DEFAULT_URL = os.getenv("TRAINSAFE_URL", "http://127.0.0.1:6000")
+DEFAULT_SESSION_FILE = os.getenv(
+    "TRAINSAFE_SESSION_FILE", os.path.join(os.path.expanduser("~"), ".trainsafe_session.json"))
+
+# Отметка незавершённого скачивания выгрузки рядом с файлом (см. download_export)
+DOWNLOAD_MARKER_SUFFIX = ".part.json"
+
+# Ответы gateway, после которых сохранённую сессию нужно подтвердить заново
+SESSION_ERRORS = ("Invalid session token", "Session is not active", "Session expired")
+
+
+class TrainSafeError(Exception):
+    """Ошибка, которую вернул gateway (status — HTTP-код)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class SessionExpiredError(TrainSafeError):
+    """Сессия недействительна, нужен новый вход с 2FA."""
+
+
+def _read_exact(raw, size):
+    data = raw.read(size)
+    while len(data) < size:
+        chunk = raw.read(size - len(data))
+        if not chunk:
+            raise TrainSafeError("Dataset stream ended unexpectedly")
+        data += chunk
+    return data
+
+
+def _read_frames(raw):
+    """Кадры потока /dataset/batches (format=npy): (заголовок, [.npy колонок])."""
+    while True:
+        prefix = raw.read(4)
+        if not prefix:
+            return
+        if len(prefix) < 4:
+            prefix += _read_exact(raw, 4 - len(prefix))
+        header = json.loads(_read_exact(raw, int.from_bytes(prefix, "big")))
+        columns = header.get("columns") or []
+        yield header, [_read_exact(raw, meta["nbytes"]) for meta in columns]
+
+
+def _range_total(content_range):
+    """Полный размер из Content-Range ("bytes 0-9/100", "bytes */100") или None."""
+    _, _, total = (content_range or "").rpartition("/")
+    return int(total) if total.isdigit() else None
+
+
+def _resume_offset(job_id, path, marker):
+    """С какого байта докачивать path: отметка должна быть от той же выгрузки job_id."""
+    try:
+        with open(marker, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if saved.get("job_id") != job_id or not os.path.exists(path):
+        return 0
+    offset = os.path.getsize(path)
+    total = saved.get("size")
+    return 0 if total is not None and offset > total else offset
+
+
+def _write_marker(marker, job_id, size):
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({"job_id": job_id, "size": size}, f)
+
+
+class TrainSafeClient:
+    """
+    base_url — адрес gateway; username — пользователь.
+    code_provider — callable() -> str, спрашивает код 2FA при (повторном) входе.
+    password — пароль для автоматического повторного входа, когда сессия истекла.
+    session_file — файл сохранённых сессий (None — не сохранять).
+    deadline — бюджет секунд на запрос (/execute, /execute_batch, /exports и вход): gateway
+    и сервисы бросают работу, которую клиент уже не дождётся (504). None — бюджет gateway.
+    """
+
+    def __init__(self, base_url=DEFAULT_URL, username=None, password=None, code_provider=None,
+                 session_file=DEFAULT_SESSION_FILE, timeout=(5, 300), pool_size=4, deadline=None):
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.code_provider = code_provider
+        self.session_file = session_file
+        self.timeout = timeout
+        self.deadline = deadline
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+        self.user_id = None
+        self.role = None
+        self.code = None
+        self.session_id = None
+        self.transaction_id = None
+        self.dataset_categories = {}
+        self._load_session()
+
+    # ----- сессия ------------------------------------------------------------
+
+    @property
+    def authenticated(self):
+        return self.session_id is not None
+
+    def _session_key(self):
+        return f"{self.base_url}|{self.username}"
+
+    def _read_session_file(self):
+        if not self.session_file or not os.path.exists(self.session_file):
+            return {}
+        try:
+            with open(self.session_file, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_session(self):
+        saved = self._read_session_file().get(self._session_key())
+        if saved:
+            self.user_id = saved["user_id"]
+            self.role = saved["role"]
+            self.code = saved["code"]
+            self.session_id = saved["session_id"]
+
+    def _save_session(self):
+        if not self.session_file:
+            return
+        sessions = self._read_session_file()
+        key = self._session_key()
+        if self.session_id is None:
+            sessions.pop(key, None)
+        else:
+            sessions[key] = {"user_id": self.user_id, "role": self.role, "code": self.code,
+                             "session_id": self.session_id, "saved_at": time.time()}
+        # Код сессии — секрет: файл доступен только владельцу
+        fd = os.open(self.session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(sessions, f)
+
+    def login(self, password=None, code=None):
+        """
+        Полный вход: /login (генерирует код 2FA) и /validate_2fa.
+        code — код 2FA; если не задан, вызывается code_provider.
+        """
+        password = password or self.password
+        if not self.username or not password:
+            raise TrainSafeError("username and password are required")
+        data = self._post("/login", {"username": self.username, "password": password}, auth=False)
+        self.user_id = data["user_id"]
+        self.role = data["role"]
+
+        if code is None:
+            if self.code_provider is None:
+                raise TrainSafeError("2FA code is required")
+            code = self.code_provider()
+        data = self._post("/validate_2fa", {"user_id": self.user_id, "code": code}, auth=False)
+        self.code = code
+        self.session_id = data["session_id"]
+        self.role = data.get("role", self.role)
+        self._save_session()
+        return self
+
+    def logout(self):
+        """Забывает сохранённую сессию (на сервере она истечёт сама)."""
+        self.session_id = None
+        self.code = None
+        self._save_session()
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----- HTTP --------------------------------------------------------------
+
+    def _session_payload(self):
+        payload = {"username": self.username, "user_id": self.user_id, "role": self.role,
+                   "code": self.code, "session_id": self.session_id}
+        if self.transaction_id is not None:
+            payload["transaction_id"] = self.transaction_id
+        return payload
+
+    def _session_headers(self):
+        return {"X-User-Id": str(self.user_id), "X-Session-Code": str(self.code)}
+
+    def _identity_headers(self):
+        """Сессия и роль заголовками — для потоковых /ingest и /dataset/batches."""
+        return dict(self._session_headers(), **{
+            "X-Session-Id": str(self.session_id), "X-Role": str(self.role),
+            "X-Username": str(self.username),
+        })
+
+    def _raise_for(self, resp):
+        try:
+            message = resp.json().get("message", resp.text)
+        except ValueError:
+            message = resp.text
+        if resp.status_code == 401 and message in SESSION_ERRORS:
+            raise SessionExpiredError(message, resp.status_code)
+        raise TrainSafeError(message, resp.status_code)
+
+    def _post(self, path, payload, auth=True, expected=(200,)):
+        if auth:
+            payload = dict(self._session_payload(), **payload)
+        headers = {"X-Request-Timeout-Ms": str(int(self.deadline * 1000))} if self.deadline else None
+        resp = self.http.post(self.base_url + path, json=payload, headers=headers, timeout=self.timeout)
+        if resp.status_code not in expected:
+            self._raise_for(resp)
+        return resp.json()
+
+    def _with_session(self, call):
+        """
+        Выполняет call() с сохранённой сессией. Если gateway её не принимает и
+        можно войти заново (есть пароль и code_provider), входит и повторяет вызов.
+        """
+        if not self.authenticated:
+            self.login()
+        try:
+            return call()
+        except SessionExpiredError:
+            self.logout()
+            if not self.password or self.code_provider is None:
+                raise
+            self.login()
+            return call()
+
+    # ----- запросы -----------------------------------------------------------
+
+    def execute(self, query, params=None):
+        """
+        Синхронный запрос через /execute. Для SELECT — список словарей,
+        для DML/DDL — сообщение сервера.
+        """
+        data = self._with_session(lambda: self._post("/execute", {"query": query, "params": params}))
+        return data["result"] if "result" in data else data.get("message")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Транзакция из нескольких execute (BEGIN ... COMMIT) на закреплённом за сессией
+        соединении; исключение внутри блока откатывает её (ROLLBACK). Простаивающую
+        транзакцию сервер откатывает сам, после этого execute бросает TrainSafeError (409).
+        """
+        data = self._with_session(lambda: self._post("/execute", {"query": "BEGIN"}))
+        self.transaction_id = data["transaction_id"]
+        try:
+            yield self
+        except BaseException:
+            try:
+                self._post("/execute", {"query": "ROLLBACK"})
+            except (TrainSafeError, requests.RequestException):
+                pass
+            raise
+        else:
+            self._post("/execute", {"query": "COMMIT"})
+        finally:
+            self.transaction_id = None
+
+    def execute_batch(self, queries, transaction=False):
+        """Пакет запросов через /execute_batch; элементы — строки или {"query", "params"}."""
+        return self._with_session(lambda: self._post(
+            "/execute_batch", {"queries": queries, "transaction": transaction}))
+
+    def submit_export(self, query, params=None, fmt="csv"):
+        """Ставит выгрузку в очередь; возвращает job_id."""
+        data = self._with_session(lambda: self._post(
+            "/exports", {"query": query, "params": params, "format": fmt}, expected=(202,)))
+        return data["job_id"]
+
+    def export_status(self, job_id):
+        resp = self.http.get(f"{self.base_url}/exports/{job_id}", headers=self._session_headers(),
+                             timeout=self.timeout)
+        if resp.status_code != 200:
+            self._raise_for(resp)
+        return resp.json()
+
+    def wait_export(self, job_id, poll_interval=0.5, timeout=None):
+        """Ждёт завершения выгрузки; возвращает её статус или бросает TrainSafeError."""
+        started = time.monotonic()
+        while True:
+            status = self.export_status(job_id)
+            if status["status"] == "done":
+                return status
+            if status["status"] == "failed":
+                raise TrainSafeError(f"Export failed: {status.get('error')}")
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TrainSafeError(f"Export {job_id} is not ready after {timeout}s")
+            time.sleep(poll_interval)
+
+    def download_export(self, job_id, path, chunk_size=1024 * 1024):
+        """
+        Скачивает файл выгрузки в path. Пока файл качается, рядом лежит отметка
+        path + DOWNLOAD_MARKER_SUFFIX с job_id и размером: если прошлое скачивание
+        этой же выгрузки прервалось, недостающее докачивается через Range.
+        Файл другой выгрузки (или без отметки) перезаписывается. Возвращает размер файла.
+        """
+        marker = path + DOWNLOAD_MARKER_SUFFIX
+        offset = _resume_offset(job_id, path, marker)
+        headers = self._session_headers()
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        with self.http.get(f"{self.base_url}/exports/{job_id}/download", headers=headers,
+                           stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 416 and offset:
+                if _range_total(resp.headers.get("Content-Range")) == offset:
+                    os.remove(marker)  # прошлое скачивание оборвалось после последнего куска
+                    return offset
+                os.remove(marker)  # файл не совпадает с выгрузкой: качаем заново
+                return self.download_export(job_id, path, chunk_size)
+            if resp.status_code not in (200, 206):
+                self._raise_for(resp)
+            if resp.status_code == 206:
+                mode, total = "ab", _range_total(resp.headers.get("Content-Range"))
+            else:
+                length = resp.headers.get("Content-Length")
+                mode, total = "wb", int(length) if length is not None else None
+            _write_marker(marker, job_id, total)
+            with open(path, mode) as f:
+                for chunk in resp.iter_content(chunk_size):
+                    f.write(chunk)
+        size = os.path.getsize(path)
+        if total is not None and size != total:
+            raise TrainSafeError(f"Export {job_id} download is incomplete ({size} of {total} bytes)")
+        os.remove(marker)
+        return size
+
+    def ingest(self, path, fmt="csv", on_duplicate="skip", commit_rows=None):
+        """
+        Загружает строки train_data из файла CSV / NDJSON (можно .gz) через /ingest.
+        Файл передаётся потоком, не читаясь в память. Возвращает сводку сервера:
+        status ("ok" | "partial"), accepted, rejected, inserted, duplicates, errors и т.д.
+        """
+        params = {"format": fmt, "on_duplicate": on_duplicate}
+        if commit_rows is not None:
+            params["commit_rows"] = commit_rows
+
+        def call():
+            headers = self._identity_headers()
+            if path.endswith(".gz"):
+                headers["Content-Encoding"] = "gzip"
+            with open(path, "rb") as f:
+                resp = self.http.post(f"{self.base_url}/ingest", params=params, data=f,
+                                      headers=headers, timeout=self.timeout)
+            if resp.status_code != 200:
+                self._raise_for(resp)
+            return resp.json()
+
+        return self._with_session(call)
+
+    def iter_dataset(self, columns=None, batch_size=256, seed=0, epoch=0, cursor=None,
+                     drop_last=False, max_batches=None):
+        """
+        Мини-батчи train_data для обучения через /dataset/batches: (batch, cursor),
+        batch — {колонка: numpy.ndarray}. Порядок строк перемешан и определяется
+        seed и epoch; cursor — позиция после батча: передайте его вместо epoch,
+        чтобы продолжить эпоху после падения. ENUM приходят кодами int8,
+        их значения — в self.dataset_categories.
+        """
+        if numpy is None:
+            raise TrainSafeError("iter_dataset() requires numpy")
+        params = {"batch_size": batch_size, "seed": seed, "epoch": epoch, "format": "npy"}
+        if columns:
+            params["columns"] = ",".join(columns)
+        if cursor:
+            params["cursor"] = cursor
+        if drop_last:
+            params["drop_last"] = 1
+        if max_batches:
+            params["max_batches"] = max_batches
+
+        def call():
+            resp = self.http.get(f"{self.base_url}/dataset/batches", params=params,
+                                 headers=self._identity_headers(), stream=True, timeout=self.timeout)
+            if resp.status_code != 200:
+                try:
+                    self._raise_for(resp)
+                finally:
+                    resp.close()
+            return resp
+
+        with self._with_session(call) as resp:
+            for header, blobs in _read_frames(resp.raw):
+                if header.get("error"):
+                    raise TrainSafeError(f"{header['error']} (resume from cursor {header['cursor']})")
+                if not header["rows"]:
+                    return
+                batch = {}
+                for meta, blob in zip(header["columns"], blobs):
+                    batch[meta["name"]] = numpy.load(io.BytesIO(blob), allow_pickle=False)
+                    if "categories" in meta:
+                        self.dataset_categories[meta["name"]] = meta["categories"]
+                yield batch, header["cursor"]
+
+    def iter_rows(self, query, params=None, typed=True, dtypes=None):
+        """
+        Потоковая итерация по строкам результата (dict на строку).
+
+        Запрос выполняется как выгрузка /exports; gzip-CSV читается по мере скачивания,
+        поэтому в памяти одновременно находятся только текущие строки.
+        typed=True — значения приводятся к int/float по карте train_data (и dtypes).
+        """
+        for columns, rows in self._iter_export(query, params, typed, dtypes, batch_size=1000):
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    def iter_batches(self, query, params=None, batch_size=10000, typed=True, dtypes=None):
+        """Как iter_rows, но порциями: (columns, [tuple, ...])."""
+        yield from self._iter_export(query, params, typed, dtypes, batch_size)
+
+    def _iter_export(self, query, params, typed, dtypes, batch_size):
+        job_id = self.submit_export(query, params)
+        self.wait_export(job_id)
+        with self.http.get(f"{self.base_url}/exports/{job_id}/download",
+                           headers=self._session_headers(), stream=True, timeout=self.timeout) as resp:
+            if resp.status_code != 200:
+                self._raise_for(resp)
+            text = io.TextIOWrapper(gzip.GzipFile(fileobj=resp.raw), encoding="utf-8", newline="")
+            reader = csv.reader(text)
+            columns = next(reader)
+            kinds = [column_kind(c, dtypes) if typed else None for c in columns]
+            batch = []
+            sent = False
+            for row in reader:
+                batch.append(tuple(convert_value(v, k) if k else v for v, k in zip(row, kinds)))
+                if len(batch) >= batch_size:
+                    yield columns, batch
+                    batch, sent = [], True
+            if batch or not sent:
+                # Пустой результат тоже отдаёт имена колонок
+                yield columns, batch
+
+    # ----- pandas / NumPy ----------------------------------------------------
+
+    def to_pandas(self, query, params=None, dtypes=None, batch_size=50000):
+        """
+        Результат как pandas.DataFrame с типами колонок train_data:
+        ENUM → category, INT NULL → Int64, DECIMAL/FLOAT → float64, VARCHAR → string.
+        dtypes — {колонка: "str" | "category" | "int" | "float"} для остальных колонок.
+        """
+        if pandas is None:
+            raise ImportError("to_pandas() requires pandas")
+        columns, data = self._collect_columns(query, params, dtypes, batch_size)
+        frame = pandas.DataFrame(dict(zip(columns, data)), columns=columns)
+        for name in columns:
+            kind = column_kind(name, dtypes)
+            if kind:
+                frame[name] = frame[name].astype(PANDAS_DTYPES[kind])
+        return frame
+
+    def to_numpy(self, query, params=None, dtypes=None, batch_size=50000):
+        """
+        Результат как структурированный numpy.ndarray (одно поле на колонку).
+        Числовые колонки — float64 (NULL → NaN), строковые — object.
+        """
+        if numpy is None:
+            raise ImportError("to_numpy() requires numpy")
+        columns, data = self._collect_columns(query, params, dtypes, batch_size)
+        fields = []
+        for name, values in zip(columns, data):
+            kind = column_kind(name, dtypes)
+            fields.append((name, NUMPY_DTYPES[kind] if kind else object))
+        length = len(data[0]) if data else 0
+        array = numpy.empty(length, dtype=fields)
+        for (name, dtype), values in zip(fields, data):
+            if dtype == "float64":
+                values = [numpy.nan if v is None else v for v in values]
+            array[name] = values
+        return array
+
+    def _collect_columns(self, query, params, dtypes, batch_size):
+        """Результат по колонкам: (columns, [[значения колонки], ...])."""
+        columns, data = [], []
+        for batch_columns, rows in self.iter_batches(query, params, batch_size, True, dtypes):
+            if not columns:
+                columns = batch_columns
+                data = [[] for _ in columns]
+            for i, values in enumerate(zip(*rows)):
+                data[i].extend(values)
+        return columns, data
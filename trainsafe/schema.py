@@ -0,0 +1,63 @@
+"""
+Типы колонок train_data (см. DB_init.py) для преобразования результатов.
+
+Строки выгрузки приходят из CSV как текст, а результаты /execute — как JSON,
+поэтому типы восстанавливаются по этой карте. Колонки, которых нет в карте
+(выражения, алиасы, другие таблицы у admin), остаются строками/как есть.
+"""
+
+# kind: str | category | int | float
+TRAIN_DATA_COLUMNS = {
+    "Loan_ID": "str",
+    "Customer_ID": "str",
+    "Loan_Status": "category",                  # ENUM
+    "Current_Loan_Amount": "float",             # DECIMAL(10,2)
+    "Term": "category",
+    "Credit_Score": "int",                      # INT NULL
+    "Annual_Income": "float",
+    "Years_in_current_job": "category",
+    "Home_Ownership": "category",               # ENUM
+    "Purpose": "category",
+    "Monthly_Debt": "float",
+    "Years_of_Credit_History": "float",
+    "Months_since_last_delinquent": "int",      # INT NULL
+    "Number_of_Open_Accounts": "int",           # TINYINT
+    "Number_of_Credit_Problems": "int",         # TINYINT
+    "Current_Credit_Balance": "float",          # DECIMAL(15,2)
+    "Maximum_Open_Credit": "float",             # DECIMAL(15,2)
+    "Bankruptcies": "int",                      # TINYINT
+    "Tax_Liens": "int",                         # TINYINT
+}
+
+# dtype-ы pandas: nullable-целые, чтобы NULL не превращал колонку во float
+PANDAS_DTYPES = {
+    "str": "string",
+    "category": "category",
+    "int": "Int64",
+    "float": "float64",
+}
+
+# dtype-ы NumPy: целые с NULL хранятся как float64 с NaN
+NUMPY_DTYPES = {
+    "str": object,
+    "category": object,
+    "int": "float64",
+    "float": "float64",
+}
+
+
+def column_kind(name, overrides=None):
+    if overrides and name in overrides:
+        return overrides[name]
+    return TRAIN_DATA_COLUMNS.get(name)
+
+
+def convert_value(value, kind):
+    """Одно значение из CSV/JSON в тип Python; пустая строка и None — NULL."""
+    if value is None or value == "":
+        return None
+    if kind == "int":
+        return int(float(value))
+    if kind == "float":
+        return float(value)
+    return value
@@ -0,0 +1,186 @@
+"""TrainSafeClient против тестового gateway: сохранённая сессия, повторный вход и докачка выгрузок."""
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from trainsafe.client import DOWNLOAD_MARKER_SUFFIX, SessionExpiredError, TrainSafeClient
+
+
+class Gateway:
+    """Минимальный gateway: /login, /validate_2fa, /execute и скачивание выгрузок с Range."""
+
+    def __init__(self):
+        self.sessions = set()
+        self.logins = 0
+        self.files = {}             # job_id -> bytes
+        self.ranges = []            # заголовки Range скачиваний
+        self.cut_after = None       # оборвать следующий ответ после стольких байт
+        self._next_session = 100
+
+    def handle(self, handler):
+        if handler.command == "POST":
+            length = int(handler.headers.get("Content-Length") or 0)
+            payload = json.loads(handler.rfile.read(length) or b"{}")
+            if handler.path == "/login":
+                self.logins += 1
+                return 200, {"user_id": 1, "role": "viewer"}
+            if handler.path == "/validate_2fa":
+                self._next_session += 1
+                self.sessions.add(self._next_session)
+                return 200, {"session_id": self._next_session, "role": "viewer"}
+            if handler.path == "/execute":
+                if payload.get("session_id") not in self.sessions:
+                    return 401, {"message": "Session expired"}
+                return 200, {"result": [{"session_id": payload["session_id"]}]}
+        job_id = handler.path.split("/")[2]
+        self.ranges.append(handler.headers.get("Range"))
+        return self.download(handler, self.files[job_id])
+
+    def download(self, handler, data):
+        start, status = 0, 200
+        range_header = handler.headers.get("Range")
+        if range_header:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            if start >= len(data):
+                handler.send_response(416)
+                handler.send_header("Content-Range", f"bytes */{len(data)}")
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return None
+            status = 206
+        handler.send_response(status)
+        handler.send_header("Content-Length", str(len(data) - start))
+        if status == 206:
+            handler.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        handler.end_headers()
+        body = data[start:]
+        if self.cut_after is not None:
+            body, self.cut_after = body[:self.cut_after], None
+            handler.close_connection = True
+        handler.wfile.write(body)
+        return None
+
+
+@pytest.fixture
+def gateway():
+    state = Gateway()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self):
+            result = state.handle(self)
+            if result is None:
+                return
+            status, body = result
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield state
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def make_client(gateway, tmp_path, **kwargs):
+    kwargs.setdefault("password", "secret")
+    kwargs.setdefault("code_provider", lambda: "123456")
+    return TrainSafeClient(gateway.url, "viewer_user", session_file=str(tmp_path / "session.json"), **kwargs)
+
+
+def test_saved_session_is_reused_by_next_client(gateway, tmp_path):
+    with make_client(gateway, tmp_path) as first:
+        session_id = first.execute("SELECT 1")[0]["session_id"]
+    with make_client(gateway, tmp_path, password=None, code_provider=None) as second:
+        assert second.authenticated
+        assert second.execute("SELECT 1") == [{"session_id": session_id}]
+    assert gateway.logins == 1
+
+
+def test_expired_session_logs_in_again(gateway, tmp_path):
+    with make_client(gateway, tmp_path) as client:
+        old = client.execute("SELECT 1")[0]["session_id"]
+        gateway.sessions.clear()
+        new = client.execute("SELECT 1")[0]["session_id"]
+    assert new != old
+    assert gateway.logins == 2
+    with open(tmp_path / "session.json", encoding="utf-8") as f:
+        assert [s["session_id"] for s in json.load(f).values()] == [new]
+
+
+def test_expired_session_without_password_is_forgotten(gateway, tmp_path):
+    with make_client(gateway, tmp_path) as client:
+        client.execute("SELECT 1")
+    gateway.sessions.clear()
+    with make_client(gateway, tmp_path, password=None, code_provider=None) as client:
+        with pytest.raises(SessionExpiredError):
+            client.execute("SELECT 1")
+        assert not client.authenticated
+    with open(tmp_path / "session.json", encoding="utf-8") as f:
+        assert json.load(f) == {}
+
+
+def test_interrupted_download_resumes_with_range(gateway, tmp_path):
+    gateway.files["job-1"] = os.urandom(100_000)
+    path = str(tmp_path / "export.csv.gz")
+    with make_client(gateway, tmp_path) as client:
+        client.login()
+        gateway.cut_after = 30_000
+        with pytest.raises(requests.RequestException):
+            client.download_export("job-1", path, chunk_size=4096)
+        assert os.path.exists(path + DOWNLOAD_MARKER_SUFFIX)
+        partial = os.path.getsize(path)
+        assert 0 < partial < 100_000
+        assert client.download_export("job-1", path) == 100_000
+    assert gateway.ranges == [None, f"bytes={partial}-"]
+    with open(path, "rb") as f:
+        assert f.read() == gateway.files["job-1"]
+    assert not os.path.exists(path + DOWNLOAD_MARKER_SUFFIX)
+
+
+def test_download_of_another_job_replaces_existing_file(gateway, tmp_path):
+    gateway.files.update({"job-1": b"a" * 50, "job-2": b"b" * 80, "job-3": b"c" * 20})
+    path = str(tmp_path / "export.csv.gz")
+    with make_client(gateway, tmp_path) as client:
+        client.login()
+        assert client.download_export("job-1", path) == 50
+        # Завершённое скачивание не докачивается, даже если новый файл больше
+        assert client.download_export("job-2", path) == 80
+        # Отметка прерванного скачивания другой выгрузки тоже не даёт докачки
+        with open(path + DOWNLOAD_MARKER_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump({"job_id": "job-2", "size": 80}, f)
+        assert client.download_export("job-3", path) == 20
+    assert gateway.ranges == [None, None, None]
+    with open(path, "rb") as f:
+        assert f.read() == b"c" * 20
+
+
+def test_download_with_all_bytes_already_received_completes(gateway, tmp_path):
+    gateway.files["job-1"] = b"x" * 40
+    path = str(tmp_path / "export.csv.gz")
+    with open(path, "wb") as f:
+        f.write(gateway.files["job-1"])
+    with open(path + DOWNLOAD_MARKER_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({"job_id": "job-1", "size": 40}, f)
+    with make_client(gateway, tmp_path) as client:
+        client.login()
+        assert client.download_export("job-1", path) == 40
+    assert gateway.ranges == ["bytes=40-"]
+    assert not os.path.exists(path + DOWNLOAD_MARKER_SUFFIX)
@@ -1,14 +1,28 @@
-from flask import Flask, request, jsonify
+from flask import Flask
 import random
-import mysql.connector
-from mysql.connector import Error
 from dotenv import load_dotenv
 import os
+import sys
 from datetime import datetime, timedelta
 
+# Общие модули сервисов — пакет common/ в корне репозитория (в образе — /app/common)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+from common import codec, deadline, json_provider, tracing  # noqa: E402
+from common.db import Error  # noqa: E402
+from common.db_pool import ConnectionPool  # noqa: E402
+from common.health import Health  # noqa: E402
+from common.log_config import setup_logging  # noqa: E402
+from common.profiler import Profiler  # noqa: E402
+
 # Загружаем переменные окружения из .env
 load_dotenv()
 
+logger = setup_logging("two_factor_service")
+tracer = tracing.Tracer("two_factor_service")
+
 # Конфигурация базы данных
 DB_CONFIG = {
     "host": os.getenv("DB_HOST"),
@@ -18,32 +32,64 @@ DB_CONFIG = {
     "database": "TrainSafe"
 }
 
+# Пул соединений; открывается при прогреве
+DB_POOL = ConnectionPool("two_factor_service", DB_CONFIG, int(os.getenv("DB_POOL_SIZE", 8)))
+
 app = Flask(__name__)
+json_provider.init_app(app)
+tracing.init_app(app, tracer)
+
+deadline.init_app(app, codec.make_response)
+
+HEALTH = Health("two_factor_service")
+HEALTH.init_app(app, codec.make_response)
+
+# Профилирование (/debug/profile и заголовок X-Profile, см. profiler.py): токен администратора
+# PROFILER_TOKEN (пусто — выключено), адреса, с которых оно доступно, и предел сэмплирования в секундах
+PROFILER = Profiler(
+    "two_factor_service",
+    token=os.getenv("PROFILER_TOKEN"),
+    allowed=os.getenv("PROFILER_ALLOWED_IPS", "127.0.0.1,::1").split(","),
+    max_seconds=float(os.getenv("PROFILER_MAX_SECONDS", 30)),
+)
+PROFILER.init_app(app, codec.make_response)
+
 
+@HEALTH.warm_up_step("db_pool")
+def _warm_db_pool():
+    return DB_POOL.warm_up()
+
+
+@HEALTH.check("db")
+def _check_db():
+    return DB_POOL.ping()
+
+
+@tracer.traced("db.connect")
 def get_db_connection():
-    """Подключение к базе данных."""
+    """Подключение к базе данных из пула (close() возвращает его в пул); после дедлайна — DeadlineExceeded."""
+    deadline.check("DB connection")
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = DB_POOL.get_connection()
         if conn.is_connected():
             return conn
     except Error as e:
-        print(f"Ошибка подключения к базе данных: {e}")
+        logger.error("Ошибка подключения к базе данных: %s", e)
     return None
 
-@app.route('/generate_2fa', methods=['POST'])
-def generate_2fa():
+@tracer.traced()
+def generate_2fa_code(user_id):
     """
     Генерация 2FA-кода и сохранение в базе.
-    Принимает JSON с полем user_id.
+    Возвращает (body: dict, status_code). Вызывается маршрутом /generate_2fa
+    и напрямую gateway-ем в совмещённом режиме (combined.py).
     """
-    data = request.json
-    user_id = data.get("user_id")
     if not user_id:
-        return jsonify({"message": "User ID is required"}), 400
+        return {"message": "User ID is required"}, 400
 
     conn = get_db_connection()
     if not conn:
-        return jsonify({"message": "Failed to connect to the database"}), 500
+        return {"message": "Failed to connect to the database"}, 500
 
     try:
         cursor = conn.cursor()
@@ -52,13 +98,15 @@ def generate_2fa():
         cursor.execute("SELECT username FROM users WHERE id = %s;", (user_id,))
         username_row = cursor.fetchone()
         if not username_row:
-            return jsonify({"message": "User not found"}), 404
+            return {"message": "User not found"}, 404
         username = username_row[0]
 
         # Генерация 2FA-кода
         code = f"{random.randint(100000, 999999)}"
         expires_at = datetime.now() + timedelta(minutes=5)  # Код действует 5 минут
 
+        # Gateway уже не ждёт ответа — код никто не получит, не записываем его
+        deadline.check("saving the 2FA code")
         # Запись кода в таблицу sessions
         insert_query = '''
             INSERT INTO sessions (user_id, username, code, expires_at)
@@ -67,19 +115,18 @@ def generate_2fa():
         cursor.execute(insert_query, (user_id, username, code, expires_at))
         conn.commit()
 
-        return jsonify({"message": "2FA code generated", "code": code}), 200
+        return {"message": "2FA code generated", "code": code}, 200
     except Error as e:
-        return jsonify({"message": f"Database error: {e}"}), 500
+        return {"message": f"Database error: {e}"}, 500
     finally:
         cursor.close()
         conn.close()
 
-@app.route('/validate_2fa', methods=['POST'])
-def validate_2fa():
+@tracer.traced()
+def validate_2fa_code(user_id, input_code):
     """
     Проверка 2FA-кода.
-    Принимает JSON с полями user_id и code.
-    Возвращает JSON с полями:
+    Возвращает (body: dict, status_code), где при успехе body содержит поля:
       - "message": текстовое сообщение
       - "user_id": int
       - "role": строка (admin|editor|viewer)
@@ -87,16 +134,12 @@ def validate_2fa():
       - "session_expires": строка в ISO-формате
       - "session_token": код 2FA
     """
-    data = request.json or {}
-    user_id = data.get("user_id")
-    input_code = data.get("code")
-
     if not user_id or not input_code:
-        return jsonify({"message": "User ID and code are required"}), 400
+        return {"message": "User ID and code are required"}, 400
 
     conn = get_db_connection()
     if not conn:
-        return jsonify({"message": "Failed to connect to the database"}), 500
+        return {"message": "Failed to connect to the database"}, 500
 
     try:
         cursor = conn.cursor()
@@ -110,21 +153,24 @@ def validate_2fa():
         ''', (user_id,))
         row = cursor.fetchone()
         if not row:
-            return jsonify({"message": "Invalid code"}), 401
+            return {"message": "Invalid code"}, 401
 
         session_id, db_code, db_expires, db_is_validated = row
 
         # Проверка: не использован ли код ранее
         if db_is_validated:
-            return jsonify({"message": "Code already used"}), 401
+            return {"message": "Code already used"}, 401
 
         # Проверка: не истёк ли
         if datetime.now() > db_expires:
-            return jsonify({"message": "Code expired"}), 401
+            return {"message": "Code expired"}, 401
 
         # Проверка: совпадает ли код
         if db_code != input_code:
-            return jsonify({"message": "Invalid code"}), 401
+            return {"message": "Invalid code"}, 401
+
+        # Если gateway уже не ждёт ответа, код не расходуем: клиент сможет повторить проверку
+        deadline.check("activating the session")
 
         # Если всё ок, делаем сессию активной
         session_expires = datetime.now() + timedelta(minutes=30)
@@ -143,25 +189,53 @@ def validate_2fa():
         cursor.execute("SELECT role FROM users WHERE id = %s", (user_id,))
         row_role = cursor.fetchone()
         if not row_role:
-            return jsonify({"message": "User not found"}), 404
+            return {"message": "User not found"}, 404
         role = row_role[0]
 
-        return jsonify({
+        return {
             "message": "2FA validated",
             "user_id": user_id,
             "role": role,
             "session_id": session_id,
             "session_expires": session_expires.isoformat(),
             "session_token": input_code
-        }), 200
+        }, 200
 
     except Error as e:
-        return jsonify({"message": f"Database error: {e}"}), 500
+        return {"message": f"Database error: {e}"}, 500
     finally:
         cursor.close()
         conn.close()
 
 
+# =============================================================================
+# FLASK-МАРШРУТЫ
+# =============================================================================
+
+@app.route('/generate_2fa', methods=['POST'])
+def generate_2fa():
+    """
+    Генерация 2FA-кода и сохранение в базе.
+    Принимает JSON или MessagePack с полем user_id.
+    """
+    data = codec.request_payload()
+    body, status = generate_2fa_code(data.get("user_id"))
+    return codec.make_response(body, status)
+
+@app.route('/validate_2fa', methods=['POST'])
+def validate_2fa():
+    """
+    Проверка 2FA-кода.
+    Принимает JSON или MessagePack с полями user_id и code.
+    """
+    data = codec.request_payload() or {}
+    body, status = validate_2fa_code(data.get("user_id"), data.get("code"))
+    return codec.make_response(body, status)
+
+
 # Если запускаете отдельно:
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=6001, debug=True)
\ No newline at end of file
+    # FLASK_DEBUG=0 — без debug и reloader-а
+    app.debug = os.getenv("FLASK_DEBUG", "1") not in ("0", "false", "no")
+    HEALTH.start_on_run(app)
+    app.run(host='0.0.0.0', port=6001, debug=app.debug)
\ No newline at end of file